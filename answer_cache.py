@@ -0,0 +1,132 @@
+"""
+答案缓存：进程内 LRU（带 TTL）+ SQLite 本地持久层
+
+- 内存层：OrderedDict 实现的有界 LRU，命中耗时在微秒级
+- 磁盘层：SQLite（WAL 模式），进程重启后仍然有效，并被所有 Streamlit 工作进程共享
+- 每条缓存记录 FAQ 版本（faq.json 的 mtime），FAQ 变化后旧记录自动失效
+"""
+
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# 归一化时去掉的结尾标点
+_TRAILING_PUNCT = "？?。.!！~～ "
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def normalize_question(question: str) -> str:
+    """问题归一化：去首尾空白、合并空白、统一小写、去掉结尾标点"""
+    q = _WHITESPACE_RE.sub(" ", question.strip().lower())
+    return q.rstrip(_TRAILING_PUNCT)
+
+
+def make_cache_key(question: str, history: list = None, history_window: int = 6) -> str:
+    """缓存键 = 归一化问题 + 最近 history_window 条对话历史的哈希"""
+    recent = history[-history_window:] if history and history_window > 0 else []
+    history_blob = json.dumps(recent, ensure_ascii=False, sort_keys=True)
+    raw = normalize_question(question) + "\x00" + history_blob
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class AnswerCache:
+    """两级答案缓存，get/put 均为线程安全"""
+
+    def __init__(self, path: str, max_entries: int = 1024, ttl: float = 86400):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._memory = OrderedDict()  # key -> (answer, route, created, faq_version)
+        self._lock = threading.Lock()
+        self._local = threading.local()  # 每个线程一个 SQLite 连接
+        self._puts = 0
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS answers ("
+                "key TEXT PRIMARY KEY, answer TEXT, route TEXT, "
+                "created REAL, faq_version REAL)"
+            )
+            self._local.conn = conn
+        return conn
+
+    def _remember(self, key, entry):
+        """写入内存层并按 LRU 淘汰（调用方持有锁）"""
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, key: str, faq_version: float = 0):
+        """返回 (answer, route)；未命中、过期或 FAQ 版本不符时返回 None"""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                answer, route, created, version = entry
+                if now - created <= self.ttl and version == faq_version:
+                    self._memory.move_to_end(key)
+                    return answer, route
+                del self._memory[key]
+
+        try:
+            row = self._conn().execute(
+                "SELECT answer, route, created, faq_version FROM answers WHERE key = ?", (key,)
+            ).fetchone()
+        except sqlite3.Error as e:
+            print(f"答案缓存读取错误: {e}")
+            return None
+        if row is None:
+            return None
+
+        answer, route, created, version = row
+        if now - created > self.ttl or version != faq_version:
+            return None
+        with self._lock:
+            self._remember(key, (answer, route, created, version))
+        return answer, route
+
+    def put(self, key: str, answer: str, route: str, faq_version: float = 0):
+        """写入两级缓存；磁盘层出错时只打印日志，不影响回答"""
+        now = time.time()
+        with self._lock:
+            self._remember(key, (answer, route, now, faq_version))
+            self._puts += 1
+            prune = self._puts % 256 == 0
+
+        try:
+            conn = self._conn()
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO answers (key, answer, route, created, faq_version) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (key, answer, route, now, faq_version),
+                )
+                # 定期清理过期记录和旧 FAQ 版本的记录
+                if prune:
+                    conn.execute(
+                        "DELETE FROM answers WHERE created < ? OR faq_version != ?",
+                        (now - self.ttl, faq_version),
+                    )
+        except sqlite3.Error as e:
+            print(f"答案缓存写入错误: {e}")
+
+    def clear(self):
+        """清空两级缓存"""
+        with self._lock:
+            self._memory.clear()
+        try:
+            conn = self._conn()
+            with conn:
+                conn.execute("DELETE FROM answers")
+        except sqlite3.Error as e:
+            print(f"答案缓存清空错误: {e}")
@@ -0,0 +1,284 @@
+"""
+远程 API 调用的弹性层：令牌桶限流、只对可重试错误做带抖动的指数退避重试、熔断
+
+- TokenBucket：按配额的每分钟请求数匀速发放令牌，允许一定突发；等待超过上限时直接拒绝
+- CircuitBreaker：连续 N 次调用失败后打开，期间所有调用立即失败（不再等待超时），
+  冷却时间过后放行一个探测请求（半开），成功则关闭，失败则重新打开
+- ResilientCaller：把以上两者与重试组合起来，同步和异步调用共用同一套状态
+
+是否可重试、服务端要求的等待时间（Retry-After）由调用方按所用 SDK 的异常类型判断后传入。
+"""
+
+import asyncio
+import random
+import threading
+import time
+
+from metrics import Counter, Gauge, Histogram, REGISTRY
+
+CLOSED = "closed"
+HALF_OPEN = "half_open"
+OPEN = "open"
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitOpenError(RuntimeError):
+    """熔断打开期间的调用被直接拒绝"""
+
+
+class RateLimitTimeout(RuntimeError):
+    """等待限流令牌的时间超过上限"""
+
+
+class TokenBucket:
+    """
+    参数:
+        rate: 每秒发放的令牌数（<=0 表示不限流）
+        capacity: 桶容量，即允许的最大突发请求数
+    """
+
+    def __init__(self, rate: float, capacity: int = 1):
+        self.rate = rate
+        self.capacity = max(1, capacity)
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, max_wait: float = None) -> float:
+        """
+        预订一个令牌，返回调用方需要等待的秒数（令牌在等待结束时可用）；
+        需要等待超过 max_wait 时不预订，抛出 RateLimitTimeout
+        """
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            wait = max(0.0, (1 - self._tokens) / self.rate)
+            if max_wait is not None and wait > max_wait:
+                raise RateLimitTimeout(f"限流：需要等待 {wait:.2f}s，超过上限 {max_wait:.2f}s")
+            # 令牌可以预支为负数，后来的调用方依次排在后面
+            self._tokens -= 1
+            return wait
+
+    def refund(self):
+        """退还一个预订了但没有使用的令牌"""
+        if self.rate <= 0:
+            return
+        with self._lock:
+            self._tokens = min(self.capacity, self._tokens + 1)
+
+
+class CircuitBreaker:
+    """
+    参数:
+        failure_threshold: 连续失败多少次后打开（<=0 表示不熔断）
+        reset_timeout: 打开后多少秒放行探测请求
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0, on_transition=None):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.on_transition = on_transition
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        """当前状态；冷却时间已过的打开状态视为半开"""
+        if self._state == OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+            return HALF_OPEN
+        return self._state
+
+    def _transition(self, state: str):
+        if state != self._state:
+            self._state = state
+            if self.on_transition:
+                self.on_transition(state)
+
+    def allow(self) -> bool:
+        """是否放行一次调用；半开状态下同一时间只放行一个探测请求"""
+        if self.failure_threshold <= 0:
+            return True
+        with self._lock:
+            state = self.state
+            if state == CLOSED:
+                return True
+            if state == HALF_OPEN and not self._probing:
+                self._transition(HALF_OPEN)
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._probing = False
+            self._transition(CLOSED)
+
+    def record_failure(self):
+        if self.failure_threshold <= 0:
+            return
+        with self._lock:
+            self._failures += 1
+            if self._probing or self._failures >= self.failure_threshold:
+                self._probing = False
+                self._opened_at = time.monotonic()
+                self._transition(OPEN)
+
+
+CALLS = REGISTRY.register(Counter(
+    "api_calls_total", "远程 API 调用结果（outcome: success/error/circuit_open/rate_limited）", ("client", "outcome")
+))
+RETRIES = REGISTRY.register(Counter("api_retries_total", "远程 API 重试次数（reason: 错误类型）", ("client", "reason")))
+RATE_LIMIT_WAIT = REGISTRY.register(Histogram(
+    "api_rate_limit_wait_seconds", "等待限流令牌的时间（秒）", ("client",),
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+))
+CIRCUIT_TRANSITIONS = REGISTRY.register(Counter(
+    "api_circuit_transitions_total", "熔断状态切换次数", ("client", "state")
+))
+
+# 名称 -> 最近创建的 ResilientCaller，供下面的瞬时值指标读取
+_callers = {}
+
+REGISTRY.register(Gauge(
+    "api_circuit_state", "熔断状态（0=关闭，1=半开，2=打开）",
+    lambda: {(name, ): _STATE_VALUES[c.breaker.state] for name, c in _callers.items()}, ("client",),
+))
+REGISTRY.register(Gauge(
+    "api_inflight_requests", "正在进行的远程 API 请求数",
+    lambda: {(name, ): c.inflight for name, c in _callers.items()}, ("client",),
+))
+REGISTRY.register(Gauge(
+    "api_pool_connections", "HTTP 连接池中的连接数（取不到时不输出）",
+    lambda: {(name, ): n for name, c in _callers.items() for n in [c.pool_connections()] if n is not None},
+    ("client",),
+))
+
+
+class ResilientCaller:
+    """
+    参数:
+        name: 指标中的 client 标签
+        limiter: TokenBucket，None 表示不限流
+        breaker: CircuitBreaker，None 表示不熔断
+        max_retries: 可重试错误的最大重试次数
+        base_delay / max_delay: 第 n 次重试前等待 uniform(0, min(max_delay, base_delay * 2**n)) 秒
+        rate_limit_wait: 等待限流令牌的上限（秒）
+        is_retryable: 判断异常是否可重试（网络错误、超时、429、5xx 等）
+        retry_after: 从异常中取出服务端要求的等待秒数，没有时返回 None
+    """
+
+    def __init__(self, name: str, limiter: TokenBucket = None, breaker: CircuitBreaker = None,
+                 max_retries: int = 3, base_delay: float = 0.5, max_delay: float = 8.0,
+                 rate_limit_wait: float = 10.0, is_retryable=None, retry_after=None):
+        self.name = name
+        self.limiter = limiter
+        self.breaker = breaker or CircuitBreaker(failure_threshold=0)
+        self.breaker.on_transition = lambda state: CIRCUIT_TRANSITIONS.inc(name, state)
+        self.max_retries = max(0, max_retries)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.rate_limit_wait = rate_limit_wait
+        self.is_retryable = is_retryable or (lambda e: False)
+        self.retry_after = retry_after or (lambda e: None)
+        self.pool_connections = lambda: None  # 由调用方替换为读取连接池状态的函数
+        self.inflight = 0
+        self._inflight_lock = threading.Lock()
+        _callers[name] = self
+
+    @property
+    def available(self) -> bool:
+        """熔断未打开（关闭或可以探测）"""
+        return self.breaker.state != OPEN
+
+    def _admit(self) -> float:
+        """预订限流令牌并做熔断检查，返回需要等待的秒数"""
+        wait = 0.0
+        if self.limiter is not None:
+            try:
+                wait = self.limiter.reserve(self.rate_limit_wait)
+            except RateLimitTimeout:
+                CALLS.inc(self.name, "rate_limited")
+                raise
+        # 熔断检查放在预订令牌之后：半开状态放行的探测请求一定会真正发出；
+        # 被熔断拒绝的调用退还令牌，否则熔断期间的请求会把令牌桶透支，恢复后的正常调用长时间等待
+        if not self.breaker.allow():
+            if self.limiter is not None:
+                self.limiter.refund()
+            CALLS.inc(self.name, "circuit_open")
+            raise CircuitOpenError(f"{self.name}: 熔断打开，暂停调用")
+        if self.limiter is not None:
+            RATE_LIMIT_WAIT.observe(wait, self.name)
+        return wait
+
+    def _backoff(self, error: Exception, attempt: int) -> float:
+        """失败后决定是否重试：返回重试前的等待秒数，不重试时记录失败并重新抛出"""
+        retryable = self.is_retryable(error)
+        if not retryable or attempt >= self.max_retries:
+            # 只有服务端或网络问题计入熔断；请求本身有误（4xx）说明接口仍能正常响应
+            if retryable:
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
+            CALLS.inc(self.name, "error")
+            raise error
+        RETRIES.inc(self.name, type(error).__name__)
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        server_delay = self.retry_after(error)
+        if server_delay is not None:
+            delay = max(delay, min(server_delay, self.max_delay))
+        return delay
+
+    def _track(self, delta: int):
+        with self._inflight_lock:
+            self.inflight += delta
+
+    def _succeeded(self):
+        self.breaker.record_success()
+        CALLS.inc(self.name, "success")
+
+    def call(self, fn):
+        """同步调用 fn()，按策略限流、重试与熔断；最终失败时抛出最后一次的异常"""
+        attempt = 0
+        while True:
+            wait = self._admit()
+            if wait:
+                time.sleep(wait)
+            self._track(1)
+            try:
+                result = fn()
+            except Exception as e:
+                delay = self._backoff(e, attempt)
+            else:
+                self._succeeded()
+                return result
+            finally:
+                self._track(-1)
+            attempt += 1
+            time.sleep(delay)
+
+    async def call_async(self, fn):
+        """异步版本：fn() 返回可等待对象，等待限流与退避时不占用线程"""
+        attempt = 0
+        while True:
+            wait = self._admit()
+            if wait:
+                await asyncio.sleep(wait)
+            self._track(1)
+            try:
+                result = await fn()
+            except Exception as e:
+                delay = self._backoff(e, attempt)
+            else:
+                self._succeeded()
+                return result
+            finally:
+                self._track(-1)
+            attempt += 1
+            await asyncio.sleep(delay)
@@ -1,5 +1,18 @@
 import streamlit as st
-from router import route_question
+from router import route_question_stream
+from metrics import start_exporter
+from warmup import start_warmup, warmup_status
+
+
+@st.cache_resource
+def _start_background_services():
+    """每个进程只执行一次：后台预热小模型与大模型客户端，按配置启动指标导出"""
+    start_warmup()
+    start_exporter()
+    return True
+
+
+_start_background_services()
 
 # ========== 标题 + 垃圾桶按钮放在同一行 ==========
 col1, col2 = st.columns([9, 1])
@@ -35,8 +48,21 @@ if question:
     with st.chat_message("user"):
         st.write(question)
 
-    # 调用路由，传入对话历史
-    answer, meta = route_question(question, history=st.session_state.chat_history)
+    # 调用流式路由，传入对话历史，边生成边展示回答
+    with st.chat_message("assistant"):
+        placeholder = st.empty()
+        chunks, result = route_question_stream(question, history=st.session_state.chat_history)
+        with placeholder.container():
+            streamed = st.write_stream(chunks)
+        answer, meta = result["answer"], result["meta"]
+
+        # 流式文本被截断或降级到大模型时，用最终答案覆盖已显示的内容
+        if streamed != answer:
+            placeholder.write(answer)
+        st.caption(
+            f"路由: {meta['route']} | 首字: {meta.get('ttft', meta['response_time']):.2f}s"
+            f" | 耗时: {meta['response_time']:.2f}s"
+        )
 
     # 更新对话历史
     st.session_state.chat_history.append({"role": "user", "content": question})
@@ -46,8 +72,5 @@ if question:
     if len(st.session_state.chat_history) > 6:
         st.session_state.chat_history = st.session_state.chat_history[-6:]
 
-    # 展示回答
+    # 记录回答，供页面重绘时展示
     st.session_state.messages_display.append({"role": "assistant", "content": answer, "meta": meta})
-    with st.chat_message("assistant"):
-        st.write(answer)
-        st.caption(f"路由: {meta['route']} | 耗时: {meta['response_time']:.2f}s")
\ No newline at end of file
@@ -0,0 +1,106 @@
+"""
+动态批处理引擎
+
+多个线程（如多个 Streamlit 会话）并发提交请求时，后台工作线程把短时间窗口内
+到达的请求合并成一批，交给批处理函数一次处理，再把各自的结果分发回调用方。
+模型推理只在这一个工作线程中进行，避免多个 generate 调用互相争抢 CPU 线程。
+"""
+
+import queue
+import threading
+import time
+
+
+class _Request:
+    """一次提交：输入、结果以及完成通知"""
+
+    __slots__ = ("item", "result", "error", "done", "enqueued", "stats")
+
+    def __init__(self, item):
+        self.item = item
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+        self.enqueued = time.time()
+        self.stats = {}
+
+
+class BatchingEngine:
+    """
+    参数:
+        process_batch: 批处理函数，输入列表，返回等长的结果列表
+        max_batch_size: 每批最多合并的请求数
+        max_wait: 凑批的最长等待时间（秒），从该批第一个请求出队开始计算
+    """
+
+    def __init__(self, process_batch, max_batch_size: int = 4, max_wait: float = 0.02, name: str = "batching"):
+        self.process_batch = process_batch
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait
+        self.name = name
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def _ensure_started(self):
+        """首次提交时启动后台工作线程"""
+        if self._thread is None:
+            with self._start_lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._loop, name=self.name, daemon=True)
+                    self._thread.start()
+
+    def enqueue(self, item):
+        """提交一个请求但不等待（结果由 item 自己回传的请求，如流式生成），返回请求对象"""
+        self._ensure_started()
+        request = _Request(item)
+        self._queue.put(request)
+        return request
+
+    def submit(self, item, timeout: float = None):
+        """
+        提交一个请求并阻塞等待结果，返回 (result, stats)
+        stats 包含 queue_wait（排队耗时）、batch_size、batch_time（整批处理耗时）、latency
+        """
+        request = self.enqueue(item)
+        if not request.done.wait(timeout):
+            raise TimeoutError(f"{self.name}: 等待批处理结果超时")
+        if request.error is not None:
+            raise request.error
+        request.stats["latency"] = time.time() - request.enqueued
+        return request.result, request.stats
+
+    def _collect(self):
+        """取出一批请求：阻塞等待第一个，然后在窗口内尽量凑满"""
+        batch = [self._queue.get()]
+        deadline = time.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.time()
+            try:
+                # 窗口已过时仍顺手取走已在排队的请求，不再等待
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _loop(self):
+        while True:
+            batch = self._collect()
+            start = time.time()
+            try:
+                results = self.process_batch([r.item for r in batch])
+                error = None
+            except Exception as e:
+                results = [None] * len(batch)
+                error = e
+            batch_time = time.time() - start
+
+            for request, result in zip(batch, results):
+                request.result = result
+                request.error = error
+                request.stats.update({
+                    "queue_wait": start - request.enqueued,
+                    "batch_size": len(batch),
+                    "batch_time": batch_time,
+                })
+                request.done.set()
@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+"""
+路由热路径微基准：只测 CPU 上的纯 Python 开销，不加载 Qwen、不调用 API
+
+覆盖:
+- utils.complexity_score，以及批量版 utils.complexity_scores（按每个问题折算）
+- router.faq_answer / router.fuzzy_faq_answer：FAQ 规模从 faq.json 的 55 条扩充到 10 万条合成条目
+- small_model._truncate_answer / small_model.low_confidence
+- router.route_question：小模型、大模型、日志全部替换为桩函数
+
+问题取自 logs.csv 中的真实提问（文件不存在时使用内置问题集）。
+每项按 timeit 的方式自动确定循环次数，取多次重复中最快一次的单次调用耗时（微秒），
+受机器负载的干扰最小。基线与机器相关，请在同一台机器上保存和对比。
+
+用法:
+    python benchmarks/hot_path.py
+    python benchmarks/hot_path.py --save benchmarks/baselines/hot_path.json
+    python benchmarks/hot_path.py --compare benchmarks/baselines/hot_path.json --threshold 0.25
+"""
+import argparse
+import csv
+import json
+import os
+import platform
+import random
+import sys
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+LOGS_CSV = os.path.join(ROOT_DIR, "logs.csv")
+FAQ_JSON = os.path.join(ROOT_DIR, "faq.json")
+DEFAULT_FAQ_SIZES = (55, 1000, 10000, 100000)
+
+# logs.csv 不存在时使用的问题集
+FALLBACK_QUESTIONS = [
+    "图书馆几点开门？",
+    "食堂在哪里？",
+    "宿舍可以养猫吗",
+    "校园卡丢了怎么办",
+    "怎么申请奖学金",
+    "宿舍晚上几点关门，可以晚归吗？",
+    "如何设计一份有竞争力的简历？请对比技术岗和产品岗的简历区别。",
+    "帮我分析一下本科毕业论文从开题到答辩的全流程，以及各阶段需要注意什么？",
+]
+
+# 小模型输出样例：正常回答、超长回答、低置信度回答、乱码
+SAMPLE_ANSWERS = [
+    "宿舍不允许养宠物。如有需要可以联系宿管。",
+    "抱歉，我不知道这个问题的答案。",
+    "这是无法避免的情况，请提前做好准备。",
+    "好的",
+    "))))]]]]}}}}",
+    "Library opens at 8am 图书馆",
+]
+
+
+def load_questions(path: str = LOGS_CSV) -> list:
+    """从日志中取出去重后的真实问题"""
+    questions = []
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8", newline="") as f:
+            for row in csv.DictReader(f):
+                q = (row.get("question") or "").strip()
+                if q and q not in questions:
+                    questions.append(q)
+    return questions or list(FALLBACK_QUESTIONS)
+
+
+def load_answers(faq: list) -> list:
+    """FAQ 答案、拼接出的超长回答和固定样例"""
+    answers = [item["answer"] for item in faq if item.get("answer")]
+    answers += [a + a for a in answers[:10]]
+    return answers + SAMPLE_ANSWERS
+
+
+def synthetic_faq(faq: list, size: int, seed: int = 0) -> list:
+    """
+    保留原始 FAQ，再用原有关键词的字符随机拼出新词补足到 size 条，
+    关键词长度、数量与原数据相近，匹配行为接近真实扩容后的 FAQ
+    """
+    rng = random.Random(seed)
+    chars = sorted({ch for item in faq for k in item.get("primary", []) + item.get("secondary", []) for ch in k})
+    answers = [item["answer"] for item in faq]
+
+    def word():
+        return "".join(rng.choice(chars) for _ in range(rng.randint(2, 4)))
+
+    items = list(faq[:size])
+    while len(items) < size:
+        items.append({
+            "primary": [word() for _ in range(rng.randint(1, 4))],
+            "secondary": [word() for _ in range(rng.randint(2, 6))],
+            "answer": rng.choice(answers),
+        })
+    return items
+
+
+def measure(fn, inputs: list, repeat: int = 5, min_time: float = 0.2) -> dict:
+    """
+    对 inputs 逐个调用 fn：先确定循环次数使一次测量不少于 min_time 秒，
+    再重复 repeat 次，返回单次调用的最快/中位耗时（微秒）
+    """
+    def run(loops):
+        start = time.perf_counter()
+        for _ in range(loops):
+            for item in inputs:
+                fn(item)
+        return time.perf_counter() - start
+
+    loops = 1
+    while True:
+        elapsed = run(loops)
+        if elapsed >= min_time or loops >= 10 ** 6:
+            break
+        loops = max(loops * 2, int(loops * min_time / max(elapsed, 1e-9)))
+
+    samples = sorted(run(loops) / (loops * len(inputs)) * 1e6 for _ in range(repeat))
+    return {
+        "per_call_us": round(samples[0], 3),
+        "median_us": round(samples[len(samples) // 2], 3),
+        "calls": loops * len(inputs),
+    }
+
+
+class _StubbedRouter:
+    """替换路由依赖的模型、日志、缓存与语义检索，退出时恢复"""
+
+    NAMES = ("small_model_answer", "big_model_answer", "log_event",
+             "SEMANTIC_FAQ_ENABLED", "ANSWER_CACHE_ENABLED", "HEDGE_ENABLED")
+
+    def __init__(self, router):
+        self.router = router
+        self.saved = {}
+
+    def __enter__(self):
+        self.saved = {name: getattr(self.router, name) for name in self.NAMES}
+        self.router.small_model_answer = lambda q, history=None, stats=None: "宿舍不允许养宠物。如有需要可以联系宿管。"
+        self.router.big_model_answer = lambda q, history=None: ("这是大模型的详细回答。", {"total_tokens": 100})
+        self.router.log_event = lambda *args: None
+        self.router.SEMANTIC_FAQ_ENABLED = False
+        self.router.ANSWER_CACHE_ENABLED = False
+        self.router.HEDGE_ENABLED = False
+        return self
+
+    def __exit__(self, *exc):
+        for name, value in self.saved.items():
+            setattr(self.router, name, value)
+
+
+class _SyntheticFaq:
+    """把路由的 FAQ 数据临时替换为合成数据（mtime 设为无穷大，避免被热更新覆盖）"""
+
+    def __init__(self, router, items: list):
+        self.router = router
+        self.items = items
+
+    def __enter__(self):
+        r = self.router
+        self.saved = (r._faq_cache, r._faq_mtime, r._faq_index)
+        r._faq_cache, r._faq_mtime, r._faq_index = self.items, float("inf"), None
+        return self
+
+    def __exit__(self, *exc):
+        r = self.router
+        r._faq_cache, r._faq_mtime, r._faq_index = self.saved
+
+
+def run_benchmarks(faq_sizes=DEFAULT_FAQ_SIZES, repeat: int = 5) -> dict:
+    """运行全部基准，返回 {名称: 结果}"""
+    import router
+    import small_model
+    from utils import complexity_score, complexity_scores
+
+    with open(FAQ_JSON, "r", encoding="utf-8") as f:
+        faq = json.load(f)
+    questions = load_questions()
+    answers = load_answers(faq)
+    results = {}
+
+    def record(name, fn, inputs):
+        results[name] = measure(fn, inputs, repeat=repeat)
+        print(f"  {name:<28}{results[name]['per_call_us']:>12.2f} µs/次")
+
+    def record_batch(name, fn, inputs):
+        # 整批调用一次，耗时按每个输入折算，便于与逐条版本对比
+        result = measure(fn, [inputs], repeat=repeat)
+        for key in ("per_call_us", "median_us"):
+            result[key] = round(result[key] / len(inputs), 3)
+        result["calls"] *= len(inputs)
+        results[name] = result
+        print(f"  {name:<28}{result['per_call_us']:>12.2f} µs/次")
+
+    print(f"问题 {len(questions)} 条，回答样例 {len(answers)} 条")
+    record("complexity_score", complexity_score, questions)
+    record_batch("complexity_scores[batch]", complexity_scores, questions * max(1, 10000 // len(questions)))
+    record("truncate_answer", small_model._truncate_answer, answers)
+    record("low_confidence", small_model.low_confidence, answers)
+
+    for size in faq_sizes:
+        with _SyntheticFaq(router, synthetic_faq(faq, size)):
+            start = time.perf_counter()
+            router._get_faq_index()
+            build_ms = (time.perf_counter() - start) * 1000
+            record(f"faq_answer[{size}]", router.faq_answer, questions)
+            results[f"faq_answer[{size}]"]["index_build_ms"] = round(build_ms, 2)
+            # 容错匹配的二元组倒排索引在首次调用时构建，计时前先建好
+            router._get_faq_index().fuzzy_match("")
+            record(f"fuzzy_faq_answer[{size}]", router.fuzzy_faq_answer, questions)
+
+    with _StubbedRouter(router):
+        record("route_question", router.route_question, questions)
+    return results
+
+
+def compare(baseline: dict, current: dict, threshold: float) -> list:
+    """返回超过阈值的退化项 [(名称, 基线, 当前, 比值)]；只比较两边都有的项"""
+    regressions = []
+    for name, result in current.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        ratio = result["per_call_us"] / max(base["per_call_us"], 1e-9)
+        if ratio > 1 + threshold:
+            regressions.append((name, base["per_call_us"], result["per_call_us"], ratio))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="路由热路径微基准（离线，不加载模型）")
+    parser.add_argument("--save", metavar="PATH", help="把结果保存为 JSON 基线")
+    parser.add_argument("--compare", metavar="PATH", help="与 JSON 基线对比，有退化时以非零状态退出")
+    parser.add_argument("--threshold", type=float, default=0.25, help="允许的退化比例（默认 0.25 即慢 25%%）")
+    parser.add_argument("--faq-sizes", type=int, nargs="+", default=list(DEFAULT_FAQ_SIZES))
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.faq_sizes, args.repeat)
+    report = {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "machine": platform.machine(),
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "results": results,
+    }
+
+    if args.save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save)), exist_ok=True)
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\n基线已保存: {args.save}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        print(f"\n与基线对比（{baseline['meta'].get('created', '?')}，阈值 +{args.threshold:.0%}）:")
+        for name, result in results.items():
+            base = baseline["results"].get(name)
+            if base:
+                ratio = result["per_call_us"] / max(base["per_call_us"], 1e-9)
+                print(f"  {name:<28}{base['per_call_us']:>10.2f} → {result['per_call_us']:>10.2f} µs  ×{ratio:.2f}")
+        regressions = compare(baseline["results"], results, args.threshold)
+        if regressions:
+            print(f"\n✗ {len(regressions)} 项超过退化阈值:")
+            for name, base, now, ratio in regressions:
+                print(f"  {name}: {base:.2f} → {now:.2f} µs（×{ratio:.2f}）")
+            sys.exit(1)
+        print("\n✓ 没有超过阈值的退化")
+
+
+if __name__ == "__main__":
+    main()
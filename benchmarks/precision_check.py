@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+小模型精度模式对比：float32 / bfloat16 / int8
+
+每种模式在独立子进程中加载（避免前一个模型占用的内存干扰测量），
+对固定问题集用贪心解码生成回答，报告加载耗时、常驻内存、生成速度，
+以及与 float32 回答的相似度和 low_confidence 触发率。
+
+用法:
+    python benchmarks/precision_check.py
+    python benchmarks/precision_check.py --modes float32 int8 --output precision.json
+"""
+import argparse
+import difflib
+import json
+import os
+import subprocess
+import sys
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+# 固定问题集：覆盖小模型实际承担的中低复杂度校园问题
+QUESTIONS = [
+    "宿舍可以养猫吗",
+    "校园卡丢了怎么办",
+    "期末考试一般什么时候开始",
+    "怎么申请奖学金",
+    "体育馆周末开放吗",
+    "快递站在哪里取件",
+    "选修课可以退课吗",
+    "学校有心理咨询吗",
+    "实验室晚上能用吗",
+    "怎么办理请假手续",
+]
+
+# 贪心解码，保证不同精度之间的差异只来自数值误差
+GREEDY_KWARGS = {"do_sample": False, "temperature": None, "top_p": None}
+
+
+def run_single(mode: str) -> dict:
+    """在当前进程中加载指定精度的模型并回答问题集"""
+    import small_model
+
+    small_model._load_model(precision=mode)
+    answers = []
+    start = time.time()
+    for q in QUESTIONS:
+        answers.append(small_model._generate_batch([small_model._build_prompt(q)], GREEDY_KWARGS)[0])
+    elapsed = time.time() - start
+
+    result = dict(small_model._load_stats)
+    result.update({
+        "answers": answers,
+        "seconds_per_answer": elapsed / len(QUESTIONS),
+        "low_confidence_rate": sum(small_model.low_confidence(a) for a in answers) / len(answers),
+    })
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="对比小模型不同精度模式的速度、内存与回答质量")
+    parser.add_argument("--modes", nargs="+", default=["float32", "bfloat16", "int8"])
+    parser.add_argument("--output", help="把完整结果（含每条回答）写入 JSON 文件")
+    parser.add_argument("--single", help=argparse.SUPPRESS)  # 子进程内部使用
+    args = parser.parse_args()
+
+    if args.single:
+        print(json.dumps(run_single(args.single), ensure_ascii=False))
+        return
+
+    modes = args.modes if "float32" in args.modes else ["float32"] + args.modes
+    results = {}
+    for mode in modes:
+        print(f"正在测试精度模式: {mode} ...")
+        proc = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--single", mode],
+            capture_output=True, text=True, encoding="utf-8",
+        )
+        if proc.returncode != 0:
+            print(f"  ✗ {mode} 测试失败:\n{proc.stderr[-2000:]}")
+            continue
+        results[mode] = json.loads(proc.stdout.strip().splitlines()[-1])
+
+    baseline = results.get("float32")
+    print("\n" + "=" * 78)
+    print(f"{'模式':<10}{'加载(s)':>9}{'内存(MB)':>10}{'tokens/s':>10}{'每题(s)':>9}{'与fp32相似度':>14}{'低置信率':>10}")
+    print("-" * 78)
+    for mode, r in results.items():
+        if baseline:
+            similarity = sum(
+                difflib.SequenceMatcher(None, a, b).ratio()
+                for a, b in zip(r["answers"], baseline["answers"])
+            ) / len(QUESTIONS)
+            r["similarity_to_float32"] = similarity
+        print(
+            f"{mode:<10}{r['load_time']:>9.1f}{r['rss_mb']:>10.0f}{r['tokens_per_second']:>10.1f}"
+            f"{r['seconds_per_answer']:>9.2f}{r.get('similarity_to_float32', 0):>14.2f}{r['low_confidence_rate']:>10.0%}"
+        )
+    print("=" * 78)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"完整结果已写入: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+系统提示前缀 KV 缓存的 prefill 耗时对比
+
+对每个问题分别测量：
+- 完整 prefill：整段提示词（系统提示 + 历史 + 问题）一次前向计算
+- 前缀缓存：拷贝系统提示的 past_key_values，只对剩余 token 做前向计算
+输出每个请求节省的 prefill 时间。
+
+用法:
+    python benchmarks/prefix_cache.py [--repeat 5]
+"""
+import argparse
+import copy
+import os
+import statistics
+import sys
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+QUESTIONS = [
+    "宿舍可以养猫吗",
+    "校园卡丢了怎么办",
+    "期末考试一般什么时候开始",
+    "怎么申请奖学金",
+    "体育馆周末开放吗",
+]
+HISTORY = [
+    {"role": "user", "content": "图书馆几点开门？"},
+    {"role": "assistant", "content": "图书馆早上8点开门，晚上10点关门。"},
+]
+
+
+def _time_it(fn, repeat: int) -> float:
+    """返回 repeat 次调用的中位耗时（秒）"""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="测量系统提示前缀 KV 缓存节省的 prefill 时间")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    import torch
+    import small_model
+
+    small_model._load_model()
+    model = small_model._model
+    with small_model._generate_lock:
+        prefix_ids, past = small_model._get_prefix_cache()
+    n_prefix = prefix_ids.shape[-1]
+    print(f"系统提示前缀长度: {n_prefix} tokens")
+
+    print(f"\n{'问题':<16}{'总tokens':>9}{'完整prefill(ms)':>17}{'前缀缓存(ms)':>15}{'节省(ms)':>10}")
+    saved = []
+    for with_history in (False, True):
+        for q in QUESTIONS:
+            prompt = small_model._build_prompt(q, HISTORY if with_history else None)
+            ids = small_model._tokenizer(prompt, return_tensors="pt")["input_ids"]
+            suffix = ids[:, n_prefix:]
+
+            def full():
+                with torch.no_grad():
+                    model(input_ids=ids, use_cache=True)
+
+            def cached():
+                with torch.no_grad():
+                    model(input_ids=suffix, past_key_values=copy.deepcopy(past), use_cache=True)
+
+            t_full = _time_it(full, args.repeat)
+            t_cached = _time_it(cached, args.repeat)
+            saved.append(t_full - t_cached)
+            label = (q + ("（带历史）" if with_history else ""))[:14]
+            print(f"{label:<16}{ids.shape[-1]:>9}{t_full * 1000:>17.1f}{t_cached * 1000:>15.1f}"
+                  f"{(t_full - t_cached) * 1000:>10.1f}")
+
+    print(f"\n平均每个请求节省 prefill 时间: {statistics.mean(saved) * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
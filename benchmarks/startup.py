@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+启动开销基准：各部署模式下导入路由的耗时与常驻内存
+
+每种模式在全新的子进程中测量（模块缓存、内存互不影响）：
+- import router 的耗时与之后的常驻内存，以及 torch / transformers / openai 是否已被导入
+- 第一次 FAQ 命中的 route_question 耗时（日志与答案缓存关闭，不产生文件）
+- full 模式另测第一次需要小模型时导入 small_model 的耗时与内存（不加载权重）
+
+每项取 --repeat 次中最快的一次（第一次运行可能受磁盘缓存影响）。
+
+用法:
+    python benchmarks/startup.py [--repeat 3] [--json]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODES = ("full", "faq_remote")
+
+# 子进程中执行的测量脚本，结果以 JSON 打印到最后一行
+_CHILD = r"""
+import json, sys, time
+sys.path.insert(0, ROOT_DIR)
+from utils import rss_mb
+base_rss = rss_mb()
+
+start = time.perf_counter()
+import router
+result = {
+    "import_router_s": time.perf_counter() - start,
+    "rss_mb": rss_mb(),
+    "base_rss_mb": base_rss,
+    "loaded": [m for m in ("torch", "transformers", "openai") if m in sys.modules],
+}
+
+router.log_event = lambda *args: None
+start = time.perf_counter()
+answer, meta = router.route_question("图书馆几点开门？")
+result["first_faq_s"] = time.perf_counter() - start
+result["faq_route"] = meta["route"]
+
+if WITH_SMALL_MODEL:
+    start = time.perf_counter()
+    import small_model
+    result["import_small_model_s"] = time.perf_counter() - start
+    result["rss_with_small_model_mb"] = rss_mb()
+print(json.dumps(result))
+"""
+
+
+def measure(mode: str) -> dict:
+    """在新的子进程中按指定部署模式测量一次"""
+    env = dict(os.environ, DEPLOYMENT_MODE=mode, ANSWER_CACHE_ENABLED="0", LOG_BUFFERED="0")
+    code = f"ROOT_DIR = {ROOT_DIR!r}\nWITH_SMALL_MODEL = {mode == 'full'}\n" + _CHILD
+    output = subprocess.run(
+        [sys.executable, "-c", code], env=env, cwd=ROOT_DIR,
+        capture_output=True, text=True, check=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def best_of(mode: str, repeat: int) -> dict:
+    """repeat 次测量中 import router 最快的一次"""
+    return min((measure(mode) for _ in range(repeat)), key=lambda r: r["import_router_s"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="各部署模式的导入耗时与常驻内存")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--json", action="store_true", help="以 JSON 输出结果")
+    args = parser.parse_args()
+
+    results = {mode: best_of(mode, args.repeat) for mode in MODES}
+    if args.json:
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+        return
+
+    print(f"{'模式':<12}{'import router':>15}{'常驻内存':>12}{'首次FAQ':>12}  已导入的重型依赖")
+    for mode, r in results.items():
+        print(f"{mode:<12}{r['import_router_s'] * 1000:>13.0f}ms{r['rss_mb']:>10.0f}MB"
+              f"{r['first_faq_s'] * 1000:>10.1f}ms  {', '.join(r['loaded']) or '无'}")
+    full = results["full"]
+    if "import_small_model_s" in full:
+        print(f"\nfull 模式首次需要小模型时导入 small_model: {full['import_small_model_s'] * 1000:.0f}ms，"
+              f"常驻内存增至 {full['rss_with_small_model_mb']:.0f}MB（不含模型权重）")
+
+
+if __name__ == "__main__":
+    main()
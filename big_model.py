@@ -1,59 +1,375 @@
+import sys
 import time
-from openai import OpenAI
-from config import BIG_MODEL_API_KEY, BIG_MODEL_API_BASE, BIG_MODEL_NAME, BIG_MODEL_MAX_TOKENS
+from api_client import CircuitBreaker, CircuitOpenError, ResilientCaller, TokenBucket
+from config import (
+    BIG_MODEL_API_KEY, BIG_MODEL_API_BASE, BIG_MODEL_NAME, BIG_MODEL_MAX_TOKENS,
+    BIG_MODEL_MAX_CONNECTIONS, BIG_MODEL_KEEPALIVE_EXPIRY, BIG_MODEL_TIMEOUT,
+    BIG_MODEL_RPM, BIG_MODEL_BURST, BIG_MODEL_RATE_LIMIT_WAIT,
+    BIG_MODEL_MAX_RETRIES, BIG_MODEL_RETRY_BASE_DELAY, BIG_MODEL_RETRY_MAX_DELAY,
+    BIG_MODEL_BREAKER_FAILURES, BIG_MODEL_BREAKER_RESET, BIG_MODEL_PROMPT_BUDGET, BIG_MODEL_TOKENIZER,
+)
+from history_compactor import EstimateCounter, TokenizerCounter, compact_messages, prompt_tokens
+from metrics import observe_tokens_per_second
+from tracing import record_stage
 
-# 全局变量，延迟创建客户端
+# 全局变量，延迟创建客户端（openai 包也在创建时才导入，FAQ 命中的请求不需要它）
 _client = None
+_async_client = None
+# 限流、重试与熔断（同步、异步和流式调用共用同一套状态）
+_caller = None
+# 压缩对话历史用的 token 计数器（延迟创建）；没有分词器时按字符估算
+_token_counter = None
+_ESTIMATE_COUNTER = EstimateCounter()
+
+# 可重试的 HTTP 状态码（另加全部 5xx）：请求超时、冲突、限流
+RETRYABLE_STATUS = (408, 409, 429)
+
+
+def _is_retryable(error: Exception) -> bool:
+    """网络错误、超时、408/409/429 和 5xx 可以重试；其余 4xx 说明请求本身有问题，重试无益"""
+    openai = sys.modules.get("openai")
+    if openai is None:
+        return False
+    if isinstance(error, openai.APIConnectionError):  # 包括 APITimeoutError
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code in RETRYABLE_STATUS or error.status_code >= 500
+    return False
+
+
+def _retry_after(error: Exception):
+    """服务端通过 Retry-After 头要求的等待秒数"""
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    try:
+        return float(response.headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def _get_caller():
+    """懒加载限流/重试/熔断调用器"""
+    global _caller
+    if _caller is None:
+        _caller = ResilientCaller(
+            "big_model",
+            limiter=TokenBucket(BIG_MODEL_RPM / 60, BIG_MODEL_BURST),
+            breaker=CircuitBreaker(BIG_MODEL_BREAKER_FAILURES, BIG_MODEL_BREAKER_RESET),
+            max_retries=BIG_MODEL_MAX_RETRIES,
+            base_delay=BIG_MODEL_RETRY_BASE_DELAY,
+            max_delay=BIG_MODEL_RETRY_MAX_DELAY,
+            rate_limit_wait=BIG_MODEL_RATE_LIMIT_WAIT,
+            is_retryable=_is_retryable,
+            retry_after=_retry_after,
+        )
+        _caller.pool_connections = _pool_connections
+    return _caller
+
+
+def big_model_available() -> bool:
+    """熔断是否未打开；接口降级期间路由据此优先选择本地回答"""
+    return _get_caller().available
+
+
+def _http_client(async_client: bool = False):
+    """
+    按配置调优的 keep-alive 连接池（openai SDK 底层的 httpx 客户端）；
+    取不到 httpx 时返回 None，使用 SDK 默认连接池
+    """
+    import openai
+    # 较新的 SDK 基于 httpx2，旧版本基于 httpx
+    for module_name, prefix in (("httpx2", "Httpx2"), ("httpx", "Httpx")):
+        try:
+            http = __import__(module_name)
+        except ImportError:
+            continue
+        limits = http.Limits(
+            max_connections=BIG_MODEL_MAX_CONNECTIONS,
+            max_keepalive_connections=BIG_MODEL_MAX_CONNECTIONS,
+            keepalive_expiry=BIG_MODEL_KEEPALIVE_EXPIRY,
+        )
+        name = f"DefaultAsync{prefix}Client" if async_client else f"Default{prefix}Client"
+        default = http.AsyncClient if async_client else http.Client
+        return getattr(openai, name, default)(limits=limits)
+    return None
+
+
+def _pool_connections():
+    """同步客户端连接池中的连接数；SDK 内部结构不同时返回 None"""
+    try:
+        return len(_client._client._transport._pool.connections)
+    except (AttributeError, TypeError):
+        return None
+
 
 def _get_client():
-    """懒加载OpenAI客户端"""
+    """懒加载OpenAI客户端（关闭 SDK 自带重试，由 _caller 统一重试）"""
     global _client
     if _client is None:
         if not BIG_MODEL_API_KEY:
             raise ValueError("未配置QWEN_API_KEY，请在.env文件中配置或设置环境变量")
+        from openai import OpenAI
         _client = OpenAI(
             api_key=BIG_MODEL_API_KEY,
-            base_url=BIG_MODEL_API_BASE
+            base_url=BIG_MODEL_API_BASE,
+            timeout=BIG_MODEL_TIMEOUT,
+            max_retries=0,
+            http_client=_http_client(),
         )
     return _client
 
+
+def _get_async_client():
+    """懒加载异步OpenAI客户端（供 route_question_async 使用）"""
+    global _async_client
+    if _async_client is None:
+        if not BIG_MODEL_API_KEY:
+            raise ValueError("未配置QWEN_API_KEY，请在.env文件中配置或设置环境变量")
+        from openai import AsyncOpenAI
+        _async_client = AsyncOpenAI(
+            api_key=BIG_MODEL_API_KEY,
+            base_url=BIG_MODEL_API_BASE,
+            timeout=BIG_MODEL_TIMEOUT,
+            max_retries=0,
+            http_client=_http_client(async_client=True),
+        )
+    return _async_client
+
+
+def _get_token_counter():
+    """
+    token 计数器：配置了 BIG_MODEL_TOKENIZER 时加载该分词器；否则复用已加载的小模型分词器
+    （同为 Qwen 词表），小模型未加载时按字符估算（不为此导入 transformers）
+    """
+    global _token_counter
+    if BIG_MODEL_TOKENIZER:
+        if _token_counter is None:
+            try:
+                from transformers import AutoTokenizer
+                tokenizer = AutoTokenizer.from_pretrained(BIG_MODEL_TOKENIZER, trust_remote_code=True)
+                _token_counter = TokenizerCounter(tokenizer)
+            except Exception as e:
+                print(f"大模型分词器加载失败，改为估算token数: {e}")
+                _token_counter = _ESTIMATE_COUNTER
+        return _token_counter
+
+    tokenizer = getattr(sys.modules.get("small_model"), "_tokenizer", None)
+    if tokenizer is None:
+        return _ESTIMATE_COUNTER
+    if _token_counter is None or _token_counter.tokenizer is not tokenizer:
+        _token_counter = TokenizerCounter(tokenizer)
+    return _token_counter
+
+
+def _build_messages(question: str, history: list = None, usage_info: dict = None) -> list:
+    """
+    构建消息列表：系统提示 + 最近对话历史 + 当前问题；超出 BIG_MODEL_PROMPT_BUDGET 时压缩最早的历史，
+    usage_info 中写入压缩前后的提示词 token 数（prompt_tokens_before / prompt_tokens_after，本地计数）
+    """
+    messages = [
+        {"role": "system", "content": "你是一个校园问答助手，请准确、详细地回答学生的问题。"},
+    ]
+
+    # 加入对话历史（最近3轮对话，共6条消息）
+    if history:
+        messages.extend(history[-6:])  # 最近3轮
+
+    messages.append({"role": "user", "content": question})
+    return compact_messages(messages, _get_token_counter(), BIG_MODEL_PROMPT_BUDGET, usage_info)
+
+
+def _fallback_answer(question: str) -> str:
+    """API 不可用时的降级回答"""
+    return f"[大模型] 关于'{question}'，这是一个复杂的问题，建议您咨询相关部门获取准确信息。"
+
+
+def _estimate_usage(messages: list, answer: str, usage_info: dict):
+    """服务端没有返回 usage 时（流中途断开），按本地 token 计数估算提示词与已收到的输出"""
+    counter = _get_token_counter()
+    prompt = prompt_tokens(messages, counter)
+    completion = counter.count(answer)
+    usage_info.update({
+        "prompt_tokens": prompt,
+        "completion_tokens": completion,
+        "total_tokens": prompt + completion,
+        "usage_estimated": True,
+    })
+
+
+def estimate_stream_tokens(usage_info: dict, answer: str) -> int:
+    """
+    流式调用被调用方中途取消时（拿不到服务端 usage），估算已计费的 token 数：
+    建立请求时记录的提示词 token 数（prompt_tokens_after）+ 已收到输出的本地计数，与 _estimate_usage 一致
+    """
+    return usage_info.get("prompt_tokens_after", 0) + _get_token_counter().count(answer)
+
+
+def _record_api_call(api_time: float, usage_info: dict):
+    """记录 API 往返耗时；非流式调用的生成速度按整个往返时间估算"""
+    record_stage("big_model.api", api_time)
+    if usage_info.get("completion_tokens") and api_time > 0:
+        usage_info["tokens_per_second"] = usage_info["completion_tokens"] / api_time
+        observe_tokens_per_second("big_model", usage_info["tokens_per_second"])
+
+
 def big_model_answer(question: str, history: list = None):
     """使用远程Qwen3大模型API回答问题，返回(answer, usage_info)元组"""
     try:
         client = _get_client()
         
-        messages = [
-            {"role": "system", "content": "你是一个校园问答助手，请准确、详细地回答学生的问题。"},
-        ]
+        compaction = {}
+        messages = _build_messages(question, history, compaction)
         
-        # 加入对话历史（最近3轮对话，共6条消息）
-        if history:
-            messages.extend(history[-6:])  # 最近3轮
-        
-        messages.append({"role": "user", "content": question})
-        
-        # 调用Qwen API
-        response = client.chat.completions.create(
+        # 调用Qwen API（限流、可重试错误退避重试、熔断）
+        api_start = time.time()
+        response = _get_caller().call(lambda: client.chat.completions.create(
             model=BIG_MODEL_NAME,
             messages=messages,
             max_tokens=BIG_MODEL_MAX_TOKENS,
             temperature=0.7
-        )
+        ))
+        api_time = time.time() - api_start
         
         answer = response.choices[0].message.content.strip()
         
         # 提取token使用量信息
         usage = response.usage
         usage_info = {
+            **compaction,
             "prompt_tokens": usage.prompt_tokens if usage else 0,
             "completion_tokens": usage.completion_tokens if usage else 0,
             "total_tokens": usage.total_tokens if usage else 0,
         }
+        _record_api_call(api_time, usage_info)
         
         return (answer if answer else "大模型未返回有效回答", usage_info)
         
+    except CircuitOpenError:
+        # 熔断期间立即降级，不等待超时
+        return (_fallback_answer(question), {"total_tokens": 0})
     except Exception as e:
         print(f"大模型API调用错误: {e}")
-        # 降级到简单回答
-        time.sleep(0.2)
-        return (f"[大模型] 关于'{question}'，这是一个复杂的问题，建议您咨询相关部门获取准确信息。", {"total_tokens": 0})
+        # 降级到简单回答（可重试的错误已经按退避策略重试过）
+        return (_fallback_answer(question), {"total_tokens": 0})
+
+
+async def big_model_answer_async(question: str, history: list = None):
+    """big_model_answer 的异步版本：等待网络响应时不占用线程，返回(answer, usage_info)元组"""
+    try:
+        client = _get_async_client()
+        compaction = {}
+        messages = _build_messages(question, history, compaction)
+
+        api_start = time.time()
+        response = await _get_caller().call_async(lambda: client.chat.completions.create(
+            model=BIG_MODEL_NAME,
+            messages=messages,
+            max_tokens=BIG_MODEL_MAX_TOKENS,
+            temperature=0.7
+        ))
+        api_time = time.time() - api_start
+
+        answer = response.choices[0].message.content.strip()
+
+        usage = response.usage
+        usage_info = {
+            **compaction,
+            "prompt_tokens": usage.prompt_tokens if usage else 0,
+            "completion_tokens": usage.completion_tokens if usage else 0,
+            "total_tokens": usage.total_tokens if usage else 0,
+        }
+        _record_api_call(api_time, usage_info)
+
+        return (answer if answer else "大模型未返回有效回答", usage_info)
+
+    except CircuitOpenError:
+        return (_fallback_answer(question), {"total_tokens": 0})
+    except Exception as e:
+        print(f"大模型API调用错误: {e}")
+        return (_fallback_answer(question), {"total_tokens": 0})
+
+
+def big_model_answer_stream(question: str, history: list = None, usage_info: dict = None):
+    """
+    流式调用远程大模型：逐段产出回答增量
+
+    生成器的返回值（StopIteration.value，可用 `answer = yield from ...` 获取）是完整答案。
+    usage_info 字典在流结束后写入 prompt/completion/total_tokens（取自最后一个 chunk 的 usage），
+    以及 ttft（首个增量耗时）和 tokens_per_second（生成速度）。
+    输出了部分内容后流中断时返回已收到的部分，usage_info 中 truncated 为 True，token 数按本地计数估算。
+    """
+    if usage_info is None:
+        usage_info = {}
+    usage_info.setdefault("total_tokens", 0)
+    start = time.time()
+    first_delta_time = None
+    parts = []
+    stream = None
+
+    try:
+        client = _get_client()
+        messages = _build_messages(question, history, usage_info)
+        # 只在建立流之前重试；收到首个增量后出错不再重试，避免重复输出
+        stream = _get_caller().call(lambda: client.chat.completions.create(
+            model=BIG_MODEL_NAME,
+            messages=messages,
+            max_tokens=BIG_MODEL_MAX_TOKENS,
+            temperature=0.7,
+            stream=True,
+            stream_options={"include_usage": True},
+        ))
+
+        usage = None
+        try:
+            for chunk in stream:
+                # 开启 include_usage 后，最后一个 chunk 的 choices 为空，只携带 usage
+                if chunk.usage:
+                    usage = chunk.usage
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if not delta:
+                    continue
+                if first_delta_time is None:
+                    first_delta_time = time.time()
+                    usage_info["ttft"] = first_delta_time - start
+                parts.append(delta)
+                yield delta
+        finally:
+            # 调用方提前结束迭代时关闭连接，停止接收剩余 token
+            stream.close()
+
+        end = time.time()
+        record_stage("big_model.api", end - start)
+        if usage:
+            usage_info.update({
+                "prompt_tokens": usage.prompt_tokens,
+                "completion_tokens": usage.completion_tokens,
+                "total_tokens": usage.total_tokens,
+            })
+        if first_delta_time is not None and end > first_delta_time:
+            usage_info["tokens_per_second"] = usage_info.get("completion_tokens", len(parts)) / (end - first_delta_time)
+            observe_tokens_per_second("big_model", usage_info["tokens_per_second"])
+
+        answer = "".join(parts).strip()
+        if not answer:
+            answer = "大模型未返回有效回答"
+            yield answer
+        return answer
+
+    except Exception as e:
+        if not isinstance(e, CircuitOpenError):
+            print(f"大模型API调用错误: {e}")
+        if stream is not None and _is_retryable(e):
+            # 流已建立后才出错（连接中断、读超时），同样计入熔断
+            _get_caller().breaker.record_failure()
+        # 已经输出了部分内容时保留已有回答（已产生的 token 同样计费，按本地计数估算），否则降级到简单回答
+        if parts:
+            answer = "".join(parts).strip()
+            _estimate_usage(messages, answer, usage_info)
+            usage_info["truncated"] = True
+            return answer
+        answer = _fallback_answer(question)
+        yield answer
+        return answer
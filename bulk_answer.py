@@ -0,0 +1,285 @@
+"""
+批量离线回答：从文件流式读取问题，按路由分组并发回答，结果写入 JSONL（每行含完整 meta）
+
+适用于预先回答迎新常见问题、导入的咨询工单等大批量问题集。输入每次读入 BULK_CHUNK_SIZE 个问题，
+先用 plan_routes（批量复杂度评分 + FAQ 关键词匹配）分类，再按路由分组执行：
+- FAQ 命中与空问题：在主线程直接回答
+- 小模型问题：交给小模型通道，并发数等于批大小 × 推理进程数，由批处理引擎 / 推理进程池合并成批生成
+- 大模型问题：交给有界的大模型通道（默认 BIG_MODEL_MAX_CONNECTIONS 个并发），限流与重试由 api_client 负责
+每个通道排队的问题数有上限，读入速度跟随处理速度，内存占用与文件大小无关。
+实际回答仍走 route_question（答案缓存、语义检索、低置信度回退、相同问题合并都照常生效）。
+默认不写请求日志，避免离线流量混入线上的日志统计和回退预测的训练数据；--log 时写入，路由记为 bulk:<路由>。
+
+输入: 每行一个问题的文本文件（id 为行号），或 .jsonl 文件，每行 {"id", "question", "history"}（id 缺省为行号）
+输出: 每行 {"id", "question", "answer", "meta", "degraded"}，按完成顺序追加
+
+断点续跑：每完成一条追加一行，每 BULK_CHECKPOINT_EVERY 条 flush + fsync 一次。用同样的参数重新运行时
+跳过已有结果的 id；降级回答（degraded 为 true，如大模型接口不可用）重新回答并追加，同一 id 以最后一行为准
+（load_results 按此读取）。中断时写了一半的最后一行在续跑前截掉。
+
+命令行:
+    python bulk_answer.py questions.txt answers.jsonl
+    python bulk_answer.py tickets.jsonl answers.jsonl --big-concurrency 8
+"""
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from config import (
+    BIG_MODEL_MAX_CONNECTIONS, BULK_BIG_CONCURRENCY, BULK_CHECKPOINT_EVERY, BULK_CHUNK_SIZE,
+    BULK_SMALL_CONCURRENCY, LOCAL_MODELS_ENABLED, SMALL_MODEL_MAX_BATCH_SIZE, SMALL_MODEL_WORKERS,
+)
+from router import DEGRADED_PREFIXES, plan_routes, route_question
+from utils import log_scope
+
+# 降级路由：大模型熔断期间保留的小模型回答，续跑时与降级提示一样重新回答
+DEGRADED_ROUTES = ("small_model_degraded",)
+# 写入请求日志时加在路由前的标记
+BULK_ROUTE_PREFIX = "bulk:"
+# 在主线程直接回答的路由（不调用模型）
+INLINE_ROUTES = ("faq", "faq_fuzzy", "invalid")
+
+
+def iter_questions(path: str):
+    """逐行读取问题，产出 (id, question, history)；跳过空行"""
+    is_jsonl = path.endswith(".jsonl")
+    with open(path, encoding="utf-8") as f:
+        for lineno, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            if not is_jsonl:
+                yield lineno, line, None
+                continue
+            item = json.loads(line)
+            if isinstance(item, str):
+                yield lineno, item, None
+            else:
+                yield item.get("id", lineno), item.get("question", ""), item.get("history")
+
+
+def _chunks(items, size: int):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def load_results(path: str) -> dict:
+    """读取输出文件，返回 id -> 记录（同一 id 以最后一行为准，跳过不完整的行）"""
+    results = {}
+    if not os.path.exists(path):
+        return results
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            results[record["id"]] = record
+    return results
+
+
+def _drop_partial_line(path: str):
+    """中断时最后一行可能只写了一半：截断到最后一个换行符，续跑追加的内容从新的一行开始"""
+    if not os.path.exists(path):
+        return
+    with open(path, "rb+") as f:
+        end = pos = f.seek(0, os.SEEK_END)
+        while pos > 0:
+            step = min(65536, pos)
+            f.seek(pos - step)
+            newline = f.read(step).rfind(b"\n")
+            if newline >= 0:
+                pos = pos - step + newline + 1
+                break
+            pos -= step
+        if pos < end:
+            f.truncate(pos)
+
+
+class ResultWriter:
+    """线程安全地追加结果，每 checkpoint_every 条 flush + fsync 一次"""
+
+    def __init__(self, path: str, checkpoint_every: int = BULK_CHECKPOINT_EVERY):
+        self._file = open(path, "a", encoding="utf-8")
+        self._lock = threading.Lock()
+        self.checkpoint_every = max(1, checkpoint_every)
+        self.written = 0
+        self.degraded = 0
+        self.routes = Counter()
+
+    def write(self, record: dict):
+        line = json.dumps(record, ensure_ascii=False, default=str) + "\n"
+        with self._lock:
+            self._file.write(line)
+            self.written += 1
+            self.degraded += record["degraded"]
+            self.routes[record["meta"].get("route")] += 1
+            if self.written % self.checkpoint_every == 0:
+                self._checkpoint()
+
+    def _checkpoint(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        with self._lock:
+            self._checkpoint()
+            self._file.close()
+
+
+class _Lane:
+    """一组路由的执行通道：workers 个线程，另外最多 max_pending 个问题排队，满了时提交方阻塞"""
+
+    def __init__(self, name: str, workers: int, max_pending: int):
+        self.workers = max(1, workers)
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=f"bulk-{name}")
+        self._slots = threading.BoundedSemaphore(self.workers + max(0, max_pending))
+        self.error = None
+
+    def submit(self, fn, *args):
+        self._slots.acquire()
+        future = self._executor.submit(fn, *args)
+        future.add_done_callback(self._done)
+
+    def _done(self, future):
+        self._slots.release()
+        if future.exception() is not None and self.error is None:
+            self.error = future.exception()
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+
+def answer_one(item_id, question: str, history: list = None, log: bool = False) -> dict:
+    """
+    回答一个问题，返回输出记录；route_question 抛出异常时记为降级，续跑时重试
+    log 为 False 时不写请求日志，为 True 时路由加上 BULK_ROUTE_PREFIX 写入
+    """
+    try:
+        with log_scope(enabled=log, route_prefix=BULK_ROUTE_PREFIX):
+            answer, meta = route_question(question, history=history)
+    except Exception as e:
+        answer, meta = None, {"route": "error", "error": str(e)}
+    degraded = answer is None or answer.startswith(DEGRADED_PREFIXES) or meta.get("route") in DEGRADED_ROUTES
+    return {"id": item_id, "question": question, "answer": answer, "meta": meta, "degraded": degraded}
+
+
+def default_small_concurrency() -> int:
+    """小模型并发数：让每个推理进程（单进程时为批处理引擎）都能凑满一批"""
+    return SMALL_MODEL_MAX_BATCH_SIZE * max(1, SMALL_MODEL_WORKERS)
+
+
+def run_bulk(input_path: str, output_path: str, chunk_size: int = BULK_CHUNK_SIZE,
+             small_concurrency: int = None, big_concurrency: int = None,
+             checkpoint_every: int = BULK_CHECKPOINT_EVERY, progress=None, log: bool = False) -> dict:
+    """
+    批量回答 input_path 中的问题并追加到 output_path，返回统计：
+    total（输入问题数）、skipped（已有结果而跳过）、answered、degraded、planned / routes（计划与实际路由计数）、elapsed
+    progress: 可选回调，每处理完一块输入调用一次，参数为当前统计
+    log: 是否写请求日志（路由记为 bulk:<路由>），默认不写
+    """
+    small_concurrency = small_concurrency or BULK_SMALL_CONCURRENCY or default_small_concurrency()
+    big_concurrency = big_concurrency or BULK_BIG_CONCURRENCY or BIG_MODEL_MAX_CONNECTIONS
+    chunk_size = max(1, chunk_size)
+
+    _drop_partial_line(output_path)
+    done = {item_id for item_id, record in load_results(output_path).items() if not record.get("degraded")}
+
+    start = time.time()
+    stats = {"total": 0, "skipped": 0, "planned": Counter()}
+    writer = ResultWriter(output_path, checkpoint_every)
+    small = _Lane("small", small_concurrency, chunk_size)
+    big = _Lane("big", big_concurrency, chunk_size)
+
+    def handle(item_id, question, history):
+        writer.write(answer_one(item_id, question, history, log=log))
+
+    try:
+        for chunk in _chunks(iter_questions(input_path), chunk_size):
+            stats["total"] += len(chunk)
+            todo = [item for item in chunk if item[0] not in done]
+            stats["skipped"] += len(chunk) - len(todo)
+            for item, plan in zip(todo, plan_routes([question for _, question, _ in todo])):
+                route = plan["route"]
+                stats["planned"][route] += 1
+                if route in INLINE_ROUTES:
+                    handle(*item)
+                elif route == "small_model":
+                    small.submit(handle, *item)
+                else:
+                    big.submit(handle, *item)
+            if progress:
+                progress({**stats, "answered": writer.written, "elapsed": time.time() - start})
+    finally:
+        small.close()
+        big.close()
+        writer.close()
+
+    for lane in (small, big):
+        if lane.error is not None:
+            raise lane.error
+    stats.update({
+        "answered": writer.written,
+        "degraded": writer.degraded,
+        "routes": writer.routes,
+        "elapsed": time.time() - start,
+    })
+    return stats
+
+
+def _print_progress(stats: dict):
+    rate = stats["answered"] / stats["elapsed"] if stats["elapsed"] > 0 else 0
+    print(f"  已读取 {stats['total']}，跳过 {stats['skipped']}，已回答 {stats['answered']}（{rate:.1f} 条/秒）",
+          flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="批量离线回答问题文件，结果写入 JSONL（可断点续跑）")
+    parser.add_argument("input", help="问题文件：每行一个问题，或 .jsonl（{\"id\", \"question\", \"history\"}）")
+    parser.add_argument("output", help="输出 JSONL 文件；已存在时跳过已回答的 id")
+    parser.add_argument("--chunk-size", type=int, default=BULK_CHUNK_SIZE, help="每次读入并分类的问题数")
+    parser.add_argument("--small-concurrency", type=int, default=0, help="小模型并发数（0=批大小×推理进程数）")
+    parser.add_argument("--big-concurrency", type=int, default=0, help="大模型并发数（0=BIG_MODEL_MAX_CONNECTIONS）")
+    parser.add_argument("--checkpoint-every", type=int, default=BULK_CHECKPOINT_EVERY,
+                        help="每回答多少条 flush + fsync 一次")
+    parser.add_argument("--log", action="store_true", help="把回答写入请求日志（路由记为 bulk:<路由>），默认不写")
+    args = parser.parse_args()
+
+    if LOCAL_MODELS_ENABLED:
+        # 先等小模型加载完成，否则预热期间的小模型问题都会交给大模型
+        from warmup import start_warmup, wait_ready
+        start_warmup()
+        print("小模型已就绪" if wait_ready() else "小模型不可用，小模型问题将交给大模型")
+
+    stats = run_bulk(
+        args.input, args.output,
+        chunk_size=args.chunk_size,
+        small_concurrency=args.small_concurrency,
+        big_concurrency=args.big_concurrency,
+        checkpoint_every=args.checkpoint_every,
+        progress=_print_progress,
+        log=args.log,
+    )
+    print(f"完成：输入 {stats['total']} 条，跳过 {stats['skipped']} 条，回答 {stats['answered']} 条，"
+          f"降级 {stats['degraded']} 条，耗时 {stats['elapsed']:.1f}s")
+    print("  计划路由: " + "，".join(f"{k} {v}" for k, v in stats["planned"].most_common()))
+    print("  实际路由: " + "，".join(f"{k} {v}" for k, v in stats["routes"].most_common()))
+    if stats["degraded"]:
+        print("有降级回答，重新运行同一命令可重试这些问题")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
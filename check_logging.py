@@ -12,41 +12,70 @@ print("=" * 70)
 
 # 导入模块
 try:
-    from utils import LOG_PATH, log_event
+    from utils import LOG_PATH, LOG_BACKEND, log_event, flush_logs, get_log_store
+    from config import LOG_STORE_PATH
     print("✓ 成功导入 utils 模块")
 except ImportError as e:
     print(f"✗ 导入失败: {e}")
     sys.exit(1)
 
+
+def _tail_csv(path, n=5):
+    """返回 CSV 日志的表头、最后 n 行和数据行数（逐行读取，不把整个文件读进内存）"""
+    from collections import deque
+    with open(path, 'r', encoding='utf-8') as f:
+        header = f.readline().rstrip()
+        tail = deque(maxlen=n)
+        count = 0
+        for line in f:
+            tail.append(line.rstrip())
+            count += 1
+    return header, list(tail), count
+
+
+def _recent_rows(n=5):
+    """当前日志后端中最近 n 条记录（每行一个字符串）"""
+    if LOG_BACKEND == "sqlite":
+        return [",".join(str(v) for v in row.values()) for row in get_log_store().last(n)]
+    return _tail_csv(LOG_PATH, n)[1]
+
+
 # 显示关键信息
 print(f"\n【关键信息】")
 print(f"  当前工作目录: {os.getcwd()}")
 print(f"  脚本所在目录: {os.path.dirname(os.path.abspath(__file__))}")
-print(f"  日志文件路径: {LOG_PATH}")
-print(f"  日志文件绝对路径: {os.path.abspath(LOG_PATH)}")
+print(f"  日志后端: {LOG_BACKEND}")
+if LOG_BACKEND == "sqlite":
+    print(f"  日志数据库路径: {LOG_STORE_PATH}")
+else:
+    print(f"  日志文件路径: {LOG_PATH}")
+    print(f"  日志文件绝对路径: {os.path.abspath(LOG_PATH)}")
 
 # 检查日志文件状态
 print(f"\n【日志文件状态】")
-if os.path.exists(LOG_PATH):
+if LOG_BACKEND == "sqlite":
+    if os.path.exists(LOG_STORE_PATH):
+        print(f"  ✓ 日志数据库存在")
+        print(f"  文件大小: {os.path.getsize(LOG_STORE_PATH)} 字节")
+        print(f"\n  最近5条记录:")
+        for line in _recent_rows(5):
+            print(f"    {line}")
+        if os.path.exists(LOG_PATH):
+            print(f"\n  ! 发现旧的CSV日志: {LOG_PATH}")
+            print(f"    可运行 python log_store.py --import-csv {LOG_PATH} 迁移到数据库")
+    else:
+        print(f"  ✗ 日志数据库不存在")
+        print(f"  这是正常的，数据库会在第一次记录日志时自动创建")
+elif os.path.exists(LOG_PATH):
     print(f"  ✓ 日志文件存在")
     print(f"  文件大小: {os.path.getsize(LOG_PATH)} 字节")
-    
-    # 读取并显示内容
-    with open(LOG_PATH, 'r', encoding='utf-8') as f:
-        lines = f.readlines()
-        print(f"  总行数: {len(lines)}")
-        print(f"  数据行数: {len(lines) - 1 if lines else 0}")
-    
+
+    header, tail, count = _tail_csv(LOG_PATH)
+    print(f"  数据行数: {count}")
     print(f"\n  最近5条记录:")
-    with open(LOG_PATH, 'r', encoding='utf-8') as f:
-        lines = f.readlines()
-        # 显示表头
-        if lines:
-            print(f"    {lines[0].rstrip()}")
-        # 显示最后5条数据
-        for line in lines[-5:]:
-            if line != lines[0]:  # 跳过表头
-                print(f"    {line.rstrip()}")
+    print(f"    {header}")
+    for line in tail:
+        print(f"    {line}")
 else:
     print(f"  ✗ 日志文件不存在")
     print(f"  这是正常的，文件会在第一次记录日志时自动创建")
@@ -55,15 +84,15 @@ else:
 print(f"\n【功能测试】")
 try:
     log_event("诊断测试", 0, "test", 0.001, 0.0)
+    # 日志由后台线程批量写入，读取前先等待写出
+    flush_logs()
     print(f"  ✓ 成功写入测试日志")
-    
+
     # 验证
-    with open(LOG_PATH, 'r', encoding='utf-8') as f:
-        lines = f.readlines()
-        if any("诊断测试" in line for line in lines):
-            print(f"  ✓ 确认测试日志已写入")
-        else:
-            print(f"  ✗ 警告: 未找到测试日志")
+    if any("诊断测试" in line for line in _recent_rows(5)):
+        print(f"  ✓ 确认测试日志已写入")
+    else:
+        print(f"  ✗ 警告: 未找到测试日志")
 except Exception as e:
     print(f"  ✗ 写入失败: {e}")
 
@@ -82,7 +111,7 @@ for loc in old_locations:
 
 # 给出建议
 print(f"\n【使用建议】")
-print(f"  1. 日志文件位置固定在: {LOG_PATH}")
+print(f"  1. 日志位置固定在: {LOG_STORE_PATH if LOG_BACKEND == 'sqlite' else LOG_PATH}")
 print(f"  2. 无论从哪个目录运行程序，日志都会写入这个位置")
 print(f"  3. 如果需要查看日志，请访问上述路径")
 print(f"  4. 日志文件不再纳入版本控制（已添加到 .gitignore）")
@@ -4,15 +4,181 @@ from dotenv import load_dotenv
 # Load environment variables from .env file
 load_dotenv()
 
+# Deployment mode: full (local small model + semantic FAQ + remote big model) |
+# faq_remote (keyword FAQ + remote big model only; torch/transformers are never imported)
+DEPLOYMENT_MODE = os.getenv("DEPLOYMENT_MODE", "full")
+LOCAL_MODELS_ENABLED = DEPLOYMENT_MODE != "faq_remote"
+
 # Small model configuration (local Qwen2 1.5B for Chinese dialogue)
 # Note: Using Qwen2-1.5B-Instruct for better Chinese conversation capabilities
 # Qwen2 1.5B is optimized for Chinese dialogue and general Q&A scenarios
 SMALL_MODEL_PATH = os.getenv("SMALL_MODEL_PATH", "Qwen/Qwen2-1.5B-Instruct")
 SMALL_MODEL_DEVICE = "cpu"  # Use CPU for integrated graphics
 SMALL_MODEL_MAX_LENGTH = 512
+# Token budget for system prompt + history + question; the oldest history turns are
+# shortened or dropped to fit (see history_compactor.py), the question is never cut
+SMALL_MODEL_PROMPT_BUDGET = int(os.getenv("SMALL_MODEL_PROMPT_BUDGET", str(SMALL_MODEL_MAX_LENGTH)))
+# Weight precision: float32 | bfloat16 | int8 (dynamic quantization of Linear layers)
+SMALL_MODEL_PRECISION = os.getenv("SMALL_MODEL_PRECISION", "float32")
+# Reuse the precomputed KV cache of the fixed system prompt for single-prompt generation
+SMALL_MODEL_PREFIX_CACHE = os.getenv("SMALL_MODEL_PREFIX_CACHE", "1") == "1"
+# Logprob confidence: abort generation once the mean log-probability of the last
+# SMALL_MODEL_CONFIDENCE_WINDOW sampled tokens falls below SMALL_MODEL_MIN_LOGPROB,
+# so the router falls back to the big model without finishing a doomed answer.
+# Log-probabilities are taken after temperature/top-k/top-p, i.e. from the distribution
+# tokens are actually sampled from (temperature 0.3 sharpens it, hence the tighter default)
+SMALL_MODEL_EARLY_ABORT = os.getenv("SMALL_MODEL_EARLY_ABORT", "1") == "1"
+SMALL_MODEL_MIN_LOGPROB = float(os.getenv("SMALL_MODEL_MIN_LOGPROB", "-0.6"))
+SMALL_MODEL_CONFIDENCE_WINDOW = int(os.getenv("SMALL_MODEL_CONFIDENCE_WINDOW", "8"))
+
+# Dynamic batching: concurrent small-model requests arriving within the wait
+# window (streaming and non-streaming alike) are merged into one left-padded generate call
+SMALL_MODEL_BATCHING = os.getenv("SMALL_MODEL_BATCHING", "1") == "1"
+SMALL_MODEL_MAX_BATCH_SIZE = int(os.getenv("SMALL_MODEL_MAX_BATCH_SIZE", "4"))
+SMALL_MODEL_MAX_WAIT_MS = float(os.getenv("SMALL_MODEL_MAX_WAIT_MS", "20"))
+
+# Multi-process worker pool (opt-in): SMALL_MODEL_WORKERS > 0 runs inference in that
+# many spawned processes, each pinned to its own slice of physical cores with
+# SMALL_MODEL_WORKER_THREADS torch threads (0 = cores / workers). Requests are
+# dispatched over a bounded queue of SMALL_MODEL_WORKER_QUEUE entries; when it is
+# full the call fails fast and the router falls back to the big model. A request
+# waits at most SMALL_MODEL_WORKER_TIMEOUT seconds (same budget as one big-model
+# attempt); requests held by a worker that dies fail immediately. Dead workers are
+# respawned with exponential backoff, at most SMALL_MODEL_WORKER_MAX_RESTARTS times in a row
+SMALL_MODEL_WORKERS = int(os.getenv("SMALL_MODEL_WORKERS", "0"))
+SMALL_MODEL_WORKER_THREADS = int(os.getenv("SMALL_MODEL_WORKER_THREADS", "0"))
+SMALL_MODEL_WORKER_QUEUE = int(os.getenv("SMALL_MODEL_WORKER_QUEUE", "16"))
+SMALL_MODEL_WORKER_TIMEOUT = float(os.getenv("SMALL_MODEL_WORKER_TIMEOUT", "60"))
+SMALL_MODEL_WORKER_MAX_RESTARTS = int(os.getenv("SMALL_MODEL_WORKER_MAX_RESTARTS", "5"))
+# Build the model directly on memory-mapped safetensors so that processes loading
+# the same file share its page cache; only applies when the checkpoint dtype matches
+# SMALL_MODEL_PRECISION (float32/bfloat16), otherwise the regular loader is used
+SMALL_MODEL_MMAP_WEIGHTS = os.getenv("SMALL_MODEL_MMAP_WEIGHTS", "1") == "1"
+
+# Startup warm-up: app.py loads the small model in a background thread and runs
+# WARMUP_GENERATIONS throwaway generations; with WARMUP_GATE on, questions bound for
+# the small model go to the FAQ / big model until warm-up finishes instead of blocking.
+# A failed warm-up is retried in the background WARMUP_RETRY_INTERVAL seconds later (0 = never)
+WARMUP_ENABLED = os.getenv("WARMUP_ENABLED", "1") == "1"
+WARMUP_GENERATIONS = int(os.getenv("WARMUP_GENERATIONS", "2"))
+WARMUP_GATE = os.getenv("WARMUP_GATE", "1") == "1"
+WARMUP_RETRY_INTERVAL = float(os.getenv("WARMUP_RETRY_INTERVAL", "60"))
+
+# Worker threads of the executor that runs local inference for route_question_async
+# (defaults to the batch size so concurrent requests can fill a batch)
+INFERENCE_EXECUTOR_WORKERS = int(os.getenv("INFERENCE_EXECUTOR_WORKERS", str(SMALL_MODEL_MAX_BATCH_SIZE)))
+
+# Hedged routing (opt-in): for mid-complexity questions, start the big-model call
+# alongside the small model after HEDGE_DELAY_MS (immediately for score 3) and keep
+# whichever answer is usable (applies to route_question, route_question_stream and bulk runs)
+HEDGE_ENABLED = os.getenv("HEDGE_ENABLED", "0") == "1"
+HEDGE_DELAY_MS = float(os.getenv("HEDGE_DELAY_MS", "1500"))
+
+# Request log (logs.csv): rows are queued and appended by a background thread in
+# batches of LOG_BATCH_SIZE or every LOG_FLUSH_INTERVAL_MS, whichever comes first.
+# LOG_FSYNC: never (leave it to the OS) | batch (fsync every write) | interval
+# (fsync at most once per LOG_FSYNC_INTERVAL seconds)
+LOG_BUFFERED = os.getenv("LOG_BUFFERED", "1") == "1"
+LOG_FLUSH_INTERVAL_MS = float(os.getenv("LOG_FLUSH_INTERVAL_MS", "500"))
+LOG_BATCH_SIZE = int(os.getenv("LOG_BATCH_SIZE", "64"))
+LOG_FSYNC = os.getenv("LOG_FSYNC", "never")
+LOG_FSYNC_INTERVAL = float(os.getenv("LOG_FSYNC_INTERVAL", "5"))
+# Log backend: sqlite (indexed store with retention, see log_store.py) | csv (logs.csv)
+LOG_BACKEND = os.getenv("LOG_BACKEND", "sqlite")
+LOG_STORE_PATH = os.getenv(
+    "LOG_STORE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "logs.db")
+)
+LOG_RETENTION_DAYS = float(os.getenv("LOG_RETENTION_DAYS", "30"))  # <=0 keeps rows forever
+LOG_MAX_ROWS = int(os.getenv("LOG_MAX_ROWS", "1000000"))  # <=0 means unlimited
+
+# Per-stage tracing (meta["stages"]) and in-process metrics; when disabled, spans
+# are shared no-op context managers. Metrics are exported in Prometheus text format
+# on http://METRICS_HOST:METRICS_PORT/metrics (0 = off) and/or written to
+# METRICS_DUMP_PATH every METRICS_DUMP_INTERVAL seconds (empty = off)
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "1") == "1"
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+METRICS_DUMP_PATH = os.getenv("METRICS_DUMP_PATH", "")
+METRICS_DUMP_INTERVAL = float(os.getenv("METRICS_DUMP_INTERVAL", "15"))
 
 # Big model configuration (remote Qwen3 API)
 BIG_MODEL_API_KEY = os.getenv("QWEN_API_KEY", "")
 BIG_MODEL_API_BASE = os.getenv("QWEN_API_BASE", "https://dashscope.aliyuncs.com/compatible-mode/v1")
 BIG_MODEL_NAME = os.getenv("QWEN_MODEL_NAME", "qwen-plus")
 BIG_MODEL_MAX_TOKENS = 1000
+# Prompt token budget for the big model (history is compacted to fit, 0 = no limit).
+# Tokens are counted with BIG_MODEL_TOKENIZER when set, otherwise with the small
+# model's tokenizer if it is already loaded (same Qwen vocabulary), otherwise estimated
+BIG_MODEL_PROMPT_BUDGET = int(os.getenv("BIG_MODEL_PROMPT_BUDGET", "2048"))
+BIG_MODEL_TOKENIZER = os.getenv("BIG_MODEL_TOKENIZER", "")
+# Big-model client resilience: keep-alive connection pool, token-bucket rate limit
+# matched to the API quota (BIG_MODEL_RPM requests per minute with bursts of up to
+# BIG_MODEL_BURST; 0 = unlimited), jittered exponential-backoff retries on retryable
+# errors only (connection errors, timeouts, 408/409/429/5xx), and a circuit breaker
+# that fails fast for BIG_MODEL_BREAKER_RESET seconds after BIG_MODEL_BREAKER_FAILURES
+# consecutive failed calls
+BIG_MODEL_MAX_CONNECTIONS = int(os.getenv("BIG_MODEL_MAX_CONNECTIONS", "16"))
+BIG_MODEL_KEEPALIVE_EXPIRY = float(os.getenv("BIG_MODEL_KEEPALIVE_EXPIRY", "60"))  # seconds
+BIG_MODEL_TIMEOUT = float(os.getenv("BIG_MODEL_TIMEOUT", "60"))  # seconds per attempt
+BIG_MODEL_RPM = float(os.getenv("BIG_MODEL_RPM", "600"))
+BIG_MODEL_BURST = int(os.getenv("BIG_MODEL_BURST", "20"))
+BIG_MODEL_RATE_LIMIT_WAIT = float(os.getenv("BIG_MODEL_RATE_LIMIT_WAIT", "10"))  # max seconds to queue
+BIG_MODEL_MAX_RETRIES = int(os.getenv("BIG_MODEL_MAX_RETRIES", "3"))
+BIG_MODEL_RETRY_BASE_DELAY = float(os.getenv("BIG_MODEL_RETRY_BASE_DELAY", "0.5"))
+BIG_MODEL_RETRY_MAX_DELAY = float(os.getenv("BIG_MODEL_RETRY_MAX_DELAY", "8"))
+BIG_MODEL_BREAKER_FAILURES = int(os.getenv("BIG_MODEL_BREAKER_FAILURES", "5"))  # <=0 disables
+BIG_MODEL_BREAKER_RESET = float(os.getenv("BIG_MODEL_BREAKER_RESET", "30"))
+
+# Answer cache configuration (in-process LRU + shared SQLite store)
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "1") == "1"
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "1024"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "86400"))  # seconds
+ANSWER_CACHE_PATH = os.getenv(
+    "ANSWER_CACHE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "answer_cache.db")
+)
+ANSWER_CACHE_HISTORY_WINDOW = 6  # history messages that take part in the cache key
+
+# Single-flight: concurrent requests for the same normalized question and recent
+# history share one in-flight model call instead of each generating their own
+SINGLE_FLIGHT_ENABLED = os.getenv("SINGLE_FLIGHT_ENABLED", "1") == "1"
+
+# Semantic FAQ retrieval (CPU sentence embeddings, tried after a keyword miss)
+SEMANTIC_FAQ_ENABLED = os.getenv("SEMANTIC_FAQ_ENABLED", "1") == "1" and LOCAL_MODELS_ENABLED
+SEMANTIC_FAQ_MODEL = os.getenv("SEMANTIC_FAQ_MODEL", "BAAI/bge-small-zh-v1.5")
+SEMANTIC_FAQ_THRESHOLD = float(os.getenv("SEMANTIC_FAQ_THRESHOLD", "0.72"))
+SEMANTIC_FAQ_TOP_K = 3
+SEMANTIC_FAQ_EMBEDDINGS_PATH = os.getenv(
+    "SEMANTIC_FAQ_EMBEDDINGS_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "faq_embeddings.npz"),
+)
+
+# Bulk offline answering (bulk_answer.py): questions are read and classified in
+# chunks of BULK_CHUNK_SIZE; small-model questions run on BULK_SMALL_CONCURRENCY
+# threads (0 = batch size x worker processes, so every batch can fill up) and
+# big-model questions on BULK_BIG_CONCURRENCY threads (0 = BIG_MODEL_MAX_CONNECTIONS).
+# The output file is flushed and fsynced every BULK_CHECKPOINT_EVERY answers
+BULK_CHUNK_SIZE = int(os.getenv("BULK_CHUNK_SIZE", "256"))
+BULK_SMALL_CONCURRENCY = int(os.getenv("BULK_SMALL_CONCURRENCY", "0"))
+BULK_BIG_CONCURRENCY = int(os.getenv("BULK_BIG_CONCURRENCY", "0"))
+BULK_CHECKPOINT_EVERY = int(os.getenv("BULK_CHECKPOINT_EVERY", "100"))
+
+# Learned fallback predictor (fallback_predictor.py): logistic regression over hashed
+# character n-grams and complexity features, trained offline on logged small_model /
+# big_model_fallback outcomes. When P(fallback) >= FALLBACK_PREDICTOR_THRESHOLD the
+# router sends low/mid-complexity questions straight to the big model (route
+# big_model_predicted) instead of generating a small-model answer that would be thrown
+# away; a FALLBACK_PREDICTOR_EXPLORE fraction still tries the small model so new
+# labels keep arriving. Has no effect until a model file exists; it is reloaded
+# when the file changes
+FALLBACK_PREDICTOR_ENABLED = os.getenv("FALLBACK_PREDICTOR_ENABLED", "1") == "1"
+FALLBACK_PREDICTOR_PATH = os.getenv(
+    "FALLBACK_PREDICTOR_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "fallback_model.npz")
+)
+FALLBACK_PREDICTOR_THRESHOLD = float(os.getenv("FALLBACK_PREDICTOR_THRESHOLD", "0.8"))
+FALLBACK_PREDICTOR_EXPLORE = float(os.getenv("FALLBACK_PREDICTOR_EXPLORE", "0.05"))
+
+# Typo-tolerant FAQ matching: after an exact keyword miss, keywords that appear in the
+# question within one edit (found through a character-bigram inverted index, after
+# NFKC / case / whitespace normalization) count at a penalty; answers are logged
+# under the route faq_fuzzy
+FAQ_FUZZY_ENABLED = os.getenv("FAQ_FUZZY_ENABLED", "1") == "1"
@@ -0,0 +1,279 @@
+"""
+小模型回退预测：跳过注定要回退到大模型的小模型调用
+
+日志中 big_model_fallback 的请求先完整生成了一次小模型回答，置信度检查不通过又调用了大模型，
+小模型占用的 CPU 时间白白浪费。复杂度阈值（<=1、<=3）是手工设定的，学不到 1.5B 模型具体在哪些问题上答不好。
+
+这里用日志中的结果训练逻辑回归：特征为问题的字符 1~3-gram（哈希到固定维度）加复杂度分数与长度档位，
+标签为该请求是否回退（small_model = 0，big_model_fallback = 1）。小模型出错导致的回退
+（big_model_fallback_error）、大模型熔断期间保留的降级回答（small_model_degraded）与批量离线回答
+（bulk: 前缀）说明不了小模型在这个问题上答得好不好，不参与训练。推理只用 NumPy 查表求和，
+单个问题约几十微秒。路由在 P(回退) >= FALLBACK_PREDICTOR_THRESHOLD 时直接交给大模型（路由 big_model_predicted）。
+
+模型文件（.npz）像 faq.json 一样按修改时间热加载，重新训练后无需重启。
+
+命令行:
+    python fallback_predictor.py --train                  # 用日志存储（LOG_BACKEND）训练并写入模型文件
+    python fallback_predictor.py --train --csv logs.csv   # 用 CSV 日志训练
+    python fallback_predictor.py --report --hours 168     # 用当前模型评估最近一周的日志
+"""
+
+import argparse
+import csv
+import json
+import os
+import time
+import zlib
+from bisect import bisect_left
+
+import numpy as np
+
+from config import (
+    FALLBACK_PREDICTOR_PATH, FALLBACK_PREDICTOR_THRESHOLD,
+    LOG_BACKEND, LOG_STORE_PATH, LOG_RETENTION_DAYS, LOG_MAX_ROWS,
+)
+from utils import LENGTH_BINS, LOG_PATH
+
+# 参与训练的路由与标签；其他路由（FAQ、缓存、直接大模型、预测跳过的请求）不知道小模型的结果，
+# 出错回退、熔断降级与批量离线回答的结果与问题本身无关或不是线上流量，同样不在此列
+LABELS = {"small_model": 0, "big_model_fallback": 1}
+# 字符 n-gram 哈希维度与最大长度
+HASH_DIM = 1 << 16
+NGRAM_MAX = 3
+# 复杂度分数 one-hot 的档数（更高的分数并入最后一档）
+SCORE_BUCKETS = 7
+# 训练数据少于这么多条、或没有回退样本时不生成模型
+MIN_TRAINING_ROWS = 50
+# 报告中评估的概率阈值
+REPORT_THRESHOLDS = (0.5, 0.6, 0.7, 0.8, 0.9)
+# 权重向量长度：n-gram 哈希桶 + 复杂度分数档 + 长度档
+FEATURE_DIM = HASH_DIM + SCORE_BUCKETS + len(LENGTH_BINS) + 1
+
+# 热加载的模型（延迟加载）
+_predictor = None
+_predictor_mtime = 0
+
+
+def _features(question: str, score: int) -> np.ndarray:
+    """问题的特征下标：去重后的字符 n-gram 哈希桶，加上复杂度分数与长度档位两个 one-hot 特征"""
+    text = question.strip().lower()
+    buckets = {
+        zlib.crc32(text[i:i + n].encode("utf-8")) % HASH_DIM
+        for n in range(1, NGRAM_MAX + 1)
+        for i in range(len(text) - n + 1)
+    }
+    buckets.add(HASH_DIM + min(max(int(score), 0), SCORE_BUCKETS - 1))
+    buckets.add(HASH_DIM + SCORE_BUCKETS + bisect_left(LENGTH_BINS, len(text)))
+    return np.fromiter(buckets, dtype=np.int64, count=len(buckets))
+
+
+def _sigmoid(z):
+    return 1.0 / (1.0 + np.exp(-np.clip(z, -30, 30)))
+
+
+class FallbackPredictor:
+    """逻辑回归：P(回退) = sigmoid(bias + 问题各特征权重之和)"""
+
+    def __init__(self, weights: np.ndarray, bias: float, info: dict = None):
+        self.weights = weights
+        self.bias = float(bias)
+        self.info = info or {}
+
+    def predict(self, question: str, score: int) -> float:
+        """小模型回答这个问题后回退到大模型的概率"""
+        return float(_sigmoid(self.bias + self.weights[_features(question, score)].sum()))
+
+    def predict_many(self, questions: list, scores: list) -> np.ndarray:
+        return np.array([self.predict(q, s) for q, s in zip(questions, scores)])
+
+    def save(self, path: str):
+        """写入 .npz；先写临时文件再替换，热加载不会读到写了一半的文件"""
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, weights=self.weights.astype(np.float32), bias=np.float64(self.bias),
+                     info=np.array(json.dumps(self.info, ensure_ascii=False)))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "FallbackPredictor":
+        with np.load(path) as data:
+            if data["weights"].shape != (FEATURE_DIM,):
+                raise ValueError(f"模型特征维度 {data['weights'].shape} 与当前代码 {FEATURE_DIM} 不一致，请重新训练")
+            return cls(data["weights"], float(data["bias"]), json.loads(str(data["info"])))
+
+
+def get_fallback_predictor():
+    """返回当前模型文件对应的预测器（文件更新后自动重新加载），模型文件不存在时返回 None"""
+    global _predictor, _predictor_mtime
+    try:
+        current_mtime = os.path.getmtime(FALLBACK_PREDICTOR_PATH)
+    except FileNotFoundError:
+        _predictor = None
+        _predictor_mtime = 0
+        return None
+    if current_mtime > _predictor_mtime:
+        # 先记下修改时间：加载失败时不在每个请求上重试，等文件再次更新
+        _predictor_mtime = current_mtime
+        try:
+            _predictor = FallbackPredictor.load(FALLBACK_PREDICTOR_PATH)
+        except Exception as e:
+            # 模型文件损坏或版本不符时保留旧模型（没有旧模型则不预测），不影响路由
+            print(f"回退预测模型加载失败: {e}")
+    return _predictor
+
+
+def labeled_rows(rows) -> list:
+    """从日志行中挑出有标签的记录（按原顺序），数值列转为数字"""
+    result = []
+    for row in rows:
+        if row["route"] in LABELS and row["question"]:
+            result.append({
+                "question": row["question"],
+                "score": int(row["score"]),
+                "label": LABELS[row["route"]],
+                "response_time": float(row["response_time"]),
+                "cost": float(row["cost"]),
+            })
+    return result
+
+
+def train(rows: list, l2: float = 1e-4, epochs: int = 300, learning_rate: float = 0.5) -> FallbackPredictor:
+    """
+    全批量梯度下降训练逻辑回归。rows 为 labeled_rows() 的结果；
+    特征是稀疏的 0/1 下标，前向与梯度都用 bincount 在下标上累加，不构造稠密矩阵
+    """
+    cols = [_features(r["question"], r["score"]) for r in rows]
+    row_ids = np.repeat(np.arange(len(rows)), [len(c) for c in cols])
+    cols = np.concatenate(cols)
+    labels = np.array([r["label"] for r in rows], dtype=np.float64)
+    n = len(rows)
+
+    weights = np.zeros(FEATURE_DIM)
+    # 偏置从先验回退率出发
+    prior = np.clip(labels.mean(), 1e-3, 1 - 1e-3)
+    bias = float(np.log(prior / (1 - prior)))
+    for _ in range(epochs):
+        z = np.bincount(row_ids, weights=weights[cols], minlength=n) + bias
+        error = _sigmoid(z) - labels
+        grad = np.bincount(cols, weights=error[row_ids], minlength=FEATURE_DIM) / n + l2 * weights
+        weights -= learning_rate * grad
+        bias -= learning_rate * error.mean()
+    return FallbackPredictor(weights, bias)
+
+
+def savings_report(predictor: FallbackPredictor, rows: list, thresholds=REPORT_THRESHOLDS) -> dict:
+    """
+    按阈值估算跳过小模型的收益与代价：
+    - skipped：会被直接交给大模型的请求数；precision / recall 针对实际回退的请求
+    - cpu_seconds_saved：跳过的请求都不再运行小模型，按 small_model 请求的平均耗时估算
+    - extra_api_cost：本来小模型能答好（误判）的请求改由大模型回答的成本，按回退请求的平均成本估算
+      （实际回退的请求本来就要调用大模型，不增加成本，还省去了先等小模型的时间）
+    """
+    labels = np.array([r["label"] for r in rows])
+    probabilities = predictor.predict_many([r["question"] for r in rows], [r["score"] for r in rows])
+    small_times = [r["response_time"] for r in rows if r["label"] == 0]
+    fallback_costs = [r["cost"] for r in rows if r["label"] == 1]
+    avg_small_time = float(np.mean(small_times)) if small_times else 0.0
+    avg_big_cost = float(np.mean(fallback_costs)) if fallback_costs else 0.0
+
+    report = {
+        "rows": len(rows),
+        "fallbacks": int(labels.sum()),
+        "avg_small_model_time": avg_small_time,
+        "avg_big_model_cost": avg_big_cost,
+        "thresholds": [],
+    }
+    for threshold in thresholds:
+        skipped = probabilities >= threshold
+        true_pos = int((skipped & (labels == 1)).sum())
+        false_pos = int((skipped & (labels == 0)).sum())
+        report["thresholds"].append({
+            "threshold": threshold,
+            "skipped": int(skipped.sum()),
+            "precision": true_pos / skipped.sum() if skipped.any() else 0.0,
+            "recall": true_pos / labels.sum() if labels.any() else 0.0,
+            "cpu_seconds_saved": float(skipped.sum()) * avg_small_time,
+            "extra_api_cost": false_pos * avg_big_cost,
+        })
+    return report
+
+
+def print_report(report: dict):
+    print(f"  评估样本 {report['rows']} 条，其中回退 {report['fallbacks']} 条；"
+          f"小模型平均耗时 {report['avg_small_model_time']:.2f}s，回退请求平均成本 {report['avg_big_model_cost']:.4f}")
+    print(f"  {'阈值':>6} {'跳过':>8} {'精确率':>8} {'召回率':>8} {'节省CPU秒':>12} {'额外API成本':>12}")
+    for t in report["thresholds"]:
+        print(f"  {t['threshold']:>8.2f} {t['skipped']:>8} {t['precision']:>10.1%} {t['recall']:>10.1%} "
+              f"{t['cpu_seconds_saved']:>14.1f} {t['extra_api_cost']:>14.4f}")
+
+
+def load_log_rows(csv_path: str = None, hours: float = None) -> list:
+    """读取日志行（dict，列同 log_store.COLUMNS）：指定 csv_path 时读 CSV，否则读 LOG_BACKEND 对应的存储"""
+    start = time.time() - hours * 3600 if hours else None
+    if csv_path or LOG_BACKEND != "sqlite":
+        with open(csv_path or LOG_PATH, newline="", encoding="utf-8") as f:
+            rows = list(csv.DictReader(f))
+        if start is not None:
+            rows = [r for r in rows if time.mktime(time.strptime(r["timestamp"], "%Y-%m-%dT%H:%M:%S")) >= start]
+        return rows
+
+    from log_store import LogStore
+    store = LogStore(LOG_STORE_PATH, retention_days=LOG_RETENTION_DAYS, max_rows=LOG_MAX_ROWS)
+    rows = []
+    for route in LABELS:
+        rows.extend(store.by_route(route, start=start, limit=LOG_MAX_ROWS if LOG_MAX_ROWS > 0 else -1))
+    rows.sort(key=lambda r: r["timestamp"])
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="训练 / 评估小模型回退预测模型")
+    parser.add_argument("--train", action="store_true", help="用日志训练并写入模型文件")
+    parser.add_argument("--report", action="store_true", help="用当前模型评估日志，估算节省的CPU时间与额外API成本")
+    parser.add_argument("--csv", metavar="PATH", help="从 CSV 日志读取（默认读 LOG_BACKEND 对应的存储）")
+    parser.add_argument("--hours", type=float, help="只使用最近多少小时的日志（默认全部）")
+    parser.add_argument("--holdout", type=float, default=0.2, help="--train 时留作评估的最新日志比例")
+    parser.add_argument("--output", default=FALLBACK_PREDICTOR_PATH, help="模型文件路径")
+    args = parser.parse_args()
+    if not args.train and not args.report:
+        parser.error("请指定 --train 或 --report")
+
+    rows = labeled_rows(load_log_rows(args.csv, args.hours))
+    fallbacks = sum(r["label"] for r in rows)
+    print(f"有标签的日志 {len(rows)} 条（small_model {len(rows) - fallbacks}，big_model_fallback {fallbacks}）")
+
+    if args.train:
+        if len(rows) < MIN_TRAINING_ROWS or not fallbacks:
+            print(f"训练数据不足（至少 {MIN_TRAINING_ROWS} 条且包含回退样本），不生成模型")
+            return
+        # 按时间切分：用较早的日志训练，评估最新的日志，模拟上线后的效果
+        split = int(len(rows) * (1 - args.holdout))
+        if 0 < split < len(rows):
+            print(f"\n用较早的 {split} 条训练，评估最新的 {len(rows) - split} 条:")
+            report = savings_report(train(rows[:split]), rows[split:])
+            print_report(report)
+        else:
+            report = None
+        predictor = train(rows)
+        predictor.info = {
+            "trained_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "rows": len(rows),
+            "fallbacks": fallbacks,
+            "holdout_report": report,
+        }
+        predictor.save(args.output)
+        print(f"\n模型已写入 {args.output}（全部 {len(rows)} 条日志），当前阈值 "
+              f"FALLBACK_PREDICTOR_THRESHOLD={FALLBACK_PREDICTOR_THRESHOLD}")
+        if os.path.abspath(args.output) == os.path.abspath(FALLBACK_PREDICTOR_PATH):
+            print("路由在下一个请求时自动加载新模型")
+
+    if args.report:
+        if not os.path.exists(args.output):
+            print(f"模型文件 {args.output} 不存在，请先 --train")
+            return
+        print(f"\n用 {args.output} 评估:")
+        print_report(savings_report(FallbackPredictor.load(args.output), rows))
+
+
+if __name__ == "__main__":
+    main()
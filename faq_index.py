@@ -0,0 +1,210 @@
+"""
+FAQ 关键词多模式匹配索引（Aho-Corasick 自动机）
+
+把 faq.json 中所有条目的 primary / secondary / keywords 关键词一次性编译成
+一个 Aho-Corasick 自动机。匹配时只需对问题做一次线性扫描，就能得到每个条目
+在各级别上的命中数，代价与问题长度和命中数相关，而与 FAQ 条目数无关。
+
+计数规则与逐条 `normalize(k) in normalize(q)` 扫描一致：
+- 同一个关键词在问题中出现多次只算一次命中
+- 关键词在列表中重复出现、或同时出现在多个级别/条目中，各自分别计数
+
+注意这比最初的 `k.lower() in q.lower()` 扫描略宽：问题与关键词先经 normalize() 归一化
+（NFKC 全角转半角、转小写、去掉空白），"ＷＩＦＩ密码"、"图书 馆几点开" 这类只差全半角或空格的写法
+现在也精确命中（原来未命中，走小模型/大模型）。原来命中的关键词仍然命中，命中数不会变少。
+
+容错匹配（fuzzy_match）：另建关键词的字符二元组倒排索引，问题的二元组查倒排表得到候选关键词，
+共享二元组数不足的候选直接排除，剩下的再用有上限的编辑距离与问题中最相近的子串比对。
+归一化与精确匹配相同，近似命中因此只包含真正的错字、多字、漏字（"图书官几点开"、"wi-fi"），
+不包含仅全半角、大小写或空白不同的写法。
+"""
+
+import unicodedata
+from collections import defaultdict, deque
+
+# 命中级别
+LEVEL_PRIMARY = 0
+LEVEL_SECONDARY = 1
+LEVEL_LEGACY = 2  # 旧格式平铺 keywords 列表
+
+# 参与容错匹配的最短关键词长度（按级别）：两个字的词错一个字就面目全非；
+# secondary 多为"怎么走""几点"这类意图短语，"怎么走"与"怎么办"只差一个字意思就完全不同，要求更长
+FUZZY_MIN_LENGTH = {LEVEL_PRIMARY: 3, LEVEL_SECONDARY: 4, LEVEL_LEGACY: 3}
+# 容错匹配允许的最大编辑距离（替换、插入、删除各算 1）
+FUZZY_MAX_EDITS = 1
+
+
+def normalize(text: str) -> str:
+    """匹配前的归一化（精确匹配与容错匹配共用）：NFKC（全角转半角）、小写、去掉空白"""
+    return "".join(unicodedata.normalize("NFKC", text).lower().split())
+
+
+def _bigrams(text: str) -> set:
+    return {text[i:i + 2] for i in range(len(text) - 1)}
+
+
+def substring_distance(pattern: str, text: str, limit: int) -> int:
+    """
+    pattern 与 text 中最相近子串的编辑距离（Sellers 算法：子串可以从 text 任意位置开始和结束）。
+    某一行的最小值超过 limit 后不可能再变小，提前返回 limit + 1
+    """
+    prev = [0] * (len(text) + 1)
+    for i, pc in enumerate(pattern, 1):
+        cur = [i] * (len(text) + 1)
+        for j, tc in enumerate(text, 1):
+            cur[j] = min(prev[j - 1] + (pc != tc), prev[j] + 1, cur[j - 1] + 1)
+        if min(cur) > limit:
+            return limit + 1
+        prev = cur
+    return min(min(prev), limit + 1)
+
+
+class FaqIndex:
+    """编译后的 FAQ 关键词索引"""
+
+    def __init__(self, faq: list):
+        self.items = faq
+        # 每个关键词（已归一化）对应一个模式编号
+        self._pattern_ids = {}
+        # 模式编号 -> [(条目下标, 级别), ...]（保留重复，保证计数与逐条扫描一致）
+        self._postings = []
+        # 空关键词在任何问题中都算命中，单独记录
+        self._always = []
+
+        for idx, item in enumerate(faq):
+            primary = item.get("primary", [])
+            secondary = item.get("secondary", [])
+            if not primary and not secondary:
+                # 兼容旧格式（平铺 keywords 列表）
+                for k in item.get("keywords", []):
+                    self._add(k, idx, LEVEL_LEGACY)
+                continue
+            for k in primary:
+                self._add(k, idx, LEVEL_PRIMARY)
+            for k in secondary:
+                self._add(k, idx, LEVEL_SECONDARY)
+
+        self._build_automaton()
+        # 容错匹配用的二元组倒排索引与归一化关键词，首次调用 fuzzy_match 时构建
+        self._fuzzy_postings = None
+        self._fuzzy_keywords = None
+
+    def _add(self, keyword: str, idx: int, level: int):
+        k = normalize(keyword)
+        if not k:
+            self._always.append((idx, level))
+            return
+        pid = self._pattern_ids.get(k)
+        if pid is None:
+            pid = len(self._postings)
+            self._pattern_ids[k] = pid
+            self._postings.append([])
+        self._postings[pid].append((idx, level))
+
+    def _build_automaton(self):
+        """构建 goto / fail / output 表"""
+        goto = [{}]
+        output = [[]]
+        for k, pid in self._pattern_ids.items():
+            state = 0
+            for ch in k:
+                nxt = goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(goto)
+                    goto[state][ch] = nxt
+                    goto.append({})
+                    output.append([])
+                state = nxt
+            output[state].append(pid)
+
+        # BFS 计算失败指针，并把失败链上的输出合并到当前状态
+        fail = [0] * len(goto)
+        queue = deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in goto[state].items():
+                queue.append(nxt)
+                f = fail[state]
+                while f and ch not in goto[f]:
+                    f = fail[f]
+                fail[nxt] = goto[f].get(ch, 0)
+                output[nxt] = output[nxt] + output[fail[nxt]]
+
+        self._goto = goto
+        self._fail = fail
+        self._output = output
+
+    def find_patterns(self, text: str) -> set:
+        """返回问题中出现过的所有关键词模式编号（text 需已经 normalize()）"""
+        goto = self._goto
+        fail = self._fail
+        output = self._output
+        found = set()
+        state = 0
+        for ch in text:
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if output[state]:
+                found.update(output[state])
+        return found
+
+    def match(self, question: str) -> dict:
+        """
+        对问题做一次扫描，返回 {条目下标: [primary命中数, secondary命中数, 旧格式命中数]}
+        只包含至少命中一个关键词的条目
+        """
+        hits = {}
+        for idx, level in self._always:
+            hits.setdefault(idx, [0, 0, 0])[level] += 1
+        for pid in self.find_patterns(normalize(question)):
+            for idx, level in self._postings[pid]:
+                hits.setdefault(idx, [0, 0, 0])[level] += 1
+        return hits
+
+    def _build_fuzzy_index(self):
+        """
+        二元组 -> [模式编号, ...]；只收录归一化后长度达到其所在级别 FUZZY_MIN_LENGTH 的关键词
+        """
+        postings = defaultdict(list)
+        keywords = {}
+        for norm, pid in self._pattern_ids.items():
+            if all(len(norm) < FUZZY_MIN_LENGTH[level] for _, level in self._postings[pid]):
+                continue
+            grams = _bigrams(norm)
+            keywords[pid] = (norm, len(grams))
+            for gram in grams:
+                postings[gram].append(pid)
+        self._fuzzy_postings = dict(postings)
+        self._fuzzy_keywords = keywords
+
+    def fuzzy_match(self, question: str, max_edits: int = FUZZY_MAX_EDITS) -> dict:
+        """
+        近似命中：返回 {条目下标: [primary, secondary, 旧格式 是否近似命中（0/1）]}，
+        只统计编辑距离不超过 max_edits、且没有被 match() 精确命中的关键词。
+        一处错别字往往同时接近几个同义词（"图书官"与"图书馆""图书室"），每个级别最多计 1 次。
+
+        候选关键词只来自问题二元组的倒排表，代价与问题长度和倒排表长度相关，与 FAQ 条目数无关。
+        关键词的 n 个不同二元组每处编辑最多破坏 2 个，与问题共享少于 max(1, n - 2×max_edits) 个的候选
+        不可能在距离内（至少要共享 1 个，一个二元组都不剩的写法不算近似），不做编辑距离计算
+        """
+        if self._fuzzy_postings is None:
+            self._build_fuzzy_index()
+        text = normalize(question)
+        shared = defaultdict(int)
+        for gram in _bigrams(text):
+            for pid in self._fuzzy_postings.get(gram, ()):
+                shared[pid] += 1
+
+        exact = self.find_patterns(text)
+        hits = {}
+        for pid, count in shared.items():
+            norm, distinct = self._fuzzy_keywords[pid]
+            if pid in exact or count < max(1, distinct - 2 * max_edits):
+                continue
+            if substring_distance(norm, text, max_edits) > max_edits:
+                continue
+            for idx, level in self._postings[pid]:
+                if len(norm) >= FUZZY_MIN_LENGTH[level]:
+                    hits.setdefault(idx, [0, 0, 0])[level] = 1
+        return hits
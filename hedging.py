@@ -0,0 +1,113 @@
+"""
+对冲请求：小模型生成的同时，在后台提前发起大模型调用
+
+小模型回答通过置信度检查时取消大模型调用（未启动则不再启动，已启动则关闭流，
+停止接收剩余 token）；未通过时直接使用已经在路上的大模型回答，不必再串行等待。
+流式路由用 chunks() 先补发已收到的增量，再继续转发后续增量。
+"""
+
+import threading
+
+
+class HedgedCall:
+    """
+    在后台线程中延迟启动的流式大模型调用
+
+    参数:
+        stream_fn: 流式调用函数，签名同 big_model_answer_stream(question, history, usage_info)
+        delay: 启动前的等待时间（秒），期间可被 start_now() 提前或被 cancel() 取消
+        estimate_fn: 取消进行中的调用时估算已计费 token 数的函数 (usage_info, 已收到的文本) -> int，
+            默认为 big_model.estimate_stream_tokens（提示词 + 已收到输出）
+    """
+
+    def __init__(self, stream_fn, question: str, history: list = None, delay: float = 0, estimate_fn=None):
+        if estimate_fn is None:
+            from big_model import estimate_stream_tokens as estimate_fn
+        self.stream_fn = stream_fn
+        self.question = question
+        self.history = history
+        self.delay = delay
+        self.estimate_fn = estimate_fn
+        self.usage_info = {}
+        self.answer = None
+        self.started = False
+        self.finished = False
+        self.cancelled = False
+        self.parts = []  # 已收到的增量，取消时用于估算浪费的 token，chunks() 据此补发
+        self._wake = threading.Event()
+        self._done = threading.Event()
+        self._changed = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name="hedged-big-model", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        try:
+            self._wake.wait(self.delay)
+            if self.cancelled:
+                return
+            self.started = True
+            stream = self.stream_fn(self.question, history=self.history, usage_info=self.usage_info)
+            while True:
+                if self.cancelled:
+                    stream.close()
+                    return
+                try:
+                    part = next(stream)
+                except StopIteration as stop:
+                    self.answer = stop.value
+                    self.finished = True
+                    return
+                with self._changed:
+                    self.parts.append(part)
+                    self._changed.notify_all()
+        except Exception as e:
+            print(f"对冲大模型调用错误: {e}")
+        finally:
+            with self._changed:
+                self._done.set()
+                self._changed.notify_all()
+
+    def start_now(self):
+        """跳过剩余延迟，立即启动"""
+        self._wake.set()
+
+    def result(self, timeout: float = None):
+        """等待调用完成（未启动则立即启动），返回 (answer, usage_info)；调用出错时 answer 为 None"""
+        self.start_now()
+        self._done.wait(timeout)
+        return self.answer, self.usage_info
+
+    def chunks(self):
+        """
+        流式取结果（未启动则立即启动）：先产出已收到的增量，再逐个转发后续增量；
+        生成器的返回值同 result() 的 answer
+        """
+        self.start_now()
+        sent = 0
+        while True:
+            with self._changed:
+                while sent == len(self.parts) and not self._done.is_set():
+                    self._changed.wait()
+                pending = self.parts[sent:]
+                done = self._done.is_set()
+            for part in pending:
+                yield part
+            sent += len(pending)
+            if done and sent == len(self.parts):
+                return self.answer
+
+    def cancel(self) -> int:
+        """
+        取消调用，返回已浪费的 token 数
+        未启动时为 0；已完成时取 usage 中的实际值；进行中时请求已经发出，提示词与已收到的输出都已计费，
+        用 estimate_fn 按本地 token 计数估算
+        """
+        self.cancelled = True
+        self._wake.set()
+        if not self.started:
+            return 0
+        if self.finished:
+            return self.usage_info.get("total_tokens", 0)
+        with self._changed:
+            text = "".join(self.parts)
+        return self.estimate_fn(self.usage_info, text)
@@ -0,0 +1,126 @@
+"""
+按 token 预算压缩对话历史（小模型与大模型共用）
+
+原来小模型保留最近 MAX_HISTORY_ROUNDS 轮对话后按 max_length 从右侧截断，过长时会截掉当前问题本身；
+大模型不论长短都发送最近 6 条消息。compact_messages() 用模型的分词器统计真实 token 数，
+把 系统提示 + 历史 + 当前问题 压进预算：从最早的历史消息开始，能缩短就缩短（保留开头），
+缩短后太短就整条丢弃；系统提示和当前问题从不截断。
+
+分词器不可用时（FAQ + 远程模式下不导入 transformers）用 EstimateCounter 按字符估算。
+"""
+
+import math
+import re
+from functools import lru_cache
+
+# 聊天模板为每条消息额外引入的 token（ChatML: <|im_start|>role\n ... <|im_end|>\n）
+MESSAGE_OVERHEAD_TOKENS = 5
+# add_generation_prompt 追加的 <|im_start|>assistant\n
+GENERATION_PROMPT_TOKENS = 3
+# 缩短后不足这么多 token 的历史消息直接丢弃，留下的半句话没有参考价值
+MIN_SHORTENED_TOKENS = 16
+# 缩短的历史消息末尾加上省略号
+ELLIPSIS = "…"
+
+
+class TokenizerCounter:
+    """用 transformers 分词器计数与截断；同一段历史每轮都会重复计数，结果按文本缓存"""
+
+    def __init__(self, tokenizer, cache_size: int = 4096):
+        self.tokenizer = tokenizer
+        self._encode = lru_cache(maxsize=cache_size)(self._encode_uncached)
+
+    def _encode_uncached(self, text: str) -> tuple:
+        return tuple(self.tokenizer.encode(text, add_special_tokens=False))
+
+    def count(self, text: str) -> int:
+        return len(self._encode(text))
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """保留开头的 max_tokens 个 token"""
+        ids = self._encode(text)
+        return self.tokenizer.decode(ids[:max_tokens], skip_special_tokens=True)
+
+
+# 一个汉字（或其他非 ASCII 字符）、一段 ASCII 单词/数字、一个标点各算一段
+_PIECE_RE = re.compile(r"[A-Za-z0-9_]+|\s+|[^\sA-Za-z0-9_]")
+
+
+class EstimateCounter:
+    """
+    不加载分词器时的估算：汉字和标点各 1 个 token，英文单词与数字约每 4 个字符 1 个 token，
+    空白不计。对 Qwen 系列分词器而言中文略有高估，预算因此偏保守
+    """
+
+    @staticmethod
+    def _piece_tokens(piece: str) -> int:
+        if piece.isspace():
+            return 0
+        if piece.isascii() and (piece[0].isalnum() or piece[0] == "_"):
+            return math.ceil(len(piece) / 4)
+        return 1
+
+    def count(self, text: str) -> int:
+        return sum(self._piece_tokens(p) for p in _PIECE_RE.findall(text))
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        used = 0
+        for match in _PIECE_RE.finditer(text):
+            used += self._piece_tokens(match.group())
+            if used > max_tokens:
+                return text[:match.start()]
+        return text
+
+
+def prompt_tokens(messages: list, counter) -> int:
+    """消息列表套用聊天模板后的 token 数（模板开销按每条消息固定值估计）"""
+    return GENERATION_PROMPT_TOKENS + sum(
+        counter.count(m["content"]) + MESSAGE_OVERHEAD_TOKENS for m in messages
+    )
+
+
+def compact_messages(messages: list, counter, budget: int, stats: dict = None) -> list:
+    """
+    把 [系统提示, 历史..., 当前问题] 压进 budget 个 token，返回新的消息列表（不修改传入的列表）
+
+    从最早的历史消息开始：超出部分能靠缩短这一条消除、且缩短后不少于 MIN_SHORTENED_TOKENS 时缩短它，
+    否则丢弃这一条继续看下一条。系统提示（第一条 role 为 system 的消息）和当前问题（最后一条）不动，
+    二者本身超出预算时照原样返回。
+
+    stats 中写入 prompt_tokens_before / prompt_tokens_after、history_dropped、history_shortened
+    """
+    head = 1 if messages and messages[0]["role"] == "system" else 0
+    fixed = messages[:head] + messages[-1:]
+    history = list(messages[head:-1])
+
+    before = prompt_tokens(messages, counter)
+    total = before
+    dropped = shortened = 0
+    if budget > 0 and total > budget:
+        kept = []
+        for i, message in enumerate(history):
+            excess = total - budget
+            if excess <= 0:
+                kept.extend(history[i:])
+                break
+            tokens = counter.count(message["content"])
+            keep = tokens - excess - counter.count(ELLIPSIS)
+            if keep >= MIN_SHORTENED_TOKENS:
+                content = counter.truncate(message["content"], keep) + ELLIPSIS
+                kept.append({**message, "content": content})
+                kept.extend(history[i + 1:])
+                total -= tokens - counter.count(content)
+                shortened += 1
+                break
+            total -= tokens + MESSAGE_OVERHEAD_TOKENS
+            dropped += 1
+        history = kept
+
+    if stats is not None:
+        stats.update({
+            "prompt_tokens_before": before,
+            "prompt_tokens_after": total,
+            "history_dropped": dropped,
+            "history_shortened": shortened,
+        })
+    return fixed[:head] + history + fixed[head:]
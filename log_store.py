@@ -0,0 +1,264 @@
+"""
+请求日志存储：SQLite（WAL 模式），替代只追加的 logs.csv
+
+- request_log：逐条记录，按时间（ts）和 (route, ts) 建索引，
+  “最近 N 条”和“某路由某时间段”查询只扫描命中的行，与总行数无关
+- request_log_hourly：按小时、路由汇总的次数/耗时/成本，写入时同步更新，
+  聚合统计只读汇总行，不再扫描明细
+- compact()：按保留天数和最大行数删除旧明细（小时汇总保留），写入时定期自动执行
+
+命令行:
+    python log_store.py --import-csv logs.csv   # 一次性迁移旧日志（同一文件不会重复导入）
+    python log_store.py --tail 5
+    python log_store.py --stats --hours 24
+    python log_store.py --compact
+"""
+
+import argparse
+import csv
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+# 与 logs.csv 相同的列顺序
+COLUMNS = ("timestamp", "question", "score", "route", "response_time", "cost")
+
+_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS request_log ("
+    "id INTEGER PRIMARY KEY, ts REAL NOT NULL, question TEXT, score INTEGER, "
+    "route TEXT, response_time REAL, cost REAL)",
+    "CREATE INDEX IF NOT EXISTS idx_request_log_ts ON request_log (ts)",
+    "CREATE INDEX IF NOT EXISTS idx_request_log_route_ts ON request_log (route, ts)",
+    "CREATE TABLE IF NOT EXISTS request_log_hourly ("
+    "bucket INTEGER NOT NULL, route TEXT NOT NULL, count INTEGER, "
+    "total_time REAL, max_time REAL, total_cost REAL, PRIMARY KEY (bucket, route))",
+    "CREATE TABLE IF NOT EXISTS imports (source TEXT PRIMARY KEY, rows INTEGER, imported REAL)",
+)
+
+
+def _to_ts(timestamp) -> float:
+    """ISO 时间字符串（本地时间）或时间戳 -> 时间戳"""
+    if isinstance(timestamp, (int, float)):
+        return float(timestamp)
+    return datetime.fromisoformat(timestamp).timestamp()
+
+
+def _to_row(record) -> dict:
+    ts, question, score, route, response_time, cost = record
+    return {
+        "timestamp": datetime.fromtimestamp(ts).isoformat(timespec="seconds"),
+        "question": question,
+        "score": score,
+        "route": route,
+        "response_time": response_time,
+        "cost": cost,
+    }
+
+
+class LogStore:
+    """
+    参数:
+        path: 数据库文件路径
+        retention_days: 明细保留天数（<=0 表示不按时间清理）
+        max_rows: 明细最多保留行数（<=0 表示不限）
+        synchronous: SQLite synchronous 级别，NORMAL（WAL 下断电最多丢最近的事务）或 FULL
+        compact_every: 每写入多少行自动执行一次 compact()
+    """
+
+    def __init__(self, path: str, retention_days: float = 30, max_rows: int = 1000000,
+                 synchronous: str = "NORMAL", compact_every: int = 10000):
+        self.path = path
+        self.retention_days = retention_days
+        self.max_rows = max_rows
+        self.synchronous = synchronous
+        self.compact_every = compact_every
+        self._local = threading.local()  # 每个线程一个 SQLite 连接
+        self._lock = threading.Lock()
+        self._since_compact = 0
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(f"PRAGMA synchronous={self.synchronous}")
+            with conn:
+                for statement in _SCHEMA:
+                    conn.execute(statement)
+            self._local.conn = conn
+        return conn
+
+    def append(self, rows: list) -> int:
+        """
+        写入一批日志行（列顺序同 COLUMNS，timestamp 为 ISO 字符串或时间戳），
+        同一事务内更新小时汇总；返回写入行数
+        """
+        records = []
+        hourly = {}
+        for timestamp, question, score, route, response_time, cost in rows:
+            ts = _to_ts(timestamp)
+            response_time, cost = float(response_time), float(cost)
+            records.append((ts, question, int(score), route, response_time, cost))
+            key = (int(ts // 3600), route)
+            count, total_time, max_time, total_cost = hourly.get(key, (0, 0.0, 0.0, 0.0))
+            hourly[key] = (count + 1, total_time + response_time, max(max_time, response_time), total_cost + cost)
+        if not records:
+            return 0
+
+        conn = self._conn()
+        with conn:
+            conn.executemany(
+                "INSERT INTO request_log (ts, question, score, route, response_time, cost) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                records,
+            )
+            conn.executemany(
+                "INSERT INTO request_log_hourly (bucket, route, count, total_time, max_time, total_cost) "
+                "VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (bucket, route) DO UPDATE SET "
+                "count = count + excluded.count, total_time = total_time + excluded.total_time, "
+                "max_time = max(max_time, excluded.max_time), total_cost = total_cost + excluded.total_cost",
+                [key + value for key, value in hourly.items()],
+            )
+
+        with self._lock:
+            self._since_compact += len(records)
+            compact = self.compact_every > 0 and self._since_compact >= self.compact_every
+            if compact:
+                self._since_compact = 0
+        if compact:
+            self.compact()
+        return len(records)
+
+    def compact(self) -> int:
+        """按保留策略删除旧明细，返回删除行数；小时汇总不受影响"""
+        conn = self._conn()
+        deleted = 0
+        with conn:
+            if self.retention_days > 0:
+                deleted += conn.execute(
+                    "DELETE FROM request_log WHERE ts < ?", (time.time() - self.retention_days * 86400,)
+                ).rowcount
+            if self.max_rows > 0:
+                deleted += conn.execute(
+                    "DELETE FROM request_log WHERE id IN "
+                    "(SELECT id FROM request_log ORDER BY ts DESC, id DESC LIMIT -1 OFFSET ?)",
+                    (self.max_rows,),
+                ).rowcount
+        if deleted:
+            # 删除后截断 WAL 文件，腾出的页由后续写入复用
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        return deleted
+
+    def last(self, n: int = 5) -> list:
+        """最近 n 条记录，按时间先后排列"""
+        records = self._conn().execute(
+            "SELECT ts, question, score, route, response_time, cost FROM request_log "
+            "ORDER BY ts DESC, id DESC LIMIT ?", (n,)
+        ).fetchall()
+        return [_to_row(r) for r in reversed(records)]
+
+    def by_route(self, route: str, start=None, end=None, limit: int = 1000) -> list:
+        """某路由在 [start, end) 内的记录（start/end 为 ISO 字符串或时间戳，省略表示不限）"""
+        start = _to_ts(start) if start is not None else float("-inf")
+        end = _to_ts(end) if end is not None else float("inf")
+        records = self._conn().execute(
+            "SELECT ts, question, score, route, response_time, cost FROM request_log "
+            "WHERE route = ? AND ts >= ? AND ts < ? ORDER BY ts LIMIT ?",
+            (route, start, end, limit),
+        ).fetchall()
+        return [_to_row(r) for r in records]
+
+    def aggregate(self, start=None, end=None, route: str = None) -> dict:
+        """
+        按路由汇总 [start, end) 内的次数、平均/最大耗时和总成本（按整点小时对齐），
+        返回 {route: {"count", "avg_time", "max_time", "total_cost"}}
+        """
+        start_bucket = int(_to_ts(start) // 3600) if start is not None else -1
+        end_bucket = int(-(-_to_ts(end) // 3600)) if end is not None else 2 ** 62
+        sql = (
+            "SELECT route, SUM(count), SUM(total_time), MAX(max_time), SUM(total_cost) "
+            "FROM request_log_hourly WHERE bucket >= ? AND bucket < ?"
+        )
+        params = [start_bucket, end_bucket]
+        if route is not None:
+            sql += " AND route = ?"
+            params.append(route)
+        result = {}
+        for name, count, total_time, max_time, total_cost in self._conn().execute(sql + " GROUP BY route", params):
+            result[name] = {
+                "count": count,
+                "avg_time": total_time / count if count else 0.0,
+                "max_time": max_time,
+                "total_cost": total_cost,
+            }
+        return result
+
+    def import_csv(self, csv_path: str, batch_size: int = 5000) -> int:
+        """
+        一次性导入旧的 logs.csv；按文件路径、大小和修改时间记录已导入，重复执行不会重复写入。
+        返回导入行数（已导入过时返回 0），格式不对的行跳过
+        """
+        stat = os.stat(csv_path)
+        source = f"{os.path.abspath(csv_path)}:{stat.st_size}:{int(stat.st_mtime)}"
+        conn = self._conn()
+        if conn.execute("SELECT 1 FROM imports WHERE source = ?", (source,)).fetchone():
+            return 0
+
+        imported = 0
+        # 导入的历史数据一次写入，不触发自动 compact
+        compact_every, self.compact_every = self.compact_every, 0
+        try:
+            with open(csv_path, "r", encoding="utf-8", newline="") as f:
+                batch = []
+                for row in csv.reader(f):
+                    if len(row) != len(COLUMNS) or row[0] == COLUMNS[0]:
+                        continue
+                    try:
+                        _to_ts(row[0]), int(row[2]), float(row[4]), float(row[5])
+                    except ValueError:
+                        continue
+                    batch.append(row)
+                    if len(batch) >= batch_size:
+                        imported += self.append(batch)
+                        batch = []
+                imported += self.append(batch)
+        finally:
+            self.compact_every = compact_every
+        with conn:
+            conn.execute("INSERT INTO imports (source, rows, imported) VALUES (?, ?, ?)",
+                         (source, imported, time.time()))
+        return imported
+
+
+def main():
+    from config import LOG_STORE_PATH, LOG_RETENTION_DAYS, LOG_MAX_ROWS
+
+    parser = argparse.ArgumentParser(description="请求日志存储工具")
+    parser.add_argument("--import-csv", metavar="PATH", help="导入旧的 logs.csv")
+    parser.add_argument("--tail", type=int, metavar="N", help="显示最近 N 条记录")
+    parser.add_argument("--stats", action="store_true", help="按路由汇总次数、耗时和成本")
+    parser.add_argument("--hours", type=float, help="--stats 统计最近多少小时（默认全部）")
+    parser.add_argument("--compact", action="store_true", help="按保留策略清理旧记录")
+    args = parser.parse_args()
+
+    store = LogStore(LOG_STORE_PATH, retention_days=LOG_RETENTION_DAYS, max_rows=LOG_MAX_ROWS)
+    print(f"日志数据库: {LOG_STORE_PATH}")
+    if args.import_csv:
+        count = store.import_csv(args.import_csv)
+        print(f"导入 {count} 条记录" if count else "该文件已导入过，跳过")
+    if args.compact:
+        print(f"清理 {store.compact()} 条旧记录")
+    if args.tail:
+        for row in store.last(args.tail):
+            print("  " + ",".join(str(row[c]) for c in COLUMNS))
+    if args.stats:
+        start = time.time() - args.hours * 3600 if args.hours else None
+        for route, s in sorted(store.aggregate(start=start).items()):
+            print(f"  {route:<20} 次数 {s['count']:>8}  平均耗时 {s['avg_time']:.3f}s  "
+                  f"最大耗时 {s['max_time']:.3f}s  总成本 {s['total_cost']:.4f}")
+
+
+if __name__ == "__main__":
+    main()
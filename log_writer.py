@@ -0,0 +1,101 @@
+"""
+后台批量写入器
+
+请求路径上只把记录放进内存队列（不阻塞、不打开文件），由后台线程攒批后
+一次写入：攒够 batch_size 条，或第一条记录入队后经过 flush_interval 秒即写出。
+flush() 等待已入队的记录全部写完；close() 写完剩余记录后停止线程，进程退出时调用。
+"""
+
+import queue
+import threading
+import time
+
+_STOP = object()
+
+
+class BackgroundWriter:
+    """
+    参数:
+        write_batch: 写入函数，输入记录列表；抛出异常时这批记录保留，下次写入时重试
+        flush_interval: 最长缓冲时间（秒）
+        batch_size: 攒够多少条立即写出
+    """
+
+    def __init__(self, write_batch, flush_interval: float = 0.5, batch_size: int = 64, name: str = "log-writer"):
+        self.write_batch = write_batch
+        self.flush_interval = flush_interval
+        self.batch_size = max(1, batch_size)
+        self.name = name
+        self.written = 0  # 已成功写出的记录数
+        self._queue = queue.Queue()
+        self._closed = False
+        self._thread = threading.Thread(target=self._loop, name=name, daemon=True)
+        self._thread.start()
+
+    def put(self, record):
+        """入队一条记录，立即返回"""
+        self._queue.put(record)
+
+    def flush(self, timeout: float = None) -> bool:
+        """等待此前入队的记录全部写出；超时返回 False"""
+        if not self._thread.is_alive():
+            return self._queue.empty()
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout)
+
+    def close(self, timeout: float = 5.0):
+        """写出剩余记录并停止后台线程（可重复调用）"""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+
+    def _write(self, pending: list) -> bool:
+        try:
+            self.write_batch(pending)
+        except Exception as e:
+            print(f"{self.name}: 写入失败，{len(pending)} 条记录将在下次重试: {e}")
+            return False
+        self.written += len(pending)
+        pending.clear()
+        return True
+
+    def _loop(self):
+        pending = []
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            waiters = []
+            stop = False
+            # 顺手取走已在排队的记录，减少唤醒次数
+            while item is not None:
+                if item is _STOP:
+                    stop = True
+                elif isinstance(item, threading.Event):
+                    waiters.append(item)
+                else:
+                    pending.append(item)
+                    if deadline is None:
+                        deadline = time.monotonic() + self.flush_interval
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    item = None
+
+            if pending and (stop or waiters or len(pending) >= self.batch_size
+                            or time.monotonic() >= deadline):
+                if self._write(pending):
+                    deadline = None
+                else:
+                    deadline = time.monotonic() + self.flush_interval
+            for waiter in waiters:
+                waiter.set()
+            if stop:
+                return
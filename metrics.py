@@ -0,0 +1,267 @@
+"""
+进程内指标汇总与 Prometheus 文本格式导出
+
+- 计数器：各路由请求数、降级次数（按原因）、小模型调用次数、答案缓存命中/未命中
+- 直方图：各路由响应时间、各阶段耗时、小模型/大模型生成速度（tokens/s）
+- 导出：METRICS_PORT 非 0 时在本地启动 /metrics HTTP 端点；
+  METRICS_DUMP_PATH 非空时定期（及进程退出时）把同样的文本写入文件，供 node_exporter textfile 采集
+
+TRACING_ENABLED=0 时 observe_* 直接返回，不做任何统计。
+每个 Streamlit / worker 进程各自汇总，多进程部署时请为每个进程配置不同的端口或文件。
+"""
+
+import atexit
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from config import TRACING_ENABLED, METRICS_HOST, METRICS_PORT, METRICS_DUMP_PATH, METRICS_DUMP_INTERVAL
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+TOKENS_PER_SECOND_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=()) -> str:
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def _number(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """单调递增计数器"""
+
+    def __init__(self, name: str, help_text: str, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels):
+        return self._values.get(labels, 0)
+
+    def total(self):
+        return sum(self._values.values())
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}")
+        return lines
+
+
+class Gauge:
+    """导出时由回调函数计算的瞬时值；有标签时回调返回 {标签值元组: 值}"""
+
+    def __init__(self, name: str, help_text: str, fn, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.fn = fn
+        self.labelnames = tuple(labelnames)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} gauge"]
+        if not self.labelnames:
+            lines.append(f"{self.name} {_number(float(self.fn()))}")
+            return lines
+        for labels, value in sorted(self.fn().items()):
+            lines.append(f"{self.name}{_labels(self.labelnames, labels)} {_number(float(value))}")
+        return lines
+
+
+class Histogram:
+    """累积分桶直方图"""
+
+    def __init__(self, name: str, help_text: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        self._series = {}  # labels -> [各桶计数, sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def count(self, *labels) -> int:
+        series = self._series.get(labels)
+        return series[2] if series else 0
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for labels, (counts, total, count) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, n in zip(self.buckets, counts):
+                    cumulative += n
+                    le = _labels(self.labelnames, labels, [("le", _number(bound))])
+                    lines.append(f"{self.name}_bucket{le} {cumulative}")
+                lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {_number(total)}")
+                lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+REQUESTS = REGISTRY.register(Counter("router_requests_total", "按路由统计的请求数", ("route",)))
+RESPONSE_SECONDS = REGISTRY.register(Histogram("router_response_seconds", "按路由统计的响应时间（秒）", ("route",)))
+STAGE_SECONDS = REGISTRY.register(Histogram("router_stage_seconds", "各处理阶段耗时（秒）", ("stage",)))
+SMALL_MODEL_CALLS = REGISTRY.register(Counter("router_small_model_calls_total", "调用小模型的请求数"))
+FALLBACKS = REGISTRY.register(Counter(
+    "router_fallbacks_total", "小模型降级到大模型的次数（reason: low_confidence/early_abort/error）", ("reason",)
+))
+FALLBACK_RATIO = REGISTRY.register(Gauge(
+    "router_fallback_ratio", "降级次数 / 小模型调用次数",
+    lambda: FALLBACKS.total() / SMALL_MODEL_CALLS.total() if SMALL_MODEL_CALLS.total() else 0.0,
+))
+CACHE_LOOKUPS = REGISTRY.register(Counter("answer_cache_lookups_total", "答案缓存查询次数（result: hit/miss）", ("result",)))
+TOKENS_PER_SECOND = REGISTRY.register(Histogram(
+    "model_tokens_per_second", "模型生成速度（tokens/s）", ("model",), buckets=TOKENS_PER_SECOND_BUCKETS
+))
+
+
+def observe_request(meta: dict):
+    """按一次请求的 meta 更新路由、阶段与降级指标"""
+    if not TRACING_ENABLED:
+        return
+    route = meta["route"]
+    REQUESTS.inc(route)
+    RESPONSE_SECONDS.observe(meta["response_time"], route)
+    for stage, seconds in meta.get("stages", {}).items():
+        STAGE_SECONDS.observe(seconds, stage)
+
+    if route in ("small_model", "small_model_degraded", "big_model_fallback", "big_model_fallback_error"):
+        SMALL_MODEL_CALLS.inc()
+    if route in ("big_model_fallback", "big_model_fallback_error"):
+        small_stats = meta.get("small_model_stats") or {}
+        if small_stats.get("aborted"):
+            reason = "early_abort"
+        elif "error" in small_stats:
+            reason = "error"
+        else:
+            reason = "low_confidence"
+        FALLBACKS.inc(reason)
+
+
+def observe_cache_lookup(hit: bool):
+    if TRACING_ENABLED:
+        CACHE_LOOKUPS.inc("hit" if hit else "miss")
+
+
+def observe_tokens_per_second(model: str, value: float):
+    if TRACING_ENABLED and value > 0:
+        TOKENS_PER_SECOND.observe(value, model)
+
+
+def render_metrics() -> str:
+    """当前进程的全部指标（Prometheus 文本格式）"""
+    return REGISTRY.render()
+
+
+def dump_metrics(path: str):
+    """把指标写入文件（先写临时文件再替换，采集方不会读到半个文件）"""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(render_metrics())
+    os.replace(tmp_path, path)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = render_metrics().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # 不把每次抓取打印到控制台
+
+
+_server = None
+_dumper = None
+_exporter_lock = threading.Lock()
+
+
+def start_metrics_server(port: int, host: str = "127.0.0.1"):
+    """在后台线程启动 /metrics 端点，返回 server（port 为 0 时由系统分配端口）"""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    return server
+
+
+def _dump_loop(path: str, interval: float):
+    while True:
+        time.sleep(interval)
+        try:
+            dump_metrics(path)
+        except OSError as e:
+            print(f"指标文件写入错误: {e}")
+
+
+def start_exporter():
+    """按配置启动 HTTP 端点和/或定期写文件；可重复调用（如 Streamlit 每次重跑脚本），只启动一次"""
+    global _server, _dumper
+    if not TRACING_ENABLED:
+        return
+    with _exporter_lock:
+        if _server is None and METRICS_PORT:
+            try:
+                _server = start_metrics_server(METRICS_PORT, METRICS_HOST)
+                print(f"指标端点: http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+            except OSError as e:
+                # 多进程部署时端口可能已被其他进程占用
+                print(f"指标端点启动失败: {e}")
+                _server = False
+        if _dumper is None and METRICS_DUMP_PATH:
+            _dumper = threading.Thread(
+                target=_dump_loop, args=(METRICS_DUMP_PATH, METRICS_DUMP_INTERVAL),
+                name="metrics-dumper", daemon=True,
+            )
+            _dumper.start()
+            atexit.register(dump_metrics, METRICS_DUMP_PATH)
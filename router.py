@@ -1,9 +1,29 @@
+import asyncio
+import contextvars
 import json
 import os
+import random
 import time
-from utils import complexity_score, log_event
-from small_model import small_model_answer, low_confidence
-from big_model import big_model_answer
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from utils import complexity_score, complexity_scores, log_event
+from faq_index import FaqIndex
+from hedging import HedgedCall
+from answer_cache import AnswerCache, make_cache_key
+from single_flight import SingleFlight
+from semantic_faq import semantic_faq_answer
+from fallback_predictor import get_fallback_predictor
+from tracing import start_trace, current_stages, span
+from metrics import observe_request, observe_cache_lookup
+from warmup import small_model_ready
+from config import (
+    ANSWER_CACHE_ENABLED, ANSWER_CACHE_MAX_ENTRIES, ANSWER_CACHE_TTL,
+    ANSWER_CACHE_PATH, ANSWER_CACHE_HISTORY_WINDOW,
+    SEMANTIC_FAQ_ENABLED, SEMANTIC_FAQ_THRESHOLD, SEMANTIC_FAQ_TOP_K,
+    INFERENCE_EXECUTOR_WORKERS, HEDGE_ENABLED, HEDGE_DELAY_MS, WARMUP_GATE, LOCAL_MODELS_ENABLED,
+    SINGLE_FLIGHT_ENABLED, FAQ_FUZZY_ENABLED, FALLBACK_PREDICTOR_ENABLED, FALLBACK_PREDICTOR_THRESHOLD, FALLBACK_PREDICTOR_EXPLORE,
+)
+from big_model import big_model_answer, big_model_answer_async, big_model_answer_stream, big_model_available
 
 # 使用绝对路径避免工作目录问题
 FAQ_PATH = os.path.join(os.path.dirname(__file__), "faq.json")
@@ -11,13 +31,54 @@ FAQ_PATH = os.path.join(os.path.dirname(__file__), "faq.json")
 # 成本估算：每个token的成本（简化估算）
 COST_PER_TOKEN = 0.001
 
+# FAQ 未命中时的提示语
+NO_FAQ_ANSWER = "我还不知道呢，请再描述得详细一点"
+
+# 流式输出中，小模型回答置信度不足、改由大模型回答时插入的提示
+FALLBACK_NOTICE = "\n\n---\n*小模型回答置信度较低，以下为大模型的回答：*\n\n"
+
 # FAQ评分权重常量
 PRIMARY_KEYWORD_WEIGHT = 3  # 第一关键词权重
 SECONDARY_KEYWORD_WEIGHT = 1  # 第二关键词权重
+FUZZY_KEYWORD_PENALTY = 0.5  # 近似命中（错别字、多字漏字）按精确命中的一半计分
 
 # 模块级别缓存 FAQ 数据，避免重复读取文件
 _faq_cache = None
 _faq_mtime = 0
+# 由 FAQ 数据编译出的关键词索引，仅在 faq.json 变化时重建
+_faq_index = None
+
+# 异步路由中运行本地推理（小模型、FAQ 语义检索）的专用线程池（延迟创建）
+_inference_executor = None
+
+# 答案缓存（延迟创建）；只缓存模型生成的答案，FAQ 命中本身已足够快
+_answer_cache = None
+CACHEABLE_ROUTES = (
+    "faq_semantic", "small_model", "big_model", "big_model_fallback", "big_model_fallback_error",
+    "big_model_warmup", "big_model_predicted",
+)
+# 模型返回降级提示时的前缀（繁忙、出错、接口不可用等），这类回答不缓存
+DEGRADED_PREFIXES = ("[小模型]", "[大模型]")
+
+# 相同问题的并发模型调用合并（同一进程内各线程共享）
+_single_flight = SingleFlight()
+
+
+# small_model 会导入 torch/transformers（数秒、数百 MB 内存），推迟到真正需要小模型时再导入，
+# 只走 FAQ 或大模型的请求（以及 DEPLOYMENT_MODE=faq_remote 的部署）不承担这部分开销
+def small_model_answer(question: str, history: list = None, stats: dict = None) -> str:
+    from small_model import small_model_answer as answer
+    return answer(question, history=history, stats=stats)
+
+
+def small_model_answer_stream(question: str, history: list = None, stats: dict = None):
+    from small_model import small_model_answer_stream as answer_stream
+    return answer_stream(question, history=history, stats=stats)
+
+
+def low_confidence(answer: str) -> bool:
+    from small_model import low_confidence as check
+    return check(answer)
 
 
 def _load_faq():
@@ -37,6 +98,40 @@ def _load_faq():
     return _faq_cache
 
 
+def _get_faq_index():
+    """获取编译好的FAQ关键词索引，FAQ数据重新加载后自动重建"""
+    global _faq_index
+    faq = _load_faq()
+    if _faq_index is None or _faq_index.items is not faq:
+        _faq_index = FaqIndex(faq)
+    return _faq_index
+
+
+def _get_answer_cache():
+    """懒加载答案缓存"""
+    global _answer_cache
+    if _answer_cache is None:
+        _answer_cache = AnswerCache(ANSWER_CACHE_PATH, ANSWER_CACHE_MAX_ENTRIES, ANSWER_CACHE_TTL)
+    return _answer_cache
+
+
+def _get_inference_executor():
+    """懒加载本地推理线程池"""
+    global _inference_executor
+    if _inference_executor is None:
+        _inference_executor = ThreadPoolExecutor(
+            max_workers=INFERENCE_EXECUTOR_WORKERS, thread_name_prefix="inference"
+        )
+    return _inference_executor
+
+
+def _semantic_answer(question: str):
+    """FAQ语义检索层：返回 (answer, similarity)，未启用或相似度不足时 answer 为 None"""
+    if not SEMANTIC_FAQ_ENABLED:
+        return None, 0.0
+    return semantic_faq_answer(question, _load_faq(), SEMANTIC_FAQ_THRESHOLD, SEMANTIC_FAQ_TOP_K)
+
+
 def faq_answer(question: str) -> str:
     """
     多级关键词匹配：
@@ -46,48 +141,421 @@ def faq_answer(question: str) -> str:
     - 两级都命中才算匹配成功
     - 多条都匹配时，取 (primary命中数 + secondary命中数) 最高的
     """
-    faq = _load_faq()
-    q = question.lower()  # 统一小写，解决 WiFi/wifi 等大小写问题
+    index = _get_faq_index()
 
     best_match = None
+    best_idx = None
     best_score = 0
 
-    for item in faq:
-        primary_keywords = item.get("primary", [])
-        secondary_keywords = item.get("secondary", [])
-
+    # 一次扫描得到所有条目的命中情况：{条目下标: [primary, secondary, 旧格式]}
+    for idx, (primary_hits, secondary_hits, match_count) in index.match(question).items():
         # 兼容旧格式（平铺 keywords 列表）
-        if not primary_keywords and not secondary_keywords:
-            old_keywords = item.get("keywords", [])
-            if old_keywords:
-                match_count = sum(1 for k in old_keywords if k.lower() in q)
-                # 与新格式 primary 权重对齐：旧格式关键词视为 primary 级别
-                weighted_score = match_count * PRIMARY_KEYWORD_WEIGHT
-                if weighted_score > best_score:
-                    best_score = weighted_score
-                    best_match = item
-                continue
-
+        if match_count:
+            # 与新格式 primary 权重对齐：旧格式关键词视为 primary 级别
+            score = match_count * PRIMARY_KEYWORD_WEIGHT
         # === 多级匹配：两级都必须命中 ===
-        primary_hits = sum(1 for k in primary_keywords if k.lower() in q)
-        secondary_hits = sum(1 for k in secondary_keywords if k.lower() in q)
-
         # 第一关键词 AND 第二关键词 都必须至少命中一个
-        if primary_hits == 0 or secondary_hits == 0:
+        elif primary_hits == 0 or secondary_hits == 0:
             continue
+        else:
+            # 总分 = primary命中数 × 3 + secondary命中数 × 1
+            # primary 权重更高，确保主题越精准排越前
+            score = primary_hits * PRIMARY_KEYWORD_WEIGHT + secondary_hits * SECONDARY_KEYWORD_WEIGHT
+
+        # 同分时保留 faq.json 中靠前的条目
+        if score > best_score or (score == best_score and best_idx is not None and idx < best_idx):
+            best_score = score
+            best_match = index.items[idx]
+            best_idx = idx
+
+    if best_match:
+        return best_match.get("answer", "暂无答案")
 
-        # 总分 = primary命中数 × 3 + secondary命中数 × 1
-        # primary 权重更高，确保主题越精准排越前
-        score = primary_hits * PRIMARY_KEYWORD_WEIGHT + secondary_hits * SECONDARY_KEYWORD_WEIGHT
+    return NO_FAQ_ANSWER
 
-        if score > best_score:
+
+def fuzzy_faq_answer(question: str) -> str:
+    """
+    容错匹配：faq_answer 未命中时，把问题中近似出现的关键词（见 FaqIndex.fuzzy_match）
+    与精确命中合在一起，按同样的多级规则打分，近似命中按 FUZZY_KEYWORD_PENALTY 折算。
+    条目至少要有一个精确命中的关键词，避免两级都靠近似匹配凑出答案；未命中返回 NO_FAQ_ANSWER。
+    旧格式（平铺 keywords）条目只要有一个精确命中，faq_answer 就已经返回了答案，这里不再处理
+    """
+    index = _get_faq_index()
+    exact = index.match(question)
+    fuzzy = index.fuzzy_match(question)
+
+    best_match = None
+    best_idx = None
+    best_score = 0
+    for idx, fuzzy_hits in fuzzy.items():
+        exact_hits = exact.get(idx)
+        if not exact_hits:
+            continue
+        primary, secondary = (e + f * FUZZY_KEYWORD_PENALTY for e, f in zip(exact_hits[:2], fuzzy_hits[:2]))
+        if primary == 0 or secondary == 0:
+            continue
+        score = primary * PRIMARY_KEYWORD_WEIGHT + secondary * SECONDARY_KEYWORD_WEIGHT
+
+        if score > best_score or (score == best_score and best_idx is not None and idx < best_idx):
             best_score = score
-            best_match = item
+            best_match = index.items[idx]
+            best_idx = idx
 
     if best_match:
         return best_match.get("answer", "暂无答案")
 
-    return "我还不知道呢，请再描述得详细一点"
+    return NO_FAQ_ANSWER
+
+
+def _keyword_answer(question: str):
+    """关键词 FAQ 层：返回 (answer, route)，先精确匹配（faq），未命中再容错匹配（faq_fuzzy）；都未命中时 answer 为 None"""
+    with span("faq_keyword"):
+        answer = faq_answer(question)
+    if answer != NO_FAQ_ANSWER:
+        return answer, "faq"
+    if FAQ_FUZZY_ENABLED:
+        with span("faq_fuzzy"):
+            answer = fuzzy_faq_answer(question)
+        if answer != NO_FAQ_ANSWER:
+            return answer, "faq_fuzzy"
+    return None, None
+
+
+def plan_routes(questions: list, low_max: int = 1, mid_max: int = 3) -> list:
+    """
+    离线模拟路由决策：返回每个问题会走的路由，不调用任何模型、不写日志，用于在历史日志上评估阈值调整
+
+    对每个问题返回 {"score", "bucket", "faq_hit", "route"}：
+    - bucket: low（score <= low_max）/ mid（score <= mid_max）/ high，默认阈值与 route_question 一致
+    - faq_hit: FAQ 关键词是否命中（含容错匹配；对所有问题都计算，便于比较不同阈值下的 FAQ 覆盖率）
+    - route: invalid / faq / faq_fuzzy / small_model / big_model；FAQ + 远程模式下中低复杂度未命中为 big_model
+
+    语义检索需要向量模型，这里不模拟（中复杂度一律按未命中计）；答案缓存、预热、熔断等运行时状态也不考虑。
+    评分批量计算，FAQ 匹配按问题文本去重，日志中大量重复的问题只匹配一次。
+    """
+    questions = list(questions)
+    scores = complexity_scores(questions).tolist()
+    model_route = "small_model" if LOCAL_MODELS_ENABLED else "big_model"
+    faq_hits = {}
+    plans = []
+    for question, score in zip(questions, scores):
+        if not question or not question.strip():
+            plans.append({"score": 0, "bucket": "low", "faq_hit": False, "route": "invalid"})
+            continue
+        if question not in faq_hits:
+            faq_hits[question] = _keyword_answer(question)[1]
+        faq_route = faq_hits[question]
+        hit = faq_route is not None
+        if score <= low_max:
+            bucket, route = "low", faq_route or model_route
+        elif score <= mid_max:
+            bucket, route = "mid", model_route
+        else:
+            bucket, route = "high", "big_model"
+        plans.append({"score": score, "bucket": bucket, "faq_hit": hit, "route": route})
+    return plans
+
+
+def _cached_answer(question: str, history: list, score: int, start: float):
+    """
+    查询答案缓存：返回 (cache_key, hit)
+    命中时 hit 为 (answer, meta)，并已记录日志；未启用缓存时 cache_key 为 None
+    """
+    if not ANSWER_CACHE_ENABLED:
+        return None, None
+
+    with span("cache_lookup"):
+        # FAQ 版本变化后旧答案自动失效
+        _load_faq()
+        cache_key = make_cache_key(question, history, ANSWER_CACHE_HISTORY_WINDOW)
+        cached = _get_answer_cache().get(cache_key, faq_version=_faq_mtime)
+    observe_cache_lookup(bool(cached))
+    if not cached:
+        return cache_key, None
+
+    answer, cached_route = cached
+    response_time = time.time() - start
+    log_event(question, score, "cache", response_time, 0)
+    meta = {
+        "score": score,
+        "route": "cache",
+        "cached_route": cached_route,
+        "response_time": response_time,
+        "cost": 0,
+    }
+    _attach_stages(meta, None)
+    observe_request(meta)
+    return cache_key, (answer, meta)
+
+
+def _local_answer(question: str, score: int, extra: dict):
+    """
+    不调用模型的回答层，返回 (answer, route)；需要交给模型时 answer 为 None
+    - 低复杂度：先 FAQ 关键词（精确匹配，再容错匹配），未命中再做语义检索
+    - 中复杂度：FAQ 语义检索（多为常见问题的换种说法）
+    - 高复杂度：直接交给大模型
+    """
+    if score <= 1:
+        answer, route = _keyword_answer(question)
+        if answer is not None:
+            return answer, route
+    if score <= 3:
+        with span("faq_semantic"):
+            semantic, extra["similarity"] = _semantic_answer(question)
+        if semantic:
+            return semantic, "faq_semantic"
+    return None, None
+
+
+def _small_model_available() -> bool:
+    """
+    小模型是否可以接收问题：FAQ + 远程模式下从不使用；
+    启动预热未完成时（WARMUP_GATE=1）改由大模型回答，不阻塞等待加载
+    """
+    if not LOCAL_MODELS_ENABLED:
+        return False
+    return not WARMUP_GATE or small_model_ready()
+
+
+def _prefer_local() -> bool:
+    """大模型接口熔断期间，高复杂度问题也先交给小模型，而不是直接拿到降级提示"""
+    return not big_model_available() and _small_model_available()
+
+
+def _bypass_route() -> str:
+    """小模型不可用时交给大模型的路由标记：预热期间为 big_model_warmup，FAQ + 远程模式下为 big_model"""
+    return "big_model_warmup" if LOCAL_MODELS_ENABLED else "big_model"
+
+
+def _bypass_answer(question: str, history: list, extra: dict):
+    """小模型不可用时的替代回答，返回 (answer, route, cost)"""
+    answer, usage_info = big_model_answer(question, history=history)
+    extra["big_model_stats"] = _big_model_stats(usage_info)
+    return answer, _bypass_route(), usage_info.get("total_tokens", 0) * COST_PER_TOKEN
+
+
+def _predicts_fallback(question: str, score: int, extra: dict) -> bool:
+    """
+    回退预测：小模型的回答大概率通不过置信度检查时直接交给大模型，省去注定被丢弃的一次生成。
+    只在有模型文件且大模型可用时生效；超过阈值的请求中 FALLBACK_PREDICTOR_EXPLORE 比例仍交给小模型，
+    继续产生训练标签。预测概率记入 extra["fallback_probability"]
+    """
+    if not FALLBACK_PREDICTOR_ENABLED or not big_model_available():
+        return False
+    predictor = get_fallback_predictor()
+    if predictor is None:
+        return False
+    with span("fallback_predictor"):
+        probability = predictor.predict(question, score)
+    extra["fallback_probability"] = round(probability, 4)
+    if probability < FALLBACK_PREDICTOR_THRESHOLD:
+        return False
+    if random.random() < FALLBACK_PREDICTOR_EXPLORE:
+        extra["fallback_explored"] = True
+        return False
+    return True
+
+
+def _fallback_route(small_stats: dict) -> str:
+    """
+    小模型回答不可用、改由大模型回答时的路由：置信度不足为 big_model_fallback；小模型出错
+    （推理异常、推理队列已满、推理进程退出）为 big_model_fallback_error，与问题本身无关，不作为回退预测的训练标签
+    """
+    return "big_model_fallback_error" if "error" in small_stats else "big_model_fallback"
+
+
+def _predicted_answer(question: str, history: list, extra: dict):
+    """预测会回退的问题直接交给大模型，返回 (answer, route, cost)"""
+    answer, usage_info = big_model_answer(question, history=history)
+    extra["big_model_stats"] = _big_model_stats(usage_info)
+    return answer, "big_model_predicted", usage_info.get("total_tokens", 0) * COST_PER_TOKEN
+
+
+# meta["big_model_stats"] 中保留的大模型调用统计（含历史压缩前后的提示词 token 数）
+BIG_MODEL_STAT_KEYS = (
+    "ttft", "tokens_per_second", "prompt_tokens", "completion_tokens",
+    "prompt_tokens_before", "prompt_tokens_after", "history_dropped", "history_shortened",
+    "usage_estimated", "truncated",
+)
+
+
+def _big_model_stats(usage_info: dict) -> dict:
+    return {k: usage_info[k] for k in BIG_MODEL_STAT_KEYS if k in usage_info}
+
+
+# 小模型统计中并入阶段耗时的字段（批量生成时为整批的耗时）
+SMALL_MODEL_STAGE_KEYS = {
+    "latency": "small_model",
+    "queue_wait": "small_model.queue_wait",
+    "tokenize_time": "small_model.tokenize",
+    "prefill_time": "small_model.prefill",
+    "decode_time": "small_model.decode",
+}
+
+
+def _attach_stages(meta: dict, small_stats: dict):
+    """把当前请求的阶段耗时（含小模型统计中的分阶段耗时）写入 meta["stages"]"""
+    stages = current_stages()
+    if stages is None:
+        return
+    for key, stage in SMALL_MODEL_STAGE_KEYS.items():
+        if small_stats and key in small_stats:
+            stages[stage] = small_stats[key]
+    meta["stages"] = {name: round(seconds, 6) for name, seconds in stages.items()}
+
+
+def _degraded_answer(answer: str, route: str) -> bool:
+    """降级提示（[小模型] / [大模型] 开头），或未通过置信度检查的小模型回答"""
+    if answer.startswith(DEGRADED_PREFIXES):
+        return True
+    return route == "small_model" and low_confidence(answer)
+
+
+def _finish(question: str, score: int, start: float, answer: str, route: str, cost: float,
+            cache_key: str, extra: dict, small_stats: dict):
+    """记录日志、写入答案缓存并组装 meta"""
+    response_time = time.time() - start
+    log_event(question, score, route, response_time, cost)
+
+    # 只缓存正常生成的答案，降级提示、低置信度的小模型回答（熔断恢复后不应继续返回）、中途断开的大模型回答不进缓存
+    truncated = extra.get("big_model_stats", {}).get("truncated")
+    if cache_key and route in CACHEABLE_ROUTES and not truncated and not _degraded_answer(answer, route):
+        _get_answer_cache().put(cache_key, answer, route, faq_version=_faq_mtime)
+
+    meta = {
+        "score": score,
+        "route": route,
+        "response_time": response_time,
+        "cost": cost,
+    }
+    meta.update(extra)
+    if small_stats:
+        meta["small_model_stats"] = small_stats
+    _attach_stages(meta, small_stats)
+    observe_request(meta)
+    return meta
+
+
+def _flight_key(question: str, history: list, cache_key: str):
+    """合并并发请求用的键：与答案缓存相同（归一化问题 + 最近对话历史）；未启用合并时为 None"""
+    if not SINGLE_FLIGHT_ENABLED:
+        return None
+    return cache_key or make_cache_key(question, history, ANSWER_CACHE_HISTORY_WINDOW)
+
+
+def _finish_coalesced(question: str, score: int, start: float, answer: str, route: str, extra: dict):
+    """
+    合并到其他请求计算结果上的请求：路由记为 coalesced（原路由见 coalesced_route），
+    不再计费、不重复写入答案缓存
+    """
+    extra["coalesced"] = True
+    extra["coalesced_route"] = route
+    return _finish(question, score, start, answer, "coalesced", 0, None, extra, None)
+
+
+def _start_hedge(question: str, history: list, score: int) -> HedgedCall:
+    """对冲模式：小模型生成的同时，延迟 HEDGE_DELAY_MS（复杂度为3时立即）在后台启动大模型调用"""
+    delay = 0 if score >= 3 else HEDGE_DELAY_MS / 1000
+    return HedgedCall(big_model_answer_stream, question, history, delay=delay)
+
+
+def _hedge_won(hedge: HedgedCall, extra: dict):
+    """小模型未通过检查、改用对冲的大模型回答：在 extra["hedge"] 中记录（需在取结果之前调用）"""
+    extra["hedge"] = {"winner": "big", "big_started_early": hedge.started, "wasted_tokens": 0, "delay": hedge.delay}
+
+
+def _cancel_hedge(hedge: HedgedCall, extra: dict) -> float:
+    """小模型胜出：取消对冲调用，返回浪费的成本（已经发出的大模型请求同样计费），记录在 extra["hedge"] 中"""
+    started = hedge.started
+    wasted = hedge.cancel()
+    extra["hedge"] = {"winner": "small", "big_started_early": started, "wasted_tokens": wasted, "delay": hedge.delay}
+    return wasted * COST_PER_TOKEN
+
+
+def _hedged_answer(question: str, history: list, score: int, extra: dict, small_stats: dict):
+    """
+    对冲模式：小模型通过置信度检查则取消大模型，否则直接等待大模型结果
+    返回 (answer, route, cost)，并在 extra["hedge"] 中记录胜出方与浪费的 token
+    """
+    hedge = _start_hedge(question, history, score)
+
+    answer = small_model_answer(question, history=history, stats=small_stats)
+    route = "small_model"
+
+    if answer.startswith("[小模型]") or low_confidence(answer):
+        _hedge_won(hedge, extra)
+        answer, usage_info = hedge.result()
+        if answer is None:
+            # 对冲调用异常退出时，按普通降级再调用一次
+            answer, usage_info = big_model_answer(question, history=history)
+        route = _fallback_route(small_stats)
+        cost = usage_info.get("total_tokens", 0) * COST_PER_TOKEN
+        extra["big_model_stats"] = _big_model_stats(usage_info)
+    else:
+        cost = _cancel_hedge(hedge, extra)
+    return answer, route, cost
+
+
+def _model_answer(question: str, history: list, score: int, extra: dict, small_stats: dict):
+    """FAQ 未命中时交给模型回答，返回 (answer, route, cost)"""
+    cost = 0
+
+    # 1) 低复杂度：FAQ 未命中，交给小模型
+    if score <= 1:
+        if not _small_model_available():
+            return _bypass_answer(question, history, extra)
+        if _predicts_fallback(question, score, extra):
+            return _predicted_answer(question, history, extra)
+
+        answer = small_model_answer(question, history=history, stats=small_stats)
+        route = "small_model"
+
+        # 检查小模型异常返回或低置信度，自动降级到大模型（大模型熔断期间保留小模型回答，记为降级路由）
+        if answer.startswith("[小模型]") or low_confidence(answer):
+            if big_model_available():
+                answer, usage_info = big_model_answer(question, history=history)
+                route = _fallback_route(small_stats)
+                cost = usage_info.get("total_tokens", 0) * COST_PER_TOKEN
+                extra["big_model_stats"] = _big_model_stats(usage_info)
+            else:
+                route = "small_model_degraded"
+
+    # 2) 中复杂度：FAQ 语义检索未命中，交给小模型，低置信度再回退（可选对冲模式）
+    elif score <= 3:
+        if not _small_model_available():
+            return _bypass_answer(question, history, extra)
+        if _predicts_fallback(question, score, extra):
+            return _predicted_answer(question, history, extra)
+
+        if HEDGE_ENABLED and big_model_available():
+            return _hedged_answer(question, history, score, extra, small_stats)
+
+        answer = small_model_answer(question, history=history, stats=small_stats)
+        route = "small_model"
+
+        # 检查小模型异常返回或低置信度，自动降级到大模型（大模型熔断期间保留小模型回答，记为降级路由）
+        if answer.startswith("[小模型]") or low_confidence(answer):
+            if big_model_available():
+                answer, usage_info = big_model_answer(question, history=history)
+                route = _fallback_route(small_stats)
+                cost = usage_info.get("total_tokens", 0) * COST_PER_TOKEN
+                extra["big_model_stats"] = _big_model_stats(usage_info)
+            else:
+                route = "small_model_degraded"
+
+    # 3) 高复杂度：直接大模型；大模型熔断期间改用小模型
+    elif _prefer_local():
+        answer = small_model_answer(question, history=history, stats=small_stats)
+        route = "small_model_degraded"
+
+    else:
+        answer, usage_info = big_model_answer(question, history=history)
+        route = "big_model"
+        cost = usage_info.get("total_tokens", 0) * COST_PER_TOKEN
+        extra["big_model_stats"] = _big_model_stats(usage_info)
+
+    return answer, route, cost
 
 
 def route_question(question: str, history: list = None):
@@ -102,50 +570,271 @@ def route_question(question: str, history: list = None):
     if not question or not question.strip():
         return "请输入您的问题", {"score": 0, "route": "invalid", "response_time": 0, "cost": 0}
     
-    score = complexity_score(question)
+    start_trace()
+    with span("complexity_score"):
+        score = complexity_score(question)
     start = time.time()
-    route = "faq"
     cost = 0
 
-    # 1) 低复杂度：先 FAQ
-    if score <= 1:
-        answer = faq_answer(question)
-        route = "faq"
+    # 0) 答案缓存
+    cache_key, hit = _cached_answer(question, history, score, start)
+    if hit:
+        return hit
 
-        if answer == "我还不知道呢，请再描述得详细一点":
-            answer = small_model_answer(question, history=history)
-            route = "small_model"
+    extra = {}
+    small_stats = {}
+    answer, route = _local_answer(question, score, extra)
+
+    if answer is None:
+        flight_key = _flight_key(question, history, cache_key)
+        if flight_key is None:
+            answer, route, cost = _model_answer(question, history, score, extra, small_stats)
+        else:
+            (answer, route, cost), shared = _single_flight.do(
+                flight_key, partial(_model_answer, question, history, score, extra, small_stats)
+            )
+            if shared:
+                meta = _finish_coalesced(question, score, start, answer, route, extra)
+                return answer, meta
+            extra["coalesced"] = False
 
-            # 检查小模型异常返回或低置信度，自动降级到大模型
+    meta = _finish(question, score, start, answer, route, cost, cache_key, extra, small_stats)
+    return answer, meta
+
+
+def _stream_model_answer(question: str, history: list, score: int, start: float,
+                         extra: dict, small_stats: dict, big_stats: dict):
+    """
+    FAQ 未命中时流式交给模型回答：产出文本增量，结束时返回 (answer, route, cost)
+    开启对冲模式时，中复杂度问题与非流式路由一样在小模型生成期间提前启动大模型调用
+    """
+    cost = 0
+    local = score <= 3 and _small_model_available()
+    predicted = local and _predicts_fallback(question, score, extra)
+    if local and not predicted or _prefer_local():
+        hedge = None
+        if HEDGE_ENABLED and 1 < score <= 3 and big_model_available():
+            hedge = _start_hedge(question, history, score)
+        model_start = time.time()
+        try:
+            answer = yield from small_model_answer_stream(question, history=history, stats=small_stats)
+            route = "small_model" if score <= 3 else "small_model_degraded"
+            if "ttft" in small_stats:
+                extra["ttft"] = model_start - start + small_stats["ttft"]
+
+            # 流结束后再做置信度检查，不通过则流式降级到大模型（调用方用最终答案覆盖已显示内容）；
+            # 大模型熔断期间保留小模型回答，记为降级路由
             if answer.startswith("[小模型]") or low_confidence(answer):
-                answer, usage_info = big_model_answer(question, history=history)
-                route = "big_model_fallback"
-                cost = usage_info.get("total_tokens", 0) * COST_PER_TOKEN
+                if hedge is not None or big_model_available():
+                    if "ttft" in extra:
+                        yield FALLBACK_NOTICE
+                    answer = None
+                    if hedge is not None:
+                        # 已经在路上的对冲调用：先补发已收到的增量，再继续转发
+                        _hedge_won(hedge, extra)
+                        timing = {}
+                        answer = yield from _relay(hedge.chunks(), start, timing)
+                        big_stats.update(hedge.usage_info)
+                        if "ttft" in timing:
+                            extra.setdefault("ttft", timing["ttft"])
+                    if answer is None:
+                        big_start = time.time()
+                        answer = yield from big_model_answer_stream(question, history=history, usage_info=big_stats)
+                        if "ttft" not in extra and "ttft" in big_stats:
+                            extra["ttft"] = big_start - start + big_stats["ttft"]
+                    route = _fallback_route(small_stats)
+                    cost = big_stats.get("total_tokens", 0) * COST_PER_TOKEN
+                else:
+                    route = "small_model_degraded"
+            elif hedge is not None:
+                cost = _cancel_hedge(hedge, extra)
+        except GeneratorExit:
+            # 调用方提前关闭流时一并取消对冲调用，不再在后台接收大模型的剩余 token
+            if hedge is not None:
+                hedge.cancel()
+            raise
 
-    # 2) 中复杂度：先小模型，低置信度再回退
-    elif score <= 3:
-        answer = small_model_answer(question, history=history)
-        route = "small_model"
+    else:
+        model_start = time.time()
+        answer = yield from big_model_answer_stream(question, history=history, usage_info=big_stats)
+        # 中低复杂度问题走到这里说明预测小模型会回退，或小模型不可用（预热中或 FAQ + 远程模式）
+        if score > 3:
+            route = "big_model"
+        else:
+            route = "big_model_predicted" if predicted else _bypass_route()
+        cost = big_stats.get("total_tokens", 0) * COST_PER_TOKEN
+        if "ttft" in big_stats:
+            extra["ttft"] = model_start - start + big_stats["ttft"]
 
-        # 检查小模型异常返回或低置信度，自动降级到大模型
-        if answer.startswith("[小模型]") or low_confidence(answer):
-            answer, usage_info = big_model_answer(question, history=history)
-            route = "big_model_fallback"
+    return answer, route, cost
+
+
+def _relay(chunks, start: float, timing: dict):
+    """转发生成器的增量，记录首个增量的耗时（timing["ttft"]），返回该生成器的结果"""
+    try:
+        while True:
+            try:
+                chunk = next(chunks)
+            except StopIteration as stop:
+                return stop.value
+            timing.setdefault("ttft", time.time() - start)
+            yield chunk
+    finally:
+        # 调用方提前关闭时一并关闭上游（合并请求的 leader 据此通知等待中的请求）
+        chunks.close()
+
+
+def route_question_stream(question: str, history: list = None):
+    """
+    流式路由，返回 (chunks, result)
+
+    - chunks: 文本增量生成器，可直接交给 st.write_stream 渲染
+    - result: 字典，chunks 迭代结束后包含 "answer"（最终答案）和 "meta"（额外记录 ttft 首字耗时）
+
+    最终答案可能与流式显示的文本不同（小模型输出被截断，或置信度低降级到大模型），
+    调用方应在迭代结束后以 result["answer"] 为准。
+    """
+    result = {}
+    return _route_stream(question, history, result), result
+
+
+def _route_stream(question: str, history: list, result: dict):
+    # 空问题检查：对空字符串或纯空白字符串直接返回提示
+    if not question or not question.strip():
+        result["answer"] = "请输入您的问题"
+        result["meta"] = {"score": 0, "route": "invalid", "response_time": 0, "cost": 0}
+        yield result["answer"]
+        return
+
+    start_trace()
+    with span("complexity_score"):
+        score = complexity_score(question)
+    start = time.time()
+    cost = 0
+
+    cache_key, hit = _cached_answer(question, history, score, start)
+    if hit:
+        result["answer"], result["meta"] = hit
+        result["meta"]["ttft"] = result["meta"]["response_time"]
+        yield result["answer"]
+        return
+
+    extra = {}
+    small_stats = {}
+    big_stats = {}
+    answer, route = _local_answer(question, score, extra)
+
+    if answer is None:
+        model_stream = partial(_stream_model_answer, question, history, score, start, extra, small_stats, big_stats)
+        flight_key = _flight_key(question, history, cache_key)
+        if flight_key is None:
+            answer, route, cost = yield from model_stream()
+        else:
+            timing = {}
+            (answer, route, cost), shared = yield from _relay(
+                _single_flight.stream(flight_key, model_stream), start, timing
+            )
+            if shared:
+                # 合并到非流式请求上时没有增量，整段输出最终答案
+                if not timing:
+                    timing["ttft"] = time.time() - start
+                    yield answer
+                extra["ttft"] = timing["ttft"]
+                result["answer"] = answer
+                result["meta"] = _finish_coalesced(question, score, start, answer, route, extra)
+                return
+            extra["coalesced"] = False
+
+    else:
+        extra["ttft"] = time.time() - start
+        yield answer
+
+    # 没有产出任何文本时，首字耗时即最终答案就绪的时间
+    extra.setdefault("ttft", time.time() - start)
+    if big_stats:
+        extra["big_model_stats"] = _big_model_stats(big_stats)
+
+    result["answer"] = answer
+    result["meta"] = _finish(question, score, start, answer, route, cost, cache_key, extra, small_stats)
+
+
+async def _in_executor(fn, *args, **kwargs):
+    """在本地推理线程池中执行同步工作；复制当前上下文，线程池里的阶段耗时与日志范围沿用本次请求"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        _get_inference_executor(), contextvars.copy_context().run, partial(fn, *args, **kwargs)
+    )
+
+
+def _checked_small_answer(question: str, history: list, small_stats: dict):
+    """小模型回答并做置信度检查，返回 (answer, 是否需要降级)；异步路由在线程池中一并执行"""
+    answer = small_model_answer(question, history=history, stats=small_stats)
+    return answer, answer.startswith("[小模型]") or low_confidence(answer)
+
+
+async def route_question_async(question: str, history: list = None):
+    """
+    route_question 的异步版本，返回值同样是 (answer, meta)
+
+    远程大模型通过 AsyncOpenAI 调用，等待网络时不占用线程；
+    小模型、FAQ 语义检索、置信度检查、回退预测，以及答案缓存（SQLite）读写和日志写入
+    都交给专用线程池执行，不阻塞事件循环。
+    """
+    # 空问题检查：对空字符串或纯空白字符串直接返回提示
+    if not question or not question.strip():
+        return "请输入您的问题", {"score": 0, "route": "invalid", "response_time": 0, "cost": 0}
+
+    start_trace()
+    with span("complexity_score"):
+        score = complexity_score(question)
+    start = time.time()
+    cost = 0
+
+    cache_key, hit = await _in_executor(_cached_answer, question, history, score, start)
+    if hit:
+        return hit
+
+    extra = {}
+    small_stats = {}
+
+    if score <= 3:
+        answer, route = await _in_executor(_local_answer, question, score, extra)
+
+        if answer is None and not _small_model_available():
+            answer, usage_info = await big_model_answer_async(question, history=history)
+            route = _bypass_route()
+            cost = usage_info.get("total_tokens", 0) * COST_PER_TOKEN
+            extra["big_model_stats"] = _big_model_stats(usage_info)
+
+        elif answer is None and await _in_executor(_predicts_fallback, question, score, extra):
+            answer, usage_info = await big_model_answer_async(question, history=history)
+            route = "big_model_predicted"
             cost = usage_info.get("total_tokens", 0) * COST_PER_TOKEN
+            extra["big_model_stats"] = _big_model_stats(usage_info)
+
+        elif answer is None:
+            answer, weak = await _in_executor(_checked_small_answer, question, history, small_stats)
+            route = "small_model"
+
+            # 小模型异常返回或低置信度，自动降级到大模型（大模型熔断期间保留小模型回答，记为降级路由）
+            if weak:
+                if big_model_available():
+                    answer, usage_info = await big_model_answer_async(question, history=history)
+                    route = _fallback_route(small_stats)
+                    cost = usage_info.get("total_tokens", 0) * COST_PER_TOKEN
+                    extra["big_model_stats"] = _big_model_stats(usage_info)
+                else:
+                    route = "small_model_degraded"
+
+    elif _prefer_local():
+        answer = await _in_executor(small_model_answer, question, history=history, stats=small_stats)
+        route = "small_model_degraded"
 
-    # 3) 高复杂度：直接大模型
     else:
-        answer, usage_info = big_model_answer(question, history=history)
+        answer, usage_info = await big_model_answer_async(question, history=history)
         route = "big_model"
         cost = usage_info.get("total_tokens", 0) * COST_PER_TOKEN
+        extra["big_model_stats"] = _big_model_stats(usage_info)
 
-    response_time = time.time() - start
-    log_event(question, score, route, response_time, cost)
-
-    meta = {
-        "score": score,
-        "route": route,
-        "response_time": response_time,
-        "cost": cost,
-    }
-    return answer, meta
\ No newline at end of file
+    meta = await _in_executor(_finish, question, score, start, answer, route, cost, cache_key, extra, small_stats)
+    return answer, meta
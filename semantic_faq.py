@@ -0,0 +1,209 @@
+"""
+FAQ 语义检索：关键词未命中时，用句向量找出意思相近的 FAQ 条目
+
+- 每个 FAQ 条目（关键词 + 答案）预先编码成归一化向量，组成 NumPy 矩阵
+- 矩阵持久化在 faq.json 旁边（faq_embeddings.npz），按 FAQ 内容哈希校验，FAQ 变化后自动重建
+- 查询时一次矩阵乘法得到全部余弦相似度，再用 argpartition 取 top-k，5 万条目也只需数毫秒
+- 向量模型在 CPU 上运行；模型与索引由启动预热（warmup.py）加载和建立，请求线程不加载模型、不编码 FAQ，
+  模型未加载、索引未就绪或 FAQ 热更新后的新索引未建好时，在后台线程中加载/建索引（同一时间只建一次），
+  期间请求按未命中处理或继续使用上一版 FAQ 及其矩阵
+  （矩阵可以直接从持久化文件读出，但查询时仍要编码问题，所以模型未加载也按未就绪处理）
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+import numpy as np
+from config import SEMANTIC_FAQ_MODEL, SEMANTIC_FAQ_EMBEDDINGS_PATH
+
+# bge 系列模型推荐的检索查询前缀
+QUERY_INSTRUCTION = "为这个句子生成表示以用于检索相关文章："
+ENCODE_BATCH_SIZE = 64
+ENCODE_MAX_LENGTH = 256
+
+# 后台建索引失败后，至少间隔多少秒再重试
+INDEX_RETRY_INTERVAL = 30
+
+# 全局变量，延迟加载向量模型；模型无法加载（如离线环境）时 _load_failed 置位，关闭该层
+_tokenizer = None
+_model = None
+_load_failed = False
+_model_lock = threading.Lock()
+
+# 当前向量索引：(faq 列表对象, 归一化矩阵)，整体替换，读取方不会拿到不配对的 FAQ 与矩阵
+_index = None
+_index_lock = threading.Lock()
+# 后台建索引的状态：正在建的 faq 列表对象、上次失败的时间
+_building = None
+_build_failed_at = 0.0
+_build_state_lock = threading.Lock()
+
+
+def _model_loaded() -> bool:
+    return _tokenizer is not None and _model is not None
+
+
+def _load_model():
+    """懒加载向量模型（CPU），多个线程同时调用时只加载一次"""
+    global _tokenizer, _model, _load_failed
+    if _tokenizer is not None and _model is not None:
+        return
+    with _model_lock:
+        if _tokenizer is not None and _model is not None:
+            return
+        try:
+            from transformers import AutoTokenizer, AutoModel
+            print(f"正在加载FAQ向量模型: {SEMANTIC_FAQ_MODEL}")
+            tokenizer = AutoTokenizer.from_pretrained(SEMANTIC_FAQ_MODEL)
+            model = AutoModel.from_pretrained(SEMANTIC_FAQ_MODEL, device_map="cpu")
+            model.eval()
+        except Exception:
+            _load_failed = True
+            raise
+        _tokenizer, _model = tokenizer, model
+        print("FAQ向量模型加载完成")
+
+
+def encode(texts: list) -> np.ndarray:
+    """把文本编码成 L2 归一化的 float32 向量矩阵（每行一个文本）"""
+    import torch
+    _load_model()
+    chunks = []
+    for i in range(0, len(texts), ENCODE_BATCH_SIZE):
+        batch = _tokenizer(
+            texts[i:i + ENCODE_BATCH_SIZE], padding=True, truncation=True,
+            max_length=ENCODE_MAX_LENGTH, return_tensors="pt"
+        )
+        with torch.no_grad():
+            hidden = _model(**batch).last_hidden_state
+        # bge 使用 [CLS] 向量作为句向量
+        chunks.append(hidden[:, 0].float().numpy())
+    if not chunks:
+        return np.zeros((0, 0), dtype=np.float32)
+    matrix = np.concatenate(chunks).astype(np.float32)
+    matrix /= np.linalg.norm(matrix, axis=1, keepdims=True) + 1e-12
+    return matrix
+
+
+def _item_text(item: dict) -> str:
+    """FAQ 条目的检索文本：各级关键词 + 答案"""
+    keywords = item.get("primary", []) + item.get("secondary", []) + item.get("keywords", [])
+    return " ".join(keywords) + " " + item.get("answer", "")
+
+
+def _faq_hash(texts: list) -> str:
+    raw = json.dumps([SEMANTIC_FAQ_MODEL] + texts, ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _load_or_build_matrix(faq: list) -> np.ndarray:
+    """读取持久化的向量矩阵；不存在或与当前 FAQ 不符时重新编码并保存"""
+    texts = [_item_text(item) for item in faq]
+    digest = _faq_hash(texts)
+
+    if os.path.exists(SEMANTIC_FAQ_EMBEDDINGS_PATH):
+        try:
+            with np.load(SEMANTIC_FAQ_EMBEDDINGS_PATH) as data:
+                if str(data["faq_hash"]) == digest:
+                    return data["embeddings"]
+        except (OSError, KeyError, ValueError) as e:
+            print(f"FAQ向量文件读取失败，将重新生成: {e}")
+
+    print(f"正在为 {len(texts)} 条FAQ生成向量...")
+    matrix = encode(texts)
+    # 先写临时文件再替换，避免多个进程读到写了一半的文件
+    tmp_path = SEMANTIC_FAQ_EMBEDDINGS_PATH + f".{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        np.savez(f, embeddings=matrix, faq_hash=np.array(digest))
+    os.replace(tmp_path, SEMANTIC_FAQ_EMBEDDINGS_PATH)
+    return matrix
+
+
+def build_index(faq: list) -> tuple:
+    """
+    加载向量模型，为 faq 建立向量索引（读取持久化矩阵或重新编码）并发布，返回 (faq, matrix)；
+    并发调用时只建一次，已是当前 FAQ 的索引时直接返回。
+    持久化矩阵命中时建索引本身用不到模型，这里仍先加载，查询时编码问题不必在请求线程里加载
+    """
+    global _index
+    _load_model()
+    with _index_lock:
+        index = _index
+        if index is None or index[0] is not faq:
+            index = (faq, _load_or_build_matrix(faq))
+            _index = index
+    return index
+
+
+def _build_in_background(faq: list):
+    """在后台线程中为 faq 建索引；已在建或刚失败过（INDEX_RETRY_INTERVAL 内）时不重复启动"""
+    global _building
+    with _build_state_lock:
+        if _building is not None or time.time() - _build_failed_at < INDEX_RETRY_INTERVAL:
+            return
+        _building = faq
+
+    def run():
+        global _building, _build_failed_at
+        try:
+            build_index(faq)
+        except Exception as e:
+            print(f"FAQ向量索引建立失败: {e}")
+            _build_failed_at = time.time()
+        finally:
+            with _build_state_lock:
+                _building = None
+
+    threading.Thread(target=run, name="semantic-faq-index", daemon=True).start()
+
+
+def _search_index(index: tuple, question: str, top_k: int) -> list:
+    faq, matrix = index
+    query = encode([QUERY_INSTRUCTION + question])[0]
+    sims = matrix @ query
+
+    k = min(top_k, len(sims))
+    top = np.argpartition(-sims, k - 1)[:k]
+    top = top[np.argsort(-sims[top])]
+    return [(int(i), float(sims[i])) for i in top]
+
+
+def search(question: str, faq: list, top_k: int = 3) -> list:
+    """
+    返回与问题最相近的 top_k 个 FAQ 条目：[(条目下标, 余弦相似度), ...]，按相似度降序
+    索引不是当前 FAQ 的（未建立或热更新后）先同步建立；请求路径使用 semantic_faq_answer
+    """
+    if not faq:
+        return []
+    return _search_index(build_index(faq), question, top_k)
+
+
+def semantic_faq_answer(question: str, faq: list, threshold: float, top_k: int = 3):
+    """
+    语义检索 FAQ，返回 (answer, similarity)；最高相似度低于阈值、索引或模型未就绪、模型不可用时 answer 为 None
+
+    不在请求线程中加载模型、建索引：模型未加载或当前 FAQ 的索引不存在时交给后台线程，就绪之前按未命中处理；
+    FAQ 热更新后新索引建好之前继续使用上一版索引，答案从与矩阵配对的那份 FAQ 中取
+    """
+    if _load_failed or not faq:
+        return None, 0.0
+    index = _index
+    if index is None or index[0] is not faq or not _model_loaded():
+        _build_in_background(faq)
+        if index is None or not _model_loaded():
+            return None, 0.0
+    try:
+        results = _search_index(index, question, top_k)
+    except Exception as e:
+        # 模型无法加载时 _load_failed 已置位，之后直接跳过；其他错误（如单次编码失败）只跳过本次
+        print(f"FAQ语义检索失败，已跳过: {e}")
+        return None, 0.0
+
+    if not results:
+        return None, 0.0
+    best_idx, best_sim = results[0]
+    if best_sim < threshold:
+        return None, best_sim
+    return index[0][best_idx].get("answer", "暂无答案"), best_sim
@@ -0,0 +1,148 @@
+"""
+相同问题的并发请求合并（single-flight）
+
+开学时大量同学几秒内问同一个问题，答案缓存要等第一个回答生成完才有内容，
+在此之前每个请求都会各自调用一次小模型或付费的大模型。SingleFlight 让同一个键上
+并发到达的请求共享一次正在进行的计算：第一个请求（leader）负责计算，其余请求
+（follower）等待并拿到同一个结果；流式调用时 follower 按 leader 的进度同步收到增量。
+
+只有同一个键的请求互相等待，不同问题之间不加锁。leader 中途放弃（流式连接被关闭）时
+follower 收到 FlightAbandoned 后各自重新计算。
+"""
+
+import threading
+
+
+class FlightAbandoned(Exception):
+    """leader 在计算完成前退出（如流式输出被调用方关闭）"""
+
+
+class Flight:
+    """一次正在进行的计算：保存已产出的增量、结果或异常"""
+
+    def __init__(self):
+        self.chunks = []
+        self.followers = 0
+        self.done = False
+        self.value = None
+        self.error = None
+        self._cond = threading.Condition()
+
+    def publish(self, chunk):
+        with self._cond:
+            self.chunks.append(chunk)
+            self._cond.notify_all()
+
+    def finish(self, value=None, error: BaseException = None):
+        with self._cond:
+            self.value = value
+            self.error = error
+            self.done = True
+            self._cond.notify_all()
+
+    def wait(self):
+        """等待计算完成，返回结果或重新抛出 leader 的异常"""
+        with self._cond:
+            self._cond.wait_for(lambda: self.done)
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+    def follow(self):
+        """生成器：依次产出 leader 已经和之后产出的增量，结束时返回结果"""
+        sent = 0
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self.done or len(self.chunks) > sent)
+                pending = self.chunks[sent:]
+                done = self.done
+            for chunk in pending:
+                yield chunk
+            sent += len(pending)
+            if done and sent == len(self.chunks):
+                break
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+
+class SingleFlight:
+    """按键合并并发计算，线程安全"""
+
+    def __init__(self):
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def _join(self, key):
+        """返回 (flight, is_leader)"""
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                flight.followers += 1
+                return flight, False
+            flight = self._flights[key] = Flight()
+            return flight, True
+
+    def _land(self, key, flight: Flight, value=None, error: BaseException = None):
+        # 先移除再通知：结果交出后到达的请求开始新的计算（通常已能命中答案缓存）
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+        flight.finish(value, error)
+
+    def inflight(self) -> int:
+        """正在进行的计算数"""
+        return len(self._flights)
+
+    def do(self, key, fn):
+        """
+        计算 fn()，同一个键上并发的调用共享同一次计算。
+        返回 (value, shared)：shared 为 True 表示结果来自其他请求的计算
+        """
+        flight, leader = self._join(key)
+        if not leader:
+            try:
+                return flight.wait(), True
+            except FlightAbandoned:
+                return fn(), False
+        try:
+            value = fn()
+        except BaseException as e:
+            self._land(key, flight, error=e)
+            raise
+        self._land(key, flight, value=value)
+        return value, False
+
+    def stream(self, key, make_stream):
+        """
+        do() 的流式版本：make_stream() 返回生成器（产出增量，结束时 return 结果）。
+        本方法同样是生成器，产出增量，结束时返回 (value, shared)
+        """
+        flight, leader = self._join(key)
+        if not leader:
+            try:
+                value = yield from flight.follow()
+                return value, True
+            except FlightAbandoned:
+                value = yield from make_stream()
+                return value, False
+
+        stream = make_stream()
+        try:
+            while True:
+                try:
+                    chunk = next(stream)
+                except StopIteration as stop:
+                    value = stop.value
+                    break
+                flight.publish(chunk)
+                yield chunk
+        except GeneratorExit:
+            stream.close()
+            self._land(key, flight, error=FlightAbandoned(key))
+            raise
+        except BaseException as e:
+            self._land(key, flight, error=e)
+            raise
+        self._land(key, flight, value=value)
+        return value, False
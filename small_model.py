@@ -1,36 +1,576 @@
+import copy
+import glob
+import json
+import math
+import mmap
+import os
+import queue
+import struct
 import time
 import re
+import threading
 from collections import deque
-from transformers import AutoTokenizer, AutoModelForCausalLM
+from transformers import (
+    AutoConfig, AutoTokenizer, AutoModelForCausalLM, GenerationConfig, LogitsProcessor, LogitsProcessorList,
+    StoppingCriteria, StoppingCriteriaList, TemperatureLogitsWarper, TextIteratorStreamer, TopKLogitsWarper,
+    TopPLogitsWarper,
+)
 import torch
-from config import SMALL_MODEL_PATH, SMALL_MODEL_DEVICE, SMALL_MODEL_MAX_LENGTH
+from config import (
+    SMALL_MODEL_PATH, SMALL_MODEL_DEVICE, SMALL_MODEL_MAX_LENGTH, SMALL_MODEL_PROMPT_BUDGET, SMALL_MODEL_PRECISION,
+    SMALL_MODEL_BATCHING, SMALL_MODEL_MAX_BATCH_SIZE, SMALL_MODEL_MAX_WAIT_MS, SMALL_MODEL_PREFIX_CACHE,
+    SMALL_MODEL_EARLY_ABORT, SMALL_MODEL_MIN_LOGPROB, SMALL_MODEL_CONFIDENCE_WINDOW,
+    SMALL_MODEL_MMAP_WEIGHTS, SMALL_MODEL_WORKERS, SMALL_MODEL_WORKER_THREADS, SMALL_MODEL_WORKER_QUEUE,
+    SMALL_MODEL_WORKER_TIMEOUT, SMALL_MODEL_WORKER_MAX_RESTARTS, WARMUP_GENERATIONS,
+)
+from batching import BatchingEngine
+from history_compactor import TokenizerCounter, compact_messages
+from metrics import observe_tokens_per_second
+from tracing import span
+from utils import rss_mb
 
 # 全局变量，延迟加载模型
 _tokenizer = None
 _model = None
+_precision = None  # 当前已加载模型的精度模式
+_token_counter = None  # 基于当前分词器的 token 计数器（带缓存），分词器重新加载后重建
+
+# 加载时测得的内存与速度：precision、load_time、rss_mb、tokens_per_second、mmap_weights
+_load_stats = {}
+
+# 支持的精度模式：float32（默认）、bfloat16（支持 AVX512-BF16/AMX 的 CPU 上更快）、
+# int8（Linear 层动态量化，权重内存约为 float32 的 1/4）
+PRECISION_MODES = ("float32", "bfloat16", "int8")
+
+# 动态批处理引擎（延迟创建）
+_batch_engine = None
+
+# 多进程推理池（SMALL_MODEL_WORKERS > 0 时延迟创建），本进程不加载模型
+_worker_pool = None
+
+# safetensors 头部的数据类型标记
+_SAFETENSORS_DTYPES = {
+    "F32": torch.float32, "F16": torch.float16, "BF16": torch.bfloat16,
+    "I64": torch.int64, "I32": torch.int32, "U8": torch.uint8, "BOOL": torch.bool,
+}
+
+# 批量生成与流式生成共用同一个模型，串行执行，避免互相争抢 CPU 线程
+_generate_lock = threading.Lock()
+# 模型加载锁：预热线程与首个请求同时加载时只加载一次
+_load_lock = threading.Lock()
+
+# 系统提示前缀的 KV 缓存：(构建依据, 前缀 token, past_key_values)
+# 构建依据包含模型、分词器和系统提示，任一变化都会自动重建
+_prefix_cache = None
+
+# 生成过程中置信度过低被提前终止时返回的答案；以 "[小模型]" 开头，路由会直接降级到大模型
+LOW_CONFIDENCE_ANSWER = "[小模型] 回答置信度过低，已提前终止生成"
+
+# 流式生成：等待下一个 token 的超时时间（秒）
+STREAM_TOKEN_TIMEOUT = 60
 
 # ========== 新增：上下文记忆管理 ==========
 # 最多保留最近 3 轮对话（可调），避免超出 max_length
 MAX_HISTORY_ROUNDS = 3
 
+SYSTEM_PROMPT = (
+    "你是校园问答助手。请用一两句话简短回答，不超过100字。"
+    "直接给出答案，不要重复问题，不要说多余的话。"
+    "每次只回答用户当前的问题，不要续写或补充之前的回答。"
+)
+
+# ========== 改进：更短的生成参数 ==========
+GENERATION_KWARGS = {
+    "max_new_tokens": 80,  # 从128减少到80，更严格控制长度
+    "temperature": 0.3,
+    "do_sample": True,
+    "top_p": 0.8,
+    "repetition_penalty": 1.2,  # 略微提高重复惩罚
+    "no_repeat_ngram_size": 3,
+}
+
+
+def _load_model(precision: str = None):
+    """懒加载本地小模型；precision 为空时使用配置中的 SMALL_MODEL_PRECISION，与已加载模型不同时重新加载"""
+    global _tokenizer, _model, _precision, _prefix_cache, _token_counter
+    precision = precision or SMALL_MODEL_PRECISION
+    if precision not in PRECISION_MODES:
+        raise ValueError(f"不支持的小模型精度模式: {precision}，可选: {', '.join(PRECISION_MODES)}")
+
+    with _load_lock:
+        # 启动预热线程正在加载时，其他调用方在此等待，不会重复加载
+        if _tokenizer is None or _model is None or precision != _precision:
+            print(f"正在加载本地小模型: {SMALL_MODEL_PATH}（精度: {precision}）")
+            start = time.time()
+            _model = None  # 切换精度时先释放旧模型
+            _prefix_cache = None
+            _tokenizer = AutoTokenizer.from_pretrained(SMALL_MODEL_PATH, trust_remote_code=True)
+            _token_counter = None
+            # 批量生成需要左侧填充，保证每条序列的新 token 都接在末尾
+            _tokenizer.padding_side = "left"
+            # 历史压缩后仍超长（问题本身很长）时从左侧截断，保留当前问题
+            _tokenizer.truncation_side = "left"
+            dtype = torch.bfloat16 if precision == "bfloat16" else torch.float32
+            model = None
+            # int8 量化会生成新的权重张量，共享文件映射没有意义
+            if SMALL_MODEL_MMAP_WEIGHTS and precision != "int8" and SMALL_MODEL_DEVICE == "cpu":
+                try:
+                    model = _load_mmap_model(dtype)
+                except Exception as e:
+                    print(f"内存映射加载失败，改为常规加载: {e}")
+            mmap_weights = model is not None
+            if model is None:
+                model = AutoModelForCausalLM.from_pretrained(
+                    SMALL_MODEL_PATH,
+                    dtype=dtype,
+                    device_map=SMALL_MODEL_DEVICE,
+                    trust_remote_code=True,
+                    low_cpu_mem_usage=True
+                )
+            if precision == "int8":
+                # 动态量化：Linear 权重存为 int8，激活在推理时按批次量化
+                model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+            model.eval()
+            _model = model
+            _precision = precision
+
+            _load_stats.clear()
+            _load_stats.update({
+                "precision": precision,
+                "load_time": time.time() - start,
+                "rss_mb": rss_mb(),
+                "tokens_per_second": _measure_throughput(),
+                "mmap_weights": mmap_weights,
+            })
+            print(
+                f"本地小模型加载完成：耗时 {_load_stats['load_time']:.1f}s，"
+                f"常驻内存 {_load_stats['rss_mb']:.0f} MB，生成速度 {_load_stats['tokens_per_second']:.1f} tokens/s"
+            )
+
+
+def _resolve_model_dir(path: str):
+    """本地目录直接返回；Hub 模型名返回本地缓存中的快照目录，尚未下载时返回 None"""
+    if os.path.isdir(path):
+        return path
+    try:
+        from huggingface_hub import snapshot_download
+        return snapshot_download(path, local_files_only=True)
+    except Exception:
+        return None
+
+
+def _mmap_safetensors(file_path: str) -> dict:
+    """把 safetensors 文件以写时复制方式映射进内存，返回 {名称: 直接指向映射区域的张量}（不拷贝数据）"""
+    with open(file_path, "rb") as f:
+        header_len = struct.unpack("<Q", f.read(8))[0]
+        header = json.loads(f.read(header_len))
+        # 映射在文件关闭后仍然有效；张量持有对映射的引用
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+    base = 8 + header_len
+    tensors = {}
+    for name, info in header.items():
+        if name == "__metadata__":
+            continue
+        dtype = _SAFETENSORS_DTYPES.get(info["dtype"])
+        if dtype is None:
+            raise ValueError(f"{os.path.basename(file_path)}: 不支持的数据类型 {info['dtype']}（{name}）")
+        start, end = info["data_offsets"]
+        if end == start:
+            tensors[name] = torch.empty(info["shape"], dtype=dtype)
+            continue
+        count = (end - start) // torch.empty((), dtype=dtype).element_size()
+        tensors[name] = torch.frombuffer(buf, dtype=dtype, count=count, offset=base + start).view(info["shape"])
+    return tensors
+
+
+def _load_mmap_model(dtype):
+    """
+    直接在内存映射的 safetensors 上构建模型：权重留在文件映射的页缓存中，
+    同一台机器上加载同一文件的多个推理进程共享这部分物理内存。
+    本地没有 safetensors 权重、模型结构需要远程代码或文件精度与目标精度不一致
+    （转换精度必然产生私有副本）时返回 None，由调用方走常规加载
+    """
+    model_dir = _resolve_model_dir(SMALL_MODEL_PATH)
+    files = sorted(glob.glob(os.path.join(model_dir, "*.safetensors"))) if model_dir else []
+    if not files:
+        return None
+    config = AutoConfig.from_pretrained(model_dir)
+    if type(config) not in AutoModelForCausalLM._model_mapping:
+        return None
+
+    state_dict = {}
+    for file_path in files:
+        state_dict.update(_mmap_safetensors(file_path))
+    file_dtypes = {t.dtype for t in state_dict.values() if t.is_floating_point()}
+    if file_dtypes != {dtype}:
+        print(f"权重文件精度 {sorted(map(str, file_dtypes))} 与 {dtype} 不一致，无法共享内存映射，改为常规加载")
+        return None
+
+    model_class = AutoModelForCausalLM._model_mapping[type(config)]
+    model = model_class.from_pretrained(None, config=config, state_dict=state_dict, dtype=dtype)
+    try:
+        model.generation_config = GenerationConfig.from_pretrained(model_dir)
+    except OSError:
+        pass  # 没有 generation_config.json 时使用默认生成配置
+    return model
+
+
+def _measure_throughput(new_tokens: int = 16) -> float:
+    """用一次短的贪心生成粗测解码速度（tokens/s）"""
+    inputs = _tokenizer(_build_prompt("你好"), return_tensors="pt")
+    inputs = {k: v.to(SMALL_MODEL_DEVICE) for k, v in inputs.items()}
+    start = time.time()
+    with _generate_lock, torch.no_grad():
+        outputs = _model.generate(
+            **inputs, max_new_tokens=new_tokens, min_new_tokens=new_tokens, do_sample=False,
+            pad_token_id=_tokenizer.eos_token_id
+        )
+    generated = outputs.shape[-1] - inputs["input_ids"].shape[-1]
+    return generated / max(time.time() - start, 1e-6)
+
+
+def _get_token_counter() -> TokenizerCounter:
+    """基于当前分词器的 token 计数器"""
+    global _token_counter
+    if _token_counter is None or _token_counter.tokenizer is not _tokenizer:
+        _token_counter = TokenizerCounter(_tokenizer)
+    return _token_counter
+
+
+def _build_prompt(question: str, history: list = None, stats: dict = None) -> str:
+    """
+    构建带上下文记忆的提示词；超出 SMALL_MODEL_PROMPT_BUDGET 时压缩最早的历史，
+    stats 中写入压缩前后的提示词 token 数（prompt_tokens_before / prompt_tokens_after）
+    """
+    messages = [{"role": "system", "content": SYSTEM_PROMPT}]
+
+    # 加入历史对话（最近 N 轮）
+    if history:
+        recent = history[-(MAX_HISTORY_ROUNDS * 2):]  # 每轮2条：user+assistant
+        messages.extend(recent)
 
-def _load_model():
-    """懒加载本地小模型"""
-    global _tokenizer, _model
-    if _tokenizer is None or _model is None:
-        print(f"正在加载本地小模型: {SMALL_MODEL_PATH}")
-        _tokenizer = AutoTokenizer.from_pretrained(SMALL_MODEL_PATH, trust_remote_code=True)
-        _model = AutoModelForCausalLM.from_pretrained(
-            SMALL_MODEL_PATH,
-            dtype=torch.float32,
-            device_map=SMALL_MODEL_DEVICE,
-            trust_remote_code=True,
-            low_cpu_mem_usage=True
+    # 加入当前问题
+    messages.append({"role": "user", "content": question})
+    messages = compact_messages(messages, _get_token_counter(), SMALL_MODEL_PROMPT_BUDGET, stats)
+
+    return _tokenizer.apply_chat_template(
+        messages, tokenize=False, add_generation_prompt=True
+    )
+
+
+def _get_prefix_cache():
+    """返回 (前缀 token, past_key_values)；首次调用或模型/系统提示变化后重新编码（调用方需持有 _generate_lock）"""
+    global _prefix_cache
+    key = (id(_model), id(_tokenizer), SYSTEM_PROMPT)
+    if _prefix_cache is None or _prefix_cache[0] != key:
+        prefix = _tokenizer.apply_chat_template(
+            [{"role": "system", "content": SYSTEM_PROMPT}], tokenize=False
         )
-        print("本地小模型加载完成")
+        prefix_ids = _tokenizer(prefix, return_tensors="pt")["input_ids"].to(SMALL_MODEL_DEVICE)
+        with torch.no_grad():
+            past = _model(input_ids=prefix_ids, use_cache=True).past_key_values
+        _prefix_cache = (key, prefix_ids, past)
+    return _prefix_cache[1], _prefix_cache[2]
+
+
+def _prefix_kwargs(input_ids) -> dict:
+    """
+    单条提示词以系统提示前缀开头时，返回复用前缀 KV 缓存的 generate 参数，
+    这样 prefill 只需计算历史对话和当前问题部分；否则返回空字典（左填充的批次不适用）
+    """
+    if not SMALL_MODEL_PREFIX_CACHE or input_ids.shape[0] != 1:
+        return {}
+    prefix_ids, past = _get_prefix_cache()
+    n = prefix_ids.shape[-1]
+    if input_ids.shape[-1] <= n or not torch.equal(input_ids[0, :n], prefix_ids[0]):
+        return {}
+    # generate 会原地追加缓存，每个请求使用一份拷贝
+    return {"past_key_values": copy.deepcopy(past)}
+
+
+def _postprocess(answer: str) -> str:
+    """清理并截断生成结果"""
+    answer = answer.strip()
 
+    # 如果有代码块，直接保留
+    if "```" in answer:
+        return answer
+
+    # ========== 改进：更严格的截断 —— 最多两句且不超过100字 ==========
+    answer = _truncate_answer(answer, max_sentences=2, max_chars=100)
+
+    return answer if answer else "无法生成回答"
+
+
+def _sampling_warpers(generation_kwargs: dict) -> LogitsProcessorList:
+    """
+    按生成参数（叠加在模型自带的 generation_config 之上）构造与 generate() 相同的采样变换：
+    temperature → top_k → top_p，贪心解码时为空
+    """
+    base = _model.generation_config if _model is not None else GenerationConfig()
+    warpers = LogitsProcessorList()
+    if not generation_kwargs.get("do_sample", base.do_sample):
+        return warpers
+    config = copy.deepcopy(base)
+    config.update(**generation_kwargs)
+    if config.temperature is not None and config.temperature != 1.0:
+        warpers.append(TemperatureLogitsWarper(config.temperature))
+    if config.top_k is not None and config.top_k != 0:
+        warpers.append(TopKLogitsWarper(top_k=config.top_k))
+    if config.top_p is not None and config.top_p < 1.0:
+        warpers.append(TopPLogitsWarper(top_p=config.top_p))
+    return warpers
+
+
+class _ScoreRecorder(LogitsProcessor):
+    """
+    记录每一步用于采样的分布，供 _ConfidenceTracker 读取
 
-def small_model_answer(question: str, history: list = None) -> str:
+    generate() 把自定义 logits_processor 放在重复惩罚等处理器之后、temperature/top_k/top_p 之前，
+    记录器看到的还是未经采样变换的 logits，所以这里自己再做一遍同样的变换，
+    置信度、熵与提前终止阈值都按实际采样的分布计算
+    """
+
+    def __init__(self, warpers: LogitsProcessorList = None):
+        self.warpers = warpers
+        self.scores = None
+
+    def __call__(self, input_ids, scores):
+        self.scores = self.warpers(input_ids, scores) if self.warpers else scores
+        return scores
+
+
+class _ConfidenceTracker(StoppingCriteria):
+    """
+    逐 token 统计采样分布下所选 token 的对数概率与分布熵（按批次中的每条序列分别统计）
+
+    最近 window 个 token 的平均对数概率低于 min_logprob 时停止该序列并记录终止位置，
+    不必生成完整的回答再由 low_confidence 判断。遇到 eos 后的填充 token 不计入。
+    """
+
+    def __init__(self, batch_size: int, eos_token_id: int, enabled: bool = None,
+                 min_logprob: float = None, window: int = None, generation_kwargs: dict = None):
+        self.recorder = _ScoreRecorder(_sampling_warpers({**GENERATION_KWARGS, **(generation_kwargs or {})}))
+        self.eos_token_id = eos_token_id
+        self.enabled = SMALL_MODEL_EARLY_ABORT if enabled is None else enabled
+        self.min_logprob = SMALL_MODEL_MIN_LOGPROB if min_logprob is None else min_logprob
+        self.window = SMALL_MODEL_CONFIDENCE_WINDOW if window is None else window
+        self.logprobs = [[] for _ in range(batch_size)]
+        self.entropies = [[] for _ in range(batch_size)]
+        self.finished = [False] * batch_size
+        self.aborted_at = [None] * batch_size
+        self.first_step = None  # 第一次被调用的时刻（perf_counter），即 prefill 与首个 token 完成时
+
+    def __call__(self, input_ids, scores, **kwargs):
+        if self.first_step is None:
+            self.first_step = time.perf_counter()
+        step_scores = self.recorder.scores
+        if step_scores is not None:
+            logp = torch.log_softmax(step_scores.float(), dim=-1)
+            chosen = input_ids[:, -1]
+            token_logp = logp.gather(1, chosen[:, None]).squeeze(1).tolist()
+            probs = logp.exp()
+            entropy = (-torch.where(probs > 0, probs * logp, torch.zeros_like(logp)).sum(-1)).tolist()
+            for i, token in enumerate(chosen.tolist()):
+                if self.finished[i]:
+                    continue
+                if token == self.eos_token_id:
+                    self.finished[i] = True
+                    continue
+                self.logprobs[i].append(token_logp[i])
+                self.entropies[i].append(entropy[i])
+                recent = self.logprobs[i][-self.window:]
+                if self.enabled and len(recent) >= self.window and sum(recent) / len(recent) < self.min_logprob:
+                    self.finished[i] = True
+                    self.aborted_at[i] = len(self.logprobs[i])
+            self.recorder.scores = None
+        return torch.tensor([at is not None for at in self.aborted_at], dtype=torch.bool, device=input_ids.device)
+
+    def stats(self, i: int) -> dict:
+        """第 i 条序列的置信度统计：logprob_confidence 为 token 概率的几何平均（0~1）"""
+        logprobs = self.logprobs[i]
+        mean_logprob = sum(logprobs) / len(logprobs) if logprobs else 0.0
+        entropies = self.entropies[i]
+        return {
+            "logprob_confidence": round(math.exp(mean_logprob), 4),
+            "mean_logprob": round(mean_logprob, 4),
+            "mean_entropy": round(sum(entropies) / len(entropies), 4) if entropies else 0.0,
+            "generated_tokens": len(logprobs),
+            "aborted": self.aborted_at[i] is not None,
+            "abort_token": self.aborted_at[i],
+        }
+
+
+def _timing_stats(tokenize_time: float, gen_start: float, gen_end: float, tracker: "_ConfidenceTracker") -> dict:
+    """分词、prefill（含首个 token）、decode 耗时与 decode 速度；批量生成时为整批的耗时"""
+    first_step = tracker.first_step or gen_end
+    decode_time = gen_end - first_step
+    decode_tokens = sum(max(len(lp) - 1, 0) for lp in tracker.logprobs)
+    tokens_per_second = decode_tokens / decode_time if decode_time > 0 else 0.0
+    observe_tokens_per_second("small_model", tokens_per_second)
+    return {
+        "tokenize_time": tokenize_time,
+        "prefill_time": first_step - gen_start,
+        "decode_time": decode_time,
+        "tokens_per_second": tokens_per_second,
+    }
+
+
+class _StreamSink:
+    """
+    批处理引擎中的一条流式请求：批量生成的每一步把该序列新解码出的文本放入 chunks 队列，
+    序列结束（eos、置信度过低、调用方置位 stop 或达到长度上限）时放入 None，并记录置信度统计。
+    调用方置位 stop 后该序列在下一步停止生成，同批其他序列不受影响
+    """
+
+    def __init__(self, prompt: str):
+        self.prompt = prompt
+        self.chunks = queue.Queue()
+        self.stop = threading.Event()
+        self.enqueued = time.time()
+        self.text = ""
+        self.batch_stats = {}
+        self.stats = None
+        self.error = None
+        self.closed = False
+
+    def push(self, text: str):
+        """放入截至当前已解码文本中新增的部分（末尾是不完整的多字节字符时等下一步）"""
+        if len(text) > len(self.text) and text.startswith(self.text) and not text.endswith("\ufffd"):
+            self.chunks.put(text[len(self.text):])
+            self.text = text
+
+    def finish(self, stats: dict = None, error: Exception = None):
+        if self.closed:
+            return
+        self.closed = True
+        self.stats = stats or {}
+        self.error = error
+        self.chunks.put(None)
+
+
+class _SinkFeeder(StoppingCriteria):
+    """批量生成的每一步把流式序列新生成的文本交给各自的 _StreamSink；调用方已 stop 的序列停止生成"""
+
+    def __init__(self, sinks: list, tracker: "_ConfidenceTracker", prompt_len: int):
+        self.sinks = sinks
+        self.tracker = tracker
+        self.prompt_len = prompt_len
+
+    def __call__(self, input_ids, scores, **kwargs):
+        done = []
+        for i, sink in enumerate(self.sinks):
+            stop = sink is not None and sink.stop.is_set()
+            if sink is not None and not sink.closed:
+                sink.push(_tokenizer.decode(input_ids[i, self.prompt_len:], skip_special_tokens=True))
+                if stop or self.tracker.finished[i]:
+                    sink.finish(self.tracker.stats(i))
+            done.append(stop)
+        return torch.tensor(done, dtype=torch.bool, device=input_ids.device)
+
+
+def _generate(prompts: list, generation_kwargs: dict = None, sinks: list = None) -> list:
+    """
+    对一批提示词做一次左填充批量生成，返回 [(截断后的回答, 置信度与耗时统计), ...]
+    置信度过低被提前终止的序列，回答为 LOW_CONFIDENCE_ANSWER；generation_kwargs 可覆盖默认生成参数。
+    sinks 与 prompts 等长，流式请求对应位置为 _StreamSink（其余为 None），生成过程中逐步回传文本
+    """
+    tokenize_start = time.perf_counter()
+    inputs = _tokenizer(
+        prompts, return_tensors="pt", padding=True,
+        max_length=SMALL_MODEL_MAX_LENGTH, truncation=True
+    )
+    inputs = {k: v.to(SMALL_MODEL_DEVICE) for k, v in inputs.items()}
+    tokenize_time = time.perf_counter() - tokenize_start
+    tracker = _ConfidenceTracker(len(prompts), _tokenizer.eos_token_id, generation_kwargs=generation_kwargs)
+    criteria = [tracker]
+    if sinks and any(sink is not None for sink in sinks):
+        criteria.append(_SinkFeeder(sinks, tracker, inputs["input_ids"].shape[-1]))
+
+    with _generate_lock, torch.no_grad():
+        gen_start = time.perf_counter()
+        outputs = _model.generate(
+            **inputs,
+            **_prefix_kwargs(inputs["input_ids"]),
+            **{**GENERATION_KWARGS, **(generation_kwargs or {})},
+            logits_processor=LogitsProcessorList([tracker.recorder]),
+            stopping_criteria=StoppingCriteriaList(criteria),
+            eos_token_id=_tokenizer.eos_token_id,
+            pad_token_id=_tokenizer.eos_token_id
+        )
+        gen_end = time.perf_counter()
+    timing = _timing_stats(tokenize_time, gen_start, gen_end, tracker)
+
+    # 左填充后所有序列的提示长度一致，只解码新生成部分
+    prompt_len = inputs["input_ids"].shape[-1]
+    results = []
+    for i, row in enumerate(outputs):
+        gen_stats = {**tracker.stats(i), **timing}
+        if gen_stats["aborted"]:
+            answer = LOW_CONFIDENCE_ANSWER
+        else:
+            answer = _postprocess(_tokenizer.decode(row[prompt_len:], skip_special_tokens=True))
+        results.append((answer, gen_stats))
+        if sinks and sinks[i] is not None:
+            # 达到长度上限的序列在这里结束
+            sinks[i].finish(gen_stats)
+    return results
+
+
+def _process_batch(items: list) -> list:
+    """
+    批处理引擎的处理函数：items 为提示词或流式请求（_StreamSink），合并成一批生成；
+    流式请求的文本与统计经各自的 sink 回传，出错时同样通知到 sink
+    """
+    batch_start = time.time()
+    sinks = [item if isinstance(item, _StreamSink) else None for item in items]
+    for sink in sinks:
+        if sink is not None:
+            sink.batch_stats = {"batch_size": len(items), "queue_wait": batch_start - sink.enqueued}
+    try:
+        return _generate([sink.prompt if sink else item for item, sink in zip(items, sinks)], sinks=sinks)
+    except Exception as e:
+        for sink in sinks:
+            if sink is not None:
+                sink.finish(error=e)
+        raise
+
+
+def _generate_batch(prompts: list, generation_kwargs: dict = None) -> list:
+    """对一批提示词做一次左填充批量生成，返回各自截断后的回答；generation_kwargs 可覆盖默认生成参数"""
+    return [answer for answer, _ in _generate(prompts, generation_kwargs)]
+
+
+def _get_batch_engine():
+    """懒加载动态批处理引擎"""
+    global _batch_engine
+    if _batch_engine is None:
+        _batch_engine = BatchingEngine(
+            _process_batch,
+            max_batch_size=SMALL_MODEL_MAX_BATCH_SIZE,
+            max_wait=SMALL_MODEL_MAX_WAIT_MS / 1000,
+            name="small-model-batching",
+        )
+    return _batch_engine
+
+
+def _get_worker_pool():
+    """懒加载多进程推理池"""
+    global _worker_pool
+    if _worker_pool is None:
+        from worker_pool import WorkerPool
+        _worker_pool = WorkerPool(
+            SMALL_MODEL_WORKERS,
+            threads_per_worker=SMALL_MODEL_WORKER_THREADS,
+            queue_size=SMALL_MODEL_WORKER_QUEUE,
+            max_batch_size=SMALL_MODEL_MAX_BATCH_SIZE,
+            warmup_generations=WARMUP_GENERATIONS,
+            max_restarts=SMALL_MODEL_WORKER_MAX_RESTARTS,
+        )
+    return _worker_pool
+
+
+def small_model_answer(question: str, history: list = None, stats: dict = None) -> str:
     """
     使用本地Qwen2 1.5B模型回答问题
 
@@ -38,72 +578,200 @@ def small_model_answer(question: str, history: list = None) -> str:
         question: 用户当前问题
         history: 对话历史列表，每个元素是 {"role": "user"/"assistant", "content": "..."}
                  传入 None 则无上下文（兼容旧调用方式）
+        stats: 可选字典，传入时写入推理统计（latency、batch_size、queue_wait 等）、
+               置信度统计（logprob_confidence、mean_logprob、aborted、abort_token 等）
+               以及分阶段耗时（tokenize_time、prefill_time、decode_time、tokens_per_second）
     """
     try:
+        if SMALL_MODEL_WORKERS > 0:
+            # 多进程模式：交给推理进程池，队列已满时立即失败，由路由降级到大模型
+            answer, gen_stats = _get_worker_pool().submit(question, history, timeout=SMALL_MODEL_WORKER_TIMEOUT)
+            observe_tokens_per_second("small_model", gen_stats.get("tokens_per_second", 0))
+            if stats is not None:
+                stats.update(gen_stats)
+            return answer
+
         _load_model()
+        prompt = _build_prompt(question, history, stats=stats)
 
-        # ========== 改进：构建带上下文记忆的提示词 ==========
-        messages = [
-            {
-                "role": "system",
-                "content": (
-                    "你是校园问答助手。请用一两句话简短回答，不超过100字。"
-                    "直接给出答案，不要重复问题，不要说多余的话。"
-                    "每次只回答用户当前的问题，不要续写或补充之前的回答。"
-                ),
-            },
-        ]
-
-        # 加入历史对话（最近 N 轮）
-        if history:
-            recent = history[-(MAX_HISTORY_ROUNDS * 2):]  # 每轮2条：user+assistant
-            messages.extend(recent)
-
-        # 加入当前问题
-        messages.append({"role": "user", "content": question})
-
-        prompt = _tokenizer.apply_chat_template(
-            messages, tokenize=False, add_generation_prompt=True
-        )
+        # 并发请求经批处理引擎合并成一批生成；关闭时直接单条生成
+        if SMALL_MODEL_BATCHING:
+            (answer, gen_stats), batch_stats = _get_batch_engine().submit(prompt)
+        else:
+            start = time.time()
+            answer, gen_stats = _generate([prompt])[0]
+            batch_stats = {"batch_size": 1, "latency": time.time() - start}
 
-        # 编码输入
-        inputs = _tokenizer(
-            prompt, return_tensors="pt",
-            max_length=SMALL_MODEL_MAX_LENGTH, truncation=True
-        )
-        inputs = {k: v.to(SMALL_MODEL_DEVICE) for k, v in inputs.items()}
+        if stats is not None:
+            stats.update(batch_stats)
+            stats.update(gen_stats)
+        return answer
 
-        # ========== 改进：更短的生成参数 ==========
-        with torch.no_grad():
-            outputs = _model.generate(
-                **inputs,
-                max_new_tokens=80,  # 从128减少到80，更严格控制长度
-                temperature=0.3,
-                do_sample=True,
-                top_p=0.8,
-                repetition_penalty=1.2,  # 略微提高重复惩罚
-                no_repeat_ngram_size=3,
-                eos_token_id=_tokenizer.eos_token_id,
-                pad_token_id=_tokenizer.eos_token_id
-            )
+    except Exception as e:
+        print(f"小模型推理错误: {e}")
+        if stats is not None:
+            stats["error"] = str(e)
+        time.sleep(0.1)
+        return "[小模型] 暂时繁忙，请稍后再试"
 
-        # 只解码新生成部分
-        gen_ids = outputs[0][inputs["input_ids"].shape[-1]:]
-        answer = _tokenizer.decode(gen_ids, skip_special_tokens=True).strip()
 
-        # 如果有代码块，直接保留
-        if "```" in answer:
-            return answer
+class _StopOnEvent(StoppingCriteria):
+    """外部设置事件后停止生成（流式输出已满足截断条件时提前结束）"""
+
+    def __init__(self, event: threading.Event):
+        self.event = event
+
+    def __call__(self, input_ids, scores, **kwargs):
+        return torch.full((input_ids.shape[0],), self.event.is_set(), dtype=torch.bool, device=input_ids.device)
+
+
+def _enough_text(text: str, max_sentences: int = 2, max_chars: int = 100) -> bool:
+    """流式输出是否已经达到截断上限（代码块不截断）"""
+    if "```" in text:
+        return False
+    if len(text.strip()) >= max_chars:
+        return True
+    return sum(text.count(sep) for sep in "。！？.!?") >= max_sentences
+
+
+def _stream_single(prompt: str, start: float, stats: dict):
+    """不经批处理引擎，单独生成一条流式回答（SMALL_MODEL_BATCHING 关闭时）；返回值同 small_model_answer_stream"""
+    tokenize_start = time.perf_counter()
+    inputs = _tokenizer(
+        prompt, return_tensors="pt",
+        max_length=SMALL_MODEL_MAX_LENGTH, truncation=True
+    )
+    inputs = {k: v.to(SMALL_MODEL_DEVICE) for k, v in inputs.items()}
+    tokenize_time = time.perf_counter() - tokenize_start
+
+    streamer = TextIteratorStreamer(
+        _tokenizer, skip_prompt=True, skip_special_tokens=True, timeout=STREAM_TOKEN_TIMEOUT
+    )
+    stop_event = threading.Event()
+    tracker = _ConfidenceTracker(1, _tokenizer.eos_token_id)
+    errors = []
+    gen_times = []
+
+    def _run():
+        try:
+            with _generate_lock, torch.no_grad():
+                gen_times.append(time.perf_counter())
+                _model.generate(
+                    **inputs,
+                    **_prefix_kwargs(inputs["input_ids"]),
+                    **GENERATION_KWARGS,
+                    streamer=streamer,
+                    logits_processor=LogitsProcessorList([tracker.recorder]),
+                    stopping_criteria=StoppingCriteriaList([_StopOnEvent(stop_event), tracker]),
+                    eos_token_id=_tokenizer.eos_token_id,
+                    pad_token_id=_tokenizer.eos_token_id
+                )
+                gen_times.append(time.perf_counter())
+        except Exception as e:
+            errors.append(e)
+            streamer.end()
+
+    thread = threading.Thread(target=_run, name="small-model-stream", daemon=True)
+    thread.start()
+
+    text = ""
+    try:
+        for chunk in streamer:
+            if not chunk:
+                continue
+            if not text and stats is not None:
+                stats["ttft"] = time.time() - start
+            text += chunk
+            yield chunk
+            if _enough_text(text):
+                break
+    finally:
+        # 提前结束或调用方中途放弃迭代时，通知后台线程停止生成
+        stop_event.set()
+    thread.join()
+
+    if errors:
+        raise errors[0]
+    confidence = tracker.stats(0)
+    timing = _timing_stats(tokenize_time, gen_times[0], gen_times[1], tracker)
+    if stats is not None:
+        stats.update(confidence)
+        stats.update(timing)
+    return LOW_CONFIDENCE_ANSWER if confidence["aborted"] else _postprocess(text)
 
-        # ========== 改进：更严格的截断 —— 最多两句且不超过100字 ==========
-        answer = _truncate_answer(answer, max_sentences=2, max_chars=100)
 
-        return answer if answer else "无法生成回答"
+def _stream_batched(prompt: str, start: float, stats: dict):
+    """
+    流式请求与并发的其他请求（流式或非流式）一起进入批处理引擎，批量生成的每一步回传本序列新解码的文本；
+    输出已够长或调用方放弃迭代时只停止本序列。返回值同 small_model_answer_stream
+    """
+    sink = _StreamSink(prompt)
+    _get_batch_engine().enqueue(sink)
+    text = ""
+    ended = False
+    try:
+        while True:
+            chunk = sink.chunks.get(timeout=STREAM_TOKEN_TIMEOUT)
+            if chunk is None:
+                ended = True
+                break
+            if not text and stats is not None:
+                stats["ttft"] = time.time() - start
+            text += chunk
+            yield chunk
+            if _enough_text(text):
+                break
+    finally:
+        sink.stop.set()
+    # 停止后该序列在下一步结束，等它的置信度统计
+    while not ended:
+        ended = sink.chunks.get(timeout=STREAM_TOKEN_TIMEOUT) is None
+
+    if sink.error is not None:
+        raise sink.error
+    if stats is not None:
+        stats.update(sink.batch_stats)
+        stats.update(sink.stats)
+    return LOW_CONFIDENCE_ANSWER if sink.stats.get("aborted") else _postprocess(text)
+
+
+def small_model_answer_stream(question: str, history: list = None, stats: dict = None):
+    """
+    流式版本的 small_model_answer：边解码边产出文本增量
+
+    开启动态批处理（SMALL_MODEL_BATCHING）时与并发的其他请求合并进同一批生成，逐步取回本序列的文本，
+    多个会话同时提问不会互相排队；关闭时在后台线程中单独生成，通过 TextIteratorStreamer 逐段取回文本。
+    输出达到两句或100字后立即停止生成，置信度过低时提前终止。生成器的返回值（StopIteration.value，
+    可用 `answer = yield from ...` 获取）是与 small_model_answer 一致的截断后答案。
+    stats 中写入 ttft（首个文本片段耗时）、latency、置信度统计，以及分阶段耗时或批次信息（batch_size、queue_wait）。
+    """
+    start = time.time()
+    if SMALL_MODEL_WORKERS > 0:
+        # 推理进程不回传逐 token 的文本，整段答案生成后一次产出
+        answer = small_model_answer(question, history=history, stats=stats)
+        if not answer.startswith("[小模型]"):
+            if stats is not None:
+                stats["ttft"] = time.time() - start
+            yield answer
+        return answer
+
+    try:
+        _load_model()
+        prompt = _build_prompt(question, history, stats=stats)
+        # 开启动态批处理时与其他会话的请求合并生成，否则单独生成
+        stream = _stream_batched if SMALL_MODEL_BATCHING else _stream_single
+        answer = yield from stream(prompt, start, stats)
 
     except Exception as e:
         print(f"小模型推理错误: {e}")
+        if stats is not None:
+            stats["error"] = str(e)
         time.sleep(0.1)
-        return "[小模型] 暂时繁忙，请稍后再试"
+        answer = "[小模型] 暂时繁忙，请稍后再试"
+
+    if stats is not None:
+        stats["latency"] = time.time() - start
+    return answer
 
 
 def _truncate_answer(text: str, max_sentences: int = 2, max_chars: int = 100) -> str:
@@ -136,6 +804,11 @@ def _truncate_answer(text: str, max_sentences: int = 2, max_chars: int = 100) ->
 
 def low_confidence(answer: str) -> bool:
     """判断小模型回答是否置信度低"""
+    with span("low_confidence"):
+        return _low_confidence(answer)
+
+
+def _low_confidence(answer: str) -> bool:
     keywords = [
         "不确定", "不太确定", "不知道", "抱歉", "对不起",
         "不具备", "不能", "无法提供", "建议咨询", "我不是", "不能回答"
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+测试答案缓存（内存LRU + SQLite持久层）
+"""
+import os
+import sys
+import shutil
+import tempfile
+import time
+
+# 获取测试脚本所在目录
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, SCRIPT_DIR)
+
+from answer_cache import AnswerCache, make_cache_key, normalize_question
+
+
+def test_key_normalization():
+    """归一化问题 + 历史窗口决定缓存键"""
+    print("\n测试缓存键归一化...")
+    assert normalize_question("  图书馆  几点开门？ ") == "图书馆 几点开门"
+    assert make_cache_key("WiFi密码？") == make_cache_key("wifi密码")
+
+    history = [{"role": "user", "content": "你好"}, {"role": "assistant", "content": "你好！"}]
+    assert make_cache_key("选课时间", history) != make_cache_key("选课时间"), \
+        "不同对话历史应得到不同缓存键"
+    long_history = [{"role": "user", "content": "更早的问题"}] + history
+    assert make_cache_key("选课时间", long_history, history_window=2) == \
+        make_cache_key("选课时间", history, history_window=2), "窗口之外的历史不影响缓存键"
+    print("  ✓ 缓存键归一化正确")
+
+
+def test_lru_ttl_and_faq_version():
+    """LRU 淘汰、TTL 过期、FAQ 版本失效、跨实例持久化"""
+    print("\n测试LRU/TTL/FAQ版本失效...")
+    temp_dir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(temp_dir, "cache.db")
+        cache = AnswerCache(path, max_entries=2, ttl=60)
+        cache.put("a", "答案A", "small_model", faq_version=1)
+        cache.put("b", "答案B", "big_model", faq_version=1)
+        cache.put("c", "答案C", "big_model", faq_version=1)
+        assert "a" not in cache._memory, "超出容量时应淘汰最久未使用的条目"
+        assert cache.get("a", faq_version=1) == ("答案A", "small_model"), "内存淘汰后应从磁盘层读回"
+
+        assert cache.get("b", faq_version=2) is None, "FAQ版本变化后缓存应失效"
+
+        # 新实例（模拟进程重启/其他工作进程）读取磁盘层
+        other = AnswerCache(path, max_entries=2, ttl=60)
+        assert other.get("c", faq_version=1) == ("答案C", "big_model"), "磁盘层应跨实例共享"
+
+        expired = AnswerCache(path, max_entries=2, ttl=0.01)
+        expired.put("d", "答案D", "small_model", faq_version=1)
+        time.sleep(0.05)
+        assert expired.get("d", faq_version=1) is None, "超过TTL应失效"
+        print("  ✓ LRU/TTL/FAQ版本失效正确")
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+def test_route_question_cache_hit():
+    """相同问题第二次走缓存路由"""
+    print("\n测试route_question缓存命中...")
+    try:
+        import router
+    except Exception as e:
+        print(f"  跳过: router模块未加载: {e}")
+        return
+
+    temp_dir = tempfile.mkdtemp()
+    saved = (router._answer_cache, router.small_model_answer, router.log_event, router.SEMANTIC_FAQ_ENABLED)
+    calls = []
+    try:
+        router._answer_cache = AnswerCache(os.path.join(temp_dir, "cache.db"))
+        router.small_model_answer = lambda q, history=None, stats=None: calls.append(q) or "这是小模型给出的回答。"
+        router.log_event = lambda *args: None
+        router.SEMANTIC_FAQ_ENABLED = False
+
+        question = "宿舍可以养猫吗"  # FAQ未命中，走小模型
+        answer1, meta1 = router.route_question(question)
+        answer2, meta2 = router.route_question(question + "？")
+        assert meta1["route"] == "small_model", f"首次应走小模型，实际: {meta1['route']}"
+        assert meta2["route"] == "cache" and meta2["cached_route"] == "small_model"
+        assert answer1 == answer2 and len(calls) == 1, "缓存命中不应再调用模型"
+        print("  ✓ 第二次请求命中缓存")
+    finally:
+        (router._answer_cache, router.small_model_answer,
+         router.log_event, router.SEMANTIC_FAQ_ENABLED) = saved
+        shutil.rmtree(temp_dir)
+
+
+def main():
+    """运行所有测试"""
+    print("=" * 60)
+    print("测试答案缓存")
+    print("=" * 60)
+
+    tests = [
+        test_key_normalization,
+        test_lru_ttl_and_faq_version,
+        test_route_question_cache_hit,
+    ]
+
+    failed = 0
+    for test in tests:
+        try:
+            test()
+        except AssertionError as e:
+            print(f"  ✗ 测试失败: {e}")
+            failed += 1
+
+    print("\n" + "=" * 60)
+    if failed == 0:
+        print("✓ 所有测试通过!")
+    else:
+        print(f"✗ {failed} 个测试失败")
+        sys.exit(1)
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    main()
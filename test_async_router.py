@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""
+测试异步路由 route_question_async（用假的模型函数，不加载真实模型、不调用API）
+"""
+import os
+import sys
+import asyncio
+import threading
+import time
+
+# 获取测试脚本所在目录
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, SCRIPT_DIR)
+
+try:
+    import router
+except Exception as e:
+    router = None
+    print(f"  注意: router导入失败: {e}")
+
+
+def _with_stubs(small_answer="这是小模型给出的回答。"):
+    """替换模型与日志函数，返回 (调用记录, 恢复函数)"""
+    calls = {"small_threads": [], "big": 0}
+    saved = (router.small_model_answer, router.big_model_answer_async, router.log_event,
+             router.SEMANTIC_FAQ_ENABLED, router.ANSWER_CACHE_ENABLED)
+
+    def small(question, history=None, stats=None):
+        calls["small_threads"].append(threading.current_thread().name)
+        return small_answer
+
+    async def big(question, history=None):
+        calls["big"] += 1
+        await asyncio.sleep(0.2)  # 模拟网络往返
+        return "大模型的详细回答。", {"total_tokens": 10}
+
+    router.small_model_answer = small
+    router.big_model_answer_async = big
+    router.log_event = lambda *args: None
+    router.SEMANTIC_FAQ_ENABLED = False
+    router.ANSWER_CACHE_ENABLED = False
+
+    def restore():
+        (router.small_model_answer, router.big_model_answer_async, router.log_event,
+         router.SEMANTIC_FAQ_ENABLED, router.ANSWER_CACHE_ENABLED) = saved
+    return calls, restore
+
+
+def test_async_contract_and_executor():
+    """返回 (answer, meta)；小模型在专用推理线程池中执行"""
+    print("\n测试异步路由返回值与推理线程池...")
+    if router is None:
+        print("  跳过: router模块未加载")
+        return
+    calls, restore = _with_stubs()
+    try:
+        answer, meta = asyncio.run(router.route_question_async("宿舍可以养猫吗"))
+        assert answer == "这是小模型给出的回答。" and meta["route"] == "small_model"
+        assert calls["small_threads"][0].startswith("inference"), \
+            f"小模型应在推理线程池执行，实际: {calls['small_threads']}"
+
+        answer, meta = asyncio.run(router.route_question_async("图书馆几点开门？"))
+        assert meta["route"] == "faq"
+
+        answer, meta = asyncio.run(router.route_question_async(""))
+        assert meta["route"] == "invalid"
+        print("  ✓ 返回值与同步版本一致")
+    finally:
+        restore()
+
+
+def test_concurrent_big_model_calls_overlap():
+    """多个大模型请求并发等待网络，总耗时接近单次耗时"""
+    print("\n测试并发大模型请求...")
+    if router is None:
+        print("  跳过: router模块未加载")
+        return
+    calls, restore = _with_stubs()
+    question = "为什么要对比分析这两种设计方案的区别和原因？"
+    try:
+        async def run_all():
+            return await asyncio.gather(*[router.route_question_async(question) for _ in range(10)])
+
+        start = time.time()
+        results = asyncio.run(run_all())
+        elapsed = time.time() - start
+        assert all(meta["route"] == "big_model" for _, meta in results)
+        assert calls["big"] == 10
+        assert elapsed < 1.0, f"10 个并发请求耗时 {elapsed:.2f}s，未能并发等待"
+        print(f"  ✓ 10 个并发请求共耗时 {elapsed:.2f}s")
+    finally:
+        restore()
+
+
+def test_cache_and_confidence_off_event_loop():
+    """答案缓存读写与置信度检查在推理线程池中执行，不在事件循环线程上做磁盘 I/O"""
+    print("\n测试缓存与置信度检查的执行线程...")
+    if router is None:
+        print("  跳过: router模块未加载")
+        return
+    calls, restore = _with_stubs()
+    threads = {"get": [], "put": [], "low_confidence": []}
+
+    class FakeCache:
+        def __init__(self):
+            self.entries = {}
+
+        def get(self, key, faq_version=None):
+            threads["get"].append(threading.current_thread().name)
+            return self.entries.get(key)
+
+        def put(self, key, answer, route, faq_version=None):
+            threads["put"].append(threading.current_thread().name)
+            self.entries[key] = (answer, route)
+
+    def low_confidence(answer):
+        threads["low_confidence"].append(threading.current_thread().name)
+        return saved_low_confidence(answer)
+
+    saved = (router._answer_cache, router.low_confidence, router.SINGLE_FLIGHT_ENABLED)
+    saved_low_confidence = router.low_confidence
+    router._answer_cache = FakeCache()
+    router.low_confidence = low_confidence
+    router.ANSWER_CACHE_ENABLED = True
+    router.SINGLE_FLIGHT_ENABLED = False
+    try:
+        answer, meta = asyncio.run(router.route_question_async("宿舍可以养猫吗"))
+        assert meta["route"] == "small_model"
+        answer, meta = asyncio.run(router.route_question_async("宿舍可以养猫吗"))
+        assert meta["route"] == "cache"
+        for name, names in threads.items():
+            assert names and all(n.startswith("inference") for n in names), f"{name} 应在推理线程池执行: {names}"
+        print("  ✓ 缓存读写与置信度检查不占用事件循环")
+    finally:
+        router._answer_cache, router.low_confidence, router.SINGLE_FLIGHT_ENABLED = saved
+        restore()
+
+
+def main():
+    """运行所有测试"""
+    print("=" * 60)
+    print("测试异步路由")
+    print("=" * 60)
+
+    tests = [
+        test_async_contract_and_executor,
+        test_concurrent_big_model_calls_overlap,
+        test_cache_and_confidence_off_event_loop,
+    ]
+
+    failed = 0
+    for test in tests:
+        try:
+            test()
+        except AssertionError as e:
+            print(f"  ✗ 测试失败: {e}")
+            failed += 1
+
+    print("\n" + "=" * 60)
+    if failed == 0:
+        print("✓ 所有测试通过!")
+    else:
+        print(f"✗ {failed} 个测试失败")
+        sys.exit(1)
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    main()
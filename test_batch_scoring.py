@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+测试批量复杂度评分与离线路由模拟（不加载模型、不调用API）
+"""
+import os
+import random
+import sys
+
+# 获取测试脚本所在目录
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, SCRIPT_DIR)
+
+import utils
+from utils import COMPLEX_KEYWORDS, complexity_score, complexity_scores, iter_complexity_scores
+
+QUESTIONS = [
+    "",
+    "   ",
+    "图书馆几点开门？",
+    "宿舍可以养猫吗",
+    " 食堂在哪里？ ",
+    "如何设计一份有竞争力的简历？请对比技术岗和产品岗的简历区别。",
+    "帮我分析一下本科毕业论文从开题到答辩的全流程，以及各阶段需要注意什么？",
+    "分析分析;；，，？？为什么为什么",
+    "a" * 10, "a" * 11, "a" * 20, "a" * 21, "a" * 30, "a" * 31,
+]
+
+
+def _random_questions(count: int, seed: int = 0) -> list:
+    """由关键词、计分标点和普通字符随机拼成的问题，覆盖各长度档位与重复命中"""
+    rng = random.Random(seed)
+    pieces = COMPLEX_KEYWORDS + ["？", "，", ";", "；", "。", " ", "图书馆", "宿舍", "a", "1", "\n"]
+    return ["".join(rng.choice(pieces) for _ in range(rng.randint(0, 15))) for _ in range(count)]
+
+
+def test_batch_matches_single():
+    """批量评分与逐条 complexity_score 完全一致（含空问题、分块边界）"""
+    print("\n测试批量评分一致性...")
+    questions = QUESTIONS + _random_questions(3000)
+    expected = [complexity_score(q) for q in questions]
+    assert complexity_scores(questions).tolist() == expected
+
+    saved = utils.SCORE_CHUNK_SIZE
+    try:
+        utils.SCORE_CHUNK_SIZE = 7
+        assert complexity_scores(questions).tolist() == expected, "分块后结果应一致"
+    finally:
+        utils.SCORE_CHUNK_SIZE = saved
+
+    assert list(iter_complexity_scores(iter(questions), chunk_size=100)) == expected
+    assert complexity_scores([]).tolist() == [] and list(iter_complexity_scores([])) == []
+    print(f"  ✓ {len(questions)} 条问题结果一致")
+
+
+def test_keyword_overlap():
+    """关键词相互重叠或包含时，每个关键词仍按 in 判断各计 1 分"""
+    print("\n测试重叠关键词...")
+    saved = list(COMPLEX_KEYWORDS)
+    try:
+        COMPLEX_KEYWORDS.extend(["比较", "分析方法"])
+        questions = ["请对比较两种分析方法", "对比较", "分析方法", "比较"]
+        assert complexity_scores(questions).tolist() == [complexity_score(q) for q in questions]
+    finally:
+        COMPLEX_KEYWORDS[:] = saved
+    assert complexity_scores(["请对比较两种分析方法"]).tolist() == [complexity_score("请对比较两种分析方法")]
+    print("  ✓ 重叠关键词与修改后的关键词表")
+
+
+def test_plan_routes():
+    """离线路由模拟与 route_question 的实际路由一致；阈值可调"""
+    print("\n测试离线路由模拟...")
+    import router
+
+    saved = {name: getattr(router, name) for name in (
+        "small_model_answer", "big_model_answer", "low_confidence", "log_event",
+        "SEMANTIC_FAQ_ENABLED", "ANSWER_CACHE_ENABLED", "HEDGE_ENABLED", "WARMUP_GATE", "SINGLE_FLIGHT_ENABLED",
+    )}
+    try:
+        router.small_model_answer = lambda q, history=None, stats=None: "小模型的回答。"
+        router.big_model_answer = lambda q, history=None: ("大模型的回答。", {"total_tokens": 10})
+        router.low_confidence = lambda answer: False
+        router.log_event = lambda *args: None
+        router.SEMANTIC_FAQ_ENABLED = False
+        router.ANSWER_CACHE_ENABLED = False
+        router.HEDGE_ENABLED = False
+        router.WARMUP_GATE = False
+        router.SINGLE_FLIGHT_ENABLED = False
+
+        plans = router.plan_routes(QUESTIONS)
+        for question, plan in zip(QUESTIONS, plans):
+            _, meta = router.route_question(question)
+            assert plan["route"] == meta["route"], (question, plan, meta)
+            assert plan["score"] == meta["score"]
+
+        by_question = dict(zip(QUESTIONS, plans))
+        assert by_question["图书馆几点开门？"]["faq_hit"] and by_question["图书馆几点开门？"]["bucket"] == "low"
+        assert by_question[""]["route"] == "invalid"
+
+        # 提高低复杂度阈值：原来交给大模型的问题改走 FAQ 或小模型
+        relaxed = router.plan_routes(QUESTIONS, low_max=10, mid_max=10)
+        assert all(p["route"] in ("faq", "small_model", "invalid") for p in relaxed)
+        assert [p["faq_hit"] for p in relaxed] == [p["faq_hit"] for p in plans], "FAQ 命中与阈值无关"
+    finally:
+        for name, value in saved.items():
+            setattr(router, name, value)
+    print(f"  ✓ {len(QUESTIONS)} 条问题与实际路由一致")
+
+
+def main():
+    """运行所有测试"""
+    print("=" * 60)
+    print("测试批量评分与离线路由模拟")
+    print("=" * 60)
+
+    tests = [
+        test_batch_matches_single,
+        test_keyword_overlap,
+        test_plan_routes,
+    ]
+
+    failed = 0
+    for test in tests:
+        try:
+            test()
+        except AssertionError as e:
+            print(f"  ✗ 测试失败: {e}")
+            failed += 1
+
+    print("\n" + "=" * 60)
+    if failed == 0:
+        print("✓ 所有测试通过!")
+    else:
+        print(f"✗ {failed} 个测试失败")
+        sys.exit(1)
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+测试动态批处理引擎
+"""
+import os
+import sys
+import threading
+import time
+
+# 获取测试脚本所在目录
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, SCRIPT_DIR)
+
+from batching import BatchingEngine
+
+
+def test_concurrent_requests_are_batched():
+    """并发请求被合并成批，且每个调用方拿到自己的结果"""
+    print("\n测试并发请求合并...")
+    batches = []
+
+    def process(items):
+        batches.append(list(items))
+        time.sleep(0.05)  # 模拟一次批量生成
+        return [item.upper() for item in items]
+
+    engine = BatchingEngine(process, max_batch_size=4, max_wait=0.05)
+    results = {}
+
+    def worker(i):
+        results[i] = engine.submit(f"q{i}")
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(6)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    for i in range(6):
+        answer, stats = results[i]
+        assert answer == f"Q{i}", f"结果错配: {i} -> {answer}"
+        assert stats["batch_size"] >= 1 and stats["latency"] >= stats["batch_time"]
+    assert max(len(b) for b in batches) <= 4, "单批不应超过 max_batch_size"
+    assert len(batches) < 6, f"并发请求应被合并，实际批次: {batches}"
+    print(f"  ✓ 6 个请求合并为 {len(batches)} 批")
+
+
+def test_batch_error_reaches_every_caller():
+    """批处理出错时，同批的每个调用方都收到异常"""
+    print("\n测试批处理异常传递...")
+
+    def process(items):
+        raise RuntimeError("推理失败")
+
+    engine = BatchingEngine(process, max_batch_size=2, max_wait=0.01)
+    try:
+        engine.submit("q")
+    except RuntimeError as e:
+        assert "推理失败" in str(e)
+    else:
+        assert False, "应抛出批处理异常"
+
+    # 出错后引擎仍可继续服务
+    engine.process_batch = lambda items: items
+    assert engine.submit("ok")[0] == "ok"
+    print("  ✓ 异常正确传递，引擎继续可用")
+
+
+def _tiny_small_model():
+    """随机初始化的极小 Qwen2 模型 + 按字切分的分词器，用来驱动真实的批量生成（不加载真实权重）"""
+    import torch
+    from tokenizers import Tokenizer, Regex, decoders, models, pre_tokenizers
+    from transformers import PreTrainedTokenizerFast, Qwen2Config, Qwen2ForCausalLM
+
+    chars = list("图书馆食堂几点开门关吗在哪里怎么走。，？abc ")
+    vocab = {"<eos>": 0, "<unk>": 1, **{c: i + 2 for i, c in enumerate(chars)}}
+    backend = Tokenizer(models.WordLevel(vocab, unk_token="<unk>"))
+    backend.pre_tokenizer = pre_tokenizers.Split(Regex("."), behavior="isolated")
+    backend.decoder = decoders.Fuse()
+    tokenizer = PreTrainedTokenizerFast(tokenizer_object=backend, eos_token="<eos>", pad_token="<eos>", unk_token="<unk>")
+    tokenizer.padding_side = "left"
+    torch.manual_seed(0)
+    model = Qwen2ForCausalLM(Qwen2Config(
+        vocab_size=len(vocab), hidden_size=32, intermediate_size=64, num_hidden_layers=2,
+        num_attention_heads=4, num_key_value_heads=2, max_position_embeddings=512,
+    ))
+    model.eval()
+    return tokenizer, model
+
+
+def test_streams_share_batches():
+    """并发的流式请求进入同一个批处理引擎合并生成，各自逐步收到文本，提前放弃的序列不影响同批其他序列"""
+    print("\n测试流式请求合并成批...")
+    try:
+        import small_model
+        tokenizer, model = _tiny_small_model()
+    except Exception as e:
+        print(f"  跳过: 无法构造测试模型: {e}")
+        return
+
+    names = ("_tokenizer", "_model", "_batch_engine", "SMALL_MODEL_PREFIX_CACHE", "SMALL_MODEL_EARLY_ABORT",
+             "SMALL_MODEL_MAX_WAIT_MS")
+    saved = {name: getattr(small_model, name) for name in names}
+    small_model._tokenizer, small_model._model = tokenizer, model
+    small_model._batch_engine = None
+    small_model.SMALL_MODEL_PREFIX_CACHE = False
+    small_model.SMALL_MODEL_EARLY_ABORT = False  # 随机权重的置信度很低，只测流式与合批
+    small_model.SMALL_MODEL_MAX_WAIT_MS = 200
+    results = {}
+
+    def consume(i, give_up_after=None):
+        stats = {}
+        stream = small_model._stream_batched("图书馆几点开门？" * (i + 1), time.time(), stats)
+        parts = []
+        try:
+            while True:
+                parts.append(next(stream))
+                if give_up_after and len(parts) >= give_up_after:
+                    stream.close()
+                    break
+        except StopIteration as stop:
+            results[i] = (parts, stop.value, stats)
+            return
+        results[i] = (parts, None, stats)
+
+    try:
+        threads = [threading.Thread(target=consume, args=(i,)) for i in range(3)]
+        threads.append(threading.Thread(target=consume, args=(3, 2)))
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join(60)
+
+        assert len(results) == 4, f"所有流式请求都应结束: {sorted(results)}"
+        for i in range(3):
+            parts, answer, stats = results[i]
+            assert parts and answer == small_model._postprocess("".join(parts)), (parts, answer)
+            assert "ttft" in stats and "generated_tokens" in stats
+        assert max(results[i][2]["batch_size"] for i in range(3)) > 1, "并发的流式请求应合并成批"
+        assert len(results[3][0]) == 2 and results[3][1] is None
+
+        # 非流式请求照常使用同一个引擎（排在上一批之后，返回时上一批已全部结束）
+        (answer, _), batch_stats = small_model._get_batch_engine().submit("食堂在哪里")
+        assert answer and batch_stats["batch_size"] == 1
+        print(f"  ✓ 4 个流式请求合并生成（批大小 {max(results[i][2]['batch_size'] for i in range(3))}）")
+    finally:
+        for name, value in saved.items():
+            setattr(small_model, name, value)
+
+
+def main():
+    """运行所有测试"""
+    print("=" * 60)
+    print("测试动态批处理引擎")
+    print("=" * 60)
+
+    tests = [
+        test_concurrent_requests_are_batched,
+        test_batch_error_reaches_every_caller,
+        test_streams_share_batches,
+    ]
+
+    failed = 0
+    for test in tests:
+        try:
+            test()
+        except AssertionError as e:
+            print(f"  ✗ 测试失败: {e}")
+            failed += 1
+
+    print("\n" + "=" * 60)
+    if failed == 0:
+        print("✓ 所有测试通过!")
+    else:
+        print(f"✗ {failed} 个测试失败")
+        sys.exit(1)
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,378 @@
+#!/usr/bin/env python3
+"""
+测试大模型客户端的连接池、限流、重试与熔断（本地假 HTTP 服务，不调用真实API）
+"""
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 获取测试脚本所在目录
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, SCRIPT_DIR)
+
+import metrics
+from answer_cache import AnswerCache
+from api_client import CircuitBreaker, CircuitOpenError, RateLimitTimeout, ResilientCaller, TokenBucket
+
+try:
+    import openai  # noqa: F401
+    import big_model
+except Exception as e:
+    big_model = None
+    print(f"  注意: openai导入失败: {e}")
+
+
+class FakeServer:
+    """
+    OpenAI 兼容的假服务：POST /v1/chat/completions 按脚本依次返回状态码，
+    脚本用完后一直返回 200；stream 请求以 SSE 返回，cut_stream 为 True 时发出首个增量后断开连接
+    """
+
+    def __init__(self):
+        self.script = []
+        self.cut_stream = False
+        self.requests = 0
+        self.connections = set()
+        self._lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                with server._lock:
+                    server.requests += 1
+                    server.connections.add(self.client_address)
+                    status = server.script.pop(0) if server.script else 200
+                if status != 200:
+                    self._send(status, {"error": {"message": "fake error", "type": "server_error"}},
+                               {"Retry-After": "0"} if status == 429 else {})
+                elif body.get("stream"):
+                    self._stream()
+                else:
+                    self._send(200, {
+                        "id": "x", "object": "chat.completion", "created": 0, "model": "fake",
+                        "choices": [{"index": 0, "finish_reason": "stop",
+                                     "message": {"role": "assistant", "content": "假服务的回答。"}}],
+                        "usage": {"prompt_tokens": 5, "completion_tokens": 7, "total_tokens": 12},
+                    })
+
+            def _send(self, status, payload, headers=None):
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _stream(self):
+                chunks = [{"choices": [{"index": 0, "delta": {"content": text}}]} for text in ("假服务", "流式回答。")]
+                chunks.append({"choices": [], "usage": {"prompt_tokens": 5, "completion_tokens": 4, "total_tokens": 9}})
+                data = "".join(
+                    "data: " + json.dumps({"id": "x", "object": "chat.completion.chunk", "created": 0,
+                                           "model": "fake", **c}) + "\n\n"
+                    for c in chunks
+                ) + "data: [DONE]\n\n"
+                data = data.encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                if server.cut_stream:
+                    # 只发出第一个增量就关闭连接，客户端读到不完整的响应体
+                    self.wfile.write(data[:data.index(b"\n\n") + 2])
+                    self.wfile.flush()
+                    self.close_connection = True
+                    return
+                self.wfile.write(data)
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}/v1"
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class _BigModelAgainst:
+    """把 big_model 指向假服务，使用很短的退避时间；退出时恢复原配置"""
+
+    NAMES = ("BIG_MODEL_API_KEY", "BIG_MODEL_API_BASE", "_client", "_async_client", "_caller")
+
+    def __init__(self, server, failures=3, reset=0.3, max_retries=2):
+        self.server = server
+        self.caller = ResilientCaller(
+            "big_model", limiter=TokenBucket(0), breaker=CircuitBreaker(failures, reset),
+            max_retries=max_retries, base_delay=0.01, max_delay=0.05,
+            is_retryable=big_model._is_retryable, retry_after=big_model._retry_after,
+        )
+        self.caller.pool_connections = big_model._pool_connections
+
+    def __enter__(self):
+        self.saved = {name: getattr(big_model, name) for name in self.NAMES}
+        big_model.BIG_MODEL_API_KEY = "test"
+        big_model.BIG_MODEL_API_BASE = self.server.url
+        big_model._client = None
+        big_model._async_client = None
+        big_model._caller = self.caller
+        return self.caller
+
+    def __exit__(self, *exc):
+        for name, value in self.saved.items():
+            setattr(big_model, name, value)
+
+
+def test_token_bucket():
+    """突发容量内不等待，之后按速率排队；等待超过上限时拒绝且不占用令牌"""
+    print("\n测试令牌桶...")
+    bucket = TokenBucket(rate=10, capacity=2)
+    assert bucket.reserve() == 0 and bucket.reserve() == 0
+    wait = bucket.reserve()
+    assert 0.05 < wait <= 0.1, wait
+    try:
+        bucket.reserve(max_wait=0.1)
+        assert False, "等待超过上限时应抛出 RateLimitTimeout"
+    except RateLimitTimeout:
+        pass
+    assert 0.1 < bucket.reserve() <= 0.2, "被拒绝的预订不应占用令牌"
+    assert TokenBucket(rate=0).reserve() == 0, "rate<=0 不限流"
+    print("  ✓ 突发、排队与拒绝")
+
+
+def test_breaker_transitions():
+    """连续失败打开，冷却后只放行一个探测请求，探测成功关闭"""
+    print("\n测试熔断状态...")
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.1)
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open" and not breaker.allow()
+    time.sleep(0.12)
+    assert breaker.state == "half_open"
+    assert breaker.allow() and not breaker.allow(), "半开时只放行一个探测请求"
+    breaker.record_failure()
+    assert breaker.state == "open", "探测失败应重新打开"
+    time.sleep(0.12)
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == "closed" and breaker.allow()
+    print("  ✓ 关闭 -> 打开 -> 半开 -> 关闭")
+
+
+def test_open_breaker_does_not_spend_quota():
+    """熔断拒绝的调用退还令牌：熔断期间的大量请求不会透支令牌桶，恢复后的调用无需等待"""
+    print("\n测试熔断期间不消耗配额...")
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.1)
+    caller = ResilientCaller("quota_test", limiter=TokenBucket(rate=1, capacity=1), breaker=breaker,
+                             rate_limit_wait=0.5)
+    breaker.record_failure()
+    for _ in range(20):
+        try:
+            caller.call(lambda: "ok")
+            assert False, "熔断打开时应抛出 CircuitOpenError"
+        except CircuitOpenError:
+            pass
+    time.sleep(0.12)
+    start = time.monotonic()
+    assert caller.call(lambda: "ok") == "ok" and breaker.state == "closed"
+    assert time.monotonic() - start < 0.1, "探测请求不应等待被拒绝调用预订的令牌"
+    print("  ✓ 被拒绝的调用不占用令牌")
+
+
+def test_retries_only_retryable_errors():
+    """5xx/429 退避重试后成功；400 不重试，直接降级"""
+    print("\n测试重试策略...")
+    if big_model is None:
+        print("  跳过: openai未安装")
+        return
+    server = FakeServer()
+    try:
+        with _BigModelAgainst(server):
+            server.script = [500, 429]
+            answer, usage = big_model.big_model_answer("什么是机器学习？")
+            assert answer == "假服务的回答。" and usage["total_tokens"] == 12, answer
+            assert server.requests == 3, f"应重试两次，实际请求 {server.requests} 次"
+
+            server.requests = 0
+            server.script = [400]
+            answer, usage = big_model.big_model_answer("什么是机器学习？")
+            assert answer.startswith("[大模型]") and usage["total_tokens"] == 0
+            assert server.requests == 1, "400 不应重试"
+
+            server.requests = 0
+            server.script = [503, 503, 503]
+            answer, _ = big_model.big_model_answer("什么是机器学习？")
+            assert answer.startswith("[大模型]") and server.requests == 3, "重试次数用完后降级"
+
+            # 同一个 keep-alive 连接复用于多次请求
+            server.connections.clear()
+            for _ in range(3):
+                big_model.big_model_answer("什么是机器学习？")
+            assert len(server.connections) == 1, f"应复用连接，实际 {len(server.connections)} 个"
+    finally:
+        server.close()
+    print("  ✓ 只重试可重试错误，连接复用")
+
+
+def test_breaker_fails_fast_and_recovers():
+    """熔断打开后不再请求服务端，冷却后探测成功恢复；指标中可见"""
+    print("\n测试熔断...")
+    if big_model is None:
+        print("  跳过: openai未安装")
+        return
+    server = FakeServer()
+    try:
+        with _BigModelAgainst(server, failures=2, reset=0.3, max_retries=0) as caller:
+            server.script = [500, 500]
+            big_model.big_model_answer("问题一")
+            big_model.big_model_answer("问题二")
+            assert caller.breaker.state == "open" and not big_model.big_model_available()
+
+            server.requests = 0
+            start = time.time()
+            answer, _ = big_model.big_model_answer("问题三")
+            assert answer.startswith("[大模型]") and server.requests == 0, "熔断期间不应请求服务端"
+            assert time.time() - start < 0.1, "熔断期间应立即降级"
+            try:
+                caller.call(lambda: None)
+                assert False, "熔断期间应抛出 CircuitOpenError"
+            except CircuitOpenError:
+                pass
+
+            text = metrics.REGISTRY.render()
+            assert 'api_circuit_state{client="big_model"} 2' in text
+            assert 'api_calls_total{client="big_model",outcome="circuit_open"}' in text
+            assert 'api_pool_connections{client="big_model"}' in text
+
+            time.sleep(0.35)
+            assert big_model.big_model_available(), "冷却后应允许探测"
+            chunks = list(big_model.big_model_answer_stream("问题四"))
+            assert "".join(chunks) == "假服务流式回答。", chunks
+            assert caller.breaker.state == "closed"
+    finally:
+        server.close()
+    print("  ✓ 快速失败，探测成功后恢复")
+
+
+def test_cut_stream_is_billed():
+    """流式回答中途断开：返回已收到的部分，标记为截断，token 数按本地计数估算而不是记为 0"""
+    print("\n测试流式中断的计费...")
+    if big_model is None:
+        print("  跳过: openai未安装")
+        return
+    server = FakeServer()
+    try:
+        with _BigModelAgainst(server, max_retries=0):
+            server.cut_stream = True
+            usage_info = {}
+            stream = big_model.big_model_answer_stream("什么是机器学习？", usage_info=usage_info)
+            chunks = []
+            while True:
+                try:
+                    chunks.append(next(stream))
+                except StopIteration as stop:
+                    answer = stop.value
+                    break
+            assert chunks == ["假服务"] and answer == "假服务", (chunks, answer)
+            assert usage_info["truncated"] and usage_info["usage_estimated"]
+            assert usage_info["completion_tokens"] > 0 and usage_info["prompt_tokens"] > 0, usage_info
+            assert usage_info["total_tokens"] == usage_info["prompt_tokens"] + usage_info["completion_tokens"]
+    finally:
+        server.close()
+    print(f"  ✓ 截断的回答按 {usage_info['total_tokens']} 个 token 计费")
+
+
+def test_router_prefers_local_when_degraded():
+    """大模型熔断期间：高复杂度问题交给小模型，低置信度的小模型回答不再降级到大模型"""
+    print("\n测试熔断时的路由...")
+    import router
+
+    saved = {name: getattr(router, name) for name in (
+        "small_model_answer", "big_model_answer", "big_model_available", "log_event",
+        "low_confidence", "SEMANTIC_FAQ_ENABLED", "ANSWER_CACHE_ENABLED", "HEDGE_ENABLED", "WARMUP_GATE",
+        "SINGLE_FLIGHT_ENABLED", "_answer_cache",
+    )}
+    calls = []
+    try:
+        router.small_model_answer = lambda q, history=None, stats=None: calls.append("small") or "小模型的回答。"
+        router.big_model_answer = lambda q, history=None: calls.append("big") or ("大模型的回答。", {"total_tokens": 10})
+        router.low_confidence = lambda answer: True
+        router.log_event = lambda *args: None
+        router.SEMANTIC_FAQ_ENABLED = False
+        router.ANSWER_CACHE_ENABLED = False
+        router.HEDGE_ENABLED = False
+        router.WARMUP_GATE = False
+        long_question = "请详细分析并比较机器学习与深度学习的原理、优缺点以及在自然语言处理中的应用？"
+
+        router.big_model_available = lambda: True
+        assert router.route_question(long_question)[1]["route"] == "big_model"
+        assert router.route_question("宿舍可以养猫吗")[1]["route"] == "big_model_fallback"
+
+        router.big_model_available = lambda: False
+        calls.clear()
+        answer, meta = router.route_question(long_question)
+        assert meta["route"] == "small_model_degraded" and answer == "小模型的回答。", meta
+        answer, meta = router.route_question("宿舍可以养猫吗")
+        assert meta["route"] == "small_model_degraded" and calls == ["small", "small"], calls
+
+        # 熔断期间保留的低置信度回答不进答案缓存，恢复后重新回答
+        with tempfile.TemporaryDirectory() as tmp:
+            router._answer_cache = AnswerCache(os.path.join(tmp, "cache.db"))
+            router.ANSWER_CACHE_ENABLED = True
+            calls.clear()
+            assert router.route_question("宿舍可以养猫吗")[1]["route"] == "small_model_degraded"
+            router.big_model_available = lambda: True
+            assert router.route_question("宿舍可以养猫吗")[1]["route"] == "big_model_fallback"
+            assert calls == ["small", "small", "big"], calls
+    finally:
+        for name, value in saved.items():
+            setattr(router, name, value)
+    print("  ✓ 熔断期间优先本地回答，降级回答不缓存")
+
+
+def main():
+    """运行所有测试"""
+    print("=" * 60)
+    print("测试大模型客户端（限流、重试、熔断）")
+    print("=" * 60)
+
+    tests = [
+        test_token_bucket,
+        test_breaker_transitions,
+        test_open_breaker_does_not_spend_quota,
+        test_retries_only_retryable_errors,
+        test_breaker_fails_fast_and_recovers,
+        test_cut_stream_is_billed,
+        test_router_prefers_local_when_degraded,
+    ]
+
+    failed = 0
+    for test in tests:
+        try:
+            test()
+        except AssertionError as e:
+            print(f"  ✗ 测试失败: {e}")
+            failed += 1
+
+    print("\n" + "=" * 60)
+    if failed == 0:
+        print("✓ 所有测试通过!")
+    else:
+        print(f"✗ {failed} 个测试失败")
+        sys.exit(1)
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""
+测试批量离线回答（用假的模型函数，不加载真实模型、不调用API）
+"""
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+# 获取测试脚本所在目录
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, SCRIPT_DIR)
+
+import router
+import utils
+from bulk_answer import load_results, run_bulk
+
+ROUTER_STUBS = (
+    "small_model_answer", "big_model_answer", "low_confidence", "log_event", "LOCAL_MODELS_ENABLED",
+    "SEMANTIC_FAQ_ENABLED", "ANSWER_CACHE_ENABLED", "HEDGE_ENABLED", "WARMUP_GATE", "SINGLE_FLIGHT_ENABLED",
+)
+
+QUESTIONS = [
+    "图书馆几点开门？",
+    "宿舍可以养猫吗",
+    "   ",
+    "请详细分析并比较机器学习与深度学习的原理、优缺点以及在自然语言处理中的应用？",
+    "食堂在哪里？",
+]
+
+
+class FakeModels:
+    """记录调用线程与最大并发数的假模型"""
+
+    def __init__(self, delay: float = 0.05):
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.active = {"small": 0, "big": 0}
+        self.peak = {"small": 0, "big": 0}
+        self.calls = {"small": [], "big": []}
+        self.big_fails = False
+
+    def _run(self, kind, question):
+        with self.lock:
+            self.calls[kind].append(question)
+            self.active[kind] += 1
+            self.peak[kind] = max(self.peak[kind], self.active[kind])
+        time.sleep(self.delay)
+        with self.lock:
+            self.active[kind] -= 1
+
+    def small(self, question, history=None, stats=None):
+        self._run("small", question)
+        return f"小模型回答：{question}"
+
+    def big(self, question, history=None):
+        self._run("big", question)
+        if self.big_fails:
+            return f"[大模型] 关于'{question}'，建议咨询相关部门。", {"total_tokens": 0}
+        return f"大模型回答：{question}", {"total_tokens": 10}
+
+
+def _install(models: FakeModels):
+    saved = {name: getattr(router, name) for name in ROUTER_STUBS}
+    router.small_model_answer = models.small
+    router.big_model_answer = models.big
+    router.low_confidence = lambda answer: False
+    router.log_event = lambda *args: None
+    router.LOCAL_MODELS_ENABLED = True
+    router.SEMANTIC_FAQ_ENABLED = False
+    router.ANSWER_CACHE_ENABLED = False
+    router.HEDGE_ENABLED = False
+    router.WARMUP_GATE = False
+    router.SINGLE_FLIGHT_ENABLED = False
+    return saved
+
+
+def _restore(saved):
+    for name, value in saved.items():
+        setattr(router, name, value)
+
+
+def _write_questions(path, count):
+    with open(path, "w", encoding="utf-8") as f:
+        for i in range(count):
+            f.write(f"{QUESTIONS[i % len(QUESTIONS)]}{i}\n" if i % len(QUESTIONS) != 2 else "\n")
+
+
+def test_route_grouped_execution():
+    """FAQ 命中直接回答，小模型与大模型问题分别并发执行且并发数受限；每个问题恰好一行结果"""
+    print("\n测试按路由分组执行...")
+    models = FakeModels()
+    saved = _install(models)
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            source = os.path.join(tmp, "questions.txt")
+            output = os.path.join(tmp, "answers.jsonl")
+            _write_questions(source, 100)
+
+            start = time.time()
+            stats = run_bulk(source, output, chunk_size=16, small_concurrency=4, big_concurrency=8)
+            elapsed = time.time() - start
+
+            results = load_results(output)
+            with open(output, encoding="utf-8") as f:
+                assert sum(1 for _ in f) == len(results) == stats["answered"] == stats["total"] == 80
+            assert stats["skipped"] == 0 and stats["degraded"] == 0
+            assert stats["planned"] == {"faq": 40, "small_model": 20, "big_model": 20}, stats["planned"]
+            assert stats["routes"] == stats["planned"], stats["routes"]
+            assert len(models.calls["small"]) == 20 and len(models.calls["big"]) == 20
+
+            record = results[1]
+            assert record["question"] == "图书馆几点开门？0" and record["meta"]["route"] == "faq"
+            assert results[4]["answer"] == "大模型回答：" + QUESTIONS[3] + "3"
+            assert "response_time" in results[4]["meta"] and "big_model_stats" in results[4]["meta"]
+
+            assert 1 < models.peak["small"] <= 4, models.peak
+            assert 1 < models.peak["big"] <= 8, models.peak
+            # 40 次模型调用各 0.05 秒，串行需要 2 秒
+            assert elapsed < 1.5, f"应并发执行，实际耗时 {elapsed:.2f}s"
+    finally:
+        _restore(saved)
+    print(f"  ✓ 80 条问题 {elapsed:.2f}s，小模型峰值并发 {models.peak['small']}，大模型峰值并发 {models.peak['big']}")
+
+
+def test_resume_after_interruption():
+    """续跑：跳过已有结果，截掉写了一半的最后一行，降级回答重新回答"""
+    print("\n测试断点续跑...")
+    models = FakeModels(delay=0)
+    saved = _install(models)
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            source = os.path.join(tmp, "tickets.jsonl")
+            output = os.path.join(tmp, "answers.jsonl")
+            with open(source, "w", encoding="utf-8") as f:
+                for i, question in enumerate(QUESTIONS):
+                    f.write(json.dumps({"id": f"T{i}", "question": question}, ensure_ascii=False) + "\n")
+
+            # 第一次运行：大模型接口不可用
+            models.big_fails = True
+            stats = run_bulk(source, output)
+            assert stats["answered"] == 5 and stats["degraded"] == 1
+            assert load_results(output)["T3"]["degraded"]
+
+            # 模拟中断：最后一行只写了一半
+            with open(output, "a", encoding="utf-8") as f:
+                f.write('{"id": "T9", "question": "写了一半')
+
+            models.big_fails = False
+            models.calls = {"small": [], "big": []}
+            stats = run_bulk(source, output)
+            assert stats["skipped"] == 4 and stats["answered"] == 1, stats
+            assert models.calls["big"] == [QUESTIONS[3]] and models.calls["small"] == []
+
+            results = load_results(output)
+            assert sorted(results) == ["T0", "T1", "T2", "T3", "T4"], sorted(results)
+            assert not results["T3"]["degraded"] and results["T3"]["answer"].startswith("大模型回答")
+            with open(output, encoding="utf-8") as f:
+                lines = f.read().splitlines()
+            assert len(lines) == 6 and all(json.loads(line) for line in lines), "半行应被截掉"
+
+            # 全部完成后再运行不做任何事
+            stats = run_bulk(source, output)
+            assert stats["skipped"] == 5 and stats["answered"] == 0
+    finally:
+        _restore(saved)
+    print("  ✓ 已完成的跳过，半行截掉，降级回答重试")
+
+
+def test_bulk_runs_stay_out_of_request_logs():
+    """默认不写请求日志；--log 时路由记为 bulk:<路由>；范围之外的线上请求照常记录"""
+    print("\n测试批量回答的日志...")
+    models = FakeModels(delay=0)
+    saved = _install(models)
+    saved_utils = (utils.LOG_BUFFERED, utils._write_log_rows)
+    rows = []
+    try:
+        router.log_event = utils.log_event
+        utils.LOG_BUFFERED = False
+        utils._write_log_rows = rows.extend
+        with tempfile.TemporaryDirectory() as tmp:
+            source = os.path.join(tmp, "questions.txt")
+            _write_questions(source, 5)
+
+            stats = run_bulk(source, os.path.join(tmp, "quiet.jsonl"))
+            assert stats["answered"] == 4 and rows == [], rows
+
+            stats = run_bulk(source, os.path.join(tmp, "logged.jsonl"), log=True)
+            routes = sorted(row[3] for row in rows)
+            assert routes == ["bulk:big_model", "bulk:faq", "bulk:faq", "bulk:small_model"], routes
+
+        rows.clear()
+        router.route_question("图书馆几点开门？")
+        assert [row[3] for row in rows] == ["faq"], "线上请求不受影响"
+    finally:
+        utils.LOG_BUFFERED, utils._write_log_rows = saved_utils
+        _restore(saved)
+    print("  ✓ 默认不记录，--log 时带 bulk: 标记")
+
+
+def main():
+    """运行所有测试"""
+    print("=" * 60)
+    print("测试批量离线回答")
+    print("=" * 60)
+
+    tests = [
+        test_route_grouped_execution,
+        test_resume_after_interruption,
+        test_bulk_runs_stay_out_of_request_logs,
+    ]
+
+    failed = 0
+    for test in tests:
+        try:
+            test()
+        except AssertionError as e:
+            print(f"  ✗ 测试失败: {e}")
+            failed += 1
+
+    print("\n" + "=" * 60)
+    if failed == 0:
+        print("✓ 所有测试通过!")
+    else:
+        print(f"✗ {failed} 个测试失败")
+        sys.exit(1)
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+测试小模型生成过程中的对数概率置信度与提前终止（用构造的分布，不加载真实模型）
+"""
+import os
+import sys
+
+# 获取测试脚本所在目录
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, SCRIPT_DIR)
+
+try:
+    import torch
+    import small_model
+except Exception as e:
+    small_model = None
+    print(f"  注意: small_model导入失败: {e}")
+
+EOS = 0
+VOCAB = 10
+# 贪心解码不做采样变换，记录的就是构造的分布本身
+GREEDY = {"do_sample": False}
+
+
+def _step(tracker, tokens, probs):
+    """模拟一步生成：先经过记录器取得分布，再用所选 token 调用停止条件"""
+    scores = torch.log(torch.tensor(probs, dtype=torch.float32))
+    tracker.recorder(None, scores)
+    input_ids = torch.tensor(tokens)[:, None]
+    return tracker(input_ids, None).tolist()
+
+
+def _dist(top: float, token: int = 1):
+    """token 的概率为 top，其余概率均分"""
+    rest = (1 - top) / (VOCAB - 1)
+    return [top if i == token else rest for i in range(VOCAB)]
+
+
+def test_confident_sequence_not_aborted():
+    """高概率 token 不触发终止，置信度接近1"""
+    print("\n测试高置信度序列...")
+    if small_model is None:
+        print("  跳过: small_model模块未加载")
+        return
+    tracker = small_model._ConfidenceTracker(1, EOS, enabled=True, min_logprob=-1.0, window=4, generation_kwargs=GREEDY)
+    for _ in range(6):
+        assert _step(tracker, [1], [_dist(0.9)]) == [False]
+    stats = tracker.stats(0)
+    assert not stats["aborted"] and stats["abort_token"] is None
+    assert stats["generated_tokens"] == 6 and abs(stats["logprob_confidence"] - 0.9) < 1e-3
+    print(f"  ✓ 置信度 {stats['logprob_confidence']}，未终止")
+
+
+def test_low_confidence_row_aborted_in_batch():
+    """批次中只有低置信度的序列被终止，eos 之后的填充 token 不计入"""
+    print("\n测试批次内按序列提前终止...")
+    if small_model is None:
+        print("  跳过: small_model模块未加载")
+        return
+    tracker = small_model._ConfidenceTracker(3, EOS, enabled=True, min_logprob=-1.0, window=4, generation_kwargs=GREEDY)
+    results = []
+    for step in range(5):
+        row2_token = EOS if step >= 1 else 1  # 第3条第2步就结束，之后是填充
+        results.append(_step(tracker, [1, 1, row2_token], [_dist(0.9), _dist(0.1), _dist(0.9)]))
+    assert [r[0] for r in results] == [False] * 5
+    assert [r[1] for r in results] == [False, False, False, True, True], "窗口填满后应终止低置信度序列"
+    assert not any(r[2] for r in results)
+
+    low = tracker.stats(1)
+    assert low["aborted"] and low["abort_token"] == 4 and low["generated_tokens"] == 4
+    assert tracker.stats(2)["generated_tokens"] == 1
+    print(f"  ✓ 第 {low['abort_token']} 个 token 处终止，置信度 {low['logprob_confidence']}")
+
+
+def test_disabled_only_records():
+    """关闭提前终止时只统计不终止"""
+    print("\n测试关闭提前终止...")
+    if small_model is None:
+        print("  跳过: small_model模块未加载")
+        return
+    tracker = small_model._ConfidenceTracker(1, EOS, enabled=False, min_logprob=-1.0, window=2, generation_kwargs=GREEDY)
+    for _ in range(4):
+        assert _step(tracker, [1], [_dist(0.1)]) == [False]
+    stats = tracker.stats(0)
+    assert not stats["aborted"] and stats["mean_logprob"] < -1.0 and stats["mean_entropy"] > 0
+    print("  ✓ 只记录置信度")
+
+
+def test_scores_follow_sampling_warpers():
+    """采样解码时按 temperature / top_p 变换后的分布计算对数概率，与 generate() 实际采样的分布一致"""
+    print("\n测试采样变换后的置信度...")
+    if small_model is None:
+        print("  跳过: small_model模块未加载")
+        return
+    probs = [0.05, 0.5, 0.3, 0.15] + [0.0] * (VOCAB - 4)
+    tracker = small_model._ConfidenceTracker(
+        1, EOS, enabled=False, generation_kwargs={"do_sample": True, "temperature": 0.5, "top_p": 0.7, "top_k": 0}
+    )
+    _step(tracker, [1], [probs])
+
+    # temperature 0.5 后 token 1、2 占 [0.68, 0.25, ...]，top_p 0.7 需要保留前两个，再重新归一化
+    sharpened = [p ** 2 for p in probs]
+    expected = sharpened[1] / (sharpened[1] + sharpened[2])
+    stats = tracker.stats(0)
+    assert abs(stats["logprob_confidence"] - expected) < 1e-3, (stats, expected)
+    assert stats["logprob_confidence"] > 0.5, "采样变换后的置信度应高于原始分布中的 0.5"
+    print(f"  ✓ 原始概率 0.5，采样分布中为 {stats['logprob_confidence']}")
+
+
+def test_router_falls_back_on_abort():
+    """小模型提前终止时路由直接降级到大模型，meta 中带有置信度统计"""
+    print("\n测试提前终止后的降级...")
+    try:
+        import router
+    except Exception as e:
+        print(f"  跳过: router模块未加载: {e}")
+        return
+
+    def small(question, history=None, stats=None):
+        stats.update({"logprob_confidence": 0.05, "aborted": True, "abort_token": 8})
+        return small_model.LOW_CONFIDENCE_ANSWER
+
+    saved = (router.small_model_answer, router.big_model_answer, router.log_event,
+             router.SEMANTIC_FAQ_ENABLED, router.ANSWER_CACHE_ENABLED, router.HEDGE_ENABLED)
+    router.small_model_answer = small
+    router.big_model_answer = lambda q, history=None: ("大模型的详细回答。", {"total_tokens": 10})
+    router.log_event = lambda *args: None
+    router.SEMANTIC_FAQ_ENABLED = False
+    router.ANSWER_CACHE_ENABLED = False
+    router.HEDGE_ENABLED = False
+    try:
+        answer, meta = router.route_question("宿舍可以养猫吗")
+        assert answer == "大模型的详细回答。" and meta["route"] == "big_model_fallback"
+        assert meta["small_model_stats"]["aborted"] and meta["small_model_stats"]["abort_token"] == 8
+        print("  ✓ 降级到大模型，meta 记录终止位置")
+    finally:
+        (router.small_model_answer, router.big_model_answer, router.log_event,
+         router.SEMANTIC_FAQ_ENABLED, router.ANSWER_CACHE_ENABLED, router.HEDGE_ENABLED) = saved
+
+
+def main():
+    """运行所有测试"""
+    print("=" * 60)
+    print("测试小模型置信度提前终止")
+    print("=" * 60)
+
+    tests = [
+        test_confident_sequence_not_aborted,
+        test_low_confidence_row_aborted_in_batch,
+        test_disabled_only_records,
+        test_scores_follow_sampling_warpers,
+        test_router_falls_back_on_abort,
+    ]
+
+    failed = 0
+    for test in tests:
+        try:
+            test()
+        except AssertionError as e:
+            print(f"  ✗ 测试失败: {e}")
+            failed += 1
+
+    print("\n" + "=" * 60)
+    if failed == 0:
+        print("✓ 所有测试通过!")
+    else:
+        print(f"✗ {failed} 个测试失败")
+        sys.exit(1)
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+"""
+测试小模型回退预测（合成日志训练，假的模型函数，不加载真实模型、不调用API）
+"""
+import asyncio
+import csv
+import os
+import sys
+import tempfile
+import time
+
+# 获取测试脚本所在目录
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, SCRIPT_DIR)
+
+import fallback_predictor
+from fallback_predictor import FallbackPredictor, labeled_rows, load_log_rows, savings_report, train
+
+ROUTER_STUBS = (
+    "small_model_answer", "small_model_answer_stream", "big_model_answer", "big_model_answer_stream",
+    "big_model_answer_async", "big_model_available",
+    "low_confidence", "log_event", "get_fallback_predictor", "FALLBACK_PREDICTOR_EXPLORE",
+    "SEMANTIC_FAQ_ENABLED", "ANSWER_CACHE_ENABLED", "HEDGE_ENABLED", "WARMUP_GATE", "SINGLE_FLIGHT_ENABLED",
+)
+
+# 小模型答不好的问题（写代码、算题）与能答好的日常问题
+HARD = ["帮我写一段Python代码{}", "用Java实现快速排序{}", "写个SQL查询{}", "求解这个微积分题目{}"]
+EASY = ["宿舍几点熄灯{}", "快递点在哪{}", "校医院电话多少{}", "体育馆开放吗{}"]
+
+
+def _synthetic_log(count: int) -> list:
+    """合成日志行：难题回退到大模型（成本 0.5），日常问题由小模型回答（耗时 2 秒）"""
+    rows = []
+    for i in range(count):
+        hard = i % 3 == 0
+        template = (HARD if hard else EASY)[i % 4]
+        rows.append({
+            "timestamp": f"2026-03-01T10:{i // 60 % 60:02d}:{i % 60:02d}",
+            "question": template.format(i),
+            "score": "1",
+            "route": "big_model_fallback" if hard else "small_model",
+            "response_time": "6.0" if hard else "2.0",
+            "cost": "0.5" if hard else "0",
+        })
+    rows.append({"timestamp": "2026-03-01T11:00:00", "question": "图书馆几点开门？", "score": "1",
+                 "route": "faq", "response_time": "0.001", "cost": "0"})
+    return rows
+
+
+def test_train_and_report():
+    """从日志训练：难题的回退概率高、日常问题低；报告按阈值估算节省的CPU时间与额外成本"""
+    print("\n测试训练与报告...")
+    rows = labeled_rows(_synthetic_log(300))
+    assert len(rows) == 300, "FAQ 等没有标签的路由应被排除"
+    assert sum(r["label"] for r in rows) == 100
+
+    predictor = train(rows)
+    hard = predictor.predict("请帮我写一段C++代码", 1)
+    easy = predictor.predict("请问宿舍几点熄灯", 1)
+    assert hard > 0.7 > 0.3 > easy, (hard, easy)
+
+    report = savings_report(predictor, rows, thresholds=(0.5, 0.99))
+    assert report["avg_small_model_time"] == 2.0 and report["avg_big_model_cost"] == 0.5
+    at_half = report["thresholds"][0]
+    assert at_half["precision"] > 0.9 and at_half["recall"] > 0.9, at_half
+    assert at_half["cpu_seconds_saved"] == at_half["skipped"] * 2.0
+    false_pos = at_half["skipped"] - round(at_half["precision"] * at_half["skipped"])
+    assert abs(at_half["extra_api_cost"] - false_pos * 0.5) < 1e-9
+    assert report["thresholds"][1]["skipped"] <= at_half["skipped"]
+    print(f"  ✓ 难题 P={hard:.2f}，日常问题 P={easy:.2f}，阈值0.5跳过 {at_half['skipped']} 条")
+
+
+def test_labels_exclude_errors_degraded_and_bulk():
+    """小模型出错的回退、熔断期间的降级回答、批量离线回答都不作为标签"""
+    print("\n测试标签来源...")
+    rows = _synthetic_log(6)
+    for route in ("big_model_fallback_error", "small_model_degraded", "bulk:small_model", "bulk:big_model_fallback"):
+        rows.append({**rows[0], "route": route})
+    labeled = labeled_rows(rows)
+    assert len(labeled) == 6, [r["question"] for r in labeled]
+
+    import router
+    saved = {name: getattr(router, name) for name in ROUTER_STUBS}
+
+    def busy(question, history=None, stats=None):
+        stats["error"] = "queue.Full"
+        return "[小模型] 暂时繁忙，请稍后再试"
+
+    try:
+        router.small_model_answer = busy
+        router.big_model_answer = lambda q, history=None: ("大模型的回答。", {"total_tokens": 10})
+        router.big_model_available = lambda: True
+        router.low_confidence = lambda answer: False
+        router.log_event = lambda *args: None
+        router.get_fallback_predictor = lambda: None
+        router.SEMANTIC_FAQ_ENABLED = False
+        router.ANSWER_CACHE_ENABLED = False
+        router.HEDGE_ENABLED = False
+        router.WARMUP_GATE = False
+        router.SINGLE_FLIGHT_ENABLED = False
+        _, meta = router.route_question("推荐一部电影")
+        assert meta["route"] == "big_model_fallback_error", meta
+
+        router.small_model_answer = lambda q, history=None, stats=None: "[小模型] 回答置信度过低，已提前终止生成"
+        _, meta = router.route_question("推荐一部电影")
+        assert meta["route"] == "big_model_fallback", "置信度不足的回退仍是训练标签"
+    finally:
+        for name, value in saved.items():
+            setattr(router, name, value)
+    print("  ✓ 只有置信度导致的回退作为标签")
+
+
+def test_hot_reload():
+    """模型文件不存在时不预测；写入后加载，更新后重新加载，损坏时保留旧模型"""
+    print("\n测试热加载...")
+    saved_path = fallback_predictor.FALLBACK_PREDICTOR_PATH
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "fallback_model.npz")
+            fallback_predictor.FALLBACK_PREDICTOR_PATH = path
+            assert fallback_predictor.get_fallback_predictor() is None
+
+            predictor = train(labeled_rows(_synthetic_log(60)))
+            predictor.info = {"rows": 60}
+            predictor.save(path)
+            loaded = fallback_predictor.get_fallback_predictor()
+            assert loaded is not None and loaded.info == {"rows": 60}
+            assert abs(loaded.predict("写个SQL查询", 1) - predictor.predict("写个SQL查询", 1)) < 1e-5
+            assert fallback_predictor.get_fallback_predictor() is loaded, "文件未变化时不重新加载"
+
+            FallbackPredictor(predictor.weights, 5.0, {"rows": 1}).save(path)
+            os.utime(path, (time.time() + 10, time.time() + 10))
+            reloaded = fallback_predictor.get_fallback_predictor()
+            assert reloaded is not loaded and reloaded.info == {"rows": 1}
+
+            with open(path, "wb") as f:
+                f.write(b"not a model")
+            os.utime(path, (time.time() + 20, time.time() + 20))
+            assert fallback_predictor.get_fallback_predictor() is reloaded, "损坏的文件不应替换旧模型"
+
+            os.remove(path)
+            assert fallback_predictor.get_fallback_predictor() is None
+    finally:
+        fallback_predictor.FALLBACK_PREDICTOR_PATH = saved_path
+        fallback_predictor._predictor = None
+        fallback_predictor._predictor_mtime = 0
+    print("  ✓ 按修改时间热加载")
+
+
+def test_load_csv_log():
+    """从 CSV 日志读取训练数据，可按时间过滤"""
+    print("\n测试读取 CSV 日志...")
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "logs.csv")
+        rows = _synthetic_log(10)
+        rows[0]["timestamp"] = time.strftime("%Y-%m-%dT%H:%M:%S")
+        with open(path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+            writer.writeheader()
+            writer.writerows(rows)
+        assert len(load_log_rows(path)) == 11
+        recent = load_log_rows(path, hours=1)
+        assert [r["question"] for r in recent] == [rows[0]["question"]]
+    print("  ✓ CSV 日志")
+
+
+class FakePredictor:
+    """按问题返回固定概率的预测器"""
+
+    def predict(self, question, score):
+        return 0.95 if "代码" in question else 0.1
+
+
+def test_router_skips_predicted_fallback():
+    """预测会回退的问题直接交给大模型（路由 big_model_predicted），不调用小模型；其他问题照常"""
+    print("\n测试路由跳过小模型...")
+    import router
+
+    saved = {name: getattr(router, name) for name in ROUTER_STUBS}
+    calls = []
+
+    def small_stream(question, history=None, stats=None):
+        calls.append(("small", question))
+        yield "小模型的回答。"
+        return "小模型的回答。"
+
+    def big(question, history=None):
+        calls.append(("big", question))
+        return "大模型的回答。", {"total_tokens": 100}
+
+    async def big_async(question, history=None):
+        return big(question, history)
+
+    def big_stream(question, history=None, usage_info=None):
+        calls.append(("big", question))
+        usage_info["total_tokens"] = 100
+        yield "大模型的回答。"
+        return "大模型的回答。"
+
+    try:
+        router.small_model_answer = lambda q, history=None, stats=None: calls.append(("small", q)) or "小模型的回答。"
+        router.small_model_answer_stream = small_stream
+        router.big_model_answer = big
+        router.big_model_answer_stream = big_stream
+        router.big_model_answer_async = big_async
+        router.big_model_available = lambda: True
+        router.low_confidence = lambda answer: False
+        router.log_event = lambda *args: None
+        router.get_fallback_predictor = lambda: FakePredictor()
+        router.FALLBACK_PREDICTOR_EXPLORE = 0
+        router.SEMANTIC_FAQ_ENABLED = False
+        router.ANSWER_CACHE_ENABLED = False
+        router.HEDGE_ENABLED = False
+        router.WARMUP_GATE = False
+        router.SINGLE_FLIGHT_ENABLED = False
+
+        answer, meta = router.route_question("帮我写代码")
+        assert calls == [("big", "帮我写代码")], calls
+        assert meta["route"] == "big_model_predicted" and meta["fallback_probability"] == 0.95
+        assert meta["cost"] == 100 * router.COST_PER_TOKEN and "big_model_stats" in meta
+
+        calls.clear()
+        answer, meta = router.route_question("推荐一部电影")
+        assert calls == [("small", "推荐一部电影")] and meta["route"] == "small_model"
+        assert meta["fallback_probability"] == 0.1
+
+        # 流式路由同样跳过
+        calls.clear()
+        chunks, result = router.route_question_stream("帮我写代码")
+        assert "".join(chunks) == "大模型的回答。"
+        assert calls == [("big", "帮我写代码")] and result["meta"]["route"] == "big_model_predicted", calls
+
+        # 异步路由同样跳过
+        calls.clear()
+        _, meta = asyncio.run(router.route_question_async("帮我写代码"))
+        assert calls == [("big", "帮我写代码")] and meta["route"] == "big_model_predicted", calls
+
+        # 探索：超过阈值也交给小模型，积累训练标签
+        calls.clear()
+        router.FALLBACK_PREDICTOR_EXPLORE = 1.0
+        _, meta = router.route_question("帮我写代码")
+        assert calls == [("small", "帮我写代码")] and meta["fallback_explored"]
+
+        # 大模型不可用或没有模型文件时不预测
+        calls.clear()
+        router.FALLBACK_PREDICTOR_EXPLORE = 0
+        router.get_fallback_predictor = lambda: None
+        _, meta = router.route_question("帮我写代码")
+        assert meta["route"] == "small_model" and "fallback_probability" not in meta
+    finally:
+        for name, value in saved.items():
+            setattr(router, name, value)
+    print("  ✓ 预测回退的问题不再先生成小模型回答")
+
+
+def main():
+    """运行所有测试"""
+    print("=" * 60)
+    print("测试小模型回退预测")
+    print("=" * 60)
+
+    tests = [
+        test_train_and_report,
+        test_labels_exclude_errors_degraded_and_bulk,
+        test_hot_reload,
+        test_load_csv_log,
+        test_router_skips_predicted_fallback,
+    ]
+
+    failed = 0
+    for test in tests:
+        try:
+            test()
+        except AssertionError as e:
+            print(f"  ✗ 测试失败: {e}")
+            failed += 1
+
+    print("\n" + "=" * 60)
+    if failed == 0:
+        print("✓ 所有测试通过!")
+    else:
+        print(f"✗ {failed} 个测试失败")
+        sys.exit(1)
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    main()
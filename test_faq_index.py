@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+"""
+测试FAQ关键词索引（Aho-Corasick）与逐条扫描的评分一致性，以及二元组倒排索引的容错匹配
+"""
+import os
+import sys
+import json
+import random
+
+# 获取测试脚本所在目录
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, SCRIPT_DIR)
+
+import faq_index
+from faq_index import FaqIndex, normalize, substring_distance
+
+
+def _reference_hits(faq, question):
+    """原始实现：逐条目、逐关键词做子串扫描（问题与关键词同样先归一化）"""
+    q = normalize(question)
+    hits = {}
+    for idx, item in enumerate(faq):
+        primary = item.get("primary", [])
+        secondary = item.get("secondary", [])
+        if not primary and not secondary:
+            count = sum(1 for k in item.get("keywords", []) if normalize(k) in q)
+            if count:
+                hits[idx] = [0, 0, count]
+            continue
+        p = sum(1 for k in primary if normalize(k) in q)
+        s = sum(1 for k in secondary if normalize(k) in q)
+        if p or s:
+            hits[idx] = [p, s, 0]
+    return hits
+
+
+def test_real_faq_matches_reference():
+    """真实 faq.json 上，索引命中数与逐条扫描一致"""
+    print("\n测试真实FAQ命中一致性...")
+    with open(os.path.join(SCRIPT_DIR, "faq.json"), "r", encoding="utf-8") as f:
+        faq = json.load(f)
+    index = FaqIndex(faq)
+
+    questions = [
+        "图书馆几点开门？", "食堂什么时间开？", "图书馆在哪？", "WiFi密码是多少",
+        "wifi怎么连", "图书馆图书馆能打印吗", "", "完全无关的问题",
+    ]
+    with open(os.path.join(SCRIPT_DIR, "logs.csv"), "r", encoding="utf-8") as f:
+        questions += [line.split(",")[1] for line in f.readlines()[1:] if line.count(",") >= 5]
+
+    for q in questions:
+        assert index.match(q) == _reference_hits(faq, q), f"命中不一致: {q}"
+
+    print(f"  ✓ {len(questions)} 个问题命中结果一致")
+
+
+def test_overlapping_and_legacy_keywords():
+    """重叠关键词、重复关键词、大小写、旧格式 keywords 的计数"""
+    print("\n测试重叠与旧格式关键词...")
+    faq = [
+        {"primary": ["图书馆", "图书"], "secondary": ["开门", "开门", "门"], "answer": "a"},
+        {"keywords": ["WiFi", "密码", "wifi"], "answer": "b"},
+        {"primary": ["he", "she", "his", "hers"], "secondary": ["ushers"], "answer": "c"},
+        {"primary": ["只有第一级"], "answer": "d"},
+    ]
+    index = FaqIndex(faq)
+    for q in ["图书馆几点开门", "wifi密码", "ushers", "WIFI", "只有第一级", "sheshe his"]:
+        assert index.match(q) == _reference_hits(faq, q), f"命中不一致: {q}"
+
+    hits = index.match("图书馆几点开门")
+    assert hits[0] == [2, 3, 0], f"重复关键词应分别计数，实际: {hits[0]}"
+    assert index.match("WIFI密码")[1] == [0, 0, 3], "旧格式关键词应忽略大小写并分别计数"
+
+    print("  ✓ 重叠与旧格式关键词计数正确")
+
+
+def test_random_faq_matches_reference():
+    """随机生成的 FAQ 与问题上，索引与逐条扫描一致"""
+    print("\n测试随机FAQ命中一致性...")
+    rng = random.Random(42)
+    alphabet = "图书馆食堂开门时间几点abAB"
+
+    def word():
+        return "".join(rng.choice(alphabet) for _ in range(rng.randint(1, 3)))
+
+    faq = []
+    for _ in range(200):
+        if rng.random() < 0.2:
+            faq.append({"keywords": [word() for _ in range(rng.randint(1, 4))], "answer": "x"})
+        else:
+            faq.append({
+                "primary": [word() for _ in range(rng.randint(1, 4))],
+                "secondary": [word() for _ in range(rng.randint(0, 4))],
+                "answer": "x",
+            })
+    index = FaqIndex(faq)
+
+    for _ in range(300):
+        q = "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 20)))
+        assert index.match(q) == _reference_hits(faq, q), f"命中不一致: {q}"
+
+    print("  ✓ 300 个随机问题命中结果一致")
+
+
+def _lowercase_hits(faq, question):
+    """最初的 faq_answer 扫描：只转小写，不做 NFKC 与去空白"""
+    q = question.lower()
+    hits = {}
+    for idx, item in enumerate(faq):
+        levels = [item.get("primary", []), item.get("secondary", []), []]
+        if not item.get("primary") and not item.get("secondary"):
+            levels = [[], [], item.get("keywords", [])]
+        counts = [sum(1 for k in keywords if k.lower() in q) for keywords in levels]
+        if any(counts):
+            hits[idx] = counts
+    return hits
+
+
+def test_normalized_exact_matching():
+    """归一化后的精确匹配只会比最初的小写扫描多命中（全半角、空格不同的写法），原来的命中数不会变少"""
+    print("\n测试归一化精确匹配...")
+    import router
+
+    with open(os.path.join(SCRIPT_DIR, "faq.json"), "r", encoding="utf-8") as f:
+        faq = json.load(f)
+    index = FaqIndex(faq)
+
+    # 行为变化：这些写法原来一个关键词都不命中，现在与半角、无空格写法命中相同
+    for variant, plain in [("ＷＩＦＩ怎么连", "wifi怎么连"), ("图书 馆几点开门", "图书馆几点开门")]:
+        assert _lowercase_hits(faq, variant) != _lowercase_hits(faq, plain)
+        assert index.match(variant) == index.match(plain) == _lowercase_hits(faq, plain), variant
+        assert router.faq_answer(variant) == router.faq_answer(plain) != router.NO_FAQ_ANSWER, variant
+
+    rng = random.Random(7)
+    alphabet = "图书馆食堂开门abABａＢ "
+    faq = [{"primary": ["".join(rng.choice(alphabet) for _ in range(rng.randint(1, 3))) for _ in range(3)],
+            "secondary": ["".join(rng.choice(alphabet) for _ in range(rng.randint(1, 3))) for _ in range(2)],
+            "answer": "x"} for _ in range(100)]
+    index = FaqIndex(faq)
+    for _ in range(300):
+        q = "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 20)))
+        hits = index.match(q)
+        for idx, old in _lowercase_hits(faq, q).items():
+            assert all(n >= o for n, o in zip(hits[idx], old)), f"命中数变少: {q}"
+
+    print("  ✓ 原有命中保持不变，全半角与空格写法新增精确命中")
+
+
+def test_substring_distance():
+    """最相近子串的编辑距离：替换、插入、删除各算 1，超过上限提前返回 limit + 1"""
+    print("\n测试子串编辑距离...")
+    assert substring_distance("图书馆", "请问图书馆几点开", 1) == 0
+    assert substring_distance("图书馆", "图书官几点开", 1) == 1
+    assert substring_distance("图书馆", "图书大馆在哪", 1) == 1
+    assert substring_distance("图书馆", "图馆几点开", 1) == 1
+    assert substring_distance("图书馆", "食堂几点开", 1) == 2
+    assert substring_distance("图书馆", "", 2) == 3
+    assert normalize("ＷｉＦｉ 密 码") == "wifi密码"
+    print("  ✓ 编辑距离与归一化")
+
+
+def test_fuzzy_match():
+    """错别字近似命中；全半角、大小写、空白不同的写法算精确命中；过短的关键词不计入；每个级别最多计 1 次"""
+    print("\n测试容错匹配...")
+    with open(os.path.join(SCRIPT_DIR, "faq.json"), "r", encoding="utf-8") as f:
+        faq = json.load(f)
+    index = FaqIndex(faq)
+
+    # "图书官" 同时接近 图书馆 与 图书室，只计 1 次
+    assert index.fuzzy_match("图书官几点开")[0] == [1, 0, 0]
+    # 全角、大写、夹空格的写法归一化后是精确命中，不会按 faq_fuzzy 降权
+    wifi = index.match("ｗｉｆｉ怎么连")
+    assert wifi and wifi == index.match("wifi怎么连"), "全角写法应与半角写法精确命中相同条目"
+    assert index.fuzzy_match("ＷＩＦＩ怎么连") == {}
+    assert index.match("图书 馆几点开") == index.match("图书馆几点开")
+    assert index.fuzzy_match("图书馆几点开门").get(0, [0, 0, 0])[0] == 1, "图书室 与 图书馆 相差一个字"
+    exact_only = FaqIndex([{"primary": ["图书馆"], "secondary": ["几点"], "answer": "x"}])
+    assert exact_only.fuzzy_match("图书馆几点开门") == {}, "精确命中的关键词不再算近似命中"
+    # 两个字的关键词、三个字的 secondary 意图短语不做容错
+    small = FaqIndex([{"primary": ["食堂", "图书馆"], "secondary": ["怎么走", "什么时候"], "answer": "x"}])
+    assert small.fuzzy_match("食糖怎么办") == {}
+    assert small.fuzzy_match("图书官什么时侯") == {0: [1, 1, 0]}
+    print("  ✓ 近似命中")
+
+
+def _reference_fuzzy_hits(faq, question, max_edits=1):
+    """原始定义：逐条目、逐关键词在整个问题上算编辑距离（至少共享一个二元组）"""
+    text = normalize(question)
+    text_grams = {text[i:i + 2] for i in range(len(text) - 1)}
+    hits = {}
+    for idx, item in enumerate(faq):
+        levels = [(item.get("primary", []), 0), (item.get("secondary", []), 1)]
+        if not item.get("primary") and not item.get("secondary"):
+            levels = [(item.get("keywords", []), 2)]
+        for keywords, level in levels:
+            for k in keywords:
+                norm = normalize(k)
+                grams = {norm[i:i + 2] for i in range(len(norm) - 1)}
+                if (len(norm) >= faq_index.FUZZY_MIN_LENGTH[level] and norm not in text and grams & text_grams
+                        and substring_distance(norm, text, max_edits) <= max_edits):
+                    hits.setdefault(idx, [0, 0, 0])[level] = 1
+    return hits
+
+
+def test_random_fuzzy_matches_reference():
+    """随机 FAQ 与问题上，倒排索引 + 局部编辑距离与整句逐条计算结果一致"""
+    print("\n测试随机容错匹配一致性...")
+    rng = random.Random(3)
+    alphabet = "图书馆食堂开门时间几点abAB"
+
+    def word():
+        return "".join(rng.choice(alphabet) for _ in range(rng.randint(2, 6)))
+
+    faq = []
+    for _ in range(200):
+        if rng.random() < 0.2:
+            faq.append({"keywords": [word() for _ in range(rng.randint(1, 4))], "answer": "x"})
+        else:
+            faq.append({"primary": [word() for _ in range(rng.randint(1, 3))],
+                        "secondary": [word() for _ in range(rng.randint(1, 3))], "answer": "x"})
+    index = FaqIndex(faq)
+    for max_edits in (1, 2):
+        for _ in range(200):
+            q = "".join(rng.choice(alphabet + " ") for _ in range(rng.randint(0, 20)))
+            assert index.fuzzy_match(q, max_edits) == _reference_fuzzy_hits(faq, q, max_edits), f"命中不一致: {q}"
+    print("  ✓ 400 个随机问题容错命中结果一致")
+
+
+def test_fuzzy_candidates_sublinear():
+    """候选只来自问题二元组的倒排表：FAQ 扩大 100 倍，编辑距离计算次数不随之增长"""
+    print("\n测试容错匹配的候选数...")
+    rng = random.Random(7)
+    alphabet = "abcdefghijklmnopqrstuvwxyz"
+
+    def faq_of(size):
+        return [{"primary": ["".join(rng.choice(alphabet) for _ in range(6))], "secondary": ["hello"],
+                 "answer": str(i)} for i in range(size)] + [{"primary": ["library"], "secondary": ["hours"], "answer": "x"}]
+
+    calls = []
+    saved = faq_index.substring_distance
+    faq_index.substring_distance = lambda *args: calls.append(args) or saved(*args)
+    try:
+        counts = []
+        for size in (100, 10000):
+            index = FaqIndex(faq_of(size))
+            calls.clear()
+            hits = index.fuzzy_match("librery hours")
+            assert hits[size] == [1, 0, 0], hits
+            counts.append(len(calls))
+    finally:
+        faq_index.substring_distance = saved
+    assert counts[1] <= counts[0] * 5 and counts[1] < 100, counts
+    print(f"  ✓ 编辑距离计算次数 {counts[0]} → {counts[1]}（FAQ 100 → 10000 条）")
+
+
+def test_router_fuzzy_route():
+    """路由：精确匹配未命中、容错匹配命中时路由记为 faq_fuzzy；近似命中的条目必须有精确命中的关键词"""
+    print("\n测试容错匹配路由...")
+    import router
+
+    saved = {name: getattr(router, name) for name in ("log_event", "ANSWER_CACHE_ENABLED", "FAQ_FUZZY_ENABLED")}
+    try:
+        router.log_event = lambda *args: None
+        router.ANSWER_CACHE_ENABLED = False
+        router.FAQ_FUZZY_ENABLED = True
+        assert router.faq_answer("图书官几点开") == router.NO_FAQ_ANSWER
+        answer, meta = router.route_question("图书官几点开")
+        assert meta["route"] == "faq_fuzzy" and answer == router.faq_answer("图书馆几点开"), (answer, meta)
+        assert router.fuzzy_faq_answer("图书馆怎么办卡") == router.NO_FAQ_ANSWER, "只有近似的第二级不应命中"
+        assert router.fuzzy_faq_answer("图书官") == router.NO_FAQ_ANSWER, "两级都靠近似匹配时不命中"
+        assert router.plan_routes(["图书官几点开"])[0]["route"] == "faq_fuzzy"
+
+        # 精确命中的分数高于带近似命中的分数，结果不变
+        assert router.route_question("图书馆几点开门")[1]["route"] == "faq"
+        # 全角写法是精确命中，不降权也不记为 faq_fuzzy
+        answer, meta = router.route_question("ＷＩＦＩ怎么连")
+        assert meta["route"] == "faq" and answer == router.faq_answer("wifi怎么连"), (answer, meta)
+        assert router.plan_routes(["ＷＩＦＩ怎么连"])[0]["route"] != "faq_fuzzy"
+
+        router.FAQ_FUZZY_ENABLED = False
+        assert router.plan_routes(["图书官几点开"])[0]["route"] != "faq_fuzzy"
+    finally:
+        for name, value in saved.items():
+            setattr(router, name, value)
+    print("  ✓ faq_fuzzy 路由")
+
+
+def main():
+    """运行所有测试"""
+    print("=" * 60)
+    print("测试FAQ关键词索引")
+    print("=" * 60)
+
+    tests = [
+        test_real_faq_matches_reference,
+        test_overlapping_and_legacy_keywords,
+        test_random_faq_matches_reference,
+        test_normalized_exact_matching,
+        test_substring_distance,
+        test_fuzzy_match,
+        test_random_fuzzy_matches_reference,
+        test_fuzzy_candidates_sublinear,
+        test_router_fuzzy_route,
+    ]
+
+    failed = 0
+    for test in tests:
+        try:
+            test()
+        except AssertionError as e:
+            print(f"  ✗ 测试失败: {e}")
+            failed += 1
+
+    print("\n" + "=" * 60)
+    if failed == 0:
+        print("✓ 所有测试通过!")
+    else:
+        print(f"✗ {failed} 个测试失败")
+        sys.exit(1)
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    main()
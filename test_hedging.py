@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+"""
+测试对冲路由（用假的模型函数，不加载真实模型、不调用API）
+"""
+import os
+import sys
+import time
+
+# 获取测试脚本所在目录
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, SCRIPT_DIR)
+
+from hedging import HedgedCall
+
+
+PROMPT_TOKENS = 20
+
+
+def _fake_big_stream(pieces=("大模型", "的详细", "回答。"), step=0.05, log=None):
+    def stream(question, history=None, usage_info=None):
+        if log is not None:
+            log.append("started")
+        usage_info["prompt_tokens_after"] = PROMPT_TOKENS
+        try:
+            for p in pieces:
+                time.sleep(step)
+                yield p
+        except GeneratorExit:
+            if log is not None:
+                log.append("closed")
+            raise
+        usage_info["total_tokens"] = 30
+        return "".join(pieces)
+    return stream
+
+
+def test_cancel_before_start():
+    """延迟到期前取消：大模型不会被调用，浪费为0"""
+    print("\n测试延迟期内取消...")
+    log = []
+    call = HedgedCall(_fake_big_stream(log=log), "问题", delay=0.5)
+    time.sleep(0.05)
+    assert call.cancel() == 0
+    time.sleep(0.6)
+    assert log == [] and not call.started, "取消后不应再启动大模型调用"
+    print("  ✓ 未启动的调用被取消")
+
+
+def test_cancel_in_flight_closes_stream():
+    """进行中取消：关闭流，按提示词 + 已收到的输出估算浪费"""
+    print("\n测试进行中取消...")
+    log = []
+    call = HedgedCall(_fake_big_stream(step=0.1, log=log), "问题", delay=0)
+    time.sleep(0.15)
+    wasted = call.cancel()
+    call._done.wait(1)
+    assert call.started and not call.finished
+    assert "closed" in log, f"应关闭进行中的流，log={log}"
+    assert wasted >= PROMPT_TOKENS + 1, f"已发出的请求中提示词同样计费: {wasted}"
+    print(f"  ✓ 进行中的调用被中止，估算浪费 {wasted} token")
+
+
+def test_result_starts_immediately():
+    """小模型未通过检查时，result() 跳过剩余延迟立即启动并等待结果"""
+    print("\n测试提前启动并取结果...")
+    call = HedgedCall(_fake_big_stream(step=0.01), "问题", delay=10)
+    start = time.time()
+    answer, usage = call.result(timeout=2)
+    assert answer == "大模型的详细回答。" and usage["total_tokens"] == 30
+    assert time.time() - start < 1, "不应等满延迟时间"
+    print("  ✓ 立即启动并返回大模型回答")
+
+
+def test_chunks_replays_received_parts():
+    """chunks()：先补发取结果前已收到的增量，再继续转发，返回完整答案"""
+    print("\n测试流式取对冲结果...")
+    call = HedgedCall(_fake_big_stream(step=0.05), "问题", delay=0)
+    time.sleep(0.08)
+    stream = call.chunks()
+    parts = []
+    while True:
+        try:
+            parts.append(next(stream))
+        except StopIteration as stop:
+            answer = stop.value
+            break
+    assert parts == ["大模型", "的详细", "回答。"] and answer == "大模型的详细回答。", (parts, answer)
+    print("  ✓ 已收到的增量被补发")
+
+
+def test_router_hedged_mode():
+    """路由对冲模式：记录胜出方"""
+    print("\n测试路由对冲模式...")
+    try:
+        import router
+    except Exception as e:
+        print(f"  跳过: router模块未加载: {e}")
+        return
+
+    saved = (router.small_model_answer, router.big_model_answer_stream, router.log_event,
+             router.SEMANTIC_FAQ_ENABLED, router.ANSWER_CACHE_ENABLED, router.HEDGE_ENABLED)
+    router.big_model_answer_stream = _fake_big_stream(step=0.01)
+    router.log_event = lambda *args: None
+    router.SEMANTIC_FAQ_ENABLED = False
+    router.ANSWER_CACHE_ENABLED = False
+    router.HEDGE_ENABLED = True
+    question = "宿舍晚上几点关门，可以晚归吗？"  # 复杂度3：立即启动对冲
+    try:
+        router.small_model_answer = lambda q, history=None, stats=None: "宿舍晚上11点关门，晚归需登记。"
+        answer, meta = router.route_question(question)
+        assert meta["route"] == "small_model" and meta["hedge"]["winner"] == "small"
+        assert meta["hedge"]["delay"] == 0
+
+        router.small_model_answer = lambda q, history=None, stats=None: "抱歉，我不知道。"
+        answer, meta = router.route_question(question)
+        assert meta["route"] == "big_model_fallback" and meta["hedge"]["winner"] == "big"
+        assert answer == "大模型的详细回答。" and meta["cost"] > 0
+        print("  ✓ 对冲模式按置信度选择胜出方")
+    finally:
+        (router.small_model_answer, router.big_model_answer_stream, router.log_event,
+         router.SEMANTIC_FAQ_ENABLED, router.ANSWER_CACHE_ENABLED, router.HEDGE_ENABLED) = saved
+
+
+def test_router_stream_hedged_mode():
+    """流式路由同样使用对冲：小模型胜出时按提示词计入浪费，未通过时转发已在路上的大模型回答"""
+    print("\n测试流式路由对冲模式...")
+    try:
+        import router
+    except Exception as e:
+        print(f"  跳过: router模块未加载: {e}")
+        return
+
+    def small_stream(text):
+        def stream(question, history=None, stats=None):
+            time.sleep(0.1)
+            yield text
+            return text
+        return stream
+
+    log = []
+    saved = (router.small_model_answer_stream, router.big_model_answer_stream, router.log_event,
+             router.SEMANTIC_FAQ_ENABLED, router.ANSWER_CACHE_ENABLED, router.HEDGE_ENABLED,
+             router._small_model_available)
+    router.big_model_answer_stream = _fake_big_stream(step=0.05, log=log)
+    router.log_event = lambda *args: None
+    router.SEMANTIC_FAQ_ENABLED = False
+    router.ANSWER_CACHE_ENABLED = False
+    router.HEDGE_ENABLED = True
+    router._small_model_available = lambda: True
+    question = "宿舍晚上几点关门，可以晚归吗？"  # 复杂度3：立即启动对冲
+    try:
+        router.small_model_answer_stream = small_stream("宿舍晚上11点关门，晚归需登记。")
+        chunks, result = router.route_question_stream(question)
+        list(chunks)
+        meta = result["meta"]
+        assert meta["route"] == "small_model" and meta["hedge"]["winner"] == "small", meta
+        assert meta["hedge"]["wasted_tokens"] >= PROMPT_TOKENS and meta["cost"] > 0, "已发出的对冲请求应计入成本"
+        time.sleep(0.2)
+        assert log == ["started", "closed"], f"小模型胜出后应关闭对冲的流: {log}"
+
+        log.clear()
+        router.small_model_answer_stream = small_stream("抱歉，我不知道。")
+        chunks, result = router.route_question_stream(question)
+        text = "".join(chunks)
+        meta = result["meta"]
+        assert meta["route"] == "big_model_fallback" and meta["hedge"]["winner"] == "big", meta
+        assert result["answer"] == "大模型的详细回答。" and text.endswith("大模型的详细回答。"), text
+        assert log == ["started"], f"应复用对冲调用，不再另发请求: {log}"
+        print("  ✓ 流式路由按置信度选择胜出方")
+    finally:
+        (router.small_model_answer_stream, router.big_model_answer_stream, router.log_event,
+         router.SEMANTIC_FAQ_ENABLED, router.ANSWER_CACHE_ENABLED, router.HEDGE_ENABLED,
+         router._small_model_available) = saved
+
+
+def main():
+    """运行所有测试"""
+    print("=" * 60)
+    print("测试对冲路由")
+    print("=" * 60)
+
+    tests = [
+        test_cancel_before_start,
+        test_cancel_in_flight_closes_stream,
+        test_result_starts_immediately,
+        test_chunks_replays_received_parts,
+        test_router_hedged_mode,
+        test_router_stream_hedged_mode,
+    ]
+
+    failed = 0
+    for test in tests:
+        try:
+            test()
+        except AssertionError as e:
+            print(f"  ✗ 测试失败: {e}")
+            failed += 1
+
+    print("\n" + "=" * 60)
+    if failed == 0:
+        print("✓ 所有测试通过!")
+    else:
+        print(f"✗ {failed} 个测试失败")
+        sys.exit(1)
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+测试按 token 预算压缩对话历史（字符级假分词器与估算计数，不加载真实模型、不调用API）
+"""
+import os
+import sys
+
+# 获取测试脚本所在目录
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, SCRIPT_DIR)
+
+from history_compactor import (
+    ELLIPSIS, MIN_SHORTENED_TOKENS, EstimateCounter, TokenizerCounter, compact_messages, prompt_tokens,
+)
+
+
+class CharTokenizer:
+    """每个字符一个 token 的假分词器，只实现 TokenizerCounter 用到的接口"""
+
+    def __init__(self):
+        self.encode_calls = 0
+
+    def encode(self, text, add_special_tokens=False):
+        self.encode_calls += 1
+        return [ord(c) for c in text]
+
+    def decode(self, ids, skip_special_tokens=True):
+        return "".join(chr(i) for i in ids)
+
+
+def _conversation(rounds: int, answer_len: int = 60):
+    history = []
+    for i in range(rounds):
+        history.append({"role": "user", "content": f"第{i}个问题？"})
+        history.append({"role": "assistant", "content": str(i) * answer_len})
+    return history
+
+
+def test_within_budget_unchanged():
+    """没有超出预算时原样返回，before == after"""
+    print("\n测试预算内不压缩...")
+    counter = TokenizerCounter(CharTokenizer())
+    messages = [{"role": "system", "content": "系统提示"}] + _conversation(2) + [{"role": "user", "content": "问题"}]
+    stats = {}
+    result = compact_messages(messages, counter, budget=10_000, stats=stats)
+    assert result == messages and result is not messages
+    assert stats["prompt_tokens_before"] == stats["prompt_tokens_after"] == prompt_tokens(messages, counter)
+    assert stats["history_dropped"] == stats["history_shortened"] == 0
+    print(f"  ✓ {stats['prompt_tokens_before']} tokens，未压缩")
+
+
+def test_oldest_turns_dropped_or_shortened_first():
+    """超出预算时先处理最早的历史：太短的丢弃，能缩短的保留开头"""
+    print("\n测试压缩顺序...")
+    counter = TokenizerCounter(CharTokenizer())
+    system = {"role": "system", "content": "你是校园问答助手。"}
+    question = {"role": "user", "content": "图书馆周末几点开门？"}
+    history = _conversation(3)
+    messages = [system] + history + [question]
+    full = prompt_tokens(messages, counter)
+
+    # 预算只比完整提示少 30 个 token：第一条短问题被丢弃，第一条长回答被缩短
+    stats = {}
+    result = compact_messages(messages, counter, budget=full - 30, stats=stats)
+    assert result[0] == system and result[-1] == question
+    assert result[1]["role"] == "assistant" and result[1]["content"].endswith(ELLIPSIS)
+    assert result[1]["content"].startswith("0"), "缩短时保留开头"
+    assert result[2:-1] == history[2:], "较新的历史不受影响"
+    assert stats["history_dropped"] == 1 and stats["history_shortened"] == 1
+    assert stats["prompt_tokens_after"] <= full - 30
+    assert stats["prompt_tokens_after"] == prompt_tokens(result, counter)
+
+    # 预算很小：历史全部丢弃，但系统提示与当前问题完整保留
+    stats = {}
+    result = compact_messages(messages, counter, budget=5, stats=stats)
+    assert result == [system, question], result
+    assert stats["history_dropped"] == len(history)
+    assert stats["prompt_tokens_after"] == prompt_tokens([system, question], counter) > 5
+    print(f"  ✓ {full} -> 预算内，当前问题不截断")
+
+
+def test_short_remainder_dropped():
+    """缩短后不足 MIN_SHORTENED_TOKENS 时整条丢弃，不留半句话"""
+    print("\n测试过短的剩余部分...")
+    counter = TokenizerCounter(CharTokenizer())
+    history = [{"role": "assistant", "content": "x" * (MIN_SHORTENED_TOKENS + 5)}]
+    messages = history + [{"role": "user", "content": "问题"}]
+    stats = {}
+    result = compact_messages(messages, counter, budget=prompt_tokens(messages, counter) - 10, stats=stats)
+    assert result == messages[-1:] and stats["history_dropped"] == 1 and stats["history_shortened"] == 0
+    print("  ✓ 丢弃而不是留下残句")
+
+
+def test_counter_caches_encodings():
+    """同一段历史在每轮对话中重复计数，只分词一次"""
+    print("\n测试计数缓存...")
+    tokenizer = CharTokenizer()
+    counter = TokenizerCounter(tokenizer)
+    for _ in range(5):
+        assert counter.count("同一段历史") == 5
+    assert tokenizer.encode_calls == 1
+    assert counter.truncate("同一段历史", 2) == "同一"
+    print("  ✓ 已缓存")
+
+
+def test_estimate_counter():
+    """估算：汉字与标点各 1 个，英文单词约 4 字符 1 个；截断不拆开单词"""
+    print("\n测试估算计数...")
+    counter = EstimateCounter()
+    assert counter.count("图书馆几点开门？") == 8
+    assert counter.count("hello world") == 4
+    assert counter.count("") == 0
+    assert counter.truncate("图书馆 library 开门", 4) == "图书馆 "
+    assert counter.count(counter.truncate("一二三四五六", 3)) == 3
+    print("  ✓ 估算与截断")
+
+
+def test_big_model_messages_and_router_meta():
+    """大模型消息按 BIG_MODEL_PROMPT_BUDGET 压缩；路由 meta 中报告压缩前后的 token 数"""
+    print("\n测试大模型与路由...")
+    import big_model
+    import router
+
+    saved_budget = big_model.BIG_MODEL_PROMPT_BUDGET
+    saved = {name: getattr(router, name) for name in ("big_model_answer", "log_event", "ANSWER_CACHE_ENABLED")}
+    try:
+        history = _conversation(3, answer_len=400)
+        big_model.BIG_MODEL_PROMPT_BUDGET = 300
+        stats = {}
+        messages = big_model._build_messages("什么是机器学习？", history, stats)
+        assert messages[-1]["content"] == "什么是机器学习？"
+        assert stats["prompt_tokens_before"] > 300 >= stats["prompt_tokens_after"], stats
+
+        def fake_big_model(question, history=None):
+            usage = {}
+            big_model._build_messages(question, history, usage)
+            usage.update({"prompt_tokens": usage["prompt_tokens_after"], "completion_tokens": 5, "total_tokens": 5})
+            return "大模型的回答。", usage
+
+        router.big_model_answer = fake_big_model
+        router.log_event = lambda *args: None
+        router.ANSWER_CACHE_ENABLED = False
+        long_question = "请详细分析并比较机器学习与深度学习的原理、优缺点以及在自然语言处理中的应用？"
+        _, meta = router.route_question(long_question, history=history)
+        big_stats = meta["big_model_stats"]
+        assert big_stats["prompt_tokens_before"] > big_stats["prompt_tokens_after"], meta
+    finally:
+        big_model.BIG_MODEL_PROMPT_BUDGET = saved_budget
+        for name, value in saved.items():
+            setattr(router, name, value)
+    print(f"  ✓ meta 报告 {big_stats['prompt_tokens_before']} -> {big_stats['prompt_tokens_after']} tokens")
+
+
+def main():
+    """运行所有测试"""
+    print("=" * 60)
+    print("测试对话历史压缩")
+    print("=" * 60)
+
+    tests = [
+        test_within_budget_unchanged,
+        test_oldest_turns_dropped_or_shortened_first,
+        test_short_remainder_dropped,
+        test_counter_caches_encodings,
+        test_estimate_counter,
+        test_big_model_messages_and_router_meta,
+    ]
+
+    failed = 0
+    for test in tests:
+        try:
+            test()
+        except AssertionError as e:
+            print(f"  ✗ 测试失败: {e}")
+            failed += 1
+
+    print("\n" + "=" * 60)
+    if failed == 0:
+        print("✓ 所有测试通过!")
+    else:
+        print(f"✗ {failed} 个测试失败")
+        sys.exit(1)
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+测试SQLite请求日志存储
+"""
+import csv
+import os
+import sys
+import shutil
+import tempfile
+import time
+from datetime import datetime
+
+# 获取测试脚本所在目录
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, SCRIPT_DIR)
+
+from log_store import LogStore
+
+
+def _iso(ts):
+    return datetime.fromtimestamp(ts).isoformat(timespec="seconds")
+
+
+def _make_store(**kwargs):
+    temp_dir = tempfile.mkdtemp()
+    return LogStore(os.path.join(temp_dir, "logs.db"), **kwargs), temp_dir
+
+
+def test_queries():
+    """最近N条、按路由和时间段查询、聚合统计"""
+    print("\n测试日志查询...")
+    store, temp_dir = _make_store()
+    try:
+        base = 1_700_000_000  # 整点附近的固定时间，避免跨小时边界的不确定性
+        base -= base % 3600
+        store.append([
+            [_iso(base + 10), "图书馆几点开门", 0, "faq", 0.01, 0],
+            [_iso(base + 20), "宿舍可以养猫吗", 2, "small_model", 1.5, 0],
+            [_iso(base + 30), "为什么要对比分析", 5, "big_model", 3.0, 0.2],
+            [_iso(base + 3700), "校园卡丢了怎么办", 2, "small_model", 2.5, 0],
+        ])
+
+        last = store.last(2)
+        assert [r["question"] for r in last] == ["为什么要对比分析", "校园卡丢了怎么办"], "应按时间先后返回最近记录"
+        assert last[0]["timestamp"] == _iso(base + 30) and last[0]["cost"] == 0.2
+
+        rows = store.by_route("small_model", start=base, end=base + 3600)
+        assert [r["question"] for r in rows] == ["宿舍可以养猫吗"]
+
+        stats = store.aggregate()
+        assert stats["small_model"]["count"] == 2 and abs(stats["small_model"]["avg_time"] - 2.0) < 1e-9
+        assert stats["small_model"]["max_time"] == 2.5 and stats["big_model"]["total_cost"] == 0.2
+
+        first_hour = store.aggregate(start=base, end=base + 3600)
+        assert first_hour["small_model"]["count"] == 1
+        assert list(store.aggregate(route="faq")) == ["faq"]
+        print("  ✓ 查询与聚合结果正确")
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+def test_compaction_keeps_rollups():
+    """按保留天数和最大行数清理明细，小时汇总保留"""
+    print("\n测试日志清理...")
+    store, temp_dir = _make_store(retention_days=1, max_rows=3, compact_every=0)
+    try:
+        now = time.time()
+        store.append([[_iso(now - 3 * 86400), "很久以前", 1, "faq", 0.1, 0]])
+        store.append([[_iso(now - i), f"问题{i}", 1, "faq", 0.1, 0] for i in range(5, 0, -1)])
+
+        deleted = store.compact()
+        assert deleted == 3, f"应删除1条过期和2条超出行数的记录，实际 {deleted}"
+        assert [r["question"] for r in store.last(10)] == ["问题3", "问题2", "问题1"]
+        assert store.aggregate()["faq"]["count"] == 6, "小时汇总不应被清理"
+        print("  ✓ 清理策略正确")
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+def test_import_csv_once():
+    """导入旧的 logs.csv，跳过表头和格式不对的行，重复导入被忽略"""
+    print("\n测试导入CSV日志...")
+    store, temp_dir = _make_store()
+    try:
+        csv_path = os.path.join(temp_dir, "logs.csv")
+        with open(csv_path, "w", encoding="utf-8", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["timestamp", "question", "score", "route", "response_time", "cost"])
+            writer.writerow(["2025-01-01T08:00:00", "带,逗号的问题", 1, "faq", 0.01, 0])
+            writer.writerow(["坏行"])
+            writer.writerow(["2025-01-01T09:00:00", "问题二", 3, "big_model", 2.0, 0.5])
+
+        assert store.import_csv(csv_path) == 2
+        assert store.import_csv(csv_path) == 0, "同一文件不应重复导入"
+        rows = store.last(5)
+        assert rows[0]["question"] == "带,逗号的问题" and rows[1]["route"] == "big_model"
+        print("  ✓ 导入正确且只导入一次")
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+def test_log_event_sqlite_backend():
+    """LOG_BACKEND=sqlite 时 log_event 写入日志存储"""
+    print("\n测试log_event写入SQLite...")
+    try:
+        import utils
+    except Exception as e:
+        print(f"  跳过: utils模块未加载: {e}")
+        return
+    store, temp_dir = _make_store()
+    saved = (utils._log_store, utils.LOG_BACKEND)
+    utils._log_store = store
+    utils.LOG_BACKEND = "sqlite"
+    try:
+        utils.log_event("诊断测试", 0, "test", 0.001, 0.0)
+        assert utils.flush_logs(timeout=2)
+        assert store.last(1)[0]["question"] == "诊断测试"
+        print("  ✓ 写入日志存储")
+    finally:
+        utils._log_store, utils.LOG_BACKEND = saved
+        shutil.rmtree(temp_dir)
+
+
+def main():
+    """运行所有测试"""
+    print("=" * 60)
+    print("测试SQLite请求日志存储")
+    print("=" * 60)
+
+    tests = [
+        test_queries,
+        test_compaction_keeps_rollups,
+        test_import_csv_once,
+        test_log_event_sqlite_backend,
+    ]
+
+    failed = 0
+    for test in tests:
+        try:
+            test()
+        except AssertionError as e:
+            print(f"  ✗ 测试失败: {e}")
+            failed += 1
+
+    print("\n" + "=" * 60)
+    if failed == 0:
+        print("✓ 所有测试通过!")
+    else:
+        print(f"✗ {failed} 个测试失败")
+        sys.exit(1)
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+测试日志后台批量写入
+"""
+import csv
+import os
+import sys
+import shutil
+import tempfile
+import threading
+import time
+
+# 获取测试脚本所在目录
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, SCRIPT_DIR)
+
+from log_writer import BackgroundWriter
+
+
+def test_batches_by_size_and_interval():
+    """攒够 batch_size 条立即写出，不足时到达间隔后写出"""
+    print("\n测试按条数与间隔写出...")
+    batches = []
+    writer = BackgroundWriter(lambda rows: batches.append(list(rows)), flush_interval=0.2, batch_size=3)
+    for i in range(3):
+        writer.put(i)
+    time.sleep(0.1)
+    assert batches == [[0, 1, 2]], f"攒够3条应立即写出，实际: {batches}"
+
+    writer.put(3)
+    time.sleep(0.05)
+    assert len(batches) == 1, "不足一批时应等待间隔"
+    time.sleep(0.3)
+    assert batches[-1] == [3], "到达间隔后应写出"
+    writer.close()
+    print("  ✓ 按条数与间隔分批写出")
+
+
+def test_flush_and_close_write_everything():
+    """flush 等待入队记录写完；close 写出剩余记录"""
+    print("\n测试flush与close...")
+    rows = []
+    writer = BackgroundWriter(rows.extend, flush_interval=10, batch_size=1000)
+    threads = [threading.Thread(target=lambda k=k: [writer.put((k, i)) for i in range(50)]) for k in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert writer.flush(timeout=2) and len(rows) == 200
+
+    writer.put("last")
+    writer.close()
+    assert rows[-1] == "last" and writer.written == 201
+    print("  ✓ 没有丢失记录")
+
+
+def test_failed_write_is_retried():
+    """写入失败时保留记录，下次重试"""
+    print("\n测试写入失败重试...")
+    rows = []
+    failures = [1]
+
+    def write(batch):
+        if failures:
+            failures.pop()
+            raise OSError("磁盘忙")
+        rows.extend(batch)
+
+    writer = BackgroundWriter(write, flush_interval=0.05, batch_size=1)
+    writer.put("a")
+    time.sleep(0.2)
+    assert writer.flush(timeout=1) and rows == ["a"]
+    writer.close()
+    print("  ✓ 失败后重试成功")
+
+
+def test_log_event_csv_format():
+    """log_event 不阻塞，flush_logs 后文件格式与原来一致（表头只写一次）"""
+    print("\n测试log_event写入格式...")
+    try:
+        import utils
+    except Exception as e:
+        print(f"  跳过: utils模块未加载: {e}")
+        return
+    temp_dir = tempfile.mkdtemp()
+    saved = (utils.LOG_PATH, utils.LOG_BACKEND)
+    utils.LOG_PATH = os.path.join(temp_dir, "logs.csv")
+    utils.LOG_BACKEND = "csv"
+    try:
+        utils.log_event("测试问题", 1, "faq", 0.1, 0.0)
+        utils.log_event("带,逗号的问题", 2, "small_model", 0.2, 0.5)
+        assert utils.flush_logs(timeout=2)
+        with open(utils.LOG_PATH, "r", encoding="utf-8", newline="") as f:
+            rows = list(csv.reader(f))
+        assert rows[0] == utils.LOG_HEADER and len(rows) == 3
+        assert rows[2][1:] == ["带,逗号的问题", "2", "small_model", "0.2", "0.5"]
+        print("  ✓ CSV格式正确")
+    finally:
+        utils.LOG_PATH, utils.LOG_BACKEND = saved
+        shutil.rmtree(temp_dir)
+
+
+def main():
+    """运行所有测试"""
+    print("=" * 60)
+    print("测试日志后台批量写入")
+    print("=" * 60)
+
+    tests = [
+        test_batches_by_size_and_interval,
+        test_flush_and_close_write_everything,
+        test_failed_write_is_retried,
+        test_log_event_csv_format,
+    ]
+
+    failed = 0
+    for test in tests:
+        try:
+            test()
+        except AssertionError as e:
+            print(f"  ✗ 测试失败: {e}")
+            failed += 1
+
+    print("\n" + "=" * 60)
+    if failed == 0:
+        print("✓ 所有测试通过!")
+    else:
+        print(f"✗ {failed} 个测试失败")
+        sys.exit(1)
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    main()
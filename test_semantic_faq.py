@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+"""
+测试FAQ语义检索层（使用确定性的假向量，不加载真实模型）
+"""
+import os
+import sys
+import shutil
+import tempfile
+import threading
+import time
+import zlib
+
+import numpy as np
+
+# 获取测试脚本所在目录
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, SCRIPT_DIR)
+
+import semantic_faq
+
+DIM = 256
+
+
+def _fake_encode(texts):
+    """字符二元组哈希向量：字面越相近，余弦相似度越高"""
+    matrix = np.zeros((len(texts), DIM), dtype=np.float32)
+    for row, text in enumerate(texts):
+        text = text.replace(semantic_faq.QUERY_INSTRUCTION, "")
+        for a, b in zip(text, text[1:]):
+            matrix[row, zlib.crc32((a + b).encode("utf-8")) % DIM] += 1.0
+    matrix /= np.linalg.norm(matrix, axis=1, keepdims=True) + 1e-12
+    return matrix
+
+
+FAQ = [
+    {"primary": ["图书馆"], "secondary": ["开门", "几点"], "answer": "图书馆早上8点开门。"},
+    {"primary": ["食堂"], "secondary": ["营业", "时间"], "answer": "食堂早餐6:30开始营业。"},
+    {"keywords": ["校园网", "wifi"], "answer": "校园网账号为学号。"},
+]
+
+
+def _fake_load_model():
+    semantic_faq._tokenizer = semantic_faq._model = "fake"
+
+
+def _with_fake_encoder(test):
+    def wrapper():
+        temp_dir = tempfile.mkdtemp()
+        saved = (semantic_faq.encode, semantic_faq._load_model, semantic_faq._tokenizer, semantic_faq._model,
+                 semantic_faq.SEMANTIC_FAQ_EMBEDDINGS_PATH,
+                 semantic_faq._index, semantic_faq._load_failed, semantic_faq._build_failed_at)
+        try:
+            semantic_faq.encode = _fake_encode
+            semantic_faq._load_model = _fake_load_model
+            semantic_faq._tokenizer = semantic_faq._model = None
+            semantic_faq.SEMANTIC_FAQ_EMBEDDINGS_PATH = os.path.join(temp_dir, "emb.npz")
+            semantic_faq._index = None
+            semantic_faq._load_failed = False
+            semantic_faq._build_failed_at = 0.0
+            test()
+        finally:
+            (semantic_faq.encode, semantic_faq._load_model, semantic_faq._tokenizer, semantic_faq._model,
+             semantic_faq.SEMANTIC_FAQ_EMBEDDINGS_PATH,
+             semantic_faq._index, semantic_faq._load_failed, semantic_faq._build_failed_at) = saved
+            shutil.rmtree(temp_dir)
+    wrapper.__name__ = test.__name__
+    wrapper.__doc__ = test.__doc__
+    return wrapper
+
+
+@_with_fake_encoder
+def test_threshold_and_persistence():
+    """超过阈值返回答案，低于阈值返回 None；向量矩阵持久化并随FAQ变化重建"""
+    print("\n测试语义检索阈值与持久化...")
+    semantic_faq.build_index(FAQ)
+    answer, sim = semantic_faq.semantic_faq_answer("食堂营业时间是", FAQ, threshold=0.3)
+    assert answer == FAQ[1]["answer"], f"应匹配食堂条目，实际: {answer}"
+
+    answer, sim = semantic_faq.semantic_faq_answer("完全无关的内容", FAQ, threshold=0.3)
+    assert answer is None and sim < 0.3, "低于阈值不应返回答案"
+
+    path = semantic_faq.SEMANTIC_FAQ_EMBEDDINGS_PATH
+    assert os.path.exists(path), "向量矩阵应持久化到磁盘"
+    mtime = os.path.getmtime(path)
+
+    # 同样内容的新 FAQ 列表对象：直接复用磁盘上的矩阵
+    semantic_faq.search("食堂", [dict(item) for item in FAQ])
+    assert os.path.getmtime(path) == mtime, "FAQ内容未变时不应重建向量"
+
+    # FAQ 内容变化：重建
+    changed = FAQ + [{"primary": ["体育馆"], "secondary": ["开放"], "answer": "体育馆全天开放。"}]
+    time.sleep(0.01)
+    results = semantic_faq.search("体育馆开放吗", changed, top_k=2)
+    assert results[0][0] == 3, f"新条目应排第一，实际: {results}"
+    assert len(results) == 2 and results[0][1] >= results[1][1], "结果应按相似度降序"
+    print("  ✓ 阈值判断与持久化正确")
+
+
+@_with_fake_encoder
+@_with_fake_encoder
+def test_lookup_latency_at_scale():
+    """5 万条目的向量检索（不含问题编码）保持在毫秒级"""
+    print("\n测试大规模检索耗时...")
+    rng = np.random.default_rng(0)
+    matrix = rng.standard_normal((50000, 512)).astype(np.float32)
+    matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+    faq = [{"answer": str(i)} for i in range(len(matrix))]
+
+    # 直接注入已编码的索引，问题向量取第 123 行
+    semantic_faq._index = (faq, matrix)
+    semantic_faq.encode = lambda texts: matrix[123:124]
+
+    start = time.perf_counter()
+    for _ in range(20):
+        results = semantic_faq.search("问题", faq, top_k=3)
+    elapsed = (time.perf_counter() - start) / 20
+    assert results[0][0] == 123 and abs(results[0][1] - 1.0) < 1e-4, f"检索结果错误: {results}"
+    print(f"  ✓ 单次检索 {elapsed * 1000:.2f} ms")
+
+
+def _wait_for_build(timeout: float = 5.0):
+    deadline = time.time() + timeout
+    while semantic_faq._building is not None and time.time() < deadline:
+        time.sleep(0.01)
+
+
+@_with_fake_encoder
+def test_request_path_never_builds():
+    """请求线程不建索引：未就绪时按未命中处理并在后台只建一次；热更新期间用配对的旧 FAQ 与矩阵"""
+    print("\n测试请求路径不建索引...")
+    calls = []
+    release = threading.Event()
+
+    def slow_encode(texts):
+        if not texts[0].startswith(semantic_faq.QUERY_INSTRUCTION):
+            calls.append(len(texts))
+            release.wait(5)
+        return _fake_encode(texts)
+
+    semantic_faq.encode = slow_encode
+    threads = [threading.Thread(target=lambda: results.append(
+        semantic_faq.semantic_faq_answer("食堂营业时间是", FAQ, threshold=0.3))) for _ in range(8)]
+    results = []
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(1)
+    assert results == [(None, 0.0)] * 8, f"索引未就绪时应立即按未命中返回: {results}"
+    release.set()
+    _wait_for_build()
+    assert calls == [len(FAQ)], f"并发的首次请求只应建一次索引: {calls}"
+    assert semantic_faq.semantic_faq_answer("食堂营业时间是", FAQ, threshold=0.3)[0] == FAQ[1]["answer"]
+
+    # 热更新：新列表的索引建好前，答案取自与旧矩阵配对的旧 FAQ，不会按下标错配
+    release.clear()
+    reordered = [FAQ[2], FAQ[0], FAQ[1]]
+    answer, _ = semantic_faq.semantic_faq_answer("食堂营业时间是", reordered, threshold=0.3)
+    assert answer == FAQ[1]["answer"], answer
+    release.set()
+    _wait_for_build()
+    assert semantic_faq._index[0] is reordered
+    print("  ✓ 首次请求不阻塞，索引只建一次，热更新期间不错配")
+
+
+@_with_fake_encoder
+def test_cached_matrix_without_encoder():
+    """矩阵已从文件读出、向量模型未加载时，请求按未命中处理，模型在后台加载，不在请求线程里加载"""
+    print("\n测试模型未加载时跳过...")
+    semantic_faq._index = (FAQ, _fake_encode([semantic_faq._item_text(item) for item in FAQ]))
+    loading = threading.Event()
+    release = threading.Event()
+    request_thread = threading.current_thread()
+
+    def slow_load():
+        assert threading.current_thread() is not request_thread, "请求线程不应加载向量模型"
+        loading.set()
+        release.wait(5)
+        _fake_load_model()
+
+    semantic_faq._load_model = slow_load
+    assert semantic_faq.semantic_faq_answer("食堂营业时间是", FAQ, threshold=0.3) == (None, 0.0)
+    assert loading.wait(1), "模型未加载时应在后台加载"
+    release.set()
+    _wait_for_build()
+    assert semantic_faq.semantic_faq_answer("食堂营业时间是", FAQ, threshold=0.3)[0] == FAQ[1]["answer"]
+    print("  ✓ 模型加载完成前跳过语义层")
+
+
+@_with_fake_encoder
+def test_transient_error_does_not_disable():
+    """单次编码失败只跳过本次请求；只有模型加载失败才关闭语义检索层"""
+    print("\n测试错误处理...")
+    semantic_faq.build_index(FAQ)
+
+    def broken_encode(texts):
+        raise RuntimeError("临时错误")
+
+    semantic_faq.encode = broken_encode
+    assert semantic_faq.semantic_faq_answer("食堂营业时间是", FAQ, threshold=0.3) == (None, 0.0)
+    assert not semantic_faq._load_failed, "编码错误不应永久关闭语义检索"
+    semantic_faq.encode = _fake_encode
+    assert semantic_faq.semantic_faq_answer("食堂营业时间是", FAQ, threshold=0.3)[0] == FAQ[1]["answer"]
+    print("  ✓ 临时错误后恢复")
+
+
+def main():
+    """运行所有测试"""
+    print("=" * 60)
+    print("测试FAQ语义检索")
+    print("=" * 60)
+
+    tests = [
+        test_threshold_and_persistence,
+        test_lookup_latency_at_scale,
+        test_request_path_never_builds,
+        test_cached_matrix_without_encoder,
+        test_transient_error_does_not_disable,
+    ]
+
+    failed = 0
+    for test in tests:
+        try:
+            test()
+        except AssertionError as e:
+            print(f"  ✗ 测试失败: {e}")
+            failed += 1
+
+    print("\n" + "=" * 60)
+    if failed == 0:
+        print("✓ 所有测试通过!")
+    else:
+        print(f"✗ {failed} 个测试失败")
+        sys.exit(1)
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    main()
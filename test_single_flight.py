@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+"""
+测试相同问题并发合并（用假的模型函数，不加载真实模型、不调用API）
+"""
+import os
+import sys
+import threading
+import time
+
+# 获取测试脚本所在目录
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, SCRIPT_DIR)
+
+from single_flight import FlightAbandoned, SingleFlight
+
+ROUTER_STUBS = (
+    "small_model_answer", "small_model_answer_stream", "big_model_answer", "low_confidence", "log_event",
+    "SEMANTIC_FAQ_ENABLED", "ANSWER_CACHE_ENABLED", "HEDGE_ENABLED", "WARMUP_GATE", "SINGLE_FLIGHT_ENABLED",
+)
+
+
+def _run_threads(target, count):
+    """并发运行 count 个线程，返回各线程的返回值"""
+    results = [None] * count
+    threads = [threading.Thread(target=lambda i=i: results.__setitem__(i, target(i))) for i in range(count)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(timeout=10)
+    return results
+
+
+def test_do_shares_one_call():
+    """同一个键上的并发调用只计算一次，不同键互不阻塞"""
+    print("\n测试合并同步调用...")
+    flights = SingleFlight()
+    release = threading.Event()
+    calls = []
+
+    def slow():
+        calls.append(1)
+        release.wait(5)
+        return "结果"
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(flights.do("同一个问题", slow))) for _ in range(5)]
+    for t in threads:
+        t.start()
+    time.sleep(0.1)
+    # 等待期间，其他键的调用立即完成
+    assert flights.do("另一个问题", lambda: "x") == ("x", False), "其他问题不应被阻塞"
+    release.set()
+    for t in threads:
+        t.join(timeout=5)
+    assert len(calls) == 1, f"应只计算一次，实际 {len(calls)} 次"
+    assert all(value == "结果" for value, _ in results)
+    assert sum(shared for _, shared in results) == 4, results
+    assert flights.inflight() == 0
+
+    # leader 的异常同样传给等待中的请求
+    def failing():
+        time.sleep(0.1)
+        raise ValueError("失败")
+
+    errors = _run_threads(lambda i: _catch(lambda: flights.do("失败的问题", failing)), 3)
+    assert all(isinstance(e, ValueError) for e in errors), errors
+    print("  ✓ 只计算一次，异常共享，不同问题不阻塞")
+
+
+def _catch(fn):
+    try:
+        return fn()
+    except Exception as e:
+        return e
+
+
+def test_stream_followers_and_abandon():
+    """流式合并：等待中的请求收到相同增量；leader 中途放弃时等待中的请求各自重新计算"""
+    print("\n测试合并流式调用...")
+    flights = SingleFlight()
+    gate = threading.Event()
+
+    def make_stream():
+        yield "图书馆"
+        gate.wait(5)
+        yield "8点开门。"
+        return "图书馆8点开门。"
+
+    leader = flights.stream("q", make_stream)
+    assert next(leader) == "图书馆"
+    follower_chunks = []
+    follower_result = {}
+
+    def follow():
+        follower_result["value"] = yield_all(flights.stream("q", make_stream), follower_chunks)
+
+    t = threading.Thread(target=follow)
+    t.start()
+    time.sleep(0.1)
+    gate.set()
+    assert list(leader) == ["8点开门。"]
+    t.join(timeout=5)
+    assert follower_chunks == ["图书馆", "8点开门。"], follower_chunks
+    assert follower_result["value"] == ("图书馆8点开门。", True)
+
+    # leader 被关闭：等待中的请求收到 FlightAbandoned 后自行计算
+    leader = flights.stream("q2", make_stream)
+    next(leader)
+    flight = flights._flights["q2"]
+    waiting = {}
+    t = threading.Thread(target=lambda: waiting.update(result=flights.do("q2", lambda: "重新计算")))
+    t.start()
+    time.sleep(0.1)
+    leader.close()
+    t.join(timeout=5)
+    assert isinstance(flight.error, FlightAbandoned) and flights.inflight() == 0
+    assert waiting["result"] == ("重新计算", False), waiting
+    print("  ✓ 增量同步转发，放弃后重新计算")
+
+
+def yield_all(gen, chunks):
+    """消费生成器，收集增量，返回其结果"""
+    while True:
+        try:
+            chunks.append(next(gen))
+        except StopIteration as stop:
+            return stop.value
+
+
+def test_router_coalesces_concurrent_questions():
+    """路由：相同问题（标点、空白不同）的并发请求共享一次小模型调用，meta 标明是否合并"""
+    print("\n测试路由合并...")
+    import router
+
+    saved = {name: getattr(router, name) for name in ROUTER_STUBS}
+    calls = []
+
+    def slow_small_model(question, history=None, stats=None):
+        calls.append(question)
+        time.sleep(0.3)
+        return "宿舍不允许养宠物。"
+
+    try:
+        router.small_model_answer = slow_small_model
+        router.low_confidence = lambda answer: False
+        router.log_event = lambda *args: None
+        router.SEMANTIC_FAQ_ENABLED = False
+        router.ANSWER_CACHE_ENABLED = False
+        router.HEDGE_ENABLED = False
+        router.WARMUP_GATE = False
+        router.SINGLE_FLIGHT_ENABLED = True
+
+        questions = ["宿舍可以养猫吗", "宿舍可以养猫吗？", " 宿舍可以养猫吗 ", "宿舍可以养猫吗?"]
+        start = time.time()
+        results = _run_threads(lambda i: router.route_question(questions[i]), len(questions))
+        assert time.time() - start < 1.0, "合并的请求不应排队等待多次生成"
+        assert len(calls) == 1, f"应只调用一次小模型，实际 {calls}"
+        metas = [meta for _, meta in results]
+        assert all(answer == "宿舍不允许养宠物。" for answer, _ in results)
+        assert sorted(m["coalesced"] for m in metas) == [False, True, True, True], metas
+        for meta in metas:
+            if meta["coalesced"]:
+                assert meta["route"] == "coalesced" and meta["coalesced_route"] == "small_model"
+                assert meta["cost"] == 0
+            else:
+                assert meta["route"] == "small_model"
+
+        # 不同历史不合并
+        calls.clear()
+        _run_threads(lambda i: router.route_question("宿舍可以养猫吗", history=[{"role": "user", "content": str(i)}]), 2)
+        assert len(calls) == 2, "历史不同的请求不应合并"
+
+        # 关闭后各自计算
+        calls.clear()
+        router.SINGLE_FLIGHT_ENABLED = False
+        results = _run_threads(lambda i: router.route_question("宿舍可以养猫吗"), 2)
+        assert len(calls) == 2 and all("coalesced" not in meta for _, meta in results)
+    finally:
+        for name, value in saved.items():
+            setattr(router, name, value)
+    print("  ✓ 并发的相同问题只生成一次")
+
+
+def test_router_stream_follower():
+    """流式请求合并到正在进行的流式请求上，收到同样的增量"""
+    print("\n测试流式路由合并...")
+    import router
+
+    saved = {name: getattr(router, name) for name in ROUTER_STUBS}
+    calls = []
+
+    def small_stream(question, history=None, stats=None):
+        calls.append(question)
+        for chunk in ("宿舍", "不允许", "养宠物。"):
+            time.sleep(0.1)
+            yield chunk
+        return "宿舍不允许养宠物。"
+
+    try:
+        router.small_model_answer_stream = small_stream
+        router.low_confidence = lambda answer: False
+        router.log_event = lambda *args: None
+        router.SEMANTIC_FAQ_ENABLED = False
+        router.ANSWER_CACHE_ENABLED = False
+        router.WARMUP_GATE = False
+        router.SINGLE_FLIGHT_ENABLED = True
+
+        def stream(i):
+            chunks, result = router.route_question_stream("宿舍可以养猫吗")
+            return list(chunks), result
+
+        outputs = _run_threads(stream, 2)
+        assert len(calls) == 1, calls
+        for chunks, result in outputs:
+            assert "".join(chunks) == "宿舍不允许养宠物。" and result["answer"] == "宿舍不允许养宠物。"
+            assert "ttft" in result["meta"]
+        assert sorted(result["meta"]["route"] for _, result in outputs) == ["coalesced", "small_model"]
+    finally:
+        for name, value in saved.items():
+            setattr(router, name, value)
+    print("  ✓ 流式请求共享同一次生成")
+
+
+def main():
+    """运行所有测试"""
+    print("=" * 60)
+    print("测试相同问题并发合并")
+    print("=" * 60)
+
+    tests = [
+        test_do_shares_one_call,
+        test_stream_followers_and_abandon,
+        test_router_coalesces_concurrent_questions,
+        test_router_stream_follower,
+    ]
+
+    failed = 0
+    for test in tests:
+        try:
+            test()
+        except AssertionError as e:
+            print(f"  ✗ 测试失败: {e}")
+            failed += 1
+
+    print("\n" + "=" * 60)
+    if failed == 0:
+        print("✓ 所有测试通过!")
+    else:
+        print(f"✗ {failed} 个测试失败")
+        sys.exit(1)
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    main()
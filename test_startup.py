@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+测试延迟导入与 FAQ + 远程部署模式（在子进程中检查导入了哪些模块，不加载模型、不调用API）
+"""
+import json
+import os
+import subprocess
+import sys
+
+# 获取测试脚本所在目录
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, SCRIPT_DIR)
+
+HEAVY_MODULES = ("torch", "transformers", "openai")
+
+
+def _run(code: str, **env) -> dict:
+    """在全新的子进程中执行代码，返回其最后一行打印的 JSON"""
+    env = dict(os.environ, ANSWER_CACHE_ENABLED="0", **env)
+    output = subprocess.run(
+        [sys.executable, "-c", "import sys, json\nsys.path.insert(0, %r)\n" % SCRIPT_DIR + code],
+        env=env, cwd=SCRIPT_DIR, capture_output=True, text=True, timeout=120,
+    )
+    assert output.returncode == 0, output.stderr[-2000:]
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+
+def test_router_import_is_light():
+    """导入路由并回答 FAQ 问题时不导入 torch / transformers / openai"""
+    print("\n测试路由延迟导入...")
+    result = _run(
+        "import router\n"
+        "router.log_event = lambda *args: None\n"
+        "answer, meta = router.route_question('图书馆几点开门？')\n"
+        "print(json.dumps({'route': meta['route'], 'loaded': [m for m in %r if m in sys.modules]}))\n"
+        % (HEAVY_MODULES,)
+    )
+    assert result["route"] == "faq"
+    assert not result["loaded"], f"不应导入: {result['loaded']}"
+    print("  ✓ FAQ 命中时没有导入重型依赖")
+
+
+def test_faq_remote_mode_never_loads_torch():
+    """FAQ + 远程模式下，FAQ 未命中的简单问题直接交给大模型，全程不导入 torch"""
+    print("\n测试 FAQ + 远程模式...")
+    result = _run(
+        "import router\n"
+        "router.log_event = lambda *args: None\n"
+        "router.big_model_answer = lambda q, history=None: ('大模型的回答。', {'total_tokens': 10})\n"
+        "answers = [router.route_question(q)[1]['route'] for q in ('宿舍可以养猫吗', '图书馆几点开门？')]\n"
+        "import warmup\n"
+        "warmup.start_warmup(); warmup.wait_ready(30)\n"
+        "print(json.dumps({'routes': answers, 'semantic': router.SEMANTIC_FAQ_ENABLED, "
+        "'state': warmup.warmup_status()['state'], 'torch': 'torch' in sys.modules}))\n",
+        DEPLOYMENT_MODE="faq_remote", WARMUP_ENABLED="1", QWEN_API_KEY="",
+    )
+    assert result["routes"] == ["big_model", "faq"], result["routes"]
+    assert not result["semantic"], "FAQ + 远程模式下应关闭语义检索"
+    assert result["state"] == "ready" and not result["torch"], result
+    print("  ✓ 未命中走大模型，预热与路由都不导入 torch")
+
+
+def main():
+    """运行所有测试"""
+    print("=" * 60)
+    print("测试延迟导入与 FAQ + 远程部署模式")
+    print("=" * 60)
+
+    tests = [
+        test_router_import_is_light,
+        test_faq_remote_mode_never_loads_torch,
+    ]
+
+    failed = 0
+    for test in tests:
+        try:
+            test()
+        except AssertionError as e:
+            print(f"  ✗ 测试失败: {e}")
+            failed += 1
+
+    print("\n" + "=" * 60)
+    if failed == 0:
+        print("✓ 所有测试通过!")
+    else:
+        print(f"✗ {failed} 个测试失败")
+        sys.exit(1)
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""
+测试流式路由（用假的模型函数，不加载真实模型、不调用API）
+"""
+import os
+import sys
+
+# 获取测试脚本所在目录
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, SCRIPT_DIR)
+
+try:
+    import router
+except Exception as e:
+    router = None
+    print(f"  注意: router导入失败: {e}")
+
+
+def _fake_small_stream(text):
+    def stream(question, history=None, stats=None):
+        for ch in text:
+            yield ch
+        if stats is not None:
+            stats["ttft"] = 0.0
+        return text
+    return stream
+
+
+def _fake_big_stream(text):
+    def stream(question, history=None, usage_info=None):
+        for ch in text:
+            yield ch
+        usage_info.update({"total_tokens": 10, "ttft": 0.0, "tokens_per_second": 50.0})
+        return text
+    return stream
+
+
+def _with_stubs(small_text, big_text="大模型的详细回答。"):
+    """替换模型与日志函数，返回恢复函数"""
+    saved = (router.small_model_answer_stream, router.big_model_answer_stream, router.log_event,
+             router.SEMANTIC_FAQ_ENABLED, router.ANSWER_CACHE_ENABLED)
+    router.small_model_answer_stream = _fake_small_stream(small_text)
+    router.big_model_answer_stream = _fake_big_stream(big_text)
+    router.log_event = lambda *args: None
+    router.SEMANTIC_FAQ_ENABLED = False
+    router.ANSWER_CACHE_ENABLED = False
+
+    def restore():
+        (router.small_model_answer_stream, router.big_model_answer_stream, router.log_event,
+         router.SEMANTIC_FAQ_ENABLED, router.ANSWER_CACHE_ENABLED) = saved
+    return restore
+
+
+def test_stream_small_model():
+    """小模型回答逐段产出，拼起来就是最终答案"""
+    print("\n测试小模型流式输出...")
+    if router is None:
+        print("  跳过: router模块未加载")
+        return
+    restore = _with_stubs("宿舍不允许养宠物。")
+    try:
+        chunks, result = router.route_question_stream("宿舍可以养猫吗")
+        pieces = list(chunks)
+        assert len(pieces) > 1, "应分多段产出"
+        assert "".join(pieces) == result["answer"] == "宿舍不允许养宠物。"
+        assert result["meta"]["route"] == "small_model"
+        assert 0 <= result["meta"]["ttft"] <= result["meta"]["response_time"]
+        print("  ✓ 流式输出与最终答案一致")
+    finally:
+        restore()
+
+
+def test_stream_low_confidence_fallback():
+    """流结束后置信度不足，降级到大模型并给出最终答案"""
+    print("\n测试流式输出的降级...")
+    if router is None:
+        print("  跳过: router模块未加载")
+        return
+    restore = _with_stubs("抱歉，我不知道。")
+    try:
+        chunks, result = router.route_question_stream("宿舍可以养猫吗")
+        streamed = "".join(chunks)
+        assert streamed == "抱歉，我不知道。" + router.FALLBACK_NOTICE + "大模型的详细回答。", \
+            "小模型文本之后应接着流式输出大模型回答"
+        assert result["answer"] == "大模型的详细回答。", "最终答案应为大模型回答"
+        assert result["meta"]["route"] == "big_model_fallback"
+        assert result["meta"]["cost"] > 0
+        assert result["meta"]["big_model_stats"]["tokens_per_second"] == 50.0
+        print("  ✓ 低置信度流式回答降级到大模型")
+    finally:
+        restore()
+
+
+def test_stream_faq_and_invalid():
+    """FAQ 命中与空问题一次性产出"""
+    print("\n测试FAQ与空问题的流式路由...")
+    if router is None:
+        print("  跳过: router模块未加载")
+        return
+    restore = _with_stubs("不应被调用")
+    try:
+        chunks, result = router.route_question_stream("图书馆几点开门？")
+        assert list(chunks) == [result["answer"]] and result["meta"]["route"] == "faq"
+
+        chunks, result = router.route_question_stream("   ")
+        assert list(chunks) == ["请输入您的问题"] and result["meta"]["route"] == "invalid"
+        print("  ✓ FAQ与空问题处理正确")
+    finally:
+        restore()
+
+
+def test_big_model_stream_usage():
+    """大模型流式调用：逐段产出增量，usage 取自最后一个 chunk"""
+    print("\n测试大模型流式usage统计...")
+    try:
+        import big_model
+    except Exception as e:
+        print(f"  跳过: big_model模块未加载: {e}")
+        return
+    from types import SimpleNamespace as NS
+
+    def chunk(text=None, usage=None):
+        choices = [NS(delta=NS(content=text))] if text is not None else []
+        return NS(choices=choices, usage=usage)
+
+    class FakeStream:
+        closed = False
+
+        def __iter__(self):
+            yield chunk("")
+            yield chunk("图书馆")
+            yield chunk("8点开门。")
+            yield chunk(usage=NS(prompt_tokens=20, completion_tokens=5, total_tokens=25))
+
+        def close(self):
+            FakeStream.closed = True
+
+    captured = {}
+
+    def create(**kwargs):
+        captured.update(kwargs)
+        return FakeStream()
+
+    fake_client = NS(chat=NS(completions=NS(create=create)))
+    saved = big_model._client
+    big_model._client = fake_client
+    try:
+        usage_info = {}
+        gen = big_model.big_model_answer_stream("图书馆几点开门", usage_info=usage_info)
+        pieces = []
+        try:
+            while True:
+                pieces.append(next(gen))
+        except StopIteration as stop:
+            answer = stop.value
+        assert pieces == ["图书馆", "8点开门。"] and answer == "图书馆8点开门。"
+        assert captured["stream"] is True and captured["stream_options"] == {"include_usage": True}
+        assert usage_info["total_tokens"] == 25 and usage_info["completion_tokens"] == 5
+        assert "ttft" in usage_info and FakeStream.closed
+        print("  ✓ 流式增量与usage统计正确")
+    finally:
+        big_model._client = saved
+
+
+def main():
+    """运行所有测试"""
+    print("=" * 60)
+    print("测试流式路由")
+    print("=" * 60)
+
+    tests = [
+        test_stream_small_model,
+        test_stream_low_confidence_fallback,
+        test_stream_faq_and_invalid,
+        test_big_model_stream_usage,
+    ]
+
+    failed = 0
+    for test in tests:
+        try:
+            test()
+        except AssertionError as e:
+            print(f"  ✗ 测试失败: {e}")
+            failed += 1
+
+    print("\n" + "=" * 60)
+    if failed == 0:
+        print("✓ 所有测试通过!")
+    else:
+        print(f"✗ {failed} 个测试失败")
+        sys.exit(1)
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+测试分阶段耗时追踪与指标导出（用假的模型函数，不加载真实模型、不调用API）
+"""
+import os
+import sys
+import urllib.request
+
+# 获取测试脚本所在目录
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, SCRIPT_DIR)
+
+import metrics
+import tracing
+
+
+def test_span_accumulates_and_noop_without_trace():
+    """同名阶段耗时累加；没有进行中的追踪或关闭时为空操作"""
+    print("\n测试span计时...")
+    saved = tracing.TRACING_ENABLED
+    try:
+        tracing.TRACING_ENABLED = True
+        stages = tracing.start_trace()
+        with tracing.span("a"):
+            pass
+        with tracing.span("a"):
+            pass
+        tracing.record_stage("b", 0.5)
+        assert set(stages) == {"a", "b"} and stages["b"] == 0.5 and stages["a"] >= 0
+
+        tracing.TRACING_ENABLED = False
+        assert tracing.span("c") is tracing._NOOP_SPAN and tracing.start_trace() is None
+        tracing.record_stage("c", 1)
+        assert "c" not in stages
+        print("  ✓ 计时累加，关闭后为空操作")
+    finally:
+        tracing.TRACING_ENABLED = saved
+
+
+def test_prometheus_text_format():
+    """计数器与直方图按 Prometheus 文本格式输出"""
+    print("\n测试Prometheus文本格式...")
+    counter = metrics.Counter("demo_total", "示例计数", ("route",))
+    counter.inc("faq")
+    counter.inc("faq", amount=2)
+    hist = metrics.Histogram("demo_seconds", "示例耗时", ("stage",), buckets=(0.1, 1))
+    hist.observe(0.05, "x")
+    hist.observe(0.5, "x")
+    hist.observe(5, "x")
+
+    text = "\n".join(counter.render() + hist.render())
+    assert 'demo_total{route="faq"} 3' in text
+    assert 'demo_seconds_bucket{stage="x",le="0.1"} 1' in text
+    assert 'demo_seconds_bucket{stage="x",le="1"} 2' in text
+    assert 'demo_seconds_bucket{stage="x",le="+Inf"} 3' in text
+    assert 'demo_seconds_count{stage="x"} 3' in text and "# TYPE demo_seconds histogram" in text
+    print("  ✓ 文本格式正确")
+
+
+def test_route_question_stages_and_metrics():
+    """路由结果的 meta 带有阶段耗时，并更新路由与降级指标"""
+    print("\n测试路由阶段耗时与指标...")
+    try:
+        import router
+    except Exception as e:
+        print(f"  跳过: router模块未加载: {e}")
+        return
+
+    saved = (router.small_model_answer, router.big_model_answer, router.log_event,
+             router.SEMANTIC_FAQ_ENABLED, router.ANSWER_CACHE_ENABLED, router.HEDGE_ENABLED)
+
+    def small(question, history=None, stats=None):
+        stats.update({"latency": 0.2, "tokenize_time": 0.01, "prefill_time": 0.05, "decode_time": 0.14})
+        return "抱歉，我不知道。"
+
+    router.small_model_answer = small
+    router.big_model_answer = lambda q, history=None: ("大模型的详细回答。", {"total_tokens": 10})
+    router.log_event = lambda *args: None
+    router.SEMANTIC_FAQ_ENABLED = False
+    router.ANSWER_CACHE_ENABLED = False
+    router.HEDGE_ENABLED = False
+    fallbacks = metrics.FALLBACKS.value("low_confidence")
+    requests = metrics.REQUESTS.value("faq")
+    try:
+        answer, meta = router.route_question("宿舍可以养猫吗")
+        assert meta["route"] == "big_model_fallback"
+        stages = meta["stages"]
+        for stage in ("complexity_score", "faq_keyword", "low_confidence", "small_model.prefill"):
+            assert stage in stages, f"缺少阶段 {stage}: {stages}"
+        assert stages["small_model"] == 0.2
+        assert metrics.FALLBACKS.value("low_confidence") == fallbacks + 1
+
+        answer, meta = router.route_question("图书馆几点开门？")
+        assert meta["route"] == "faq" and "small_model" not in meta["stages"]
+        assert metrics.REQUESTS.value("faq") == requests + 1
+        print(f"  ✓ 阶段: {', '.join(stages)}")
+    finally:
+        (router.small_model_answer, router.big_model_answer, router.log_event,
+         router.SEMANTIC_FAQ_ENABLED, router.ANSWER_CACHE_ENABLED, router.HEDGE_ENABLED) = saved
+
+
+def test_metrics_endpoint():
+    """本地 /metrics 端点返回当前指标"""
+    print("\n测试指标端点...")
+    server = metrics.start_metrics_server(0)
+    try:
+        port = server.server_address[1]
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics", timeout=5) as resp:
+            body = resp.read().decode("utf-8")
+            assert resp.status == 200 and "text/plain" in resp.headers["Content-Type"]
+        assert "# TYPE router_requests_total counter" in body
+        print("  ✓ 端点可访问")
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def main():
+    """运行所有测试"""
+    print("=" * 60)
+    print("测试分阶段耗时追踪与指标导出")
+    print("=" * 60)
+
+    tests = [
+        test_span_accumulates_and_noop_without_trace,
+        test_prometheus_text_format,
+        test_route_question_stages_and_metrics,
+        test_metrics_endpoint,
+    ]
+
+    failed = 0
+    for test in tests:
+        try:
+            test()
+        except AssertionError as e:
+            print(f"  ✗ 测试失败: {e}")
+            failed += 1
+
+    print("\n" + "=" * 60)
+    if failed == 0:
+        print("✓ 所有测试通过!")
+    else:
+        print(f"✗ {failed} 个测试失败")
+        sys.exit(1)
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+测试启动预热与就绪门控（用假的预热和模型函数，不加载真实模型、不调用API）
+"""
+import os
+import sys
+import threading
+import time
+
+# 获取测试脚本所在目录
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, SCRIPT_DIR)
+
+import metrics
+import warmup
+
+
+class _FakeWarmup:
+    """把小模型预热替换为等待事件，退出时恢复预热模块状态"""
+
+    def __init__(self, fail: bool = False):
+        self.release = threading.Event()
+        self.calls = []
+        self.fail = fail
+
+    def _warm(self, generations):
+        self.calls.append(generations)
+        self.release.wait(5)
+        if self.fail:
+            raise RuntimeError("模型文件不存在")
+
+    def __enter__(self):
+        self.saved = (warmup._warm_small_model, warmup.WARMUP_ENABLED, warmup.SEMANTIC_FAQ_ENABLED,
+                      warmup.WARMUP_RETRY_INTERVAL)
+        warmup._warm_small_model = self._warm
+        warmup.WARMUP_ENABLED = True
+        warmup.SEMANTIC_FAQ_ENABLED = False
+        warmup.WARMUP_RETRY_INTERVAL = 60
+        return self
+
+    def __exit__(self, *exc):
+        self.release.set()
+        warmup.wait_ready(5)
+        (warmup._warm_small_model, warmup.WARMUP_ENABLED, warmup.SEMANTIC_FAQ_ENABLED,
+         warmup.WARMUP_RETRY_INTERVAL) = self.saved
+        warmup._state = warmup.IDLE
+        warmup._status.clear()
+        warmup._ready_event.clear()
+
+
+def test_states_and_idempotent_start():
+    """未启动时就绪；启动后预热中不可用，只启动一次；完成后就绪"""
+    print("\n测试预热状态...")
+    assert warmup.small_model_ready() and warmup.wait_ready(0)
+    with _FakeWarmup() as fake:
+        assert warmup.start_warmup(generations=3)
+        assert warmup.start_warmup()
+        assert warmup.warmup_status()["state"] == "loading" and not warmup.small_model_ready()
+        assert not warmup.wait_ready(0.05)
+
+        fake.release.set()
+        assert warmup.wait_ready(5)
+        status = warmup.warmup_status()
+        assert status["state"] == "ready" and "warmup_time" in status
+        assert fake.calls == [3], f"预热应只执行一次: {fake.calls}"
+    print("  ✓ idle → loading → ready，重复启动无副作用")
+
+
+def test_failed_warmup():
+    """预热失败后小模型暂不可用并记录错误，导出到指标；超过重试间隔后重新预热"""
+    print("\n测试预热失败...")
+    with _FakeWarmup(fail=True) as fake:
+        warmup.start_warmup()
+        fake.release.set()
+        assert not warmup.wait_ready(5)
+        status = warmup.warmup_status()
+        assert status["state"] == "failed" and "模型文件不存在" in status["error"]
+        assert not warmup.small_model_ready() and warmup.warmup_status()["state"] == "failed", "未到重试时间"
+        assert "warmup_state 3" in metrics.REGISTRY.render()
+
+        # 到了重试时间：下一次就绪检查在后台重新预热，成功后恢复小模型
+        fake.fail = False
+        fake.release.clear()
+        warmup.WARMUP_RETRY_INTERVAL = 0.01
+        time.sleep(0.02)
+        assert not warmup.small_model_ready() and warmup.warmup_status()["state"] == "loading"
+        fake.release.set()
+        assert warmup.wait_ready(5) and warmup.small_model_ready()
+        assert len(fake.calls) == 2 and warmup.warmup_status()["attempts"] == 2
+        text = metrics.REGISTRY.render()
+        assert "warmup_state 2" in text and "warmup_attempts 2" in text
+    print("  ✓ 失败状态与错误信息，到期后重试恢复")
+
+
+def test_disabled():
+    """WARMUP_ENABLED=0 时不启动预热，保持懒加载"""
+    print("\n测试关闭预热...")
+    saved = warmup.WARMUP_ENABLED
+    try:
+        warmup.WARMUP_ENABLED = False
+        assert not warmup.start_warmup()
+        assert warmup.warmup_status()["state"] == "idle" and warmup.small_model_ready()
+    finally:
+        warmup.WARMUP_ENABLED = saved
+    print("  ✓ 未启动预热")
+
+
+def test_router_gating():
+    """预热中小模型问题改走大模型，FAQ 命中不受影响；预热完成后恢复小模型"""
+    print("\n测试路由就绪门控...")
+    try:
+        import router
+    except Exception as e:
+        print(f"  跳过: router模块未加载: {e}")
+        return
+
+    saved = (router.small_model_answer, router.big_model_answer, router.log_event, router.WARMUP_GATE,
+             router.SEMANTIC_FAQ_ENABLED, router.ANSWER_CACHE_ENABLED, router.HEDGE_ENABLED)
+    small_calls = []
+
+    def small(question, history=None, stats=None):
+        small_calls.append(question)
+        return "宿舍不允许养宠物。如有需要可以联系宿管。"
+
+    router.small_model_answer = small
+    router.big_model_answer = lambda q, history=None: ("大模型的详细回答。", {"total_tokens": 10})
+    router.log_event = lambda *args: None
+    router.WARMUP_GATE = True
+    router.SEMANTIC_FAQ_ENABLED = False
+    router.ANSWER_CACHE_ENABLED = False
+    router.HEDGE_ENABLED = False
+    try:
+        with _FakeWarmup() as fake:
+            warmup.start_warmup()
+            answer, meta = router.route_question("宿舍可以养猫吗")
+            assert meta["route"] == "big_model_warmup" and answer == "大模型的详细回答。"
+            assert meta["cost"] > 0 and not small_calls
+
+            answer, meta = router.route_question("图书馆几点开门？")
+            assert meta["route"] == "faq"
+
+            fake.release.set()
+            warmup.wait_ready(5)
+            answer, meta = router.route_question("宿舍可以养猫吗")
+            assert meta["route"] == "small_model" and small_calls == ["宿舍可以养猫吗"]
+        print("  ✓ 预热中改走大模型，完成后恢复小模型")
+    finally:
+        (router.small_model_answer, router.big_model_answer, router.log_event, router.WARMUP_GATE,
+         router.SEMANTIC_FAQ_ENABLED, router.ANSWER_CACHE_ENABLED, router.HEDGE_ENABLED) = saved
+
+
+def main():
+    """运行所有测试"""
+    print("=" * 60)
+    print("测试启动预热与就绪门控")
+    print("=" * 60)
+
+    tests = [
+        test_states_and_idempotent_start,
+        test_failed_warmup,
+        test_disabled,
+        test_router_gating,
+    ]
+
+    failed = 0
+    for test in tests:
+        try:
+            test()
+        except AssertionError as e:
+            print(f"  ✗ 测试失败: {e}")
+            failed += 1
+
+    print("\n" + "=" * 60)
+    if failed == 0:
+        print("✓ 所有测试通过!")
+    else:
+        print(f"✗ {failed} 个测试失败")
+        sys.exit(1)
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    main()
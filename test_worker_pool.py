@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""
+测试小模型多进程推理池与内存映射权重加载（用随机初始化的微型模型，不下载真实模型）
+"""
+import os
+import queue
+import sys
+import tempfile
+import time
+
+# 获取测试脚本所在目录
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, SCRIPT_DIR)
+
+from worker_pool import WorkerPool, physical_cores, plan_core_slices
+
+try:
+    import torch
+    from transformers import Qwen2Config, Qwen2ForCausalLM
+    import small_model
+except Exception as e:
+    small_model = None
+    print(f"  注意: small_model导入失败: {e}")
+
+
+def _save_tiny_model(path: str, dtype):
+    """保存一个两层的随机 Qwen2 模型（safetensors）"""
+    config = Qwen2Config(vocab_size=64, hidden_size=32, intermediate_size=64, num_hidden_layers=2,
+                         num_attention_heads=4, num_key_value_heads=2, max_position_embeddings=128)
+    torch.manual_seed(0)
+    model = Qwen2ForCausalLM(config).to(dtype).eval()
+    model.save_pretrained(path, safe_serialization=True)
+    return model
+
+
+def _in_file_mapping(address: int, file_name: str) -> bool:
+    """地址是否落在映射了该文件的内存区域（读取 /proc/self/maps）"""
+    with open("/proc/self/maps") as f:
+        for line in f:
+            if line.rstrip().endswith(file_name):
+                start, end = (int(x, 16) for x in line.split()[0].split("-"))
+                if start <= address < end:
+                    return True
+    return False
+
+
+def test_core_slices():
+    """按物理核心平分给各进程，进程数超过核心数时共用"""
+    print("\n测试核心分配...")
+    cores = physical_cores()
+    assert cores and all(cores)
+    slices = plan_core_slices(2)
+    assert len(slices) == 2
+    for cpus, threads in slices:
+        assert cpus and threads == max(1, len(cores) // 2)
+    slices = plan_core_slices(len(cores) + 1, threads_per_worker=1)
+    assert len(slices) == len(cores) + 1 and slices[0] == slices[-1]
+    print(f"  ✓ {len(cores)} 个物理核心，分配: {plan_core_slices(2)}")
+
+
+def test_mmap_model_shares_file_pages():
+    """内存映射加载的权重直接指向文件映射，输出与常规加载一致；精度不一致时放弃"""
+    print("\n测试内存映射加载...")
+    if small_model is None:
+        print("  跳过: small_model模块未加载")
+        return
+    saved = small_model.SMALL_MODEL_PATH
+    with tempfile.TemporaryDirectory() as tmp:
+        reference = _save_tiny_model(tmp, torch.float32)
+        small_model.SMALL_MODEL_PATH = tmp
+        try:
+            model = small_model._load_mmap_model(torch.float32)
+            assert model is not None
+
+            # 参数数据位于权重文件的内存映射区域内，没有另外拷贝
+            if os.path.exists("/proc/self/maps"):
+                weight = model.model.layers[0].mlp.up_proj.weight
+                assert _in_file_mapping(weight.data_ptr(), "model.safetensors"), "参数应指向文件映射"
+
+            input_ids = torch.tensor([[1, 2, 3, 4, 5]])
+            with torch.no_grad():
+                assert torch.allclose(model(input_ids).logits, reference(input_ids).logits, atol=1e-6)
+
+            assert small_model._load_mmap_model(torch.bfloat16) is None, "精度不一致时应改为常规加载"
+        finally:
+            small_model.SMALL_MODEL_PATH = saved
+
+    small_model.SMALL_MODEL_PATH = "/nonexistent/model"
+    try:
+        assert small_model._load_mmap_model(torch.float32) is None
+    finally:
+        small_model.SMALL_MODEL_PATH = saved
+    print("  ✓ 零拷贝加载，输出一致")
+
+
+def _idle_worker(worker_id, cpus, threads, requests, results, max_batch_size, warmup_generations):
+    """就绪后不处理请求的假推理进程"""
+    results.put(("ready", worker_id, {}))
+    time.sleep(600)
+
+
+def _crash_after_taking(worker_id, cpus, threads, requests, results, max_batch_size, warmup_generations):
+    """取走一个请求并回报后异常退出的假推理进程"""
+    results.put(("ready", worker_id, {}))
+    item = requests.get()
+    results.put(("taken", worker_id, [item[0]]))
+    time.sleep(0.2)
+    os._exit(1)
+
+
+def _crash_on_start(worker_id, cpus, threads, requests, results, max_batch_size, warmup_generations):
+    """一启动就异常退出的假推理进程（如加载时崩溃）"""
+    os._exit(3)
+
+
+def test_pool_backpressure_and_failed_workers():
+    """推理进程加载失败时 wait_ready 返回 False，之后的提交立即失败；队列满时 submit 立即抛出 queue.Full"""
+    print("\n测试推理池失败与背压...")
+    saved = os.environ.get("SMALL_MODEL_PATH")
+    # 推理进程以 spawn 方式启动，从环境变量读取配置
+    os.environ["SMALL_MODEL_PATH"] = "/nonexistent/model"
+    pool = WorkerPool(1, queue_size=1)
+    try:
+        assert not pool.wait_ready(timeout=120), "模型不存在时推理进程应加载失败"
+        start = time.time()
+        try:
+            pool.submit("图书馆几点开门？", timeout=30)
+            assert False, "推理进程全部不可用时应抛出 RuntimeError"
+        except RuntimeError:
+            pass
+        assert time.time() - start < 1, "不应等到超时"
+    finally:
+        pool.close(timeout=1)
+        if saved is None:
+            os.environ.pop("SMALL_MODEL_PATH", None)
+        else:
+            os.environ["SMALL_MODEL_PATH"] = saved
+
+    pool = WorkerPool(1, queue_size=1)
+    pool._target = _idle_worker
+    try:
+        assert pool.wait_ready(timeout=120)
+        pool._requests.put_nowait((-1, "占位", [], 0))
+        try:
+            pool.submit("图书馆几点开门？", timeout=1)
+            assert False, "队列已满时应抛出 queue.Full"
+        except queue.Full:
+            pass
+        assert not pool._pending, "失败的提交不应残留"
+    finally:
+        pool.close(timeout=1)
+    print("  ✓ 加载失败可感知，队列满时快速失败")
+
+
+def test_dead_worker_fails_requests_and_restarts_are_capped():
+    """推理进程中途退出时取走的请求立即失败；启动即崩溃的进程按退避重启，次数用完后放弃"""
+    print("\n测试推理进程异常退出...")
+    pool = WorkerPool(1, restart_delay=0.05)
+    pool._target = _crash_after_taking
+    try:
+        assert pool.wait_ready(timeout=120)
+        start = time.time()
+        try:
+            pool.submit("图书馆几点开门？", timeout=60)
+            assert False, "推理进程退出时应抛出 RuntimeError"
+        except RuntimeError as e:
+            assert "异常退出" in str(e), e
+        elapsed = time.time() - start
+        assert elapsed < 10, f"不应等到超时，实际 {elapsed:.1f}s"
+        assert not pool._pending and not pool._assigned
+    finally:
+        pool.close(timeout=1)
+
+    pool = WorkerPool(1, max_restarts=2, restart_delay=0.05)
+    pool._target = _crash_on_start
+    try:
+        assert not pool.wait_ready(timeout=120), "重启次数用完后应判定为不可用"
+        assert pool.restarts == [2], pool.restarts
+        try:
+            pool.submit("图书馆几点开门？", timeout=60)
+            assert False, "推理进程全部放弃后应立即失败"
+        except RuntimeError:
+            pass
+    finally:
+        pool.close(timeout=1)
+    print(f"  ✓ {elapsed:.1f}s 内失败，重启 2 次后放弃")
+
+
+def main():
+    """运行所有测试"""
+    print("=" * 60)
+    print("测试小模型多进程推理池")
+    print("=" * 60)
+
+    tests = [
+        test_core_slices,
+        test_mmap_model_shares_file_pages,
+        test_pool_backpressure_and_failed_workers,
+        test_dead_worker_fails_requests_and_restarts_are_capped,
+    ]
+
+    failed = 0
+    for test in tests:
+        try:
+            test()
+        except AssertionError as e:
+            print(f"  ✗ 测试失败: {e}")
+            failed += 1
+
+    print("\n" + "=" * 60)
+    if failed == 0:
+        print("✓ 所有测试通过!")
+    else:
+        print(f"✗ {failed} 个测试失败")
+        sys.exit(1)
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    main()
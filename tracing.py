@@ -0,0 +1,79 @@
+"""
+分阶段耗时追踪
+
+路由入口调用 start_trace() 为当前请求（线程或 asyncio 任务）建立一张阶段耗时表，
+各模块用 `with span("阶段名"):` 或 record_stage() 累加耗时，结束时由 current_stages() 取出写入 meta["stages"]。
+TRACING_ENABLED=0 或当前没有进行中的追踪时，span() 直接返回共享的空上下文，几乎没有额外开销。
+后台线程（批处理引擎、对冲调用）不继承追踪上下文，它们的耗时通过 stats 字典带回。
+"""
+
+import contextvars
+import time
+
+from config import TRACING_ENABLED
+
+_stages = contextvars.ContextVar("trace_stages", default=None)
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class _Span:
+    __slots__ = ("stages", "name", "start")
+
+    def __init__(self, stages: dict, name: str):
+        self.stages = stages
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.stages[self.name] = self.stages.get(self.name, 0.0) + time.perf_counter() - self.start
+        return False
+
+
+def start_trace():
+    """为当前请求开始一次新的追踪，返回阶段耗时表；未启用时返回 None"""
+    if not TRACING_ENABLED:
+        return None
+    stages = {}
+    _stages.set(stages)
+    return stages
+
+
+def current_stages():
+    """当前请求的阶段耗时表 {阶段名: 秒}；没有进行中的追踪时返回 None"""
+    if not TRACING_ENABLED:
+        return None
+    return _stages.get()
+
+
+def span(name: str):
+    """计时上下文：同名阶段多次进入时耗时累加"""
+    if not TRACING_ENABLED:
+        return _NOOP_SPAN
+    stages = _stages.get()
+    if stages is None:
+        return _NOOP_SPAN
+    return _Span(stages, name)
+
+
+def record_stage(name: str, seconds: float):
+    """直接记录一段已测得的耗时（跨 yield 的流式调用等不方便用 span 的场景）"""
+    if not TRACING_ENABLED:
+        return
+    stages = _stages.get()
+    if stages is not None:
+        stages[name] = stages.get(name, 0.0) + seconds
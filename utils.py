@@ -1,12 +1,34 @@
+import atexit
+import contextvars
 import csv
 import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
 from datetime import datetime
+from config import (
+    LOG_BUFFERED, LOG_FLUSH_INTERVAL_MS, LOG_BATCH_SIZE, LOG_FSYNC, LOG_FSYNC_INTERVAL,
+    LOG_BACKEND, LOG_STORE_PATH, LOG_RETENTION_DAYS, LOG_MAX_ROWS,
+)
+from log_writer import BackgroundWriter
+from log_store import LogStore
+from tracing import span
 
 # 复杂问题关键词（可自行扩展）
 COMPLEX_KEYWORDS = ["分析", "对比", "规划", "设计", "为什么", "如何", "解释", "原因", "区别"]
 
 # 使用绝对路径避免工作目录问题
 LOG_PATH = os.path.join(os.path.dirname(__file__), "logs.csv")
+LOG_HEADER = ["timestamp", "question", "score", "route", "response_time", "cost"]
+
+# 后台日志写入器（延迟创建）；fork 出的子进程没有写入线程，按进程号重新创建
+_log_writer = None
+_log_writer_pid = None
+_log_writer_lock = threading.Lock()
+_last_fsync = 0.0
+# SQLite 日志存储（LOG_BACKEND=sqlite 时使用，延迟创建）
+_log_store = None
 
 def complexity_score(question: str) -> int:
     q = question.strip()
@@ -39,16 +61,195 @@ def complexity_score(question: str) -> int:
     return score
 
 
-def log_event(question: str, score: int, route: str, response_time: float, cost: float):
-    """记录事件到日志文件，处理并发安全"""
+# ========== 批量评分（离线重新评分日志、模拟阈值调整） ==========
+# 长度分档，与 complexity_score 一致：超过 10 / 20 / 30 字分别得 1 / 2 / 3 分
+LENGTH_BINS = (10, 20, 30)
+# 批量评分每次处理的问题数（限制拼接文本与命中矩阵的内存）
+SCORE_CHUNK_SIZE = 65536
+
+# 计分特征：{模式: 特征组}。每个关键词一组，问号、逗号、分号（中英文同组）各一组，
+# 同一组在一个问题中命中多次只算 1 分，与 complexity_score 的逐项判断一致
+_score_features = None
+
+
+def _get_score_features():
+    """按 COMPLEX_KEYWORDS 编译计分特征：[(码点数组, 特征组)]，以及特征组数"""
+    global _score_features
+    import numpy as np
+
+    keywords = tuple(dict.fromkeys(COMPLEX_KEYWORDS))
+    if _score_features is None or _score_features[0] != keywords:
+        groups = {k: i for i, k in enumerate(keywords)}
+        n = len(keywords)
+        groups.update({"？": n, "，": n + 1, ";": n + 2, "；": n + 2})
+        patterns = [(np.array([ord(c) for c in p], dtype=np.uint32), g) for p, g in groups.items() if p]
+        _score_features = (keywords, patterns, n + 3)
+    return _score_features[1], _score_features[2]
+
+
+def complexity_scores(questions: list):
+    """
+    批量版 complexity_score，返回 numpy 整数数组，结果与逐条调用完全一致
+
+    把问题拼成一段码点数组，每个关键词/标点用一次向量化比较找出全部出现位置，
+    再按位置映射回所属问题；长度分档同样按数组一次算出。大批量时按 SCORE_CHUNK_SIZE 分块
+    """
+    import numpy as np
+
+    questions = [q.strip() for q in questions]
+    if len(questions) > SCORE_CHUNK_SIZE:
+        return np.concatenate([
+            complexity_scores(questions[i:i + SCORE_CHUNK_SIZE])
+            for i in range(0, len(questions), SCORE_CHUNK_SIZE)
+        ])
+
+    lengths = np.fromiter(map(len, questions), dtype=np.int64, count=len(questions))
+    scores = np.digitize(lengths, LENGTH_BINS, right=True)
+    if not questions:
+        return scores
+
+    # 问题之间用换行分隔，关键词不含换行，匹配不会跨越两个问题
+    text = np.frombuffer("\n".join(questions).encode("utf-32-le"), dtype=np.uint32)
+    starts = np.zeros(len(questions), dtype=np.int64)
+    np.cumsum(lengths[:-1] + 1, out=starts[1:])
+
+    patterns, num_groups = _get_score_features()
+    hits = np.zeros((len(questions), num_groups), dtype=bool)
+    for codes, group in patterns:
+        n = len(text) - len(codes) + 1
+        if n <= 0:
+            continue
+        mask = text[:n] == codes[0]
+        for i in range(1, len(codes)):
+            mask &= text[i:i + n] == codes[i]
+        positions = np.flatnonzero(mask)
+        if len(positions):
+            hits[np.searchsorted(starts, positions, side="right") - 1, group] = True
+    # 空问题的长度为 0 且不会有命中，得分为 0
+    return scores + hits.sum(axis=1)
+
+
+def iter_complexity_scores(questions, chunk_size: int = SCORE_CHUNK_SIZE):
+    """对问题流（任意可迭代对象，如逐行读取的日志）分块批量评分，逐个产出 int 分数"""
+    chunk = []
+    for question in questions:
+        chunk.append(question)
+        if len(chunk) >= chunk_size:
+            yield from complexity_scores(chunk).tolist()
+            chunk = []
+    if chunk:
+        yield from complexity_scores(chunk).tolist()
+
+
+def rss_mb() -> float:
+    """当前进程的常驻内存（MB）；没有 /proc 时退回到峰值常驻内存，都取不到时返回 0"""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+    except (OSError, ValueError, IndexError, AttributeError):
+        pass
+    try:
+        import resource  # Windows 上没有该模块
+    except ImportError:
+        return 0.0
+    # Linux 上 ru_maxrss 单位为 KB，macOS 上为字节
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+
+
+def get_log_store() -> LogStore:
+    """懒加载 SQLite 日志存储（查询最近记录、按路由/时间查询、聚合统计）"""
+    global _log_store
+    if _log_store is None:
+        _log_store = LogStore(
+            LOG_STORE_PATH,
+            retention_days=LOG_RETENTION_DAYS,
+            max_rows=LOG_MAX_ROWS,
+            synchronous="FULL" if LOG_FSYNC == "batch" else "NORMAL",
+        )
+    return _log_store
+
+
+def _write_log_rows(rows: list):
+    """把一批日志行写入 LOG_BACKEND 指定的存储"""
+    if LOG_BACKEND == "sqlite":
+        get_log_store().append(rows)
+    else:
+        _append_csv_rows(rows)
+
+
+def _append_csv_rows(rows: list):
+    """把一批日志行追加到日志文件，按 LOG_FSYNC 策略决定是否落盘"""
+    global _last_fsync
     # 使用 'a+' 模式打开，然后检查文件是否为空来决定是否写表头
     # 这样可以避免 TOCTOU 竞态条件
     with open(LOG_PATH, "a+", newline="", encoding="utf-8") as f:
         # 移动到文件末尾并获取位置来判断文件是否为空
         f.seek(0, 2)
         is_empty = f.tell() == 0
-        
+
         writer = csv.writer(f)
         if is_empty:
-            writer.writerow(["timestamp", "question", "score", "route", "response_time", "cost"])
-        writer.writerow([datetime.now().isoformat(timespec="seconds"), question, score, route, response_time, cost])
\ No newline at end of file
+            writer.writerow(LOG_HEADER)
+        writer.writerows(rows)
+
+        now = time.monotonic()
+        if LOG_FSYNC == "batch" or (LOG_FSYNC == "interval" and now - _last_fsync >= LOG_FSYNC_INTERVAL):
+            f.flush()
+            os.fsync(f.fileno())
+            _last_fsync = now
+
+
+def _get_log_writer() -> BackgroundWriter:
+    """懒加载后台日志写入器，并在进程退出时写出剩余日志"""
+    global _log_writer, _log_writer_pid
+    if _log_writer is None or _log_writer_pid != os.getpid():
+        with _log_writer_lock:
+            if _log_writer is None or _log_writer_pid != os.getpid():
+                _log_writer = BackgroundWriter(
+                    _write_log_rows,
+                    flush_interval=LOG_FLUSH_INTERVAL_MS / 1000,
+                    batch_size=LOG_BATCH_SIZE,
+                )
+                _log_writer_pid = os.getpid()
+                atexit.register(_log_writer.close)
+    return _log_writer
+
+
+# 当前上下文（线程或 asyncio 任务）的日志范围：(是否写入, 路由前缀)，见 log_scope
+_log_scope = contextvars.ContextVar("log_scope", default=(True, ""))
+
+
+@contextmanager
+def log_scope(enabled: bool = True, route_prefix: str = ""):
+    """
+    在此范围内调用的 log_event：enabled 为 False 时不写入；否则路由加上 route_prefix（如 "bulk:"），
+    与线上请求分开统计。批量离线回答等非线上流量用它避免混入请求日志与回退预测的训练数据
+    """
+    token = _log_scope.set((enabled, route_prefix))
+    try:
+        yield
+    finally:
+        _log_scope.reset(token)
+
+
+def log_event(question: str, score: int, route: str, response_time: float, cost: float):
+    """记录事件到日志存储：只入队不阻塞，由后台线程批量写入（LOG_BUFFERED=0 时同步写入）"""
+    enabled, route_prefix = _log_scope.get()
+    if not enabled:
+        return
+    route = route_prefix + route
+    with span("log_event"):
+        row = [datetime.now().isoformat(timespec="seconds"), question, score, route, response_time, cost]
+        if not LOG_BUFFERED:
+            _write_log_rows([row])
+            return
+        _get_log_writer().put(row)
+
+
+def flush_logs(timeout: float = 5.0) -> bool:
+    """等待已记录的日志全部写入存储（读取日志前调用）；超时返回 False"""
+    if _log_writer is None or _log_writer_pid != os.getpid():
+        return True
+    return _log_writer.flush(timeout)
@@ -0,0 +1,154 @@
+"""
+启动预热与就绪状态
+
+start_warmup() 在进程启动时把模型加载与首次生成的开销挪到后台线程，不落在第一个请求上，依次完成:
+1. 创建大模型 OpenAI 客户端（未配置 API Key 时跳过）
+2. 加载 FAQ 向量模型并建立 FAQ 向量索引（SEMANTIC_FAQ_ENABLED 时）
+3. 加载小模型分词器与权重（DEPLOYMENT_MODE=faq_remote 时跳过），并用几条常见问题做 WARMUP_GENERATIONS 次生成，
+   填充内存分配器、算子和系统提示前缀缓存
+
+预热完成前 small_model_ready() 返回 False，路由（WARMUP_GATE=1 时）把本该交给小模型的问题
+改由 FAQ 或大模型回答，而不是阻塞等待加载。预热失败后距上次失败超过 WARMUP_RETRY_INTERVAL 秒时，
+下一次 small_model_ready() 调用在后台重新预热，期间仍按不可用处理；状态与尝试次数导出为
+warmup_state / warmup_attempts 指标。从未调用 start_warmup() 的进程（命令行、测试）
+保持原来的懒加载行为，small_model_ready() 始终为 True。
+"""
+
+import threading
+import time
+
+from config import (
+    WARMUP_ENABLED, WARMUP_GENERATIONS, WARMUP_RETRY_INTERVAL, SEMANTIC_FAQ_ENABLED, LOCAL_MODELS_ENABLED,
+)
+from metrics import Gauge, REGISTRY
+
+IDLE = "idle"
+LOADING = "loading"
+READY = "ready"
+FAILED = "failed"
+
+# 预热生成用的问题：覆盖短问题和带标点的常见问法
+WARMUP_QUESTIONS = ("你好", "图书馆几点开门？", "食堂在哪里？")
+
+_STATE_VALUES = {IDLE: 0, LOADING: 1, READY: 2, FAILED: 3}
+
+_state = IDLE
+_status = {}
+_generations = WARMUP_GENERATIONS
+_ready_event = threading.Event()
+_lock = threading.Lock()
+
+REGISTRY.register(Gauge(
+    "warmup_state", "小模型预热状态（0=未启动，1=加载中，2=就绪，3=失败）", lambda: _STATE_VALUES[_state]
+))
+REGISTRY.register(Gauge("warmup_attempts", "预热次数（含失败后的重试）", lambda: _status.get("attempts", 0)))
+
+
+def _warm_small_model(generations: int):
+    import small_model
+
+    if small_model.SMALL_MODEL_WORKERS > 0:
+        # 多进程模式：各推理进程自行加载与预热，本进程不加载模型
+        if not small_model._get_worker_pool().wait_ready():
+            raise RuntimeError("推理进程全部加载失败")
+        return
+    small_model._load_model()
+    for i in range(generations):
+        prompt = small_model._build_prompt(WARMUP_QUESTIONS[i % len(WARMUP_QUESTIONS)])
+        small_model._generate([prompt])
+
+
+def _run(generations: int):
+    global _state
+    start = time.time()
+    try:
+        import big_model
+        try:
+            big_model._get_client()
+            _status["big_model_client"] = True
+        except ValueError as e:
+            # 未配置 API Key 不影响小模型预热，调用大模型时会按原逻辑降级
+            print(f"预热：跳过大模型客户端: {e}")
+            _status["big_model_client"] = False
+
+        if SEMANTIC_FAQ_ENABLED:
+            import semantic_faq
+            from router import _load_faq
+            try:
+                faq = _load_faq()
+                if faq:
+                    # 同时加载向量模型：向量矩阵从文件读出时不需要模型，但查询时要用它编码问题
+                    semantic_faq.build_index(faq)
+            except Exception as e:
+                print(f"预热：FAQ向量索引建立失败，语义检索暂不可用: {e}")
+
+        if LOCAL_MODELS_ENABLED:
+            _warm_small_model(generations)
+        _status["warmup_time"] = time.time() - start
+        _state = READY
+        print(f"预热完成：耗时 {_status['warmup_time']:.1f}s")
+    except Exception as e:
+        _status["error"] = str(e)
+        _status["failed_at"] = time.time()
+        _state = FAILED
+        if WARMUP_RETRY_INTERVAL > 0:
+            print(f"预热失败，小模型暂不可用，{WARMUP_RETRY_INTERVAL:.0f}s 后重试: {e}")
+        else:
+            print(f"预热失败，小模型不可用: {e}")
+    finally:
+        _ready_event.set()
+
+
+def _launch():
+    """（持有 _lock 时调用）进入加载状态并启动预热线程"""
+    global _state
+    _state = LOADING
+    _ready_event.clear()
+    _status["started"] = time.time()
+    _status["attempts"] = _status.get("attempts", 0) + 1
+    threading.Thread(target=_run, args=(_generations,), name="warmup", daemon=True).start()
+
+
+def start_warmup(generations: int = None) -> bool:
+    """
+    在后台线程启动预热；可重复调用（如 Streamlit 每次重跑脚本），只启动一次。
+    返回是否已启动（WARMUP_ENABLED=0 时返回 False）
+    """
+    global _generations
+    if not WARMUP_ENABLED:
+        return False
+    with _lock:
+        if _state != IDLE:
+            return True
+        _generations = WARMUP_GENERATIONS if generations is None else generations
+        _launch()
+    return True
+
+
+def _retry_if_due():
+    """预热失败且距上次失败已超过 WARMUP_RETRY_INTERVAL 秒时，在后台重新预热"""
+    if WARMUP_RETRY_INTERVAL <= 0:
+        return
+    with _lock:
+        if _state == FAILED and time.time() - _status.get("failed_at", 0) >= WARMUP_RETRY_INTERVAL:
+            print("重新预热小模型...")
+            _launch()
+
+
+def small_model_ready() -> bool:
+    """小模型是否可以立即使用：预热中或预热失败时为 False（失败后到了重试时间会在后台重新预热）"""
+    if _state == FAILED:
+        _retry_if_due()
+    return _state in (IDLE, READY)
+
+
+def wait_ready(timeout: float = None) -> bool:
+    """等待预热结束（未启动预热时立即返回），返回小模型是否可用"""
+    if _state != IDLE:
+        _ready_event.wait(timeout)
+    return small_model_ready()
+
+
+def warmup_status() -> dict:
+    """当前预热状态：state 以及耗时、大模型客户端是否就绪、错误信息等"""
+    return {"state": _state, **_status}
@@ -0,0 +1,401 @@
+"""
+小模型多进程推理池
+
+单个 Python 进程里的 generate 串行执行，用不满多核；多开 Streamlit 进程又会让每个进程各自持有一份模型。
+推理池启动 N 个独立的推理进程（spawn 方式，不继承父进程的 torch 线程状态）：
+- 每个进程绑定一段物理核心（sched_setaffinity），torch 线程数等于分到的物理核心数，进程之间不争抢核心
+- 权重通过内存映射的 safetensors 加载（见 small_model._load_mmap_model），各进程共享同一份页缓存
+- 父进程通过有界队列分发请求；队列已满时立即抛出 queue.Full，由路由降级到大模型，而不是无限排队
+- 推理进程从队列取请求时顺手取走已在排队的请求，凑成一批做左填充批量生成
+
+父进程中的 _dispatch 线程接收结果并唤醒对应的调用方，同时定期检查推理进程是否存活：
+推理进程取走一批请求时先回报请求编号，进程异常退出时这些请求立即以错误结束（由路由降级），
+不必等到超时；退出的进程按指数退避重新拉起，连续重启超过上限后放弃，全部放弃后 submit 立即失败。
+
+命令行（在本机实测聚合吞吐随进程数的变化）:
+    python worker_pool.py --workers 1 2 4 --requests 32
+"""
+
+import argparse
+import atexit
+import itertools
+import multiprocessing
+import os
+import queue
+import threading
+import time
+
+# 检查推理进程是否存活的间隔（秒）
+CHECK_INTERVAL = 0.5
+# 重新拉起异常退出的进程前的等待：第 n 次连续重启前等待 min(RESTART_MAX_DELAY, restart_delay * 2**n) 秒
+RESTART_MAX_DELAY = 60.0
+# 进程存活超过这么多秒后再退出，不算连续重启（重启计数清零）
+RESTART_RESET_AFTER = 60.0
+
+
+def physical_cores() -> list:
+    """
+    当前进程可用的逻辑 CPU 按物理核心分组，返回 [[逻辑CPU, ...], ...]；
+    读不到拓扑信息（非 Linux）时每个逻辑 CPU 单独一组
+    """
+    if hasattr(os, "sched_getaffinity"):
+        cpus = sorted(os.sched_getaffinity(0))
+    else:
+        cpus = list(range(os.cpu_count() or 1))
+    groups = {}
+    for cpu in cpus:
+        topology = f"/sys/devices/system/cpu/cpu{cpu}/topology"
+        try:
+            with open(f"{topology}/physical_package_id") as f:
+                package = f.read().strip()
+            with open(f"{topology}/core_id") as f:
+                core = f.read().strip()
+            key = (package, core)
+        except OSError:
+            key = (None, cpu)
+        groups.setdefault(key, []).append(cpu)
+    return list(groups.values())
+
+
+def plan_core_slices(num_workers: int, threads_per_worker: int = 0) -> list:
+    """
+    为每个推理进程分配一段连续的物理核心，返回 [(逻辑CPU列表, torch线程数), ...]
+    threads_per_worker 为 0 时平分物理核心；进程数超过核心数时多个进程共用核心
+    """
+    cores = physical_cores()
+    per_worker = threads_per_worker or max(1, len(cores) // num_workers)
+    slices = []
+    for i in range(num_workers):
+        start = (i * per_worker) % len(cores)
+        group = [cores[(start + j) % len(cores)] for j in range(min(per_worker, len(cores)))]
+        slices.append((sorted(cpu for g in group for cpu in g), len(group)))
+    return slices
+
+
+def _worker_main(worker_id: int, cpus: list, threads: int, requests, results,
+                 max_batch_size: int, warmup_generations: int):
+    """推理进程入口：绑核、加载模型、预热，然后循环处理请求直到收到 None"""
+    if cpus and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cpus)
+    # 必须在导入 torch 之前设置，OpenMP 线程池按此大小创建
+    os.environ["OMP_NUM_THREADS"] = str(threads)
+    import torch
+    torch.set_num_threads(threads)
+    import small_model
+    from warmup import WARMUP_QUESTIONS
+
+    try:
+        small_model._load_model()
+        for i in range(warmup_generations):
+            small_model._generate([small_model._build_prompt(WARMUP_QUESTIONS[i % len(WARMUP_QUESTIONS)])])
+    except Exception as e:
+        results.put(("failed", worker_id, str(e)))
+        return
+    results.put(("ready", worker_id, {**small_model._load_stats, "cpus": cpus, "threads": threads}))
+
+    stopping = False
+    while not stopping:
+        batch = [requests.get()]
+        if batch[0] is None:
+            break
+        while len(batch) < max_batch_size:
+            try:
+                item = requests.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                stopping = True
+                break
+            batch.append(item)
+        # 先回报取走了哪些请求，本进程在生成中途退出时父进程据此让这些请求立即失败
+        results.put(("taken", worker_id, [item[0] for item in batch]))
+
+        start = time.time()
+        try:
+            prompt_stats = [{} for _ in batch]
+            prompts = [small_model._build_prompt(question, history, stats=prompt_stats[i])
+                       for i, (_, question, history, _) in enumerate(batch)]
+            outputs = small_model._generate(prompts)
+            error = None
+        except Exception as e:
+            outputs = [(None, {})] * len(batch)
+            prompt_stats = [{} for _ in batch]
+            error = str(e)
+        batch_time = time.time() - start
+
+        for (request_id, _, _, enqueued), (answer, gen_stats), compaction in zip(batch, outputs, prompt_stats):
+            results.put(("result", request_id, answer, {
+                **compaction,
+                **gen_stats,
+                "worker": worker_id,
+                "queue_wait": start - enqueued,
+                "batch_size": len(batch),
+                "batch_time": batch_time,
+            }, error))
+
+
+class _Pending:
+    """一次提交：结果以及完成通知"""
+
+    __slots__ = ("answer", "stats", "error", "done")
+
+    def __init__(self):
+        self.answer = None
+        self.stats = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class WorkerPool:
+    """
+    参数:
+        num_workers: 推理进程数
+        threads_per_worker: 每个进程的 torch 线程数（0 表示平分物理核心）
+        queue_size: 等待分发的请求上限，超过时 submit 抛出 queue.Full
+        max_batch_size: 推理进程每批最多合并的请求数
+        warmup_generations: 每个推理进程加载模型后的预热生成次数
+        max_restarts: 每个推理进程连续异常退出后最多重启的次数，超过后不再拉起
+        restart_delay: 第一次重启前的等待秒数，之后每次翻倍（上限 RESTART_MAX_DELAY）
+    """
+
+    def __init__(self, num_workers: int, threads_per_worker: int = 0, queue_size: int = 16,
+                 max_batch_size: int = 4, warmup_generations: int = 1,
+                 max_restarts: int = 5, restart_delay: float = 1.0):
+        self.num_workers = max(1, num_workers)
+        self.max_batch_size = max(1, max_batch_size)
+        self.warmup_generations = warmup_generations
+        self.max_restarts = max(0, max_restarts)
+        self.restart_delay = restart_delay
+        self.slices = plan_core_slices(self.num_workers, threads_per_worker)
+        self.worker_stats = {}  # 推理进程编号 -> 加载统计（ready 后写入）
+        self.restarts = [0] * self.num_workers  # 各进程连续重启的次数
+        self._target = _worker_main
+        self._ctx = multiprocessing.get_context("spawn")
+        self._requests = self._ctx.Queue(maxsize=max(1, queue_size))
+        self._results = self._ctx.Queue()
+        self._processes = [None] * self.num_workers
+        self._spawned_at = [0.0] * self.num_workers
+        self._restart_at = [None] * self.num_workers  # 计划重新拉起的时间
+        self._given_up = set()  # 不再拉起的进程（加载失败或重启次数用完）
+        self._pending = {}
+        self._assigned = {}  # 请求编号 -> 取走该请求的推理进程编号
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self._failed = threading.Event()
+        self._started = False
+        self._closed = False
+
+    def _spawn(self, worker_id: int):
+        cpus, threads = self.slices[worker_id]
+        process = self._ctx.Process(
+            target=self._target,
+            args=(worker_id, cpus, threads, self._requests, self._results,
+                  self.max_batch_size, self.warmup_generations),
+            name=f"small-model-worker-{worker_id}",
+            daemon=True,
+        )
+        process.start()
+        self._processes[worker_id] = process
+        self._spawned_at[worker_id] = time.time()
+
+    def start(self):
+        """启动全部推理进程（可重复调用，只启动一次）"""
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+            for worker_id in range(self.num_workers):
+                self._spawn(worker_id)
+            threading.Thread(target=self._dispatch, name="worker-pool-dispatch", daemon=True).start()
+        atexit.register(self.close)
+
+    def wait_ready(self, timeout: float = None) -> bool:
+        """等待至少一个推理进程加载完成；全部加载失败或超时返回 False"""
+        self.start()
+        deadline = None if timeout is None else time.time() + timeout
+        while not self._ready.is_set() and not self._failed.is_set():
+            remaining = None if deadline is None else deadline - time.time()
+            if remaining is not None and remaining <= 0:
+                break
+            self._ready.wait(0.1 if remaining is None else min(0.1, remaining))
+        return self._ready.is_set()
+
+    def submit(self, question: str, history: list = None, timeout: float = None):
+        """
+        提交一个问题并阻塞等待，返回 (answer, stats)
+        stats 包含推理进程返回的置信度与分阶段耗时，以及 worker、queue_wait、batch_size、latency
+        队列已满时抛出 queue.Full，推理失败、推理进程异常退出或已全部不可用时抛出 RuntimeError，超时抛出 TimeoutError
+        """
+        if self._closed:
+            raise RuntimeError("推理池已关闭")
+        self.start()
+        if self._failed.is_set():
+            raise RuntimeError("推理进程全部不可用")
+        request_id = next(self._ids)
+        pending = _Pending()
+        start = time.time()
+        with self._lock:
+            self._pending[request_id] = pending
+        try:
+            self._requests.put_nowait((request_id, question, list(history or []), start))
+            if not pending.done.wait(timeout):
+                raise TimeoutError("等待推理进程结果超时")
+        finally:
+            with self._lock:
+                self._pending.pop(request_id, None)
+                self._assigned.pop(request_id, None)
+        if pending.error is not None:
+            raise RuntimeError(f"推理进程错误: {pending.error}")
+        pending.stats["latency"] = time.time() - start
+        return pending.answer, pending.stats
+
+    def _fail_requests(self, error: str, worker_id: int = None, request_ids=None):
+        """让等待中的请求以错误结束：指定的请求、某个推理进程取走的全部请求，或（都不指定时）所有请求"""
+        with self._lock:
+            if request_ids is None and worker_id is None:
+                request_ids = list(self._pending)
+            elif request_ids is None:
+                request_ids = [rid for rid, wid in self._assigned.items() if wid == worker_id]
+            failed = [self._pending[rid] for rid in request_ids if rid in self._pending]
+            for rid in request_ids:
+                self._assigned.pop(rid, None)
+        for pending in failed:
+            pending.error = error
+            pending.done.set()
+
+    def _give_up(self, worker_id: int):
+        """不再拉起该进程；全部放弃后等待中和之后的请求都立即失败"""
+        self._given_up.add(worker_id)
+        self._restart_at[worker_id] = None
+        self._processes[worker_id] = None
+        if len(self._given_up) == self.num_workers:
+            self._failed.set()
+            self._fail_requests("推理进程全部不可用")
+
+    def _check_workers(self):
+        """处理异常退出的推理进程：取走的请求立即失败，按指数退避重新拉起，连续重启超过上限后放弃"""
+        now = time.time()
+        for worker_id, process in enumerate(self._processes):
+            if self._closed:
+                return
+            if process is None:
+                restart_at = self._restart_at[worker_id]
+                if restart_at is not None and now >= restart_at:
+                    self._restart_at[worker_id] = None
+                    self._spawn(worker_id)
+                continue
+            if process.exitcode is None:
+                continue
+
+            self._processes[worker_id] = None
+            self._fail_requests(f"推理进程 {worker_id} 异常退出（exitcode={process.exitcode}）", worker_id)
+            if now - self._spawned_at[worker_id] >= RESTART_RESET_AFTER:
+                self.restarts[worker_id] = 0
+            if self.restarts[worker_id] >= self.max_restarts:
+                print(f"推理进程 {worker_id} 已退出（exitcode={process.exitcode}），连续重启 "
+                      f"{self.restarts[worker_id]} 次仍失败，不再重启")
+                self._give_up(worker_id)
+                continue
+            delay = min(RESTART_MAX_DELAY, self.restart_delay * 2 ** self.restarts[worker_id])
+            self.restarts[worker_id] += 1
+            self._restart_at[worker_id] = now + delay
+            print(f"推理进程 {worker_id} 已退出（exitcode={process.exitcode}），{delay:.1f}s 后重新启动")
+
+    def _dispatch(self):
+        last_check = time.time()
+        while not self._closed:
+            try:
+                message = self._results.get(timeout=CHECK_INTERVAL)
+            except queue.Empty:
+                message = None
+            except (EOFError, OSError):
+                break
+            if time.time() - last_check >= CHECK_INTERVAL or message is None:
+                self._check_workers()
+                last_check = time.time()
+            if message is None:
+                continue
+
+            kind, key = message[0], message[1]
+            if kind == "ready":
+                self.worker_stats[key] = message[2]
+                self._ready.set()
+            elif kind == "failed":
+                # 加载失败的进程不再重启，避免反复加载
+                print(f"推理进程 {key} 加载失败: {message[2]}")
+                self._give_up(key)
+            elif kind == "taken":
+                process = self._processes[key]
+                if process is None or process.exitcode is not None:
+                    # 回报到达前进程已经退出：这批请求不会再有结果
+                    self._fail_requests(f"推理进程 {key} 异常退出", request_ids=message[2])
+                    continue
+                with self._lock:
+                    for request_id in message[2]:
+                        if request_id in self._pending:
+                            self._assigned[request_id] = key
+            else:
+                answer, stats, error = message[2:]
+                with self._lock:
+                    pending = self._pending.get(key)
+                    self._assigned.pop(key, None)
+                if pending is not None:
+                    pending.answer, pending.stats, pending.error = answer, stats, error
+                    pending.done.set()
+
+    def close(self, timeout: float = 5.0):
+        """通知推理进程退出并等待；超时未退出的进程强制结束"""
+        if self._closed or not self._started:
+            self._closed = True
+            return
+        self._closed = True
+        for _ in self._processes:
+            try:
+                self._requests.put(None, timeout=timeout)
+            except queue.Full:
+                break
+        deadline = time.time() + timeout
+        for process in self._processes:
+            if process is None:
+                continue
+            process.join(max(0.0, deadline - time.time()))
+            if process.is_alive():
+                process.terminate()
+
+
+def main():
+    from concurrent.futures import ThreadPoolExecutor
+
+    parser = argparse.ArgumentParser(description="小模型多进程推理池吞吐测试")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2], help="依次测试的推理进程数")
+    parser.add_argument("--requests", type=int, default=16, help="每轮并发提交的请求数")
+    parser.add_argument("--threads", type=int, default=0, help="每个进程的 torch 线程数（0=平分物理核心）")
+    args = parser.parse_args()
+
+    questions = ["图书馆几点开门？", "食堂在哪里？", "宿舍可以养猫吗", "校园卡丢了怎么办"]
+    print(f"物理核心 {len(physical_cores())} 个")
+    baseline = None
+    for num_workers in args.workers:
+        pool = WorkerPool(num_workers, threads_per_worker=args.threads, queue_size=args.requests)
+        if not pool.wait_ready():
+            print(f"{num_workers} 个推理进程全部加载失败")
+            pool.close()
+            continue
+        # 等全部进程就绪后再计时
+        while len(pool.worker_stats) < num_workers:
+            time.sleep(0.1)
+        start = time.time()
+        with ThreadPoolExecutor(max_workers=args.requests) as executor:
+            results = list(executor.map(lambda i: pool.submit(questions[i % len(questions)]), range(args.requests)))
+        elapsed = time.time() - start
+        tokens = sum(stats.get("generated_tokens", 0) for _, stats in results)
+        throughput = tokens / elapsed
+        baseline = baseline or throughput / num_workers
+        print(f"  {num_workers} 个进程: {throughput:.1f} tokens/s（相对单进程 ×{throughput / baseline:.2f}），"
+              f"{args.requests} 个请求耗时 {elapsed:.1f}s")
+        pool.close()
+
+
+if __name__ == "__main__":
+    main()